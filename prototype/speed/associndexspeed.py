@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+"""
+Memory and lookup latency of the in-memory association index of the resource registry. Builds the index
+from generated association docs (as CouchDB returns them, with unicode ids), so needs no CouchDB. Reports
+the memory per million associations and the find_objects/find_subjects/find_associations latency.
+
+    bin/python prototype/speed/associndexspeed.py -n 200000 -r 20000
+"""
+
+from pyon.ion.assoc_index import AssociationIndex
+from uuid import uuid4
+import random
+import resource
+import time
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-n', '--count', type=int, help='Associations')
+parser.add_argument('-r', '--resources', type=int, help='Resources the associations are between')
+parser.add_argument('-q', '--queries', type=int, help='Lookups per query type')
+parser.set_defaults(count=200000, resources=20000, queries=10000)
+opts = parser.parse_args()
+
+PREDICATES = [u'hasOwner', u'hasPart', u'hasDataset', u'hasAttachment', u'derivedFrom']
+RESTYPES = [u'InstrumentDevice', u'PlatformDevice', u'DataSet', u'UserIdentity', u'Attachment']
+
+res_ids = [unicode(uuid4().hex) for x in xrange(opts.resources)]
+res_types = dict((res_id, random.choice(RESTYPES)) for res_id in res_ids)
+
+class AssocSource(object):
+    """Stands in for the datastore, makes the docs on the fly so they do not count"""
+    def add_change_listener(self, callback, datastore_name=""):
+        return True
+
+    def find_by_view_iter(self, design_name, view_name, **kwargs):
+        for x in xrange(opts.count):
+            s, o = random.choice(res_ids), random.choice(res_ids)
+            doc = {'_id': unicode(uuid4().hex), '_rev': u'1-%s' % uuid4().hex, 'type_': u'Association', 'at': u'H2H',
+                   's': s, 'st': res_types[s], 'srv': u'1', 'p': random.choice(PREDICATES),
+                   'o': o, 'ot': res_types[o], 'orv': u'1', 'ts': unicode(int(time.time() * 1000))}
+            yield doc['_id'], None, doc
+
+def rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+index = AssociationIndex(AssocSource())
+rss_before = rss_kb()
+st = time.time()
+index.load()
+elapsed_s = time.time() - st
+rss_mb = (rss_kb() - rss_before) / 1024.0
+print "Loaded %d associations in %.1f sec: %.1f MB, %.0f MB per million" % (
+    opts.count, elapsed_s, rss_mb, rss_mb * 1000000 / opts.count)
+
+sample = [random.choice(res_ids) for x in xrange(opts.queries)]
+queries = (("find_objects", lambda res_id: index.find_objects(res_id)),
+           ("find_objects(p)", lambda res_id: index.find_objects(res_id, PREDICATES[0])),
+           ("find_subjects", lambda res_id: index.find_subjects(res_id)),
+           ("find_associations", lambda res_id: index.find_associations(res_id)))
+for name, query in queries:
+    st = time.time()
+    for res_id in sample:
+        query(res_id)
+    elapsed_s = time.time() - st
+    print "%-18s %6.1f us per lookup" % (name, elapsed_s * 1000000 / opts.queries)
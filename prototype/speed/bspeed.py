@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+"""
+Publish throughput: one message per publish call versus batched/buffered publishing.
+Run rspeed.py alongside to consume.
+"""
+
+from pyon.net.endpoint import Publisher
+from pyon.net.messaging import make_node
+import gevent
+import time
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-m', '--mode', choices=['single', 'many', 'buffered'], help='single publish calls, publish_many batches, or a buffered publisher')
+parser.add_argument('-b', '--batchsize', type=int, help='Messages per batch (many, buffered)')
+parser.add_argument('-l', '--latency', type=float, help='Max buffer latency in seconds (buffered)')
+parser.add_argument('-c', '--confirm', action='store_true', help='Use publisher confirms')
+parser.set_defaults(mode='single', batchsize=100, latency=0.1)
+opts = parser.parse_args()
+
+node,iowat=make_node()
+
+if opts.mode == 'buffered':
+    pub=Publisher(node=node, name="hassan", buffer_size=opts.batchsize, buffer_latency=opts.latency, confirm=opts.confirm)
+else:
+    pub=Publisher(node=node, name="hassan", confirm=opts.confirm)
+
+print "Mode:", opts.mode, "Batch size:", opts.batchsize, "Confirm:", opts.confirm
+
+counter = 0
+st = time.time()
+
+def tick():
+    global counter, st
+    while True:
+        time.sleep(2)
+        ct = time.time()
+        elapsed_s = ct - st
+
+        mps = counter / elapsed_s
+
+        print counter, "messages, per sec:", mps
+
+def work():
+    global counter
+    while True:
+        if opts.mode == 'many':
+            pub.publish_many([str(counter + x) for x in xrange(opts.batchsize)])
+            counter += opts.batchsize
+        else:
+            pub.publish(str(counter))
+            counter += 1
+
+_gt = gevent.spawn(tick)
+_gw = gevent.spawn(work)
+
+gevent.joinall([_gt, _gw])
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+"""
+Deleting a resource with thousands of associations: one delete call per association versus
+delete_doc(del_associations=True), which removes them with one bulk request. Runs against CouchDB
+unless --mock is given.
+
+    bin/python prototype/speed/bulkdeletespeed.py -n 2000
+"""
+
+from pyon.core import bootstrap
+from pyon.core.bootstrap import IonObject
+from pyon.datastore.datastore import DataStore, DatastoreManager
+from pyon.ion.resource import AT, RT, PRED
+import time
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-n', '--count', type=int, help='Associations of the resource')
+parser.add_argument('-m', '--mock', action='store_true', help='Use the mock datastore')
+parser.add_argument('-s', '--sysname', action='store', help='ION System Name')
+parser.set_defaults(count=2000, sysname='bulkdeletespeed')
+opts = parser.parse_args()
+
+bootstrap.sys_name = opts.sysname
+bootstrap.bootstrap_pyon()
+
+ds = DatastoreManager.get_datastore_instance('resources', persistent=not opts.mock, profile=DataStore.DS_PROFILE.RESOURCES)
+ds.delete_datastore()
+ds.create_datastore()
+
+def make_resource():
+    res_id, res_rev = ds.create(IonObject(RT.Instrument, name='instrument'))
+    att_res = ds.create_mult([IonObject("Attachment", name='att%d' % x) for x in xrange(opts.count)])
+    # created in bulk, create_association checks for duplicates one by one
+    ds.create_mult([IonObject("Association", at=AT.H2H, s=res_id, st=RT.Instrument, srv=res_rev,
+                              p=PRED.hasAttachment, o=att_id, ot="Attachment", orv=att_rev)
+                    for success, att_id, att_rev in att_res])
+    return res_id
+
+def delete_each(res_id):
+    for assoc_id in ds.find_associations(res_id, PRED.hasAttachment, id_only=True):
+        ds.delete(assoc_id)
+    ds.delete(res_id)
+
+def delete_bulk(res_id):
+    ds.delete(res_id, del_associations=True)
+
+for name, delete in (("one by one", delete_each), ("bulk", delete_bulk)):
+    res_id = make_resource()
+    st = time.time()
+    delete(res_id)
+    elapsed_s = time.time() - st
+    assert not ds.find_associations(res_id, PRED.hasAttachment, id_only=True)
+    print "%-10s %d associations deleted in %7.2f sec" % (name, opts.count, elapsed_s)
+
+ds.delete_datastore()
+ds.close()
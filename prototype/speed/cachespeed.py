@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+"""
+Resource registry style access on CouchDB: mostly reads of a hot set of resource docs, with an occasional
+read-modify-update. Compares CouchDB_DataStore without and with its read-through doc cache and reports
+operations per sec and the cache hit rate. Needs CouchDB.
+
+    bin/python prototype/speed/cachespeed.py -n 500 -o 5000 -u 0.1
+"""
+
+from pyon.core import bootstrap
+from pyon.datastore.couchdb.couchdb_datastore import CouchDB_DataStore
+import random
+import time
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-n', '--count', type=int, help='Resource docs')
+parser.add_argument('-o', '--ops', type=int, help='Operations per run')
+parser.add_argument('-u', '--updates', type=float, help='Share of operations that read and update a doc')
+parser.add_argument('-c', '--cache', type=int, help='Cache size')
+parser.add_argument('-s', '--sysname', action='store', help='ION System Name')
+parser.set_defaults(count=500, ops=5000, updates=0.1, cache=1000, sysname='cachespeed')
+opts = parser.parse_args()
+
+bootstrap.sys_name = opts.sysname
+bootstrap.bootstrap_pyon()
+
+ds_name = '%s_resources' % opts.sysname.lower()
+
+for cache_size in (0, opts.cache):
+    ds = CouchDB_DataStore(datastore_name=ds_name, cache_size=cache_size)
+    ds.delete_datastore()
+    ds.create_datastore(create_indexes=False)
+    doc_ids = [ds.create_doc({'type_': 'Resource', 'name': 'res%d' % x, 'value': 0})[0] for x in xrange(opts.count)]
+
+    random.seed(0)
+    st = time.time()
+    for x in xrange(opts.ops):
+        doc_id = random.choice(doc_ids)
+        doc = ds.read_doc(doc_id)
+        if random.random() < opts.updates:
+            doc['value'] += 1
+            ds.update_doc(doc)
+    elapsed_s = time.time() - st
+
+    stats = ds.get_cache_stats()
+    print "Cache size: %5d  ops per sec: %8.1f  hit rate: %s" % (cache_size, opts.ops / elapsed_s,
+                                                                  "%.2f" % stats['hit_rate'] if stats else "-")
+    ds.delete_datastore()
+    ds.close()
@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+
+"""
+Channel churn: publishes where every message opens and closes its own channel, as one-off event and
+RPC publishes do. With the Node's channel pool, the AMQP channels are reused after the first.
+"""
+
+from pyon.net.endpoint import Publisher
+from pyon.net.messaging import make_node
+import time
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-n', '--count', type=int, help='Publishes, each on a new channel')
+parser.add_argument('-i', '--max-idle', type=int, help='Max idle pooled channels, 0 disables pooling')
+parser.set_defaults(count=5000, max_idle=32)
+opts = parser.parse_args()
+
+node,iowat=make_node()
+node._chan_pool_max_idle = opts.max_idle
+
+pub=Publisher(node=node, name="hassan")
+
+st = time.time()
+for x in xrange(opts.count):
+    ep = pub.publish("hello", to_name="hassan")     # on a new channel
+    ep.close()
+elapsed_s = time.time() - st
+
+print "Max idle: %d  publishes per sec: %.0f" % (opts.max_idle, opts.count / elapsed_s)
+print "Pool stats:", node.get_channel_pool_stats()
+
+node.client.close()
+iowat.join(timeout=5)
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+"""
+Encode/decode throughput of message payloads: CodecInterceptor plus msgpack (encoding msgpack) versus
+the single pass IonMsgpackCodec (encoding ion-msgpack). No broker needed.
+"""
+
+from pyon.core.bootstrap import IonObject
+from pyon.core.interceptor.interceptor import Invocation
+from pyon.core.interceptor.codec import CodecInterceptor
+from pyon.core.interceptor.encode import EncodeInterceptor, ENCODING_MSGPACK, ENCODING_ION_MSGPACK
+import numpy as np
+import time
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-n', '--count', type=int, help='Payloads to encode/decode per run')
+parser.add_argument('-s', '--samples', type=int, help='Samples per granule array')
+parser.set_defaults(count=10000, samples=1000)
+opts = parser.parse_args()
+
+def make_resource():
+    contact = IonObject('ContactInformation', {"name": "Heitor Villa-Lobos",
+                                               "email": "prelude1@heitor.com",
+                                               "variables": [{"name": "Claim To Fame", "value": "Legendary Brazilian composer"}]})
+    return IonObject('UserInfo', {"name": "Heitor Villa-Lobos", "contact": contact})
+
+def make_granule():
+    return {'stream_id'  : 'speedtest',
+            'time'       : np.arange(opts.samples, dtype='float64'),
+            'temperature': np.random.random(opts.samples).astype('float32'),
+            'salinity'   : np.random.random(opts.samples).astype('float32'),
+            'attributes' : {'units': ['s', 'C', 'psu'], 'count': opts.samples}}
+
+payloads = {'resource': make_resource(),
+            'resource list': [make_resource() for x in xrange(50)],
+            'granule': make_granule()}
+
+codec = CodecInterceptor()
+encode = EncodeInterceptor()
+
+def run(label, encoding, payload):
+    enc_s = dec_s = 0.0
+    for x in xrange(opts.count):
+        inv = Invocation(path=Invocation.PATH_OUT, message=payload, headers={'encoding': encoding})
+
+        st = time.time()
+        inv = encode.outgoing(codec.outgoing(inv))
+        enc_s += time.time() - st
+        size = len(inv.message)
+
+        inv.path = Invocation.PATH_IN
+
+        st = time.time()
+        codec.incoming(encode.incoming(inv))
+        dec_s += time.time() - st
+
+    print "%-15s %-12s encode usec: %8.2f  decode usec: %8.2f  size: %d" % (label, encoding, enc_s * 1000000 / opts.count, dec_s * 1000000 / opts.count, size)
+
+for label, payload in sorted(payloads.iteritems()):
+    for encoding in (ENCODING_MSGPACK, ENCODING_ION_MSGPACK):
+        run(label, encoding, payload)
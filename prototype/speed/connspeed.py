@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+"""
+Aggregate publish or RPC throughput over a node with N AMQP connections. Run once per N:
+
+    for n in 1 2 4; do bin/python prototype/speed/connspeed.py -n $n -m publish; done
+
+The rpc mode needs a hello service running (as rpcspeed.py), the publish mode can run rspeed.py alongside to consume.
+"""
+
+from interface.services.examples.hello.ihello_service import HelloServiceClient
+from pyon.net.endpoint import Publisher
+from pyon.net.messaging import make_node, NodeB
+from pyon.core import bootstrap
+import gevent
+import time
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-n', '--connections', type=int, help='Number of AMQP connections')
+parser.add_argument('-m', '--mode', choices=['publish', 'rpc'], help='Publish messages or make RPC requests')
+parser.add_argument('-p', '--parallel', type=int, help='Number of parallel publishers/clients, each on its own channel')
+parser.add_argument('-t', '--time', type=int, help='Seconds to run')
+parser.add_argument('-l', '--policy', choices=[NodeB.POLICY_ROUND_ROBIN, NodeB.POLICY_LEAST_LOADED], help='How channels are spread over the connections')
+parser.add_argument('-s', '--sysname', action='store', help='ION System Name')
+parser.set_defaults(connections=1, mode='publish', parallel=8, time=10, policy=NodeB.POLICY_ROUND_ROBIN, sysname='tt')
+opts = parser.parse_args()
+
+bootstrap.sys_name = opts.sysname
+bootstrap.bootstrap_pyon()
+
+node,iowat=make_node(connections=opts.connections)
+node._connection_policy = opts.policy
+
+counter = [0] * opts.parallel
+
+def publish_work(wid):
+    pub = Publisher(node=node, name="hassan")
+    while True:
+        pub.publish("hello")
+        counter[wid] += 1
+        gevent.sleep(0)
+
+def rpc_work(wid):
+    hsclient = HelloServiceClient(node=node)
+    while True:
+        hsclient.noop("hello")
+        counter[wid] += 1
+
+work = publish_work if opts.mode == 'publish' else rpc_work
+workers = [gevent.spawn(work, x) for x in xrange(opts.parallel)]
+
+st = time.time()
+gevent.sleep(opts.time)
+elapsed_s = time.time() - st
+gevent.killall(workers)
+
+print "Mode: %s  connections: %d  parallel: %d  %s per sec: %.0f" % (opts.mode, opts.connections, opts.parallel,
+                                                                    'messages' if opts.mode == 'publish' else 'requests', sum(counter) / elapsed_s)
+for x, stats in enumerate(node.get_connection_stats()):
+    print "  connection %d: %s" % (x, stats)
+
+node.stop_node()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+
+"""
+Deserialization of stored/received documents: walk with registry.new and setattr per field (operate) versus
+bottom-up construction with _from_dict (deserialize). No broker or datastore needed.
+"""
+
+from pyon.core.bootstrap import IonObject, obj_registry
+from pyon.core.object import IonObjectSerializer, IonObjectDeserializer
+import time
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-n', '--count', type=int, help='Documents per run, as from one read_mult')
+parser.add_argument('-r', '--runs', type=int, help='Runs per mode')
+parser.set_defaults(count=5000, runs=5)
+opts = parser.parse_args()
+
+def make_doc(x):
+    contact = IonObject('ContactInformation', {"name": "User %d" % x,
+                                               "email": "user%d@example.com" % x,
+                                               "variables": [{"name": "Claim To Fame", "value": "Number %d" % x}]})
+    obj = IonObject('UserInfo', {"name": "User %d" % x, "contact": contact})
+    obj._id = "id%d" % x
+    obj._rev = "1"
+    return obj
+
+serializer = IonObjectSerializer()
+deserializer = IonObjectDeserializer(obj_registry=obj_registry)
+
+docs = [serializer.serialize(make_doc(x)) for x in xrange(opts.count)]
+
+for label, func in (('operate', deserializer.operate), ('deserialize', deserializer.deserialize)):
+    st = time.time()
+    for run in xrange(opts.runs):
+        objs = [func(doc) for doc in docs]
+    elapsed_s = (time.time() - st) / opts.runs
+
+    print "%-12s %d docs, %.3f sec, docs per sec: %.0f" % (label, opts.count, elapsed_s, opts.count / elapsed_s)
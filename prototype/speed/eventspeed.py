@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+"""
+Events stored per sec by EventRepository, one create per put_event (buffer size 0) versus write-behind buffering
+with bulk writes, optionally durable (put_event waits for the write). Runs against CouchDB unless --mock is given.
+
+    bin/python prototype/speed/eventspeed.py -n 2000 -b 0 10 100
+"""
+
+from pyon.core import bootstrap
+from pyon.datastore.datastore import DatastoreManager
+from pyon.event.event import EventRepository
+from pyon.util.async import spawn
+from interface.objects import Event
+import gevent
+import time
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-n', '--count', type=int, help='Events stored per run')
+parser.add_argument('-b', '--buffer', type=int, nargs='+', help='Buffer sizes to compare, 0 is unbuffered')
+parser.add_argument('-g', '--greenlets', type=int, help='Greenlets storing events at the same time')
+parser.add_argument('-d', '--durable', action='store_true', help='Wait for every event to be written')
+parser.add_argument('-m', '--mock', action='store_true', help='Use the mock datastore')
+parser.add_argument('-s', '--sysname', action='store', help='ION System Name')
+parser.set_defaults(count=2000, buffer=[0, 10, 100], greenlets=10, sysname='eventspeed')
+opts = parser.parse_args()
+
+bootstrap.sys_name = opts.sysname
+bootstrap.bootstrap_pyon()
+
+dsm = DatastoreManager()
+dsm.persistent = not opts.mock
+dsm.force_clean = True
+
+for buffer_size in opts.buffer:
+    event_repo = EventRepository(dsm, buffer_size=buffer_size, buffer_latency=0.1, durable=opts.durable)
+
+    def put(count):
+        for x in xrange(count):
+            event_repo.put_event(Event(origin="eventspeed", description=str(x)))
+
+    st = time.time()
+    gevent.joinall([spawn(put, opts.count / opts.greenlets) for x in xrange(opts.greenlets)])
+    put_s = time.time() - st
+    event_repo.flush()
+    stored_s = time.time() - st
+
+    print "Buffer: %4d  put_event per sec: %7.0f  stored per sec: %7.0f" % (buffer_size, opts.count / put_s, opts.count / stored_s)
+
+event_repo.close()
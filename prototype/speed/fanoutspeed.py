@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+"""
+A transform publishing each output on N streams: one publish per stream publisher (the old _publish_all) versus
+one publish_fanout, which encodes each message once and sends it to every stream on one channel.
+
+    bin/python prototype/speed/fanoutspeed.py -n 2000 -s 1 2 5 10
+"""
+
+from pyon.net.endpoint import Publisher
+from pyon.net.messaging import make_node
+from pyon.net.transport import NameTrio
+from pyon.core import bootstrap
+import numpy as np
+import time
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-n', '--count', type=int, help='Messages published per run')
+parser.add_argument('-p', '--points', type=int, help='Values in the array of each message')
+parser.add_argument('-s', '--streams', type=int, nargs='+', help='Output stream counts to compare')
+parser.set_defaults(count=2000, points=1000, streams=[1, 2, 5, 10])
+opts = parser.parse_args()
+
+node,iowat=make_node()
+
+xp = "%s.fanoutspeed" % bootstrap.get_sys_name()
+msg = {'stream_id': 'fanoutspeed', 'values': np.random.uniform(0, 100, opts.points)}
+
+for streams in opts.streams:
+    names = [NameTrio(xp, "fanoutspeed.%d" % x) for x in xrange(streams)]
+    pubs = [Publisher(node=node, to_name=name) for name in names]
+
+    st = time.time()
+    for x in xrange(opts.count):
+        for pub in pubs:
+            pub.publish(msg)
+    each_s = time.time() - st
+
+    st = time.time()
+    for x in xrange(opts.count):
+        pubs[0].publish_fanout([msg], names)
+    fanout_s = time.time() - st
+
+    print "Streams: %2d  per publisher: %7.0f msgs per sec  fanout: %7.0f msgs per sec" % (streams, opts.count * streams / each_s,
+                                                                                         opts.count * streams / fanout_s)
+    for pub in pubs:
+        pub.close()
+
+node.client.close()
+iowat.join(timeout=5)
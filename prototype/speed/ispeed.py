@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+
+"""
+Per-message interceptor overhead: process_interceptors over the raw stacks versus prebuilt pipelines.
+No broker needed.
+"""
+
+from pyon.core.interceptor.interceptor import Invocation, Interceptor, process_interceptors, build_pipeline, process_pipeline
+from pyon.core.interceptor.encode import EncodeInterceptor
+from pyon.core.interceptor.validate import ValidateInterceptor
+import time
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-n', '--count', type=int, help='Messages to run through each stack')
+parser.add_argument('-p', '--passthrough', type=int, help='Number of pass-through interceptors added to the stack')
+parser.set_defaults(count=100000, passthrough=3)
+opts = parser.parse_args()
+
+class PassInterceptor(Interceptor):
+    def outgoing(self, invocation):
+        return invocation
+    def incoming(self, invocation):
+        return invocation
+
+validate = ValidateInterceptor()
+validate.configure({'enabled': False})
+
+stack = [PassInterceptor() for x in xrange(opts.passthrough)] + [validate, EncodeInterceptor()]
+
+def run(label, func):
+    st = time.time()
+    for x in xrange(opts.count):
+        inv = func(Invocation(path=Invocation.PATH_OUT, message={'counter': x}, headers={}))
+        inv.path = Invocation.PATH_IN
+        func(inv)
+    elapsed_s = time.time() - st
+
+    print "%-20s %d messages, %.2f sec, usec per message: %.2f" % (label, opts.count, elapsed_s, elapsed_s * 1000000 / opts.count)
+
+pipelines = { Invocation.PATH_OUT : build_pipeline(stack, Invocation.PATH_OUT),
+              Invocation.PATH_IN  : build_pipeline(stack, Invocation.PATH_IN) }
+
+print "Stack size:", len(stack), "Pipeline size:", len(pipelines[Invocation.PATH_IN])
+
+run("process_interceptors", lambda inv: process_interceptors(stack, inv))
+run("pipeline", lambda inv: process_pipeline(pipelines[inv.path], inv))
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+"""
+Receive side cost of large payloads when the handler uses few of the fields: eager deserialization versus
+lazy payloads (endpoint.listen.lazy_payload). No broker needed.
+"""
+
+from pyon.core.bootstrap import IonObject
+from pyon.core.interceptor.interceptor import Invocation
+from pyon.core.interceptor.codec import CodecInterceptor
+from pyon.core.interceptor.encode import EncodeInterceptor
+from pyon.core.interceptor.validate import ValidateInterceptor
+import numpy as np
+import time
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-n', '--count', type=int, help='Messages received per run')
+parser.add_argument('-r', '--resources', type=int, help='Resources per find_resources like result')
+parser.set_defaults(count=200, resources=1000)
+opts = parser.parse_args()
+
+def make_resource(x):
+    contact = IonObject('ContactInformation', {"name": "User %d" % x,
+                                               "email": "user%d@example.com" % x,
+                                               "variables": [{"name": "Claim To Fame", "value": "Number %d" % x}]})
+    return IonObject('UserInfo', {"name": "User %d" % x, "contact": contact})
+
+payloads = {'resources': {'resources': [make_resource(x) for x in xrange(opts.resources)], 'count': opts.resources},
+            'granule': {'stream_id': 'speedtest',
+                        'time': np.arange(100000, dtype='float64'),
+                        'temperature': np.random.random(100000).astype('float32')}}
+
+# what the handlers look at: the count only, the stream id only (e.g. to drop granules of unknown streams)
+handlers = {'resources': lambda msg: msg['count'],
+            'granule': lambda msg: msg['stream_id']}
+
+codec = CodecInterceptor()
+encode = EncodeInterceptor()
+validate = ValidateInterceptor()
+
+for label, payload in sorted(payloads.iteritems()):
+    inv = encode.outgoing(codec.outgoing(Invocation(path=Invocation.PATH_OUT, message=payload, headers={})))
+    data = inv.message
+
+    for lazy in (False, True):
+        st = time.time()
+        for x in xrange(opts.count):
+            inv = Invocation(path=Invocation.PATH_IN, message=data, headers={}, lazy_payload=lazy)
+            inv = validate.incoming(codec.incoming(encode.incoming(inv)))
+            handlers[label](inv.message)
+        elapsed_s = time.time() - st
+
+        print "%-10s lazy: %-5s  usec per message: %10.2f" % (label, lazy, elapsed_s * 1000000 / opts.count)
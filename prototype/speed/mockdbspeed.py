@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+"""
+MockDB_DataStore association and resource queries at growing store sizes. With the indexes the time per query
+depends on the number of results (here a handful), not on the number of docs in the store.
+
+    bin/python prototype/speed/mockdbspeed.py -s 10000 100000 1000000
+"""
+
+from pyon.datastore.mockdb.mockdb_datastore import MockDB_DataStore
+from pyon.ion.resource import LCS
+import random
+import time
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-s', '--sizes', type=int, nargs='+', help='Store sizes (docs) to compare')
+parser.add_argument('-q', '--queries', type=int, help='Queries of each kind per size')
+parser.set_defaults(sizes=[10000, 100000, 1000000], queries=1000)
+opts = parser.parse_args()
+
+def fill(ds, count):
+    """
+    Half resources, half associations between random resources.
+    """
+    res_ids = []
+    for x in xrange(count / 2):
+        res_id, _ = ds.create_doc({'type_': 'Instrument', 'name': 'inst%d' % x, 'lcstate': random.choice([LCS.DRAFT_PRIVATE, LCS.DEPLOYED_AVAILABLE])})
+        res_ids.append(res_id)
+    for x in xrange(count - count / 2):
+        ds.create_doc({'type_': 'Association', 's': random.choice(res_ids), 'st': 'Instrument', 'p': 'hasPart%d' % (x % 1000),
+                       'o': random.choice(res_ids), 'ot': 'Instrument', 'at': 'H2H'})
+    return res_ids
+
+def timeit(func, args):
+    st = time.time()
+    for arg in args:
+        func(arg)
+    return (time.time() - st) * 1000 / len(args)
+
+for size in opts.sizes:
+    ds = MockDB_DataStore(datastore_name='mockdbspeed')
+    ds.create_datastore()
+
+    st = time.time()
+    res_ids = fill(ds, size)
+    fill_s = time.time() - st
+
+    sample = random.sample(res_ids, opts.queries)
+    names = ['inst%d' % random.randrange(len(res_ids)) for x in xrange(opts.queries)]
+    preds = ['hasPart%d' % random.randrange(1000) for x in xrange(opts.queries)]
+
+    print "Docs: %8d (filled in %5.1f sec)  ms per query:" % (size, fill_s),
+    print "find_objects %.3f" % timeit(lambda s: ds.find_objects(s, id_only=True), sample),
+    print "find_subjects %.3f" % timeit(lambda o: ds.find_subjects(obj=o, id_only=True), sample),
+    print "find_associations %.3f" % timeit(lambda p: ds.find_associations(predicate=p), preds),
+    print "find_res_by_name %.3f" % timeit(lambda n: ds.find_res_by_name(n, 'Instrument', id_only=True), names)
+
+    ds.delete_datastore()
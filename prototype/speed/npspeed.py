@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+
+"""
+Encode/decode latency and peak memory for large numpy arrays, per message encoding. No broker needed.
+Peak memory (max RSS) only grows, so run one encoding per process:
+
+    for e in msgpack ion-msgpack ion-msgpack-parts; do bin/python prototype/speed/npspeed.py -e $e; done
+"""
+
+from pyon.core.interceptor.interceptor import Invocation
+from pyon.core.interceptor.codec import CodecInterceptor
+from pyon.core.interceptor.encode import EncodeInterceptor, ENCODING_MSGPACK, ENCODING_ION_MSGPACK, ENCODING_ION_MSGPACK_PARTS
+import numpy as np
+import resource
+import time
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-e', '--encoding', choices=[ENCODING_MSGPACK, ENCODING_ION_MSGPACK, ENCODING_ION_MSGPACK_PARTS], help='Message encoding')
+parser.add_argument('-s', '--sizes', type=int, nargs='+', help='Array sizes in MB')
+parser.add_argument('-n', '--count', type=int, help='Round trips per size')
+parser.set_defaults(encoding=ENCODING_MSGPACK, sizes=[1, 10, 100], count=5)
+opts = parser.parse_args()
+
+codec = CodecInterceptor()
+encode = EncodeInterceptor()
+
+def maxrss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+print "Encoding:", opts.encoding, "baseline max RSS MB: %.1f" % maxrss_mb()
+
+for size in opts.sizes:
+    arr = np.random.random(size * 1024 * 1024 / 8)      # float64
+    enc_s = dec_s = 0.0
+
+    for x in xrange(opts.count):
+        inv = Invocation(path=Invocation.PATH_OUT, message={'granule': arr}, headers={'encoding': opts.encoding})
+
+        st = time.time()
+        inv = encode.outgoing(codec.outgoing(inv))
+        enc_s += time.time() - st
+
+        inv.path = Invocation.PATH_IN
+
+        st = time.time()
+        inv = codec.incoming(encode.incoming(inv))
+        dec_s += time.time() - st
+
+        assert inv.message['granule'].shape == arr.shape
+
+    print "%4d MB  encode ms: %8.2f  decode ms: %8.2f  max RSS MB: %.1f" % (size, enc_s * 1000 / opts.count, dec_s * 1000 / opts.count, maxrss_mb())
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+
+"""
+IonObject memory per object and construction rate. No broker needed.
+Compare the classes generated by default with those generated with __slots__:
+
+    bin/generate_interfaces && bin/python prototype/speed/objspeed.py
+    bin/generate_interfaces --slots && bin/python prototype/speed/objspeed.py
+"""
+
+from pyon.core.bootstrap import obj_registry
+from pyon.core.object import IonSlotsObjectBase
+from pyon.core.registry import model_classes
+import resource
+import sys
+import time
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-t', '--types', nargs='+', help='Object types to measure')
+parser.add_argument('-n', '--count', type=int, help='Objects to create per type')
+parser.set_defaults(types=['Association', 'UserInfo'], count=200000)
+opts = parser.parse_args()
+
+def maxrss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+for name in opts.types:
+    clzz = model_classes[name]
+
+    sample = clzz()
+    size = sys.getsizeof(sample)
+    if not isinstance(sample, IonSlotsObjectBase):
+        size += sys.getsizeof(sample.__dict__)
+
+    # direct construction
+    st = time.time()
+    for x in xrange(opts.count):
+        clzz()
+    direct_s = time.time() - st
+
+    # through the registry, as IonObject() does
+    st = time.time()
+    for x in xrange(opts.count):
+        obj_registry.new(name)
+    registry_s = time.time() - st
+
+    # held in memory
+    rss = maxrss_kb()
+    objs = [clzz() for x in xrange(opts.count)]
+    rss_per_obj = (maxrss_kb() - rss) * 1024.0 / opts.count
+    del objs
+
+    print "%-20s slots: %-5s  bytes per object: %4d (max RSS growth %6.1f)  constructions per sec: %9.0f (registry %9.0f)" % \
+          (name, isinstance(sample, IonSlotsObjectBase), size, rss_per_obj, opts.count / direct_s, opts.count / registry_s)
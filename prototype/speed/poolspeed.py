@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+"""
+Concurrent CouchDB access through the HTTP connection pool shared by CouchDB_DataStore instances: greenlets
+reading docs one by one from several datastores, and read_doc_mult of many ids in one request versus chunks
+read in parallel. Reports requests per sec, pool usage and the request latency histogram. Needs CouchDB.
+
+    bin/python prototype/speed/poolspeed.py -n 2000 -g 20 -c 100
+"""
+
+from pyon.core import bootstrap
+from pyon.datastore.couchdb.couchdb_datastore import CouchDB_DataStore
+import gevent
+import time
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-n', '--count', type=int, help='Docs per datastore')
+parser.add_argument('-g', '--greenlets', type=int, help='Concurrent readers')
+parser.add_argument('-c', '--chunk', type=int, help='Ids per request of the chunked read_doc_mult')
+parser.add_argument('-s', '--sysname', action='store', help='ION System Name')
+parser.set_defaults(count=2000, greenlets=20, chunk=100, sysname='poolspeed')
+opts = parser.parse_args()
+
+bootstrap.sys_name = opts.sysname
+bootstrap.bootstrap_pyon()
+
+datastores = []
+for name in ('resources', 'directory', 'state'):
+    ds = CouchDB_DataStore(datastore_name='%s_%s' % (opts.sysname.lower(), name))
+    ds.delete_datastore()
+    ds.create_datastore(create_indexes=False)
+    ds.create_doc_mult([{'type_': 'Resource', 'name': 'res%d' % x} for x in xrange(opts.count)])
+    datastores.append((ds, ds.list_objects()))
+
+reads = [0]
+def reader(ds, doc_ids):
+    for doc_id in doc_ids:
+        ds.read_doc(doc_id)
+        reads[0] += 1
+
+st = time.time()
+gls = []
+for x in xrange(opts.greenlets):
+    ds, doc_ids = datastores[x % len(datastores)]
+    gls.append(gevent.spawn(reader, ds, doc_ids[x::opts.greenlets]))
+gevent.joinall(gls, raise_error=True)
+elapsed_s = time.time() - st
+print "Single reads, %d greenlets: %8.1f reads per sec" % (opts.greenlets, reads[0] / elapsed_s)
+
+ds, doc_ids = datastores[0]
+for chunk in (len(doc_ids), opts.chunk):
+    ds._read_chunk_size = chunk
+    st = time.time()
+    docs = ds.read_doc_mult(doc_ids)
+    assert len(docs) == len(doc_ids)
+    print "read_doc_mult, %5d ids per request: %8.1f ms" % (chunk, (time.time() - st) * 1000)
+
+stats = CouchDB_DataStore.get_pool_stats()
+latency = stats.pop('latency')
+print "Pool: %s" % ", ".join("%s=%s" % kv for kv in sorted(stats.items()))
+for bound in CouchDB_DataStore._get_session().LATENCY_BUCKETS:
+    print "  <=%5d ms: %d" % (bound, latency['<=%d ms' % bound])
+print "  > %5d ms: %d" % (bound, latency['>%d ms' % bound])
+
+for ds, doc_ids in datastores:
+    ds.delete_datastore()
+    ds.close()
+CouchDB_DataStore.close_session()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+"""
+A slow subscriber behind a fast publisher: how many messages pile up in the subscriber's recv queue (in memory)
+and how long they wait there, per prefetch count. 0 is the old unlimited behavior.
+
+    bin/python prototype/speed/prefetchspeed.py -n 2000 -d 0.002
+"""
+
+from pyon.net.endpoint import Publisher, Subscriber
+from pyon.net.messaging import make_node
+import gevent
+import time
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-n', '--count', type=int, help='Messages published per run')
+parser.add_argument('-d', '--delay', type=float, help='Seconds the subscriber callback takes per message')
+parser.add_argument('-c', '--prefetch', type=int, nargs='+', help='Prefetch counts to compare')
+parser.set_defaults(count=2000, delay=0.002, prefetch=[0, 1, 10, 50])
+opts = parser.parse_args()
+
+node,iowat=make_node()
+
+for prefetch in opts.prefetch:
+    received = [0]
+    def cb(msg, headers):
+        received[0] += 1
+        gevent.sleep(opts.delay)
+
+    name = "prefetchspeed%d" % prefetch
+    sub = Subscriber(node=node, from_name=name, callback=cb, prefetch_count=prefetch)
+    gl = gevent.spawn(sub.listen)
+    sub.get_ready_event().wait(timeout=5)
+
+    pub = Publisher(node=node, to_name=name)
+    st = time.time()
+    for x in xrange(opts.count):
+        pub.publish("hello")
+    while received[0] < opts.count:
+        gevent.sleep(0.1)
+    elapsed_s = time.time() - st
+
+    stats = sub.get_stats()['recv_queue']
+    print "Prefetch: %3d  msgs per sec: %6.0f  max depth: %5d  avg ms in queue: %8.2f" % (prefetch, opts.count / elapsed_s, stats['max_depth'],
+                                                                                          stats['time_in_queue'] * 1000 / max(stats['delivered'], 1))
+    sub.close()
+    gl.join(timeout=5)
+
+node.client.close()
+iowat.join(timeout=5)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+"""
+A three hop walk of the resource graph, platform -> instruments -> L0 datasets -> L1 datasets: nested
+find_objects calls (a view query per resource per hop, and a read of every resource on the way) versus
+find_related (one multi-key view query per hop, datasets read at the end). Runs against CouchDB unless
+--mock is given.
+
+    bin/python prototype/speed/relatedspeed.py -n 100
+"""
+
+from pyon.core import bootstrap
+from pyon.core.bootstrap import IonObject
+from pyon.datastore.datastore import DataStore, DatastoreManager
+from pyon.ion.resource import AT, RT
+import time
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-n', '--count', type=int, help='Instruments of the platform, each with two L0 datasets of an L1 dataset each')
+parser.add_argument('-m', '--mock', action='store_true', help='Use the mock datastore')
+parser.add_argument('-s', '--sysname', action='store', help='ION System Name')
+parser.set_defaults(count=100, sysname='relatedspeed')
+opts = parser.parse_args()
+
+bootstrap.sys_name = opts.sysname
+bootstrap.bootstrap_pyon()
+
+ds = DatastoreManager.get_datastore_instance('resources', persistent=not opts.mock, profile=DataStore.DS_PROFILE.RESOURCES)
+ds.delete_datastore()
+ds.create_datastore()
+
+HAS_INSTRUMENT, HAS_DATASET, DERIVED = "hasInstrumentX", "hasDatasetX", "derivedX"
+
+def create(restype, count):
+    return [oid for success, oid, rev in ds.create_mult([IonObject(restype, name='%s%d' % (restype, x)) for x in xrange(count)])]
+
+def associate(subject_ids, predicate, object_ids):
+    # created in bulk, create_association checks one by one
+    ds.create_mult([IonObject("Association", at=AT.H2H, s=s, st="", srv="", p=predicate, o=o, ot="", orv="")
+                    for s, o in zip(subject_ids, object_ids)])
+
+plat_id = create(RT.PlatformDevice, 1)[0]
+inst_ids = create(RT.InstrumentDevice, opts.count)
+l0_ids = create(RT.DataSet, opts.count * 2)
+l1_ids = create(RT.DataSet, opts.count * 2)
+associate([plat_id] * opts.count, HAS_INSTRUMENT, inst_ids)
+associate(inst_ids * 2, HAS_DATASET, l0_ids)
+associate(l0_ids, DERIVED, l1_ids)
+
+def walk_nested():
+    datasets = []
+    insts, _ = ds.find_objects(plat_id, HAS_INSTRUMENT)
+    for inst in insts:
+        l0_datasets, _ = ds.find_objects(inst._id, HAS_DATASET)
+        for l0_dataset in l0_datasets:
+            l1_datasets, _ = ds.find_objects(l0_dataset._id, DERIVED)
+            datasets.extend(l1_datasets)
+    return datasets
+
+def walk_related():
+    OUT = DataStore.DIRECTION.OUT
+    return ds.find_related(plat_id, [(HAS_INSTRUMENT, OUT, None), (HAS_DATASET, OUT, None), (DERIVED, OUT, None)])
+
+for name, walk in (("nested", walk_nested), ("find_related", walk_related)):
+    st = time.time()
+    datasets = walk()
+    elapsed_s = time.time() - st
+    assert len(datasets) == len(l1_ids)
+    print "%-12s %d datasets found in %7.1f ms" % (name, len(datasets), elapsed_s * 1000)
+
+ds.delete_datastore()
+ds.close()
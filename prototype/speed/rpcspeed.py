@@ -17,6 +17,7 @@ parser.add_argument('-d', '--datasize', type=int, help='Size of data in bytes')
 parser.add_argument('-p', '--parallel', type=int, help='Number of parallel requests to run')
 parser.add_argument('-m', '--msgpack', action='store_true', help='Encode data with msgpack')
 parser.add_argument('-s', '--sysname', action='store', help='ION System Name')
+parser.add_argument('-r', '--shared', action='store_true', help='Receive replies on the shared, container-wide reply queue')
 parser.set_defaults(datasize=1024, parallel=1, sysname='tt')
 opts = parser.parse_args()
 
@@ -25,7 +26,7 @@ bootstrap.bootstrap_pyon()
 
 node,iowat=make_node()
 #dsclient = RPCClient(node=node, name="datastore", iface=IDatastoreService)
-hsclient = HelloServiceClient(node=node)#RPCClient(node=node, name="hello", iface=IHelloService)
+hsclient = HelloServiceClient(node=node, shared_reply_queue=opts.shared)#RPCClient(node=node, name="hello", iface=IHelloService)
 
 # make data (bytes)
 DATA_SIZE = opts.datasize
@@ -36,7 +37,7 @@ if opts.msgpack:
 
 PARALLEL = opts.parallel
 
-print "Datasize:", DATA_SIZE, "Parallel:", PARALLEL
+print "Datasize:", DATA_SIZE, "Parallel:", PARALLEL, "Shared reply queue:", opts.shared
 
 counter = [0] * PARALLEL
 st = time.time()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+
+"""
+Container start time with N service processes: spawned one after the other (as start_rel does by default) versus
+spawned together with spawn_processes (CFG container.apps.concurrent_start). Every service brings up two RPC
+server endpoints, each setting up its listener with one pipelined declare/bind round.
+
+    bin/python prototype/speed/startspeed.py -n 50
+"""
+
+from pyon.container.cc import Container
+from pyon.core import bootstrap
+import time
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-n', '--count', type=int, help='Number of service processes to spawn')
+parser.add_argument('-s', '--sysname', action='store', help='ION System Name')
+parser.set_defaults(count=50, sysname='tt')
+opts = parser.parse_args()
+
+bootstrap.sys_name = opts.sysname
+bootstrap.bootstrap_pyon()
+
+specs = [("hello%d" % x, 'examples.service.hello_service', 'HelloService', {'process': {'listen_name': "hello%d" % x}})
+         for x in xrange(opts.count)]
+
+for concurrent in (False, True):
+    container = Container()
+
+    st = time.time()
+    container.start()
+    started_s = time.time() - st
+
+    st = time.time()
+    if concurrent:
+        container.spawn_processes(specs)
+    else:
+        for spec in specs:
+            container.spawn_process(*spec)
+    spawned_s = time.time() - st
+
+    print "Concurrent: %-5s  container start: %.2f sec  %d services: %.2f sec (%.1f ms per service)" % (concurrent, started_s, opts.count,
+                                                                                                      spawned_s, spawned_s * 1000 / opts.count)
+    print "  declares:", container.ex_manager.get_declare_stats()
+
+    container.stop()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+"""
+An L2 practical salinity transform (PSS-78) on CTD granules, run inline in the container's greenlet versus in a pool
+of worker processes (process config transform_workers). Reports granules per sec and how long other greenlets
+were held up (the longest gap of a 1 ms ticker). No broker needed, needs numpy and h5py.
+
+    bin/python prototype/speed/transformspeed.py -n 40 -p 5000 -w 0 2 4
+"""
+
+from prototype.sci_data.stream_defs import ctd_stream_definition, ctd_stream_packet
+from prototype.sci_data.stream_parser import PointSupplementStreamParser
+from pyon.ion.transform import TransformFunction
+from pyon.util.containers import DotDict
+import numpy as np
+import gevent
+import gevent.pool
+import time
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-n', '--count', type=int, help='Granules per run')
+parser.add_argument('-p', '--points', type=int, help='CTD points per granule')
+parser.add_argument('-r', '--rounds', type=int, help='Times execute computes salinity per granule, to make it heavier')
+parser.add_argument('-w', '--workers', type=int, nargs='+', help='Worker counts to compare, 0 is inline')
+parser.set_defaults(count=40, points=5000, rounds=20, workers=[0, 2, 4])
+opts = parser.parse_args()
+
+stream_id = 'ctd_speedtest'
+stream_def = ctd_stream_definition(stream_id=stream_id)
+
+def practical_salinity(c, t, p):
+    """
+    PSS-78 from conductivity (mS/cm), temperature (C) and pressure (dbar).
+    """
+    a = (0.0080, -0.1692, 25.3851, 14.0941, -7.0261, 2.7081)
+    b = (0.0005, -0.0056, -0.0066, -0.0375, 0.0636, -0.0144)
+
+    r = c / 42.914
+    rt = 0.6766097 + t * (2.00564e-2 + t * (1.104259e-4 + t * (-6.9698e-7 + t * 1.0031e-9)))
+    rp = 1 + p * (2.070e-5 + p * (-6.370e-10 + p * 3.989e-15)) / (1 + t * (3.426e-2 + t * 4.464e-4) + r * (4.215e-1 - 3.107e-3 * t))
+    sqrt_rt = np.sqrt(r / (rp * rt))
+
+    ds = (t - 15) / (1 + 0.0162 * (t - 15))
+    return sum((ai + ds * bi) * sqrt_rt ** i for i, (ai, bi) in enumerate(zip(a, b)))
+
+class SalinityTransform(TransformFunction):
+    def execute(self, granule):
+        psp = PointSupplementStreamParser(stream_definition=stream_def, stream_granule=granule)
+        c, t, p = psp.get_values('conductivity'), psp.get_values('temperature'), psp.get_values('pressure')
+
+        for x in xrange(opts.rounds):
+            salinity = practical_salinity(c, t, p)
+
+        return {'stream_id': granule.stream_resource_id, 'salinity': salinity}
+
+def make_granule(x):
+    length = opts.points
+    return ctd_stream_packet(stream_id=stream_id,
+                             c=list(np.random.uniform(30, 50, length)),
+                             t=list(np.random.uniform(2, 25, length)),
+                             p=list(np.random.uniform(0, 1000, length)),
+                             lat=[41.5] * length, lon=[-70.5] * length,
+                             time=list(np.arange(x * length, (x + 1) * length, dtype='float64')))
+
+print "Building %d granules of %d points..." % (opts.count, opts.points)
+granules = [make_granule(x) for x in xrange(opts.count)]
+
+for workers in opts.workers:
+    tf = SalinityTransform()
+    tf.CFG = DotDict({'process': {'transform_workers': workers, 'transform_shm_size': 16*1024*1024}})
+    tf.streams = {'output': 'salinity_stream'}
+
+    published = []
+    tf.publish = published.append
+    tf._on_init()
+
+    # what the rest of the container sees: how long between two 1 ms ticks at worst
+    max_gap = [0.0]
+    def ticker():
+        last = time.time()
+        while True:
+            gevent.sleep(0.001)
+            now = time.time()
+            max_gap[0] = max(max_gap[0], now - last)
+            last = now
+    tick = gevent.spawn(ticker)
+
+    st = time.time()
+    # as many in flight as there are workers, as the stream process subscriber would have
+    pool = gevent.pool.Pool(size=max(workers, 1))
+    for granule in granules:
+        pool.spawn(tf.process, granule)
+    pool.join()
+    elapsed_s = time.time() - st
+
+    tick.kill()
+    tf._on_quit()
+
+    assert len(published) == opts.count
+    print "Workers: %d  granules per sec: %6.1f  max greenlet stall: %7.1f ms" % (workers, opts.count / elapsed_s, max_gap[0] * 1000)
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+"""
+IonObject validation cost for every object type in interface.objects: the class's compiled validator versus
+building the validator (the per-call schema work) on every call. No broker needed.
+"""
+
+from pyon.core.bootstrap import obj_registry
+from pyon.core.object import IonObjectBase, IonObjectValidator
+from pyon.core.registry import model_classes
+import time
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-n', '--count', type=int, help='Validations per object type')
+parser.add_argument('-v', '--verbose', action='store_true', help='Print timings per object type')
+parser.set_defaults(count=10000)
+opts = parser.parse_args()
+
+def timeit(func):
+    st = time.time()
+    for x in xrange(opts.count):
+        func()
+    return time.time() - st
+
+total_compiled = total_uncompiled = 0.0
+types = 0
+
+for name, clzz in sorted(model_classes.iteritems()):
+    if not issubclass(clzz, IonObjectBase):
+        continue
+    try:
+        obj = obj_registry.new(name)
+        obj._validate()
+    except Exception, ex:
+        print "Skipping %s: %s" % (name, ex)
+        continue
+
+    compiled_s = timeit(obj._validate)
+    uncompiled_s = timeit(lambda: IonObjectValidator(clzz, types=model_classes).validate(obj))
+
+    total_compiled += compiled_s
+    total_uncompiled += uncompiled_s
+    types += 1
+
+    if opts.verbose:
+        print "%-40s compiled usec: %6.2f  uncompiled usec: %6.2f" % (name, compiled_s * 1000000 / opts.count, uncompiled_s * 1000000 / opts.count)
+
+print "%d object types, mean usec per validation, compiled: %.2f  uncompiled: %.2f" % (types, total_compiled * 1000000 / opts.count / max(types, 1), total_uncompiled * 1000000 / opts.count / max(types, 1))
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+"""
+Reading a long event history of one origin: find_events (one list, all events converted up front) versus
+find_events_iter (pages read with keyset continuation, converted as iterated). Reports time to the first event,
+total time and the growth of the process max RSS. The iterator runs first, as max RSS never goes down.
+Runs against CouchDB unless --mock is given.
+
+    bin/python prototype/speed/viewpagespeed.py -n 20000 -p 500
+"""
+
+from pyon.core import bootstrap
+from pyon.datastore.datastore import DatastoreManager
+from pyon.event.event import EventRepository
+from interface.objects import Event
+import resource
+import time
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-n', '--count', type=int, help='Events in the history')
+parser.add_argument('-p', '--page', type=int, help='Page size of the iterator')
+parser.add_argument('-m', '--mock', action='store_true', help='Use the mock datastore')
+parser.add_argument('-s', '--sysname', action='store', help='ION System Name')
+parser.set_defaults(count=20000, page=500, sysname='viewpagespeed')
+opts = parser.parse_args()
+
+bootstrap.sys_name = opts.sysname
+bootstrap.bootstrap_pyon()
+
+dsm = DatastoreManager()
+dsm.persistent = not opts.mock
+dsm.force_clean = True
+event_repo = EventRepository(dsm, buffer_size=0)
+
+print "Storing %d events..." % opts.count
+batch = 1000
+for x in xrange(0, opts.count, batch):
+    event_repo.put_events([Event(origin="viewpagespeed", ts_created=str(1000000 + x + i)) for i in xrange(min(batch, opts.count - x))])
+
+def maxrss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def run(name, events):
+    rss = maxrss_mb()
+    st = time.time()
+    first_s = None
+    count = 0
+    for ev in events():
+        if first_s is None:
+            first_s = time.time() - st
+        count += 1
+    total_s = time.time() - st
+    assert count == opts.count
+    print "%-12s first event: %8.1f ms  all: %6.2f sec  max RSS growth: %7.1f MB" % (name, first_s * 1000, total_s, maxrss_mb() - rss)
+
+run("iter", lambda: event_repo.find_events_iter(origin="viewpagespeed", page_size=opts.page))
+run("list", lambda: event_repo.find_events(origin="viewpagespeed"))
+
+event_repo.close()
@@ -61,6 +61,10 @@ class AppManager(object):
 
         if rel is None: rel = {}
 
+        # consecutive processapps are spawned together if configured, rel order may express dependencies otherwise
+        concurrent = CFG.get_safe('container.apps.concurrent_start', False)
+        processapps = []
+
         for rel_app_cfg in rel.apps:
             name = rel_app_cfg.name
             log.debug("app definition in rel: %s" % str(rel_app_cfg))
@@ -75,14 +79,35 @@ class AppManager(object):
                 else:
                     config = DictModifier(CFG)
 
-                self.container.spawn_process(name, module, cls, config)
-                self.apps.append(DotDict(type="application", name=name, processapp=rel_app_cfg.processapp))
+                processapps.append((rel_app_cfg.processapp, config))
+                if not concurrent:
+                    self._spawn_processapps(processapps)
 
             else:
+                self._spawn_processapps(processapps)
+
                 # Case 2: Rel contains reference to app file to start
                 app_file_path = 'res/apps/%s.yml' % (name)
                 self.start_app_from_url(app_file_path, config=rel_app_cfg.get('config', None))
 
+        self._spawn_processapps(processapps)
+
+    def _spawn_processapps(self, processapps):
+        """
+        Spawns the (processapp, config) entries collected by start_rel, concurrently if more than one,
+        and empties the list.
+        """
+        if len(processapps) == 1:
+            (name, module, cls), config = processapps[0]
+            self.container.spawn_process(name, module, cls, config)
+        elif processapps:
+            self.container.spawn_processes([(name, module, cls, config) for (name, module, cls), config in processapps])
+
+        for processapp, config in processapps:
+            self.apps.append(DotDict(type="application", name=processapp[0], processapp=processapp))
+
+        del processapps[:]
+
     def start_app_from_url(self, app_url="", config=None):
         """
         @brief Read the app file and call start_app
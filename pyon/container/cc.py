@@ -24,7 +24,7 @@ from pyon.ion.directory import Directory
 from pyon.ion.exchange import ExchangeManager
 from pyon.ion.resregistry import ResourceRegistry
 from pyon.ion.state import StateRepository
-from pyon.net.endpoint import ProcessRPCServer
+from pyon.net.endpoint import ProcessRPCServer, ReplyDispatcher
 from pyon.net import messaging
 from pyon.util.file_sys import FileSystem
 from pyon.util.log import log
@@ -308,10 +308,11 @@ class Container(BaseContainerAgent):
             self.datastore_manager.stop()
 
         elif capability == "EXCHANGE_CONNECTION":
-            self.node.client.close()
-            self.ioloop.kill()
-            self.node.client.ioloop.start()     # loop until connection closes
-            # destroy AMQP connection
+            # close the shared RPC reply queue, if any client used it
+            ReplyDispatcher.close_instance(self.node)
+
+            # destroy AMQP connection(s), looping until each has closed
+            self.node.stop_node()
 
         elif capability == "GOVERNANCE_CONTROLLER":
             self.governance_controller.stop()
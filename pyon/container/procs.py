@@ -18,13 +18,16 @@ from pyon.service.service import BaseService
 from pyon.util.containers import DictModifier, DotDict, for_name, named_any, dict_merge, get_safe
 from pyon.util.log import log
 
+import gevent
+import sys
+
 
 class ProcManager(object):
     def __init__(self, container):
         self.container = container
 
         # Define the callables that can be added to Container public API
-        self.container_api = [self.spawn_process, self.terminate_process]
+        self.container_api = [self.spawn_process, self.spawn_processes, self.terminate_process]
 
         # Add the public callables to Container
         for call in self.container_api:
@@ -130,6 +133,39 @@ class ProcManager(object):
             log.exception("Error spawning %s %s process (process_id: %s): %s" % (name, process_type, process_id, errcause))
             raise
 
+    def spawn_processes(self, process_specs):
+        """
+        Spawn several processes concurrently, each given as a (name, module, cls, config) tuple as for
+        spawn_process. The processes' endpoints are brought up in parallel, which makes starting many
+        processes much faster than calling spawn_process for one after the other. Only use for processes
+        that do not need each other while they init and start.
+
+        Returns the process ids in the order given. If any spawn fails, terminates the processes that did
+        spawn once all are done and raises the first error.
+        """
+        greenlets = [gevent.spawn(self._spawn_process_exc_info, spec) for spec in process_specs]
+        gevent.joinall(greenlets)
+        results = [gl.value for gl in greenlets]
+
+        failed = [exc_info for process_id, exc_info in results if exc_info]
+        if failed:
+            for process_id, exc_info in results:
+                if exc_info is None:
+                    try:
+                        self.terminate_process(process_id)
+                    except Exception:
+                        log.exception("Error terminating process %s after a failed spawn", process_id)
+            raise failed[0][0], failed[0][1], failed[0][2]
+
+        return [process_id for process_id, exc_info in results]
+
+    def _spawn_process_exc_info(self, spec):
+        # greenlets do not keep the traceback of their exception
+        try:
+            return self.spawn_process(*spec), None
+        except Exception:
+            return None, sys.exc_info()
+
     def _spawned_proc_failed(self, proc_sup, gproc):
         log.error("ProcManager._spawned_proc_failed: %s", gproc)
 
@@ -163,8 +199,11 @@ class ProcManager(object):
         listen_name = get_safe(config, "process.listen_name") or service_instance.name
         log.debug("Service Process (%s) listen_name: %s", name, listen_name)
 
-        self._set_service_endpoint(service_instance, listen_name)
-        self._set_service_endpoint(service_instance, service_instance.id)
+        # bring up both endpoints before waiting on either
+        listeners = [self._set_service_endpoint(service_instance, listen_name, ready=False),
+                     self._set_service_endpoint(service_instance, service_instance.id, ready=False)]
+        self._ensure_listeners_ready(service_instance, listeners)
+
         self._service_start(service_instance)
 
         # Directory registration
@@ -184,14 +223,19 @@ class ProcManager(object):
         self._service_init(service_instance)
 
         listen_name = get_safe(config, "process.listen_name") or name
+
+        # a transform running in worker processes needs that many packets in flight to use them
+        concurrency = get_safe(config, "process.transform_workers")
+
         # Throws an exception if no listen name is given!
-        self._set_subscription_endpoint(service_instance, listen_name)
+        listeners = [self._set_subscription_endpoint(service_instance, listen_name, ready=False, concurrency=concurrency)]
 
         # Add publishers if any...
         publish_streams = get_safe(config, "process.publish_streams")
         self._set_publisher_endpoints(service_instance, publish_streams)
 
-        self._set_service_endpoint(service_instance, service_instance.id)
+        listeners.append(self._set_service_endpoint(service_instance, service_instance.id, ready=False))
+        self._ensure_listeners_ready(service_instance, listeners)
 
         # Start the service
         self._service_start(service_instance)
@@ -314,7 +358,11 @@ class ProcManager(object):
         service_instance.errcause = "starting service"
         service_instance.start()
 
-    def _set_service_endpoint(self, service_instance, listen_name):
+    def _set_service_endpoint(self, service_instance, listen_name, ready=True):
+        """
+        Spawns the process's RPC server listening on listen_name. Waits for it to be ready unless ready is
+        False, in which case pass the returned (proc, errmsg) on to _ensure_listeners_ready.
+        """
         service_instance.errcause = "setting process service endpoint"
 
         # Service RPC endpoint
@@ -325,28 +373,49 @@ class ProcManager(object):
         # Start an ION process with the right kind of endpoint factory
         proc = self.proc_sup.spawn((CFG.cc.proctype or 'green', None), listener=rsvc, name=listen_name,
                                     proc_name=service_instance._proc_name)
-        self.proc_sup.ensure_ready(proc, "_set_service_endpoint for listen_name: %s" % listen_name)
 
         # map gproc to service_instance
         self._spawned_proc_to_process[proc.proc] = service_instance
 
-        log.debug("Process %s service listener ready: %s", service_instance.id, listen_name)
+        listener = (proc, "_set_service_endpoint for listen_name: %s" % listen_name)
+        if ready:
+            self._ensure_listeners_ready(service_instance, [listener])
 
-    def _set_subscription_endpoint(self, service_instance, listen_name):
+        return listener
+
+    def _set_subscription_endpoint(self, service_instance, listen_name, ready=True, concurrency=None):
+        """
+        Spawns the process's stream subscriber listening on listen_name. See _set_service_endpoint for ready.
+        concurrency is passed on to the subscriber, None for its default.
+        """
         service_instance.errcause = "setting process subscription endpoint"
 
         service_instance.stream_subscriber_registrar = StreamSubscriberRegistrar(process=service_instance, node=self.container.node)
 
-        sub = service_instance.stream_subscriber_registrar.create_subscriber(exchange_name=listen_name,callback=lambda m,h: service_instance.process(m))
+        sub = service_instance.stream_subscriber_registrar.create_subscriber(exchange_name=listen_name,callback=lambda m,h: service_instance.process(m),
+                                                                             concurrency=concurrency)
 
         proc = self.proc_sup.spawn((CFG.cc.proctype or 'green', None), listener=sub, name=listen_name,
                                     proc_name=service_instance._proc_name)
-        self.proc_sup.ensure_ready(proc, '_set_subscription_endpoint for listen_name: %s' % listen_name)
 
         # map gproc to service_instance
         self._spawned_proc_to_process[proc.proc] = service_instance
 
-        log.debug("Process %s stream listener ready: %s", service_instance.id, listen_name)
+        listener = (proc, "_set_subscription_endpoint for listen_name: %s" % listen_name)
+        if ready:
+            self._ensure_listeners_ready(service_instance, [listener])
+
+        return listener
+
+    def _ensure_listeners_ready(self, service_instance, listeners):
+        """
+        Waits for spawned listener processes, given as (proc, errmsg), to be ready. They set up their
+        endpoints concurrently, so this takes about as long as the slowest one.
+        """
+        service_instance.errcause = "waiting for process endpoints"
+        for proc, errmsg in listeners:
+            self.proc_sup.ensure_ready(proc, errmsg)
+            log.debug("Process %s listener ready: %s", service_instance.id, proc.name)
 
     def _set_publisher_endpoints(self, service_instance, publisher_streams=None):
         service_instance.stream_publisher_registrar = StreamPublisherRegistrar(process=service_instance, node=self.container.node)
@@ -8,7 +8,10 @@ from pyon.agent.agent import ResourceAgent
 from pyon.container.procs import ProcManager
 from pyon.service.service import BaseService
 from pyon.util.int_test import IonIntegrationTestCase
+from pyon.util.unit_test import PyonTestCase
 from nose.plugins.attrib import attr
+from mock import Mock
+import traceback
 
 class FakeContainer(object):
     def __init__(self):
@@ -22,6 +25,31 @@ class SampleProcess(BaseService):
 class SampleAgent(ResourceAgent):
     pass
 
+def _fake_spawn(name, module, cls, config):
+    if name == 'bad':
+        raise ValueError("spawn failed: %s" % name)
+    return name + '_id'
+
+@attr('UNIT')
+class TestProcManagerSpawnProcesses(PyonTestCase):
+
+    def test_spawn_processes_failed(self):
+        pm = ProcManager(FakeContainer())
+        pm.spawn_process = Mock(side_effect=_fake_spawn)
+        pm.terminate_process = Mock()
+
+        self.assertEquals(pm.spawn_processes([('one', 'mod', 'cls', {}), ('two', 'mod', 'cls', {})]), ['one_id', 'two_id'])
+        self.assertFalse(pm.terminate_process.called)
+
+        try:
+            pm.spawn_processes([('one', 'mod', 'cls', {}), ('bad', 'mod', 'cls', {}), ('two', 'mod', 'cls', {})])
+            self.fail("spawn_processes did not raise")
+        except ValueError:
+            # raised with the traceback of the failed spawn
+            self.assertIn('_fake_spawn', traceback.format_exc())
+
+        self.assertEquals(sorted(call[0][0] for call in pm.terminate_process.call_args_list), ['one_id', 'two_id'])
+
 @attr('INT')
 class TestProcManager(IonIntegrationTestCase):
 
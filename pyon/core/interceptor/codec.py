@@ -1,11 +1,84 @@
 from pyon.core.interceptor.interceptor import Interceptor
 from pyon.core.bootstrap import obj_registry
-from pyon.core.object import IonObjectDeserializer, IonObjectSerializer, walk
+from pyon.core.exception import BadRequest
+from pyon.core.object import IonObjectBase, IonObjectDeserializer, IonObjectSerializer, walk
+from pyon.core.interceptor.encode import ION_ENCODINGS
 from pyon.util.log import log
 
+from collections import Mapping
+
+class LazyPayload(Mapping):
+    """
+    A received payload that is deserialized on demand. Endpoints in lazy payload mode get these instead
+    of the deserialized payload, so messages rejected early or handlers using few of the fields don't pay
+    for building (and validating) all IonObjects and arrays in it.
+
+    For a dict payload, each top level value is deserialized on first access by key. For an IonObject
+    payload, each field is deserialized on first attribute access. resolve() returns the whole payload,
+    deserialized as in eager mode.
+
+    If validate is set (see ValidateInterceptor), IonObjects are validated as they are deserialized.
+    """
+    def __init__(self, raw, deserializer):
+        self._raw           = raw
+        self._deserializer  = deserializer
+        self._values        = {}
+        self._resolved      = None
+        self.validate       = False
+
+    def _deserialize(self, raw):
+        value = self._deserializer.deserialize(raw)
+
+        if self.validate:
+            # IonObject _validate will throw AttributeError on validation failure.
+            def validate_ionobj(obj):
+                if isinstance(obj, IonObjectBase):
+                    obj._validate()
+                return obj
+
+            try:
+                walk(value, validate_ionobj)
+            except AttributeError as e:
+                raise BadRequest(e.message)
+
+        return value
+
+    def resolve(self):
+        """
+        Returns the fully deserialized payload.
+        """
+        if self._resolved is None:
+            if isinstance(self._raw, dict) and "type_" not in self._raw and "numpy" not in self._raw:
+                self._resolved = dict((k, self[k]) for k in self._raw)
+            else:
+                self._resolved = self._deserialize(self._raw)
+
+        return self._resolved
+
+    def __getitem__(self, key):
+        if key not in self._values:
+            self._values[key] = self._deserialize(self._raw[key])
+        return self._values[key]
+
+    def __iter__(self):
+        return iter(self._raw)
+
+    def __len__(self):
+        return len(self._raw)
+
+    def __getattr__(self, name):
+        # fields of an IonObject payload
+        raw = self.__dict__.get('_raw', None)
+        if isinstance(raw, dict) and "type_" in raw and name in raw:
+            return self[name]
+
+        raise AttributeError("'%s' object has no attribute '%s'" % (type(self).__name__, name))
+
 class CodecInterceptor(Interceptor):
     """
     Transforms IonObject <-> dict
+
+    Messages with the ion-msgpack encodings are left alone, the EncodeInterceptor handles them.
     """
     def __init__(self):
         Interceptor.__init__(self)
@@ -15,6 +88,9 @@ class CodecInterceptor(Interceptor):
     def outgoing(self, invocation):
         log.debug("CodecInterceptor.outgoing: %s", invocation)
 
+        if invocation.headers.get('encoding', None) in ION_ENCODINGS:
+            return invocation
+
         log.debug("Payload, pre-transform: %s", invocation.message)
         invocation.message = self._io_serializer.serialize(invocation.message)
         log.debug("Payload, post-transform: %s", invocation.message)
@@ -24,19 +100,19 @@ class CodecInterceptor(Interceptor):
     def incoming(self, invocation):
         log.debug("CodecInterceptor.incoming: %s", invocation)
 
+        if invocation.headers.get('encoding', None) in ION_ENCODINGS:
+            return invocation
+
         payload = invocation.message
         log.debug("Payload, pre-transform: %s", payload)
 
-        # Horrible, hacky workaround for msgpack issue
-        # See http://jira.msgpack.org/browse/MSGPACK-15
-        def convert_tuples_to_lists(obj):
-            if isinstance(obj, tuple):
-                res = list(obj)
-                return res
-            return obj
-
-        payload = walk(payload, convert_tuples_to_lists)
+        # endpoints in lazy payload mode deserialize on demand
+        if invocation.args.get('lazy_payload', False):
+            invocation.message = LazyPayload(payload, self._io_deserializer)
+            return invocation
 
+        # deserialize also turns the tuples msgpack gives us into lists
+        # See http://jira.msgpack.org/browse/MSGPACK-15
         invocation.message = self._io_deserializer.deserialize(payload)
         log.debug("Payload, post-transform: %s", invocation.message)
 
@@ -1,15 +1,157 @@
 import msgpack
+import struct
 
 from pyon.core.interceptor.interceptor import Interceptor
+from pyon.core.bootstrap import obj_registry
+from pyon.core.object import IonObjectBase
 from pyon.util.log import log
 
+try:
+    import numpy as np
+    _have_numpy = True
+except ImportError as e:
+    _have_numpy = False
+
+# Values of the encoding header.
+# msgpack:              payload was serialized by the CodecInterceptor, then packed. Understood by all peers.
+# ion-msgpack:          IonObjects and numpy arrays are packed directly by IonMsgpackCodec, the CodecInterceptor
+#                       does nothing. Only send this to peers that understand it.
+# ion-msgpack-parts:    as ion-msgpack, but large numpy arrays follow the packed payload as raw parts.
+ENCODING_MSGPACK            = 'msgpack'
+ENCODING_ION_MSGPACK        = 'ion-msgpack'
+ENCODING_ION_MSGPACK_PARTS  = 'ion-msgpack-parts'
+
+ION_ENCODINGS = (ENCODING_ION_MSGPACK, ENCODING_ION_MSGPACK_PARTS)
+
+# ion-msgpack-parts body: length of the packed payload, packed payload, raw array parts
+_parts_header = struct.Struct('!I')
+
+def _tuples_to_lists(obj):
+    # msgpack unpacks arrays as tuples, see http://jira.msgpack.org/browse/MSGPACK-15
+    if type(obj) is tuple:
+        return [_tuples_to_lists(x) for x in obj]
+    return obj
+
+class IonMsgpackCodec(object):
+    """
+    Packs/unpacks message payloads containing IonObjects and numpy arrays in a single pass.
+
+    Produces the same structures as IonObjectSerializer/IonObjectDeserializer plus msgpack, but
+    IonObjects and arrays are converted by msgpack's default/object_hook callbacks while packing or
+    unpacking, instead of by separate walks over the payload.
+
+    Decoded numpy arrays are read-only views on the received data (np.frombuffer), copy them to modify.
+    """
+    def __init__(self, obj_registry=None, oob_threshold=65536):
+        """
+        @param  oob_threshold   Size in bytes from which arrays are sent as raw parts, when encoding with parts.
+        """
+        assert obj_registry
+        self._obj_registry = obj_registry
+        self._classes = {}      # type name -> class, filled from the registry as types are seen
+        self.oob_threshold = oob_threshold
+
+    def encode(self, obj, parts=False):
+        """
+        @param  parts   If True, arrays of oob_threshold bytes or more are appended to the message as raw
+                        parts after the packed payload, rather than packed inside of it.
+        """
+        if not parts:
+            return msgpack.packb(obj, default=self._default)
+
+        bufs = []
+        packed = msgpack.packb(obj, default=lambda o: self._default(o, bufs))
+        return "".join([_parts_header.pack(len(packed)), packed] + bufs)
+
+    def decode(self, data, parts=False):
+        """
+        @param  parts   Must match the value given to encode.
+        """
+        if not parts:
+            return _tuples_to_lists(msgpack.unpackb(data, object_hook=self._object_hook))
+
+        packed_len, = _parts_header.unpack_from(data)
+        base = _parts_header.size + packed_len
+        return _tuples_to_lists(msgpack.unpackb(data[_parts_header.size:base], object_hook=lambda o: self._object_hook(o, data, base)))
+
+    def _default(self, obj, bufs=None):
+        if isinstance(obj, IonObjectBase):
+            res = dict((k, v) for k, v in obj._get_fields().iteritems() if k in obj._schema or k in ['_id', '_rev'])
+            res["type_"] = obj.__class__.__name__
+            return res
+        if _have_numpy and isinstance(obj, np.ndarray):
+            if bufs is not None and obj.nbytes >= self.oob_threshold:
+                offset = sum(len(buf) for buf in bufs)
+                bufs.append(obj.tostring())
+                return {'numpy': {'type'  : str(obj.dtype),
+                                  'shape' : obj.shape,
+                                  'part'  : offset}}
+
+            return {'numpy': {'type'  : str(obj.dtype),
+                              'shape' : obj.shape,
+                              'body'  : obj.tostring()}}
+
+        raise TypeError("Cannot encode object of type %s" % type(obj))
+
+    def _array(self, msg, data, base):
+        dtype = np.dtype(msg['type'])
+        count = 1
+        for dim in msg['shape']:
+            count *= dim
+
+        if count == 0:
+            return np.empty(msg['shape'], dtype=dtype)
+
+        # no copies, the array uses the memory of the received message
+        if 'part' in msg:
+            arr = np.frombuffer(data, dtype=dtype, count=count, offset=base + msg['part'])
+        else:
+            arr = np.frombuffer(msg['body'], dtype=dtype, count=count)
+
+        return arr.reshape(msg['shape'])
+
+    def _object_hook(self, obj, data=None, base=0):
+        # called bottom-up, so all values of obj are already decoded except for arrays
+        for k, v in obj.items():
+            if type(v) is tuple:
+                obj[k] = _tuples_to_lists(v)
+
+        # Note: This check to detect an IonObject is a bit risky (only type_)
+        if "type_" in obj:
+            type_name = obj.pop('type_')
+            clzz = self._classes.get(type_name, None)
+            if clzz is None:
+                clzz = self._classes[type_name] = self._obj_registry.get_class(type_name.encode('ascii'))
+
+            return clzz._from_dict(obj)
+
+        if _have_numpy and 'numpy' in obj:
+            return self._array(obj['numpy'], data, base)
+
+        return obj
+
 class EncodeInterceptor(Interceptor):
+    """
+    Packs/unpacks the payload according to the encoding header.
+    """
+    def __init__(self):
+        Interceptor.__init__(self)
+        self._ion_codec = IonMsgpackCodec(obj_registry=obj_registry)
+
+    def configure(self, config):
+        if config and "oob_threshold" in config:
+            self._ion_codec.oob_threshold = config["oob_threshold"]
+
     def outgoing(self, invocation):
         log.debug("EncodeInterceptor.outgoing: %s", invocation)
         log.debug("Pre-transform: %s", invocation.message)
 
         # msgpack the content (ensures string)
-        invocation.message = msgpack.dumps(invocation.message)
+        encoding = invocation.headers.get('encoding', None)
+        if encoding in ION_ENCODINGS:
+            invocation.message = self._ion_codec.encode(invocation.message, parts=encoding == ENCODING_ION_MSGPACK_PARTS)
+        else:
+            invocation.message = msgpack.dumps(invocation.message)
 
         # make sure no Nones exist in headers - this indicates a problem somewhere up the stack
         # pika will choke hard on them as well, masking the actual problem, so we catch here.
@@ -22,6 +164,10 @@ class EncodeInterceptor(Interceptor):
     def incoming(self, invocation):
         log.debug("EncodeInterceptor.incoming: %s", invocation)
         log.debug("Pre-transform: %s", invocation.message)
-        invocation.message = msgpack.loads(invocation.message)
+        encoding = invocation.headers.get('encoding', None)
+        if encoding in ION_ENCODINGS:
+            invocation.message = self._ion_codec.decode(invocation.message, parts=encoding == ENCODING_ION_MSGPACK_PARTS)
+        else:
+            invocation.message = msgpack.loads(invocation.message)
         log.debug("Post-transform: %s", invocation.message)
         return invocation
@@ -54,3 +54,17 @@ def process_interceptors(interceptors, invocation):
         invocation = func(invocation)
     return invocation
 
+def build_pipeline(interceptors, path):
+    """
+    Resolves the bound methods for one path (Invocation.PATH_IN/PATH_OUT) of a list of interceptors
+    ahead of time. Interceptors configured as disabled (enabled attribute is False) are left out.
+
+    @returns    A tuple of callables, to be run with process_pipeline.
+    """
+    return tuple(getattr(interceptor, path) for interceptor in interceptors if getattr(interceptor, 'enabled', True))
+
+def process_pipeline(pipeline, invocation):
+    for func in pipeline:
+        invocation = func(invocation)
+    return invocation
+
@@ -4,11 +4,15 @@
 @description test lib for interceptor
 '''
 import unittest
-from pyon.core.interceptor.codec import CodecInterceptor
-from pyon.core.interceptor.interceptor import Invocation
+from pyon.core.interceptor.codec import CodecInterceptor, LazyPayload
+from pyon.core.interceptor.encode import EncodeInterceptor, IonMsgpackCodec, ENCODING_ION_MSGPACK, ENCODING_ION_MSGPACK_PARTS
+from pyon.core.object import IonObjectBase
+from pyon.core.exception import BadRequest
+from pyon.core.interceptor.interceptor import Invocation, Interceptor, build_pipeline, process_pipeline
 from pyon.util import log
 from pyon.util.unit_test import PyonTestCase
 from nose.plugins.attrib import attr
+from mock import Mock, sentinel
 
 try:
     import numpy as np
@@ -16,6 +20,14 @@ try:
 except ImportError as e:
     _have_numpy = False
 
+class FakeIonObject(IonObjectBase):
+    _schema = {'name': {'type': 'str'}, 'child': {'type': 'FakeIonObject'}, 'values': {'type': 'list'}}
+
+    def __init__(self, name=None, child=None, values=None):
+        self.name = name
+        self.child = child
+        self.values = values or []
+
 @attr('UNIT')
 class InterceptorTest(PyonTestCase):
     @unittest.skipIf(not _have_numpy,'No numpy')
@@ -49,3 +61,172 @@ class InterceptorTest(PyonTestCase):
         for d in c:
             e = (a==d)
             self.assertTrue(e.all())
+
+    def test_build_pipeline(self):
+        first = Interceptor()
+        second = Interceptor()
+        disabled = Interceptor()
+        disabled.enabled = False
+
+        pipeline = build_pipeline([first, disabled, second], Invocation.PATH_IN)
+        self.assertEquals(pipeline, (first.incoming, second.incoming))
+
+        pipeline = build_pipeline([first, disabled, second], Invocation.PATH_OUT)
+        self.assertEquals(pipeline, (first.outgoing, second.outgoing))
+
+    def test_process_pipeline(self):
+        first = Mock(return_value=sentinel.inv_one)
+        second = Mock(return_value=sentinel.inv_two)
+
+        self.assertEquals(process_pipeline((first, second), sentinel.inv), sentinel.inv_two)
+        first.assert_called_once_with(sentinel.inv)
+        second.assert_called_once_with(sentinel.inv_one)
+        self.assertEquals(process_pipeline((), sentinel.inv), sentinel.inv)
+
+    def _fake_registry(self):
+        registry = Mock()
+        registry.get_class.return_value = FakeIonObject
+        return registry
+
+    def test_ion_msgpack_codec(self):
+        codec = IonMsgpackCodec(obj_registry=self._fake_registry())
+        obj = FakeIonObject(name='parent', child=FakeIonObject(name='child', values=[1, 2, [3, 4]]))
+        obj._id = 'abc'
+
+        received = codec.decode(codec.encode({'obj': obj, 'list': [obj.child]}))
+
+        self.assertEquals(received['obj'], obj)
+        self.assertEquals(received['list'], [obj.child])
+        self.assertEquals(received['obj'].child.values, [1, 2, [3, 4]])
+
+        # classes are looked up once per type
+        codec._obj_registry.get_class.assert_called_once_with('FakeIonObject')
+
+    def test_ion_msgpack_codec_unknown_type(self):
+        codec = IonMsgpackCodec(obj_registry=self._fake_registry())
+        self.assertRaises(TypeError, codec.encode, {'fail': object()})
+
+    @unittest.skipIf(not _have_numpy,'No numpy')
+    def test_ion_msgpack_codec_numpy(self):
+        a = np.array([(90,8010,3,14112,3.14159265358979323846264)],dtype='float32')
+        codec = IonMsgpackCodec(obj_registry=self._fake_registry())
+
+        received = codec.decode(codec.encode({'double stuffed':[a,a,a]}))
+
+        for d in received['double stuffed']:
+            self.assertTrue((a==d).all())
+
+    @unittest.skipIf(not _have_numpy,'No numpy')
+    def test_ion_msgpack_codec_numpy_parts(self):
+        small = np.arange(10, dtype='int32')
+        large = np.random.random((20, 30)).astype('float64')
+        codec = IonMsgpackCodec(obj_registry=self._fake_registry(), oob_threshold=1024)
+
+        data = codec.encode({'small': small, 'large': [large, large], 'empty': np.zeros((0, 3))}, parts=True)
+
+        # the large arrays follow the packed payload as raw parts
+        self.assertTrue(data.endswith(large.tostring() * 2))
+
+        received = codec.decode(data, parts=True)
+
+        self.assertTrue((received['small'] == small).all())
+        self.assertEquals(received['empty'].shape, (0, 3))
+        for d in received['large']:
+            self.assertEquals(d.shape, large.shape)
+            self.assertTrue((d == large).all())
+
+            # a view on the received data, not a copy
+            self.assertFalse(d.flags.writeable)
+
+    def test_encode_configure(self):
+        encode = EncodeInterceptor()
+        encode.configure({'oob_threshold': 10})
+        self.assertEquals(encode._ion_codec.oob_threshold, 10)
+
+    @unittest.skipIf(not _have_numpy,'No numpy')
+    def test_encoding_header_parts(self):
+        a = np.arange(100000, dtype='float32')
+
+        encode = EncodeInterceptor()
+        codec = CodecInterceptor()
+
+        invoke = Invocation(path=Invocation.PATH_OUT, message={'a': a}, headers={'encoding': ENCODING_ION_MSGPACK_PARTS})
+        mangled = encode.outgoing(codec.outgoing(invoke))
+
+        mangled.path = Invocation.PATH_IN
+        received = codec.incoming(encode.incoming(mangled))
+        self.assertTrue((received.message['a'] == a).all())
+
+    def test_encoding_header(self):
+        obj = FakeIonObject(name='parent')
+
+        encode = EncodeInterceptor()
+        codec = CodecInterceptor()
+        encode._ion_codec = IonMsgpackCodec(obj_registry=self._fake_registry())
+
+        # codec does not touch ion-msgpack payloads, encode packs the IonObject as is
+        invoke = Invocation(path=Invocation.PATH_OUT, message={'obj': obj}, headers={'encoding': ENCODING_ION_MSGPACK})
+        mangled = encode.outgoing(codec.outgoing(invoke))
+        self.assertTrue(isinstance(mangled.message, str))
+
+        mangled.path = Invocation.PATH_IN
+        received = codec.incoming(encode.incoming(mangled))
+        self.assertEquals(received.message, {'obj': obj})
+
+        # without the header, the payload must already be serialized
+        invoke = Invocation(path=Invocation.PATH_OUT, message={'obj': obj}, headers={})
+        self.assertRaises(TypeError, encode.outgoing, invoke)
+
+    def test_lazy_payload(self):
+        deserializer = Mock()
+        deserializer.deserialize.side_effect = lambda raw: ('deserialized', raw)
+        payload = LazyPayload({'count': 2, 'resources': [1, 2]}, deserializer)
+
+        self.assertEquals(len(payload), 2)
+        self.assertEquals(sorted(payload), ['count', 'resources'])
+        self.assertFalse(deserializer.deserialize.called)
+
+        # only what is accessed gets deserialized, once
+        self.assertEquals(payload['count'], ('deserialized', 2))
+        self.assertEquals(payload['count'], ('deserialized', 2))
+        deserializer.deserialize.assert_called_once_with(2)
+
+        self.assertEquals(payload.resolve(), {'count': ('deserialized', 2), 'resources': ('deserialized', [1, 2])})
+        self.assertEquals(deserializer.deserialize.call_count, 2)
+
+    def test_lazy_payload_ionobject(self):
+        deserializer = Mock()
+        deserializer.deserialize.side_effect = lambda raw: ('deserialized', raw)
+        raw = {'type_': 'FakeIonObject', 'name': 'parent'}
+        payload = LazyPayload(raw, deserializer)
+
+        # fields of an IonObject payload are attributes
+        self.assertEquals(payload.name, ('deserialized', 'parent'))
+        self.assertRaises(AttributeError, getattr, payload, 'child')
+
+        # the IonObject is deserialized as a whole
+        self.assertEquals(payload.resolve(), ('deserialized', raw))
+
+    def test_lazy_payload_validate(self):
+        obj = FakeIonObject(name='bad')
+        obj._validate = Mock(side_effect=AttributeError('bad name'))
+        deserializer = Mock()
+        deserializer.deserialize.return_value = obj
+
+        payload = LazyPayload({'obj': 'raw'}, deserializer)
+        self.assertEquals(payload['obj'], obj)
+        self.assertFalse(obj._validate.called)
+
+        payload = LazyPayload({'obj': 'raw'}, deserializer)
+        payload.validate = True
+        self.assertRaises(BadRequest, payload.__getitem__, 'obj')
+
+    def test_codec_lazy_payload(self):
+        codec = CodecInterceptor()
+        codec._io_deserializer = Mock()
+
+        invoke = Invocation(path=Invocation.PATH_IN, message={'a': 1}, headers={}, lazy_payload=True)
+        received = codec.incoming(invoke)
+
+        self.assertTrue(isinstance(received.message, LazyPayload))
+        self.assertFalse(codec._io_deserializer.deserialize.called)
@@ -1,6 +1,7 @@
 from pyon.core.interceptor.interceptor import Interceptor
 from pyon.core.exception import BadRequest
 from pyon.core.object import IonObjectBase, walk
+from pyon.core.interceptor.codec import LazyPayload
 from pyon.util.log import log
 
 class ValidateInterceptor(Interceptor):
@@ -12,7 +13,7 @@ class ValidateInterceptor(Interceptor):
     def configure(self, config):
         if "enabled" in config:
             self.enabled = config["enabled"]
-        log.debug("ValidateInterceptor enabled: %s" % str(self.enabled))
+        log.debug("ValidateInterceptor enabled: %s", self.enabled)
 
     def outgoing(self, invocation):
         # Set validate flag in header if IonObject(s) found in message
@@ -37,6 +38,11 @@ class ValidateInterceptor(Interceptor):
             payload = invocation.message
             log.debug("Payload, pre-validate: %s", payload)
 
+            # not deserialized yet, validate whatever gets deserialized later
+            if isinstance(payload, LazyPayload):
+                payload.validate = True
+                return invocation
+
             # IonObject _validate will throw AttributeError on validation failure.
             # Raise corresponding BadRequest exception into message stack.
             def validate_ionobj(obj):
@@ -18,75 +18,162 @@ except ImportError as e:
 
 class IonObjectBase(object):
 
+    # no attributes of its own, so subclasses may use __slots__ (see IonSlotsObjectBase)
+    __slots__ = ()
+
     def __str__(self):
-        return str(self.__dict__)
+        return str(self._get_fields())
     
     def __eq__(self, other):
         if type(other) == type(self):
-            if other.__dict__ == self.__dict__:
+            if other._get_fields() == self._get_fields():
                 return True
         return False
 
+    def _get_fields(self):
+        """
+        Returns a dict of the attributes set on this object (schema fields, _id, _rev).
+        Do not modify it, use setattr.
+        """
+        return self.__dict__
+
+    @classmethod
+    def _from_dict(cls, fields):
+        """
+        Builds an object of this class from a dict of field values (already deserialized), such as
+        read from the datastore or received in a message. Fields are set in bulk, bypassing __setattr__.
+        The constructor only runs to fill in defaults if the dict does not have all schema fields.
+        """
+        if cls._schema.viewkeys() <= fields.viewkeys():
+            obj = cls.__new__(cls)
+        else:
+            obj = cls()
+        obj.__dict__.update(fields)
+        return obj
+
     def _validate(self):
         """
         Compare fields to the schema and raise AttributeError if mismatched.
         Named _validate instead of validate because the data may have a field named "validate".
+
+        Uses the validator of this object's class, see IonObjectValidator.
         """
-        id_and_rev_set = set(['_id','_rev', 'type_'])
-        fields, schema = self.__dict__, self._schema
-        extra_fields = fields.viewkeys() - schema.viewkeys() - id_and_rev_set
-        if len(extra_fields) > 0:
-            raise AttributeError('Fields found that are not in the schema: %r' % (list(extra_fields)))
-        for key in fields.iterkeys():
-            if key in id_and_rev_set:
-                continue
-            field_val, schema_val = fields[key], schema[key]
-            if type(field_val).__name__ != schema_val['type']:
+        validator = type(self).__dict__.get('_validator', None)
+        if validator is None:
+            validator = compile_validator(type(self))
+        validator.validate(self)
 
-                if field_val is None and schema_val['required'] == True:
+    def _get_type(self):
+        return self.__class__.__name__
+
+    def __contains__(self, item):
+        return hasattr(self, item)
+    
+    def update(self, other):
+        """
+        Method that allows self object attributes to be updated with other object.
+        Other object must be of same type or super type.
+        """
+        if type(other) != type(self):
+            bases = inspect.getmro(self.__class__)
+            if other.__class__ not in bases:
+                raise BadRequest("Object %s and %s do not have compatible types for update" % (type(self).__name__, type(other).__name__))
+        for key, value in other._get_fields().iteritems():
+            setattr(self, key, value)
+
+# field names allowed in addition to the schema
+_special_fields = frozenset(['_id', '_rev', 'type_'])
+
+# schema types that cannot hold IonObjects, no need to look into values of these
+_scalar_types = frozenset(['str', 'unicode', 'int', 'long', 'float', 'bool'])
+
+# schema types (by name) ints are converted to
+_numeric_coercions = {'float': float, 'long': long}
+
+_builtin_types = dict((t.__name__, t) for t in (str, unicode, int, long, float, bool, list, tuple, dict, OrderedDict, type(None)))
+
+class IonObjectValidator(object):
+    """
+    Validates objects of one IonObject class against the class's schema.
+
+    Everything derivable from the schema (allowed fields, expected types, numeric coercions, which fields
+    may contain IonObjects) is worked out once, when the validator is built.
+    """
+    def __init__(self, clzz, types=None):
+        """
+        @param  clzz    The IonObject class.
+        @param  types   Optional dict of type name -> class, used to resolve schema types that are
+                        IonObject classes. Unresolved types are compared by name.
+        """
+        self._allowed = frozenset(clzz._schema) | _special_fields
+        self._fields = {}
+        for name, schema_val in clzz._schema.iteritems():
+            type_name = schema_val['type']
+            exp_type = _builtin_types.get(type_name, None) or (types or {}).get(type_name, None)
+            self._fields[name] = (type_name,
+                                  exp_type,
+                                  schema_val.get('required', False),
+                                  _numeric_coercions.get(type_name, None),
+                                  type_name not in _scalar_types)
+
+    def validate(self, obj):
+        fields = obj._get_fields()
+        if not self._allowed.issuperset(fields):
+            extra_fields = [key for key in fields if key not in self._allowed]
+            raise AttributeError('Fields found that are not in the schema: %r' % extra_fields)
+
+        specs = self._fields
+        for key, field_val in fields.iteritems():
+            spec = specs.get(key, None)
+            if spec is None:
+                continue        # _id, _rev, type_
+
+            type_name, exp_type, required, coercion, nested = spec
+            if (type(field_val) is not exp_type) if exp_type is not None else (type(field_val).__name__ != type_name):
+
+                if field_val is None and required:
                     raise AttributeError('Required parameter "%s" not set' % key)
 
                 # if the schema doesn't define a type, we can't very well validate it
-                if schema_val['type'] == 'NoneType':
+                if type_name == 'NoneType':
                     continue
 
                 # Special handle numeric types.  Allow int to be
                 # passed for long and float.  Auto convert to the
                 # right type.
-                if isinstance(field_val, int):
-                    if schema_val['type'] == 'float':
-                        fields[key] = float(fields[key])
-                        continue
-                    elif schema_val['type'] == 'long':
-                        fields[key] = long(fields[key])
-                        continue
+                if coercion is not None and isinstance(field_val, int):
+                    setattr(obj, key, coercion(field_val))
+                    continue
 
                 # argh, annoying work around for OrderedDict vs dict issue
-                if type(field_val) == dict and schema_val['type'] == 'OrderedDict':
-                     fields[key] = OrderedDict(field_val)
-                     continue
+                if type(field_val) == dict and type_name == 'OrderedDict':
+                    setattr(obj, key, OrderedDict(field_val))
+                    continue
 
                 # optional fields ok?
                 if field_val is None:
                     continue
 
                 # IonObjects are ok for dict fields too!
-                if isinstance(field_val, IonObjectBase) and schema_val['type'] == 'OrderedDict':
+                if isinstance(field_val, IonObjectBase) and type_name == 'OrderedDict':
                     continue
 
                 # TODO work around for msgpack issue
-                if type(field_val) == tuple and schema_val['type'] == 'list':
+                if type(field_val) == tuple and type_name == 'list':
                     continue
 
                 raise AttributeError('Invalid type "%s" for field "%s", should be "%s"' %
-                                     (type(fields[key]), key, schema_val['type']))
+                                     (type(field_val), key, type_name))
+
+            if not nested:
+                continue
+
             if isinstance(field_val, IonObjectBase):
                 field_val._validate()
             # Next validate only IonObjects found in child collections. Other than that, don't validate collections.
             # Note that this is non-recursive; only for first-level collections.
             elif isinstance(field_val, Mapping):
-                for subkey in field_val:
-                    subval = field_val[subkey]
+                for subval in field_val.itervalues():
                     if isinstance(subval, IonObjectBase):
                         subval._validate()
             elif isinstance(field_val, Iterable):
@@ -94,23 +181,59 @@ class IonObjectBase(object):
                     if isinstance(subval, IonObjectBase):
                         subval._validate()
 
-    def _get_type(self):
-        return self.__class__.__name__
+def compile_validator(clzz, types=None):
+    """
+    Builds the IonObjectValidator for an IonObject class and stores it on the class, where
+    IonObjectBase._validate finds it.
+    """
+    validator = IonObjectValidator(clzz, types=types)
+    clzz._validator = validator
+    return validator
 
-    def __contains__(self, item):
-        return hasattr(self, item)
-    
-    def update(self, other):
-        """
-        Method that allows self object attributes to be updated with other object.
-        Other object must be of same type or super type.
-        """
-        if type(other) != type(self):
-            bases = inspect.getmro(self.__class__)
-            if other.__class__ not in bases:
-                raise BadRequest("Object %s and %s do not have compatible types for update" % (type(self).__name__, type(other).__name__))
-        for key in other.__dict__:
-            setattr(self, key, other.__dict__[key])
+class IonSlotsObjectBase(IonObjectBase):
+    """
+    Base for IonObject classes generated with __slots__ (generate_interfaces.py --slots).
+
+    Instances have no __dict__, which saves a lot of memory when holding many objects. _id, _rev and
+    type_ are slots as well.
+    """
+    __slots__ = ('_id', '_rev', 'type_')
+
+    @classmethod
+    def _get_slot_names(cls):
+        # all slots of the class hierarchy, computed once per class
+        names = cls.__dict__.get('_slot_names', None)
+        if names is None:
+            names = tuple(name for clzz in reversed(cls.__mro__) for name in clzz.__dict__.get('__slots__', ()))
+            cls._slot_names = names
+        return names
+
+    @classmethod
+    def _from_dict(cls, fields):
+        if cls._schema.viewkeys() <= fields.viewkeys():
+            obj = cls.__new__(cls)
+        else:
+            obj = cls()
+        slot_names = cls._get_slot_names()
+        set_count = 0
+        for name in slot_names:
+            if name in fields:
+                setattr(obj, name, fields[name])
+                set_count += 1
+        if set_count < len(fields):
+            # e.g. from docs stored before a schema change; the dict-based classes keep such fields
+            log.warn("Dropping fields of %s that are not slots: %s", cls.__name__,
+                     sorted(set(fields) - set(slot_names)))
+        return obj
+
+    def _get_fields(self):
+        fields = {}
+        for name in self._get_slot_names():
+            try:
+                fields[name] = getattr(self, name)
+            except AttributeError:
+                pass    # never set, e.g. _id of a new object
+        return fields
 
 def walk(o, cb):
     """
@@ -137,9 +260,7 @@ def walk(o, cb):
     elif isinstance(newo, IonObjectBase):
         # IOs are not iterable and are a huge pain to make them look iterable, special casing is fine then
         # @TODO consolidate with _validate method in IonObjectBase
-        fields, set_fields = newo.__dict__, newo._schema
-
-        for fieldname in set_fields:
+        for fieldname in newo._schema:
             fieldval = getattr(newo, fieldname)
             newfo = walk(fieldval, cb)
             if newfo != fieldval:
@@ -190,7 +311,7 @@ class IonObjectSerializer(IonObjectSerializationBase):
 
     def _transform(self, obj):
         if isinstance(obj, IonObjectBase):
-            res = dict((k, v) for k, v in obj.__dict__.iteritems() if k in obj._schema or k in ['_id', '_rev'])
+            res = dict((k, v) for k, v in obj._get_fields().iteritems() if k in obj._schema or k in ['_id', '_rev'])
             res["type_"] = obj.__class__.__name__
             return res
         if _have_numpy:
@@ -214,13 +335,48 @@ class IonObjectDeserializer(IonObjectSerializationBase):
     into IonObjects. You *MUST* pass an object registry
     """
 
-    deserialize = IonObjectSerializationBase.operate
-
     def __init__(self, transform_method=None, obj_registry=None, **kwargs):
         assert obj_registry
         self._obj_registry = obj_registry
+        self._classes = {}      # type name -> class, filled from the registry as types are seen
         IonObjectSerializationBase.__init__(self, transform_method=transform_method)
 
+    def deserialize(self, obj):
+        """
+        Transforms dicts produced by IonObjectSerializer back into IonObjects.
+
+        Unless a custom transform method was given, this does not walk with _transform (see operate),
+        but builds objects bottom-up with their class's _from_dict.
+        """
+        if self._transform_method != self._transform:
+            return self.operate(obj)
+        return self._deserialize(obj)
+
+    def _deserialize(self, obj):
+        if isinstance(obj, dict):
+            # Note: This check to detect an IonObject is a bit risky (only type_)
+            if "type_" in obj:
+                type_name = obj["type_"]
+                clzz = self._classes.get(type_name, None)
+                if clzz is None:
+                    clzz = self._classes[type_name] = self._obj_registry.get_class(type_name.encode('ascii'))
+
+                return clzz._from_dict(dict((k, self._deserialize(v)) for k, v in obj.iteritems() if k != "type_"))
+
+            if _have_numpy and 'numpy' in obj:
+                return self._transform(obj)
+
+            return dict((k, self._deserialize(v)) for k, v in obj.iteritems())
+
+        if _have_numpy and isinstance(obj, np.ndarray):
+            return obj
+
+        # same as walk: all other iterables become lists
+        if hasattr(obj, '__iter__'):
+            return [self._deserialize(x) for x in obj]
+
+        return obj
+
     def _transform(self, obj):
         # Note: This check to detect an IonObject is a bit risky (only type_)
         if isinstance(obj, dict) and "type_" in obj:
@@ -243,8 +399,8 @@ class IonObjectDeserializer(IonObjectSerializationBase):
                     type = msg.get('type')
                     data = msg.get('body')
                     log.debug('Numpy Array Detected:\n  type: %s\n  shape: %s\n  body: %s',type,shape,data)
-                    ret = np.fromstring(string=data,dtype=type).reshape(shape)
-                    return np.array(ret)
+                    # fromstring copies, the result is a writable array of its own
+                    return np.fromstring(string=data,dtype=type).reshape(shape)
 
 
         return obj
@@ -13,6 +13,11 @@ import time
 import multiprocessing as mp
 import os
 import signal
+import mmap
+import cPickle
+import traceback
+from gevent import queue as gqueue
+from gevent.socket import wait_read
 
 class PyonProcessError(Exception):
     pass
@@ -164,6 +169,141 @@ class PythonProcess(PyonProcess):
         log.warn("get ready event not implemented for PythonProcess")
         return None
 
+class ProcessWorkerPoolError(PyonProcessError):
+    pass
+
+def _shm_pack(shm, data):
+    """
+    Puts data in the shared memory segment if it fits and returns its length, otherwise returns data to go over the pipe.
+    """
+    if len(data) > len(shm):
+        return data
+
+    shm.seek(0)
+    shm.write(data)
+    return len(data)
+
+def _shm_unpack(shm, packed):
+    if isinstance(packed, int):
+        return shm[:packed]
+    return packed
+
+def _pool_worker_main(func, conn, shm):
+    """
+    Loop of a ProcessWorkerPool worker process: reads an argument, calls func with it, sends back the result or the
+    traceback. Exits when the pool closes its end of the pipe.
+    """
+    # the container handles interrupts and stops the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    while True:
+        try:
+            packed = conn.recv()
+        except EOFError:
+            break
+
+        try:
+            result = func(cPickle.loads(_shm_unpack(shm, packed)))
+            conn.send(('ok', _shm_pack(shm, cPickle.dumps(result, cPickle.HIGHEST_PROTOCOL))))
+        except Exception:
+            conn.send(('error', traceback.format_exc()))
+
+class _PoolWorker(object):
+    """
+    One worker process of a ProcessWorkerPool, with its pipe and shared memory segment. Runs one call at a time.
+    """
+    def __init__(self, func, shm_size):
+        # anonymous shared mapping, inherited by the forked worker
+        self.shm = mmap.mmap(-1, shm_size)
+        self.conn, child_conn = mp.Pipe()
+
+        self.proc = mp.Process(target=_pool_worker_main, args=(func, child_conn, self.shm))
+        self.proc.daemon = True
+        self.proc.start()
+
+        child_conn.close()
+
+    def call(self, arg):
+        self.conn.send(_shm_pack(self.shm, cPickle.dumps(arg, cPickle.HIGHEST_PROTOCOL)))
+
+        # wait without blocking the container's other greenlets
+        wait_read(self.conn.fileno())
+        status, packed = self.conn.recv()
+
+        if status == 'error':
+            raise ProcessWorkerPoolError("Worker call failed: %s" % packed)
+
+        return cPickle.loads(_shm_unpack(self.shm, packed))
+
+    def stop(self, timeout=5):
+        self.conn.close()
+        self.proc.join(timeout)
+        if self.proc.is_alive():
+            self.proc.terminate()
+        self.shm.close()
+
+class ProcessWorkerPool(object):
+    """
+    @brief A fixed number of OS worker processes that run one function on arguments sent to them, so CPU bound
+    work does not block the container's greenlets.
+
+    Workers are forked when the pool is created, so func can be a bound method of any object the container
+    process holds (it is not pickled). Arguments and results are pickled and passed through a shared memory
+    segment per worker, only data larger than the segment goes over the worker's pipe.
+    """
+
+    def __init__(self, func, size=2, shm_size=4*1024*1024):
+        """
+        @param  func        Callable taking one argument, run in the workers.
+        @param  size        Number of worker processes.
+        @param  shm_size    Bytes of shared memory per worker, should hold a pickled argument or result.
+        """
+        self._func = func
+        self._shm_size = shm_size
+        self._idle = gqueue.Queue()
+
+        for x in xrange(size):
+            self._idle.put(_PoolWorker(func, shm_size))
+
+        self._workers = size
+
+    def apply(self, arg):
+        """
+        Calls func(arg) in the next free worker and returns the result. Blocks the calling greenlet only.
+
+        @throws ProcessWorkerPoolError  If func raised or the worker died (it is then replaced).
+        """
+        worker = self._idle.get()
+        try:
+            return worker.call(arg)
+        except ProcessWorkerPoolError:
+            # func raised, the worker is fine
+            raise
+        except (EOFError, IOError), ex:
+            log.error("ProcessWorkerPool worker (pid %s) died, replacing it: %s", worker.proc.pid, ex)
+            worker = self._replace_worker(worker)
+            raise ProcessWorkerPoolError("Worker died: %s" % ex)
+        except BaseException:
+            # e.g. the calling greenlet was killed or timed out: the reply to this call is still to come,
+            # the next call would get it
+            log.warn("ProcessWorkerPool call interrupted, replacing worker (pid %s)", worker.proc.pid)
+            worker = self._replace_worker(worker)
+            raise
+        finally:
+            self._idle.put(worker)
+
+    def _replace_worker(self, worker):
+        worker.stop(timeout=0)
+        return _PoolWorker(self._func, self._shm_size)
+
+    def shutdown(self, timeout=5):
+        """
+        Stops the workers, waiting for calls in progress to finish.
+        """
+        while self._workers:
+            self._idle.get().stop(timeout)
+            self._workers -= 1
+
 class ProcessSupervisor(object):
     """
     @brief Manage spawning processes of multiple kinds and ensure they're alive.
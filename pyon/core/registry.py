@@ -7,6 +7,7 @@ import inspect
 from copy import deepcopy
 
 from pyon.core.exception import NotFound
+from pyon.core.object import IonObjectBase, IonSlotsObjectBase, compile_validator
 from pyon.util.config import CFG
 from pyon.util.log import log
 
@@ -92,22 +93,32 @@ class IonObjectRegistry(object):
         for name, clzz in classes:
             message_classes[name] = clzz
 
+        # Build the validators once all classes are known, so object typed fields resolve to classes
+        for clzz in model_classes.values() + message_classes.values():
+            if issubclass(clzz, IonObjectBase) and hasattr(clzz, '_schema'):
+                compile_validator(clzz, types=model_classes)
+
+    def get_class(self, _def):
+        """ Returns the object or message class with the given name. """
+        if _def in model_classes:
+            return model_classes[_def]
+        elif _def in message_classes:
+            return message_classes[_def]
+        else:
+            raise NotFound("No matching class found for name %s" % _def)
+
     def new(self, _def, _dict=None, **kwargs):
         """ See get_def() for definition lookup options. """
         #log.debug("In IonObjectRegistry.new")
         #log.debug("name: %s" % _def)
         #log.debug("_dict: %s" % str(_dict))
         #log.debug("kwargs: %s" % str(kwargs))
-        if _def in model_classes:
-            clzz = model_classes[_def]
-        elif _def in message_classes:
-            clzz = message_classes[_def]
-        else:
-            raise NotFound("No matching class found for name %s" % _def)
+        clzz = self.get_class(_def)
 
         # Conditionally override the __setattr__ method to
-        # include additional client side validation
-        if self.validate_setattr:
+        # include additional client side validation. Not needed
+        # with __slots__, these reject unknown attributes already.
+        if self.validate_setattr and not issubclass(clzz, IonSlotsObjectBase):
             def validating_setattr(self, name, value):
                 if name not in self._schema and name != "_id" and name != "_rev":
                     raise AttributeError("'%s' object has no attribute '%s'" % (type(self).__name__, name))
@@ -5,7 +5,10 @@ __license__ = 'Apache 2.0'
 
 from pyon.core.registry import IonObjectRegistry
 from pyon.core.bootstrap import IonObject
+from pyon.core.object import IonObjectBase, IonSlotsObjectBase, IonObjectValidator, IonObjectSerializer, IonObjectDeserializer, compile_validator, walk
+from mock import Mock, patch
 from pyon.util.int_test import IonIntegrationTestCase
+from pyon.util.unit_test import PyonTestCase
 from nose.plugins.attrib import attr
 
 @attr('UNIT')
@@ -44,3 +47,181 @@ class ObjectTest(IonIntegrationTestCase):
         """ Use the factory and singleton from bootstrap.py/public.py """
         obj = IonObject('SampleObject')
         self.assertEqual(obj.name, '')
+
+class ValidatorChild(IonObjectBase):
+    _schema = {'name': {'type': 'str', 'default': ''}}
+
+    def __init__(self, name=''):
+        self.name = name
+
+class ValidatorParent(IonObjectBase):
+    _schema = {'name': {'type': 'str', 'default': ''},
+               'count': {'type': 'float', 'default': 0.0},
+               'child': {'type': 'ValidatorChild', 'default': None},
+               'children': {'type': 'list', 'default': []},
+               'any': {'type': 'NoneType', 'default': None}}
+
+    def __init__(self, name='', count=0.0, child=None, children=None, any=None):
+        self.name = name
+        self.count = count
+        self.child = child
+        self.children = children or []
+        self.any = any
+
+@attr('UNIT')
+class ValidatorTest(PyonTestCase):
+    def setUp(self):
+        compile_validator(ValidatorChild)
+        compile_validator(ValidatorParent, types={'ValidatorChild': ValidatorChild})
+
+    def test_validate(self):
+        obj = ValidatorParent(name='parent', child=ValidatorChild('child'), children=(ValidatorChild(),), any=5)
+        obj._id = 'id'
+        obj._validate()
+
+    def test_coercion(self):
+        obj = ValidatorParent(count=3)
+        obj._validate()
+        self.assertEquals(type(obj.count), float)
+
+    def test_extra_field(self):
+        obj = ValidatorParent()
+        obj.extra = 1
+        self.assertRaises(AttributeError, obj._validate)
+
+    def test_invalid_type(self):
+        obj = ValidatorParent(name=3)
+        self.assertRaises(AttributeError, obj._validate)
+
+    def test_nested_invalid(self):
+        obj = ValidatorParent(child=ValidatorChild(name=3))
+        self.assertRaises(AttributeError, obj._validate)
+
+        obj = ValidatorParent(children=[ValidatorChild(name=3)])
+        self.assertRaises(AttributeError, obj._validate)
+
+    def test_compiled_once(self):
+        validator = ValidatorParent._validator
+        self.assertTrue(isinstance(validator, IonObjectValidator))
+
+        ValidatorParent()._validate()
+        self.assertTrue(ValidatorParent.__dict__['_validator'] is validator)
+
+    def test_compiled_on_first_use(self):
+        class Uncompiled(ValidatorChild):
+            pass
+
+        self.assertFalse('_validator' in Uncompiled.__dict__)
+        Uncompiled()._validate()
+        self.assertTrue('_validator' in Uncompiled.__dict__)
+
+class SlotsParent(IonSlotsObjectBase):
+    def __init__(self, name='', count=0.0):
+        self.name = name
+        self.count = count
+
+    _schema = {'name': {'type': 'str', 'default': ''},
+               'count': {'type': 'float', 'default': 0.0}}
+    __slots__ = ('name', 'count', )
+
+class SlotsChild(SlotsParent):
+    def __init__(self, name='', count=0.0, child=None):
+        self.name = name
+        self.count = count
+        self.child = child
+
+    _schema = dict(SlotsParent._schema.items() + {'child': {'type': 'SlotsParent', 'default': None}}.items())
+    __slots__ = ('child', )
+
+@attr('UNIT')
+class SlotsObjectTest(PyonTestCase):
+    def test_no_dict(self):
+        obj = SlotsChild(name='child')
+        self.assertFalse(hasattr(obj, '__dict__'))
+        self.assertRaises(AttributeError, setattr, obj, 'extra', 1)
+
+    def test_fields(self):
+        obj = SlotsChild(name='child')
+        self.assertEquals(obj._get_fields(), {'name': 'child', 'count': 0.0, 'child': None})
+
+        obj._id = 'id'
+        self.assertEquals(obj._get_fields()['_id'], 'id')
+        self.assertEquals(SlotsChild._get_slot_names(), ('_id', '_rev', 'type_', 'name', 'count', 'child'))
+
+    def test_eq_update(self):
+        obj = SlotsChild(name='child')
+        other = SlotsChild()
+        self.assertNotEquals(obj, other)
+
+        other.update(obj)
+        self.assertEquals(obj, other)
+
+    def test_validate(self):
+        obj = SlotsChild(count=3, child=SlotsParent())
+        obj._validate()
+        self.assertEquals(type(obj.count), float)
+
+        obj.child.name = 5
+        self.assertRaises(AttributeError, obj._validate)
+
+    def test_serialize(self):
+        obj = SlotsChild(name='child', child=SlotsParent(name='parent'))
+        obj._id = 'id'
+
+        data = IonObjectSerializer().serialize(obj)
+        self.assertEquals(data, {'type_': 'SlotsChild', '_id': 'id', 'name': 'child', 'count': 0.0,
+                                 'child': {'type_': 'SlotsParent', 'name': 'parent', 'count': 0.0}})
+
+        registry = Mock()
+        registry.get_class.side_effect = lambda type_name: {'SlotsChild': SlotsChild, 'SlotsParent': SlotsParent}[type_name]
+        self.assertEquals(IonObjectDeserializer(obj_registry=registry).deserialize(data), obj)
+
+    def test_from_dict_unknown_field(self):
+        # fields no longer in the schema are dropped
+        with patch('pyon.core.object.log') as log_mock:
+            obj = SlotsChild._from_dict({'type_': 'SlotsChild', '_id': 'id', 'name': 'child', 'count': 1.0,
+                                         'child': None, 'removed': 5})
+        self.assertEquals(obj._get_fields(), {'type_': 'SlotsChild', '_id': 'id', 'name': 'child', 'count': 1.0, 'child': None})
+        self.assertTrue(log_mock.warn.called)
+
+    def test_walk(self):
+        obj = SlotsChild(name='child', child=SlotsParent(name='parent'))
+
+        def upper(o):
+            if isinstance(o, str):
+                return o.upper()
+            return o
+
+        walk(obj, upper)
+        self.assertEquals(obj.name, 'CHILD')
+        self.assertEquals(obj.child.name, 'PARENT')
+
+@attr('UNIT')
+class DeserializerTest(PyonTestCase):
+    def setUp(self):
+        self.registry = Mock()
+        self.registry.get_class.side_effect = lambda type_name: {'ValidatorChild': ValidatorChild, 'ValidatorParent': ValidatorParent}[type_name]
+        self.deserializer = IonObjectDeserializer(obj_registry=self.registry)
+
+    def test_deserialize(self):
+        obj = ValidatorParent(name='parent', child=ValidatorChild('child'), children=[ValidatorChild('one'), ValidatorChild('two')])
+        obj._id = 'id'
+        data = IonObjectSerializer().serialize({'obj': obj, 'tuple': (1, 2)})
+
+        res = self.deserializer.deserialize(data)
+
+        self.assertEquals(res, {'obj': obj, 'tuple': [1, 2]})
+        self.assertEquals(self.registry.get_class.call_count, 2)
+
+    def test_deserialize_defaults(self):
+        # fields missing from the dict get their defaults
+        res = self.deserializer.deserialize({'type_': 'ValidatorParent', 'name': 'parent'})
+        self.assertEquals(res, ValidatorParent(name='parent'))
+
+    def test_deserialize_same_as_operate(self):
+        self.registry.new.side_effect = lambda type_name: self.registry.get_class(type_name)()
+
+        obj = ValidatorParent(name='parent', child=ValidatorChild('child'), children=[ValidatorChild('one')])
+        data = IonObjectSerializer().serialize([obj, {'nested': obj}])
+
+        self.assertEquals(self.deserializer.deserialize(data), self.deserializer.operate(data))
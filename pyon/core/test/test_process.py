@@ -3,13 +3,15 @@
 __author__ = 'Adam R. Smith'
 __license__ = 'Apache 2.0'
 
-from pyon.core.process import GreenProcess, PythonProcess, GreenProcessSupervisor
+from pyon.core.process import GreenProcess, PythonProcess, GreenProcessSupervisor, ProcessWorkerPool, ProcessWorkerPoolError
 from pyon.core.exception import ContainerError
 from pyon.util.int_test import IonIntegrationTestCase
 from unittest import SkipTest
 from nose.plugins.attrib import attr
 
 import time
+import os
+import gevent
 
 @attr('UNIT', group='process')
 class ProcessTest(IonIntegrationTestCase):
@@ -116,5 +118,43 @@ class ProcessTest(IonIntegrationTestCase):
         proc = sup.spawn(('green', failboat))
         self.assertRaises(ContainerError, sup.ensure_ready, proc)
 
+    def test_worker_pool(self):
+        def double(x):
+            if x is None:
+                raise ValueError("no input")
+            return os.getpid(), x * 2
 
+        pool = ProcessWorkerPool(double, size=2, shm_size=1024)
+        self.addCleanup(pool.shutdown)
 
+        pid, val = pool.apply(21)
+        self.assertEqual(val, 42)
+        self.assertNotEqual(pid, os.getpid())
+
+        # larger than the shared memory, goes over the pipe
+        pid, val = pool.apply('a' * 4096)
+        self.assertEqual(val, 'a' * 8192)
+
+        self.assertRaises(ProcessWorkerPoolError, pool.apply, None)
+
+        # the worker is still usable after an error in the function
+        self.assertEqual(pool.apply(1)[1], 2)
+
+    def test_worker_pool_interrupted(self):
+        def slow_echo(arg):
+            # busy, not sleeping: the worker is a fork of the container
+            end = time.time() + arg[0]
+            while time.time() < end:
+                pass
+            return arg[1]
+
+        pool = ProcessWorkerPool(slow_echo, size=1, shm_size=1024)
+        self.addCleanup(pool.shutdown)
+
+        # killed while waiting for the result
+        gl = gevent.spawn(pool.apply, (0.5, 'first'))
+        gevent.sleep(0.1)
+        gl.kill()
+
+        # the next call gets its own result, not the one of the killed call
+        self.assertEqual(pool.apply((0, 'second')), 'second')
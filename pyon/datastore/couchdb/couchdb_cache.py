@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+"""Read-through cache of CouchDB documents"""
+
+__license__ = 'Apache 2.0'
+
+from collections import OrderedDict, defaultdict
+from copy import deepcopy
+
+
+class CouchDBDocCache(object):
+    """
+    LRU cache of the head revision of CouchDB docs, keyed by (datastore name, doc id).
+
+    Docs are stored and handed out as deep copies, so callers may change what they get. Every
+    invalidation counts as a change of its datastore: a doc read from CouchDB is only put if no
+    change was seen for the datastore since the read started (see generation), so a read racing
+    with a change never caches an old revision.
+    """
+
+    def __init__(self, size=1000):
+        self._size          = size
+        self._docs          = OrderedDict()         # (datastore name, doc id) -> doc, least recently used first
+        self._generation    = defaultdict(int)      # datastore name -> number of changes seen
+        self._stats         = {'hits': 0, 'misses': 0, 'puts': 0, 'invalidations': 0, 'evictions': 0}
+
+    def get(self, datastore_name, doc_id, rev_id=None):
+        """
+        Returns a copy of the cached doc, or None. With rev_id, only if that is the cached revision.
+        """
+        key = (datastore_name, doc_id)
+        doc = self._docs.pop(key, None)
+        if doc is None or (rev_id and doc['_rev'] != rev_id):
+            if doc is not None:
+                self._docs[key] = doc
+            self._stats['misses'] += 1
+            return None
+
+        self._docs[key] = doc
+        self._stats['hits'] += 1
+        return deepcopy(doc)
+
+    def generation(self, datastore_name):
+        return self._generation[datastore_name]
+
+    def put(self, datastore_name, doc, generation=None):
+        """
+        Caches a copy of the head revision of a doc. If generation is given (taken before reading the doc),
+        the doc is only cached if the datastore has not changed since.
+        """
+        if generation is not None and generation != self._generation[datastore_name]:
+            return
+
+        key = (datastore_name, doc['_id'])
+        self._docs.pop(key, None)
+        self._docs[key] = deepcopy(doc)
+        self._stats['puts'] += 1
+
+        while len(self._docs) > self._size:
+            self._docs.popitem(last=False)
+            self._stats['evictions'] += 1
+
+    def invalidate(self, datastore_name, doc_id, rev_id=None):
+        """
+        A doc changed: drops it, unless rev_id is given and is the cached revision (our own write).
+        """
+        self._generation[datastore_name] += 1
+
+        key = (datastore_name, doc_id)
+        doc = self._docs.get(key)
+        if doc is None or (rev_id and doc['_rev'] == rev_id):
+            return
+        del self._docs[key]
+        self._stats['invalidations'] += 1
+
+    def clear(self, datastore_name):
+        """
+        Drops all docs of a datastore.
+        """
+        self._generation[datastore_name] += 1
+        for key in [key for key in self._docs if key[0] == datastore_name]:
+            del self._docs[key]
+
+    def get_stats(self):
+        stats = dict(self._stats)
+        stats['size'] = len(self._docs)
+        stats['max_size'] = self._size
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = float(stats['hits']) / lookups if lookups else 0.0
+        return stats
@@ -77,6 +77,26 @@ function(doc) {
   if (doc.type_ == "Association") {
     emit([doc.p, doc.s, doc.o, doc.at, doc.srv, doc.orv], doc);
   }
+}""",
+        },
+        # For find_related hops: exact keys, to look up many ids with one multi-key query.
+        # The key [id, null] matches any predicate
+        'related_obj':{
+            'map':"""
+function(doc) {
+  if (doc.type_ == "Association") {
+    emit([doc.s, doc.p], [doc.o, doc.ot]);
+    emit([doc.s, null], [doc.o, doc.ot]);
+  }
+}""",
+        },
+        'related_sub':{
+            'map':"""
+function(doc) {
+  if (doc.type_ == "Association") {
+    emit([doc.o, doc.p], [doc.s, doc.st]);
+    emit([doc.o, null], [doc.s, doc.st]);
+  }
 }""",
         }
     },
@@ -3,8 +3,12 @@
 __author__ = 'Thomas R. Lennan, Michael Meisinger'
 __license__ = 'Apache 2.0'
 
+from functools import wraps
 from uuid import uuid4
 import hashlib
+import inspect
+
+import gevent
 
 import couchdb
 from couchdb.client import ViewResults, Row
@@ -13,19 +17,15 @@ from couchdb.http import PreconditionFailed, ResourceConflict, ResourceNotFound
 from pyon.core.bootstrap import obj_registry
 from pyon.core.exception import BadRequest, Conflict, NotFound
 from pyon.core.object import IonObjectBase, IonObjectSerializer, IonObjectDeserializer
-from pyon.datastore.datastore import DataStore
+from pyon.datastore.datastore import DataStore, END_MARKER
+from pyon.datastore.couchdb.couchdb_cache import CouchDBDocCache
 from pyon.datastore.couchdb.couchdb_config import get_couchdb_views
+from pyon.datastore.couchdb.couchdb_session import PooledSession
 from pyon.ion.resource import CommonResourceLifeCycleSM
+from pyon.util.async import spawn
 from pyon.util.log import log
 from pyon.core.bootstrap import CFG
 
-# Token for a most likely non-inclusive key range upper bound (end_key), for queries such as
-# prefix <= keys < upper bound: e.g. ['some','value'] <= keys < ['some','value', END_MARKER]
-# or "somestr" <= keys < "somestr"+END_MARKER for string prefix checking
-# Note: Use highest ASCII characters here, not 8bit
-#END_MARKER = "\x7f\x7f\x7f\x7f"
-END_MARKER = "ZZZZZZ"
-
 def sha1hex(doc):
     """
     Compare the content of the doc without its id or revision...
@@ -43,12 +43,46 @@ def sha1hex(doc):
     return hashlib.sha1(doc_string).hexdigest().upper()
 
 
+def _is_datastore_missing(ex):
+    """
+    Tells whether a ResourceNotFound is about the database itself rather than a doc or view in it.
+    """
+    error = ex.args[0] if ex.args else None
+    return isinstance(error, tuple) and len(error) > 1 and error[1] in ('no_db_file', 'Database does not exist.')
+
+def datastore_op(func):
+    """
+    Decorates a CouchDB_DataStore method using a couchdb Database from _dbs. If the datastore was deleted
+    meanwhile (e.g. by another container), raises BadRequest as on first access and drops it from _dbs.
+    """
+    @wraps(func)
+    def call(self, *args, **kwargs):
+        try:
+            return func(self, *args, **kwargs)
+        except ResourceNotFound as ex:
+            if not _is_datastore_missing(ex):
+                raise
+            datastore_name = inspect.getcallargs(func, self, *args, **kwargs).get('datastore_name') or self.datastore_name
+            self._dbs.pop(datastore_name, None)
+            raise BadRequest("Datastore '%s' does not exist" % datastore_name)
+    return call
+
+
 class CouchDB_DataStore(DataStore):
     """
     Data store implementation utilizing CouchDB to persist documents.
     For API info, see: http://packages.python.org/CouchDB/client.html
+
+    With a cache_size, head revisions of docs read or written are kept in an LRU cache (see CouchDBDocCache).
+    A greenlet per datastore follows the CouchDB _changes feed and drops docs changed by anyone else.
+
+    All instances share one bounded pool of keep-alive HTTP connections (see PooledSession). The pool is a class
+    attribute, so it is shared by every container in the process, and its size is read from the config of the
+    first container creating a CouchDB datastore.
     """
-    def __init__(self, host=None, port=None, datastore_name='prototype', options="", profile=DataStore.DS_PROFILE.BASIC):
+    _session = None     # PooledSession of the process
+
+    def __init__(self, host=None, port=None, datastore_name='prototype', options="", profile=DataStore.DS_PROFILE.BASIC, cache_size=0):
         log.debug('__init__(host=%s, port=%s, datastore_name=%s, options=%s)' % (host, port, datastore_name, options))
         self.host = host or CFG.server.couchdb.host
         self.port = port or CFG.server.couchdb.port
@@ -66,7 +100,10 @@ class CouchDB_DataStore(DataStore):
         #connection_str = "http://%s:%s" % (self.host, self.port)
         # TODO: Security risk to emit password into log. Remove later.
         log.info('Connecting to CouchDB server: %s' % connection_str)
-        self.server = couchdb.Server(connection_str)
+        self.server = couchdb.Server(connection_str, session=self._get_session())
+        self._dbs = {}      # datastore name -> couchdb Database, known to exist
+        # Number of ids read per request by read_doc_mult, chunks are read in parallel
+        self._read_chunk_size = CFG.get_safe('container.datastore.read_chunk_size', 100)
 
         # Datastore specialization (views)
         self.profile = profile
@@ -76,15 +113,49 @@ class CouchDB_DataStore(DataStore):
         # TODO: Not nice to have this class depend on ION objects
         self._io_deserializer   = IonObjectDeserializer(obj_registry=obj_registry)
 
+        # read-through doc cache
+        self._cache             = CouchDBDocCache(cache_size) if cache_size else None
+        self._followers         = {}        # datastore name -> greenlet following its changes
+        self._follow_seqs       = {}        # datastore name -> last update seq seen by its follower
+        self._listeners         = {}        # datastore name -> change listener callbacks
+
     def close(self):
         log.info("Closing connection to CouchDB")
-        map(lambda x: map(lambda y: y.close(), x), self.server.resource.session.conns.values())
-        self.server.resource.session.conns = {}     # just in case we try to reuse this, for some reason
+        for datastore_name in self._followers.keys():
+            self._stop_follower(datastore_name)
+        # The HTTP connections are shared with the other datastores, see close_session
+        self._dbs = {}
+
+    @classmethod
+    def _get_session(cls):
+        if cls._session is None:
+            cls._session = PooledSession(size=CFG.get_safe('container.datastore.http_pool.size', 20))
+        return cls._session
+
+    @classmethod
+    def close_session(cls):
+        """
+        Closes the idle connections of the HTTP pool shared by all CouchDB datastores of the process,
+        including those of other containers. Connections in use are not affected.
+        """
+        if cls._session is not None:
+            cls._session.close()
+
+    @classmethod
+    def get_pool_stats(cls):
+        """
+        Returns the usage and request latency histogram of the shared HTTP pool.
+        """
+        return cls._get_session().get_stats()
 
     def _get_datastore(self, datastore_name=None):
         datastore_name = datastore_name or self.datastore_name
+        if datastore_name in self._dbs:
+            return self._dbs[datastore_name], datastore_name
         try:
+            # Checks that it exists with a HEAD request, once
             ds = self.server[datastore_name]
+            self._dbs[datastore_name] = ds
             return ds, datastore_name
         except ResourceNotFound:
             raise BadRequest("Datastore '%s' does not exist" % datastore_name)
@@ -107,6 +178,12 @@ class CouchDB_DataStore(DataStore):
     def delete_datastore(self, datastore_name=""):
         datastore_name = datastore_name or self.datastore_name
         log.info('Deleting data store %s' % datastore_name)
+        self._dbs.pop(datastore_name, None)
+        self._stop_follower(datastore_name)
+        self._follow_seqs.pop(datastore_name, None)
+        self._notify_listeners(datastore_name, None)
+        if self._cache:
+            self._cache.clear(datastore_name)
         try:
             self.server.delete(datastore_name)
         except ResourceNotFound:
@@ -119,6 +196,7 @@ class CouchDB_DataStore(DataStore):
         log.debug('Data stores: %s' % str(dbs))
         return dbs
 
+    @datastore_op
     def info_datastore(self, datastore_name=""):
         ds, datastore_name = self._get_datastore(datastore_name)
         log.debug('Listing information about data store %s' % datastore_name)
@@ -132,6 +210,7 @@ class CouchDB_DataStore(DataStore):
                 return True
         return False
 
+    @datastore_op
     def list_objects(self, datastore_name=""):
         ds, datastore_name = self._get_datastore(datastore_name)
         log.warning('Listing all objects in data store %s' % datastore_name)
@@ -139,6 +218,7 @@ class CouchDB_DataStore(DataStore):
         log.debug('Objects: %s' % str(objs))
         return objs
 
+    @datastore_op
     def list_object_revisions(self, object_id, datastore_name=""):
         ds, datastore_name = self._get_datastore(datastore_name)
         log.debug('Listing all versions of object %s/%s' % (datastore_name, object_id))
@@ -153,6 +233,7 @@ class CouchDB_DataStore(DataStore):
         return self.create_doc(self._ion_object_to_persistence_dict(obj),
                                object_id=object_id, datastore_name=datastore_name)
 
+    @datastore_op
     def create_doc(self, doc, object_id=None, datastore_name=""):
         ds, datastore_name = self._get_datastore(datastore_name)
         if '_id' in doc:
@@ -160,24 +241,23 @@ class CouchDB_DataStore(DataStore):
         if '_rev' in doc:
             raise BadRequest("Doc must not have '_rev'")
 
-        if object_id:
-            try:
-                self.read(object_id, '', datastore_name)
-                raise BadRequest("Object with id %s already exists" % object_id)
-            except NotFound:
-                pass
-
         # Assign an id to doc (recommended in CouchDB documentation)
+        # An existing object_id makes the save fail with a conflict
         doc["_id"] = object_id or uuid4().hex
         log.info('Creating new object %s/%s' % (datastore_name, doc["_id"]))
         log.debug('create doc contents: %s', doc)
 
+        if self._cache:
+            generation = self._cache_generation(datastore_name)
+
         # Save doc.  CouchDB will assign version to doc.
         try:
             res = ds.save(doc)
         except ResourceConflict:
             raise BadRequest("Object with id %s already exist" % doc["_id"])
         log.debug('Create result: %s' % str(res))
+        if self._cache:
+            self._cache.put(datastore_name, doc, generation)
         id, version = res
         return (id, version)
 
@@ -200,6 +280,7 @@ class CouchDB_DataStore(DataStore):
         return self.create_doc_mult([self._ion_object_to_persistence_dict(obj) for obj in objects],
                                     object_ids)
 
+    @datastore_op
     def create_doc_mult(self, docs, object_ids=None):
         if any(["_id" in doc for doc in docs]):
             raise BadRequest("Docs must not have '_id'")
@@ -207,6 +288,7 @@ class CouchDB_DataStore(DataStore):
             raise BadRequest("Docs must not have '_rev'")
         if object_ids and len(object_ids) != len(docs):
             raise BadRequest("Invalid object_ids")
+        ds, datastore_name = self._get_datastore()
 
         # Assign an id to doc (recommended in CouchDB documentation)
         object_ids = object_ids or [uuid4().hex for i in xrange(len(docs))]
@@ -214,12 +296,19 @@ class CouchDB_DataStore(DataStore):
         for doc, oid in zip(docs, object_ids):
             doc["_id"] = oid
 
+        if self._cache:
+            generation = self._cache_generation(datastore_name)
+
         # Update docs.  CouchDB will assign versions to docs.
-        res = self.server[self.datastore_name].update(docs)
+        res = ds.update(docs)
         if not res or not all([success for success, oid, rev in res]):
             log.error('Create error. Result: %s' % str(res))
         else:
             log.debug('Create result: %s' % str(res))
+        if self._cache:
+            for doc, (success, oid, rev) in zip(docs, res):
+                if success:
+                    self._cache.put(datastore_name, dict(doc, _rev=rev), generation)
         return res
 
     def read(self, object_id, rev_id="", datastore_name=""):
@@ -232,7 +321,16 @@ class CouchDB_DataStore(DataStore):
         log.debug('Ion object: %s' % str(obj))
         return obj
 
+    @datastore_op
     def read_doc(self, doc_id, rev_id="", datastore_name=""):
+        datastore_name = datastore_name or self.datastore_name
+        if self._cache:
+            doc = self._cache.get(datastore_name, doc_id, rev_id)
+            if doc is not None:
+                log.debug('Read object %s/%s from cache' % (datastore_name, doc_id))
+                return doc
+            generation = self._cache_generation(datastore_name)
+
         ds, datastore_name = self._get_datastore(datastore_name)
         if not rev_id:
             log.debug('Reading head version of object %s/%s' % (datastore_name, doc_id))
@@ -245,6 +343,8 @@ class CouchDB_DataStore(DataStore):
             if doc is None:
                 raise NotFound('Object with id %s does not exist.' % str(doc_id))
         log.debug('read doc contents: %s', doc)
+        if self._cache and not rev_id:
+            self._cache.put(datastore_name, doc, generation)
         return doc
 
     def read_mult(self, object_ids, datastore_name=""):
@@ -255,16 +355,41 @@ class CouchDB_DataStore(DataStore):
         obj_list = [self._persistence_dict_to_ion_object(doc) for doc in docs]
         return obj_list
 
+    @datastore_op
     def read_doc_mult(self, object_ids, datastore_name=""):
+        datastore_name = datastore_name or self.datastore_name
+        cached = {}
+        if self._cache:
+            for object_id in object_ids:
+                doc = self._cache.get(datastore_name, object_id)
+                if doc is not None:
+                    cached[object_id] = doc
+            if len(cached) == len(set(object_ids)):
+                return [cached[object_id] for object_id in object_ids]
+            generation = self._cache_generation(datastore_name)
+
         ds, datastore_name = self._get_datastore(datastore_name)
-        log.info('Reading head version of objects %s/%s' % (datastore_name, object_ids))
-        docs = ds.view("_all_docs", keys=object_ids, include_docs=True)
+        read_ids = [object_id for object_id in object_ids if object_id not in cached]
+        log.info('Reading head version of objects %s/%s' % (datastore_name, read_ids))
+        if len(read_ids) > self._read_chunk_size:
+            # Chunks are read in parallel, over separate pooled connections
+            chunks = [read_ids[i:i + self._read_chunk_size] for i in xrange(0, len(read_ids), self._read_chunk_size)]
+            gls = [spawn(lambda keys: list(ds.view("_all_docs", keys=keys, include_docs=True)), chunk) for chunk in chunks]
+            gevent.joinall(gls, raise_error=True)
+            docs = [row for gl in gls for row in gl.value]
+        else:
+            docs = ds.view("_all_docs", keys=read_ids, include_docs=True)
         # Check for docs not found
         notfound_list = ['Object with id %s does not exist.' % str(row.key) for row in docs if row.doc is None]
         if notfound_list:
             raise NotFound("\n".join(notfound_list))
 
-        doc_list = [row.doc.copy() for row in docs]
+        for row in docs:
+            cached[row.key] = row.doc.copy()
+            if self._cache:
+                self._cache.put(datastore_name, row.doc, generation)
+
+        doc_list = [cached[object_id] for object_id in object_ids]
         return doc_list
     
     def update(self, obj, datastore_name=""):
@@ -272,28 +397,76 @@ class CouchDB_DataStore(DataStore):
             raise BadRequest("Obj param is not instance of IonObjectBase")
         return self.update_doc(self._ion_object_to_persistence_dict(obj))
 
+    @datastore_op
     def update_doc(self, doc, datastore_name=""):
         ds, datastore_name = self._get_datastore(datastore_name)
         if '_id' not in doc:
             raise BadRequest("Doc must have '_id'")
         if '_rev' not in doc:
             raise BadRequest("Doc must have '_rev'")
-        
-        # First, try to read document to ensure it exists
-        # Have to do this because save will create a new doc
-        # if it doesn't exist.  We don't want this side-effect.
-        self.read_doc(doc["_id"], doc["_rev"], datastore_name)
 
+        # No need to read the doc first: as it has a _rev, save cannot create a new doc,
+        # CouchDB rejects it with a conflict if the doc does not exist
         log.info('Saving new version of object %s/%s' % (datastore_name, doc["_id"]))
         log.debug('update doc contents: %s', doc)
+        if self._cache:
+            generation = self._cache_generation(datastore_name)
         try:
             res = ds.save(doc)
         except ResourceConflict:
+            if self._cache:
+                self._cache.invalidate(datastore_name, doc["_id"])
             raise Conflict('Object not based on most current version')
         log.debug('Update result: %s' % str(res))
+        if self._cache:
+            self._cache.put(datastore_name, doc, generation)
         id, version = res
         return (id, version)
 
+    def update_mult(self, objects, datastore_name=""):
+        if any([not isinstance(obj, IonObjectBase) for obj in objects]):
+            raise BadRequest("Obj param is not instance of IonObjectBase")
+        return self.update_doc_mult([self._ion_object_to_persistence_dict(obj) for obj in objects],
+                                    datastore_name=datastore_name)
+
+    @datastore_op
+    def update_doc_mult(self, docs, datastore_name=""):
+        ds, datastore_name = self._get_datastore(datastore_name)
+        if not all(["_id" in doc for doc in docs]):
+            raise BadRequest("Docs must have '_id'")
+        if not all(["_rev" in doc for doc in docs]):
+            raise BadRequest("Docs must have '_rev'")
+        log.info('Saving new versions of %s objects in %s' % (len(docs), datastore_name))
+
+        if self._cache:
+            generation = self._cache_generation(datastore_name)
+
+        # One _bulk_docs request. CouchDB checks the _rev of each doc on its own
+        res = self._bulk_update(ds, docs)
+        if self._cache:
+            for doc, (success, oid, rev) in zip(docs, res):
+                if success:
+                    self._cache.put(datastore_name, dict(doc, _rev=rev), generation)
+                else:
+                    self._cache.invalidate(datastore_name, oid)
+        return res
+
+    def _bulk_update(self, ds, docs):
+        """
+        Saves docs with one _bulk_docs request. Returns list of (Success, Oid, rev or exception),
+        a doc not based on the most current version failing with a Conflict.
+        """
+        res = []
+        for success, oid, rev in ds.update(docs):
+            if not success and isinstance(rev, ResourceConflict):
+                rev = Conflict('Object %s not based on most current version' % oid)
+            res.append((success, oid, rev))
+        if not all(r[0] for r in res):
+            log.error('Bulk update error. Result: %s' % str(res))
+        else:
+            log.debug('Bulk update result: %s' % str(res))
+        return res
+
     def delete(self, obj, datastore_name="", del_associations=False):
         if not isinstance(obj, IonObjectBase) and not isinstance(obj, str):
             raise BadRequest("Obj param is not instance of IonObjectBase or string id")
@@ -306,16 +479,22 @@ class CouchDB_DataStore(DataStore):
                 raise BadRequest("Doc must have '_rev'")
             self.delete_doc(self._ion_object_to_persistence_dict(obj), datastore_name=datastore_name, del_associations=del_associations)
 
+    @datastore_op
     def delete_doc(self, doc, datastore_name="", del_associations=False):
         ds, datastore_name = self._get_datastore(datastore_name)
         doc_id = doc if type(doc) is str else doc["_id"]
         log.debug('Deleting object %s/%s' % (datastore_name, doc_id))
 
         if del_associations:
-            assoc_ids = self.find_associations(anyobj=doc_id, id_only=True)
-            for aid in assoc_ids:
-                self.delete(aid, datastore_name=datastore_name)
-            log.debug("Deleted %n associations for object %s" % (len(assoc_ids), doc_id))
+            # An association of the object with itself is found twice
+            assocs = dict((assoc._id, assoc) for assoc in self.find_associations(anyobj=doc_id, id_only=False))
+            res = self.delete_mult(assocs.values(), datastore_name=datastore_name)
+            failed = [(oid, ex) for success, oid, ex in res if not success]
+            if failed:
+                # Keep the object, so that its remaining associations do not dangle
+                log.error("Failed to delete associations of object %s: %s" % (doc_id, failed))
+                raise Conflict("Could not delete %s associations of object %s" % (len(failed), doc_id))
+            log.debug("Deleted %s associations for object %s" % (len(assocs), doc_id))
 
         elif self._is_in_association(doc_id, datastore_name):
             log.warn("XXXXXXX Attempt to delete object %s that still has associations" % doc_id)
@@ -326,8 +505,121 @@ class CouchDB_DataStore(DataStore):
                 del ds[doc_id]
             else:
                 ds.delete(doc)
-        except ResourceNotFound:
+        except ResourceNotFound as ex:
+            if _is_datastore_missing(ex):
+                raise
             raise NotFound('Object with id %s does not exist.' % doc_id)
+        finally:
+            if self._cache:
+                self._cache.invalidate(datastore_name, doc_id)
+
+    def delete_mult(self, objects, datastore_name=""):
+        if any([not isinstance(obj, IonObjectBase) and not isinstance(obj, str) for obj in objects]):
+            raise BadRequest("Obj param is not instance of IonObjectBase or string id")
+        return self.delete_doc_mult([obj if type(obj) is str else self._ion_object_to_persistence_dict(obj) for obj in objects],
+                                    datastore_name=datastore_name)
+
+    @datastore_op
+    def delete_doc_mult(self, docs, datastore_name=""):
+        ds, datastore_name = self._get_datastore(datastore_name)
+        doc_ids = [doc if type(doc) is str else doc["_id"] for doc in docs]
+        log.info('Deleting %s objects in %s' % (len(doc_ids), datastore_name))
+
+        # Docs given by id are deleted at their current revision, read with one request
+        revs = dict((doc["_id"], doc["_rev"]) for doc in docs if type(doc) is not str and "_rev" in doc)
+        read_ids = [doc_id for doc_id in doc_ids if doc_id not in revs]
+        if read_ids:
+            for row in ds.view("_all_docs", keys=read_ids):
+                if row.value and not row.value.get('deleted'):
+                    revs[row.key] = row.value['rev']
+
+        del_docs = [{'_id': doc_id, '_rev': revs[doc_id], '_deleted': True} for doc_id in doc_ids if doc_id in revs]
+        bulk_res = iter(self._bulk_update(ds, del_docs) if del_docs else [])
+        res = []
+        for doc_id in doc_ids:
+            if doc_id in revs:
+                res.append(next(bulk_res))
+            else:
+                res.append((False, doc_id, NotFound('Object with id %s does not exist.' % doc_id)))
+            if self._cache:
+                self._cache.invalidate(datastore_name, doc_id)
+        return res
+
+    def get_cache_stats(self):
+        """
+        Returns the hits, misses, size etc. of the doc cache, or None if there is no cache.
+        """
+        return self._cache.get_stats() if self._cache else None
+
+    def _cache_generation(self, datastore_name):
+        """
+        Returns the cache generation of a datastore to read or write a doc with, following its changes from now on.
+        A doc is cached after the read or write only if no change came in meanwhile.
+        """
+        if datastore_name not in self._followers:
+            self._start_follower(datastore_name)
+        return self._cache.generation(datastore_name)
+
+    def add_change_listener(self, callback, datastore_name=""):
+        datastore_name = datastore_name or self.datastore_name
+        self._listeners.setdefault(datastore_name, []).append(callback)
+        # A running follower does not read the changed docs: restart it from where it is
+        self._stop_follower(datastore_name)
+        self._start_follower(datastore_name)
+        return True
+
+    def _start_follower(self, datastore_name):
+        ds, datastore_name = self._get_datastore(datastore_name)
+        since = self._follow_seqs.get(datastore_name) or ds.info()['update_seq']
+        self._followers[datastore_name] = spawn(self._follow_changes, datastore_name, since)
+
+    def _stop_follower(self, datastore_name):
+        follower = self._followers.pop(datastore_name, None)
+        if follower is not None:
+            follower.kill()
+
+    def _follow_changes(self, datastore_name, since):
+        """
+        Runs in a greenlet per datastore: drops cached docs changed in CouchDB since the follower was started,
+        and passes the changes to the change listeners.
+        Our own writes come back here too, they are kept as the cache already has their revision.
+        """
+        while True:
+            try:
+                ds, datastore_name = self._get_datastore(datastore_name)
+                include_docs = bool(self._listeners.get(datastore_name))
+                for change in ds.changes(feed='continuous', since=since, heartbeat=10000, include_docs=include_docs):
+                    if 'last_seq' in change:
+                        since = change['last_seq']
+                        break
+                    since = self._follow_seqs[datastore_name] = change['seq']
+                    if self._cache:
+                        revs = change.get('changes')
+                        rev_id = revs[0]['rev'] if revs and not change.get('deleted') else None
+                        self._cache.invalidate(datastore_name, change['id'], rev_id)
+                    self._notify_listeners(datastore_name, change)
+            except BadRequest:
+                log.info("Datastore %s is gone, not following its changes anymore" % datastore_name)
+                self._followers.pop(datastore_name, None)
+                if self._cache:
+                    self._cache.clear(datastore_name)
+                self._notify_listeners(datastore_name, None)
+                return
+            except Exception:
+                # changes may have been missed, and the datastore may be gone
+                log.exception("Error following changes of datastore %s, dropping its cached docs" % datastore_name)
+                if self._cache:
+                    self._cache.clear(datastore_name)
+                self._notify_listeners(datastore_name, None)
+                self._dbs.pop(datastore_name, None)
+                gevent.sleep(1)
+
+    def _notify_listeners(self, datastore_name, change):
+        for callback in self._listeners.get(datastore_name, ()):
+            try:
+                callback(change)
+            except Exception:
+                log.exception("Error in change listener of datastore %s" % datastore_name)
 
     def _get_viewname(self, design, name):
         return "_design/%s/_view/%s" % (design, name)
@@ -403,6 +695,7 @@ class CouchDB_DataStore(DataStore):
 
         return False
 
+    @datastore_op
     def find_objects(self, subject, predicate=None, object_type=None, id_only=False, **kwargs):
         log.debug("find_objects(subject=%s, predicate=%s, object_type=%s, id_only=%s" % (subject, predicate, object_type, id_only))
         if type(id_only) is not bool:
@@ -440,6 +733,7 @@ class CouchDB_DataStore(DataStore):
         obj_list = self.read_mult(obj_ids)
         return (obj_list, obj_assocs)
 
+    @datastore_op
     def find_subjects(self, subject_type=None, predicate=None, obj=None, id_only=False, **kwargs):
         log.debug("find_subjects(subject_type=%s, predicate=%s, object=%s, id_only=%s" % (subject_type, predicate, obj, id_only))
         if type(id_only) is not bool:
@@ -477,6 +771,7 @@ class CouchDB_DataStore(DataStore):
         sub_list = self.read_mult(sub_ids)
         return (sub_list, sub_assocs)
 
+    @datastore_op
     def find_associations(self, subject=None, predicate=None, obj=None, assoc_type=None, id_only=True, anyobj=None, **kwargs):
         log.debug("find_associations(subject=%s, predicate=%s, object=%s)" % (subject, predicate, obj))
         if type(id_only) is not bool:
@@ -546,6 +841,13 @@ class CouchDB_DataStore(DataStore):
         log.debug("find_associations() found %s associations" % (len(assocs)))
         return assocs
 
+    def _find_related_hop(self, ids, predicate, direction, restype):
+        ds, datastore_name = self._get_datastore()
+        view_name = "related_obj" if direction == self.DIRECTION.OUT else "related_sub"
+        view = ds.view(self._get_viewname("association", view_name), keys=[[res_id, predicate or None] for res_id in ids])
+        return [row.value[0] for row in view if not restype or row.value[1] == restype]
+
+    @datastore_op
     def find_res_by_type(self, restype, lcstate=None, id_only=False):
         log.debug("find_res_by_type(restype=%s, lcstate=%s)" % (restype, lcstate))
         if type(id_only) is not bool:
@@ -571,6 +873,7 @@ class CouchDB_DataStore(DataStore):
             res_docs = [self._persistence_dict_to_ion_object(row.doc) for row in rows]
             return (res_docs, res_assocs)
 
+    @datastore_op
     def find_res_by_lcstate(self, lcstate, restype=None, id_only=False):
         log.debug("find_res_by_lcstate(lcstate=%s, restype=%s)" % (lcstate, restype))
         if type(id_only) is not bool:
@@ -602,6 +905,7 @@ class CouchDB_DataStore(DataStore):
             res_docs = [self._persistence_dict_to_ion_object(row.doc) for row in rows]
             return (res_docs, res_assocs)
 
+    @datastore_op
     def find_res_by_name(self, name, restype=None, id_only=False):
         log.debug("find_res_by_name(name=%s, restype=%s)" % (name, restype))
         if type(id_only) is not bool:
@@ -624,6 +928,7 @@ class CouchDB_DataStore(DataStore):
             res_docs = [self._persistence_dict_to_ion_object(row.doc) for row in rows]
             return (res_docs, res_assocs)
 
+    @datastore_op
     def find_dir_entries(self, qname):
         log.debug("find_dir_entries(qname=%s)" % (qname))
         if not str(qname).startswith('/'):
@@ -639,6 +944,7 @@ class CouchDB_DataStore(DataStore):
         log.debug("find_dir_entries() found %s objects" % (len(res_entries)))
         return res_entries
 
+    @datastore_op
     def find_by_view(self, design_name, view_name, key=None, keys=None, start_key=None, end_key=None,
                            id_only=True, convert_doc=True, **kwargs):
         """
@@ -685,6 +991,38 @@ class CouchDB_DataStore(DataStore):
         log.info("find_by_view() found %s objects" % (len(res_rows)))
         return res_rows
 
+    @datastore_op
+    def _find_view_page(self, design_name, view_name, key=None, start_key=None, end_key=None, id_only=True,
+                        page_size=100, cursor=None, **kwargs):
+        ds, datastore_name = self._get_datastore()
+
+        view_args = self._get_view_args(kwargs)
+        if cursor:
+            # keyset continuation instead of skip, which CouchDB walks row by row
+            view_args.pop('skip', None)
+        view_args['include_docs'] = (not id_only)
+        view_args['limit'] = page_size + 1
+
+        startkey, endkey = self._get_view_range(key, start_key, end_key, view_args.get('descending', False))
+        if cursor:
+            startkey = cursor[0]
+            view_args['startkey_docid'] = cursor[1]
+        if startkey is not None:
+            view_args['startkey'] = startkey
+        if endkey is not None:
+            view_args['endkey'] = endkey
+
+        view_doc = design_name if design_name == "_all_docs" else self._get_viewname(design_name, view_name)
+        rows = list(ds.view(view_doc, **view_args))
+        log.debug("find_by_view page(%s/%s): %s rows from %s" % (design_name, view_name, len(rows), startkey))
+
+        next_cursor = None
+        if len(rows) > page_size:
+            next_cursor = [rows[page_size]['key'], rows[page_size]['id']]
+            rows = rows[:page_size]
+
+        return [(row['id'], row['key'], row.get('doc')) for row in rows], next_cursor
+
     def _ion_object_to_persistence_dict(self, ion_object):
         if ion_object is None: return None
 
@@ -697,6 +1035,7 @@ class CouchDB_DataStore(DataStore):
         ion_object = self._io_deserializer.deserialize(obj_dict)
         return ion_object
 
+    @datastore_op
     def query_view(self, view_name='', opts={}, datastore_name=''):
         '''
         query_view is a straight through method for querying a view in CouchDB. query_view provides us the interface
@@ -713,6 +1052,7 @@ class CouchDB_DataStore(DataStore):
 
         return result
 
+    @datastore_op
     def custom_query(self, map_fun, reduce_fun=None, datastore_name='', **options):
         '''
         custom_query sets up a temporary view in couchdb, the map_fun is a string consisting
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+"""HTTP session shared by the CouchDB datastores of a container"""
+
+__license__ = 'Apache 2.0'
+
+import time
+from urlparse import urlsplit
+
+from couchdb.http import Session
+from gevent import coros
+
+
+class PooledSession(Session):
+    """
+    couchdb-python Session with a bounded pool of keep-alive connections.
+
+    At most size requests are in flight at once, further requests wait for a slot. At most size
+    idle connections are kept per host, others are closed when their response has been read.
+    Responses that are streamed (continuous changes feeds, large views) hold their connection
+    until read, but not a slot.
+    """
+
+    # upper bounds of the request latency histogram buckets, in ms
+    LATENCY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+    def __init__(self, size=20, timeout=None):
+        Session.__init__(self, timeout=timeout)
+        self.size           = size
+        self._slots         = coros.Semaphore(size)
+        self._in_use        = 0
+        self._stats         = {'requests': 0, 'errors': 0, 'waits': 0, 'wait_time_ms': 0.0, 'max_in_use': 0}
+        self._latency       = [0] * (len(self.LATENCY_BUCKETS) + 1)
+
+    def request(self, method, url, body=None, headers=None, credentials=None, num_redirects=0):
+        if num_redirects:
+            # a redirect of a request that already holds a slot
+            return Session.request(self, method, url, body, headers, credentials, num_redirects)
+
+        if self._slots.locked():
+            self._stats['waits'] += 1
+            wait_st = time.time()
+            self._slots.acquire()
+            self._stats['wait_time_ms'] += (time.time() - wait_st) * 1000
+        else:
+            self._slots.acquire()
+
+        self._in_use += 1
+        self._stats['max_in_use'] = max(self._stats['max_in_use'], self._in_use)
+        st = time.time()
+        try:
+            return Session.request(self, method, url, body, headers, credentials, num_redirects)
+        except Exception:
+            self._stats['errors'] += 1
+            raise
+        finally:
+            self._record_latency((time.time() - st) * 1000)
+            self._in_use -= 1
+            self._slots.release()
+
+    def _return_connection(self, url, conn):
+        scheme, host = urlsplit(url, 'http', False)[:2]
+        if len(self.conns.get((scheme, host), ())) >= self.size:
+            conn.close()
+            return
+        Session._return_connection(self, url, conn)
+
+    def _record_latency(self, latency_ms):
+        self._stats['requests'] += 1
+        for i, bound in enumerate(self.LATENCY_BUCKETS):
+            if latency_ms <= bound:
+                self._latency[i] += 1
+                return
+        self._latency[-1] += 1
+
+    def close(self):
+        """
+        Closes the idle connections. The session can still be used, it opens new ones.
+        """
+        conns, self.conns = self.conns, {}
+        for host_conns in conns.itervalues():
+            for conn in host_conns:
+                conn.close()
+
+    def get_stats(self):
+        """
+        Returns pool usage counters and the request latency histogram, as {'<=N ms': count}.
+        """
+        stats = dict(self._stats)
+        stats['size'] = self.size
+        stats['in_use'] = self._in_use
+        stats['idle'] = sum(len(host_conns) for host_conns in self.conns.itervalues())
+        latency = dict(('<=%d ms' % bound, count) for bound, count in zip(self.LATENCY_BUCKETS, self._latency))
+        latency['>%d ms' % self.LATENCY_BUCKETS[-1]] = self._latency[-1]
+        stats['latency'] = latency
+        return stats
@@ -9,6 +9,15 @@ from pyon.ion.resource import AT
 from pyon.util.containers import DotDict, get_ion_ts, get_safe
 from pyon.util.log import log
 
+import json
+
+# Token for a most likely non-inclusive key range upper bound (end_key), for queries such as
+# prefix <= keys < upper bound: e.g. ['some','value'] <= keys < ['some','value', END_MARKER]
+# or "somestr" <= keys < "somestr"+END_MARKER for string prefix checking
+# Note: Use highest ASCII characters here, not 8bit
+#END_MARKER = "\x7f\x7f\x7f\x7f"
+END_MARKER = "ZZZZZZ"
+
 
 class DataStore(object):
     """
@@ -19,6 +28,9 @@ class DataStore(object):
     DS_PROFILE_LIST = ['OBJECTS','RESOURCES','DIRECTORY','STATE','EVENTS','EXAMPLES','SCIDATA','BASIC']
     DS_PROFILE = DotDict(zip(DS_PROFILE_LIST, DS_PROFILE_LIST))
 
+    # Direction of a find_related hop: from subject to objects (as find_objects) or from object to subjects
+    DIRECTION = DotDict(OUT='out', IN='in')
+
     def close(self):
         """
         Close any connections required for this datastore.
@@ -131,7 +143,8 @@ class DataStore(object):
         """
         Update an existing Ion object in the data store.  The '_rev' value
         must exist in the object and must be the most recent known object
-        version. If not, a Conflict exception is thrown.
+        version. If not, or if the object does not exist, a Conflict
+        exception is thrown.
         """
         pass
 
@@ -139,7 +152,8 @@ class DataStore(object):
         """
         Update an existing raw doc in the data store.  The '_rev' value
         must exist in the doc and must be the most recent known doc
-        version. If not, a Conflict exception is thrown.
+        version. If not, or if the doc does not exist, a Conflict
+        exception is thrown.
         """
         pass
 
@@ -165,11 +179,58 @@ class DataStore(object):
         """
         pass
 
+    def add_change_listener(self, callback, datastore_name=""):
+        """
+        Calls callback(change) in a greenlet for every change of the data store made from
+        now on by anyone, change being a dict with 'id', 'seq', 'deleted' if deleted and
+        the new 'doc'. callback(None) means changes may have been missed.
+        Returns False if the data store does not report changes.
+        """
+        return False
+
+    def update_mult(self, objects, datastore_name=""):
+        """
+        Update multiple existing Ion objects, in one request if the data store
+        allows. Returns list of (Success, Oid, rev), one per object in order.
+        An object that failed has the exception as rev, a Conflict if it was
+        not based on the most recent version. The other objects are updated.
+        """
+        pass
+
+    def update_doc_mult(self, docs, datastore_name=""):
+        """
+        Update multiple existing raw docs. See update_mult.
+        """
+        pass
+
+    def delete_mult(self, objects, datastore_name=""):
+        """
+        Remove multiple Ion objects (or objects by id, if str), in one request
+        if the data store allows. Returns list of (Success, Oid, rev), one per
+        object in order, rev being the revision of the deletion. An object that
+        failed has the exception as rev: NotFound, or Conflict if the object given
+        was not the most recent version. The other objects are removed.
+        """
+        pass
+
+    def delete_doc_mult(self, docs, datastore_name=""):
+        """
+        Remove multiple raw docs (or docs by id, if str). See delete_mult.
+        """
+        pass
+
 
     def create_association(self, subject=None, predicate=None, obj=None, assoc_type=AT.H2H):
         """
         Create an association between two IonObjects with a given predicate
         """
+        return self.create(self.new_association(subject, predicate, obj, assoc_type))
+
+    def new_association(self, subject=None, predicate=None, obj=None, assoc_type=AT.H2H):
+        """
+        Returns a new Association object between two IonObjects with a given predicate, not yet
+        created. Raises BadRequest if the association is illegal or exists already.
+        """
         if not subject or not predicate or not obj:
             raise BadRequest("Association must have all elements set")
         if type(subject) is str:
@@ -237,7 +298,7 @@ class DataStore(object):
                           p=predicate,
                           o=object_id, ot=ot, orv=obj._rev,
                           ts=get_ion_ts())
-        return self.create(assoc)
+        return assoc
 
     def delete_association(self, association=''):
         """
@@ -287,6 +348,127 @@ class DataStore(object):
         elif not restype and not lcstate and not name:
             return self.find_res_by_type(None, None, id_only)
 
+    def find_related(self, start_ids, path, max_depth=None, id_only=False):
+        """
+        Walks the associations from the given ids (or id) along path, a list of (predicate, direction, type)
+        hops. Direction is one of DIRECTION, type is the type of the resource reached, predicate and type
+        may be None for any. Each hop is one query for all ids reached so far; objects are only read at the end.
+        With max_depth (in hops), the path is repeated up to that depth, e.g. to find parts of parts.
+        Returns the list of ids (or objects) at the end of the path, or of any repetition of it, except
+        the start ids and ids found before.
+        """
+        if not path:
+            raise BadRequest("Must provide path")
+        if any([direction not in self.DIRECTION.values() for predicate, direction, restype in path]):
+            raise BadRequest("Illegal direction in path")
+        if isinstance(start_ids, basestring):
+            start_ids = [start_ids]
+        max_depth = max_depth or len(path)
+
+        found_ids = []
+        seen = set(start_ids)
+        frontier = self._unique(start_ids)
+        for depth in xrange(max_depth):
+            if not frontier:
+                break
+            predicate, direction, restype = path[depth % len(path)]
+            frontier = self._unique(self._find_related_hop(frontier, predicate, direction, restype))
+            if (depth + 1) % len(path) == 0:
+                # End of the path: ids seen at an earlier end (or start) are not followed again
+                frontier = [res_id for res_id in frontier if res_id not in seen]
+                seen.update(frontier)
+                found_ids.extend(frontier)
+
+        log.debug("find_related() found %s objects" % len(found_ids))
+        if id_only:
+            return found_ids
+        return self.read_mult(found_ids)
+
+    def _find_related_hop(self, ids, predicate, direction, restype):
+        """
+        Returns the ids of resources associated with any of ids in direction, with predicate and of restype
+        (None for any), with duplicates.
+        """
+        raise NotImplementedError()
+
+    def _unique(self, ids):
+        seen = set()
+        return [res_id for res_id in ids if not (res_id in seen or seen.add(res_id))]
+
+    def find_by_view(self, design_name, view_name, key=None, keys=None, start_key=None, end_key=None,
+                     id_only=True, convert_doc=True, **kwargs):
+        """
+        Generic find function using a defined index (view). Returns a list of triples
+        (id, key, object or None if id_only).
+        """
+        pass
+
+    def find_by_view_iter(self, design_name, view_name, key=None, start_key=None, end_key=None,
+                          id_only=True, convert_doc=True, page_size=100, **kwargs):
+        """
+        Like find_by_view, but a generator: rows are read from the view page_size at a time, continuing
+        each page after the last row of the previous one, and objects are converted as they are yielded.
+        A limit kwarg caps the total number of rows.
+        """
+        limit = int(kwargs.pop('limit', 0) or 0)
+        count = 0
+        cursor = None
+        while True:
+            if limit:
+                page_size = min(page_size, limit - count)
+            rows, cursor = self._find_view_page(design_name, view_name, key=key, start_key=start_key, end_key=end_key,
+                                                id_only=id_only, page_size=page_size, cursor=cursor, **kwargs)
+            for row in rows:
+                yield self._convert_view_row(row, id_only, convert_doc)
+
+            count += len(rows)
+            if cursor is None or (limit and count >= limit):
+                return
+
+    def find_by_view_page(self, design_name, view_name, key=None, start_key=None, end_key=None,
+                          id_only=True, convert_doc=True, page_size=100, cursor=None, **kwargs):
+        """
+        Returns one page of find_by_view results as a tuple (list of triples, cursor). Pass the cursor
+        (an opaque string) to get the next page; it is None after the last page.
+        """
+        rows, next_cursor = self._find_view_page(design_name, view_name, key=key, start_key=start_key, end_key=end_key,
+                                                 id_only=id_only, page_size=page_size,
+                                                 cursor=json.loads(cursor) if cursor else None, **kwargs)
+        res_rows = [self._convert_view_row(row, id_only, convert_doc) for row in rows]
+        return res_rows, json.dumps(next_cursor) if next_cursor else None
+
+    def _find_view_page(self, design_name, view_name, key=None, start_key=None, end_key=None, id_only=True,
+                        page_size=100, cursor=None, **kwargs):
+        """
+        Reads page_size rows from a view, starting at cursor (the [key, id] of a row) if given.
+        Returns a tuple (list of (id, key, doc or None), [key, id] of the first row of the next page or None).
+        """
+        raise NotImplementedError()
+
+    def _get_view_range(self, key=None, start_key=None, end_key=None, descending=False):
+        """
+        Returns the view (startkey, endkey) in query order, None for an open end. end_key is a prefix.
+        """
+        if key is not None:
+            return key, key
+        startkey, endkey = None, None
+        if start_key:
+            startkey = list(start_key) if isinstance(start_key, (list, tuple)) else start_key
+        if end_key:
+            # string keys (e.g. _all_docs ids) are prefixes by concatenation, list keys by an extra element
+            endkey = list(end_key) + [END_MARKER] if isinstance(end_key, (list, tuple)) else end_key + END_MARKER
+        if descending:
+            return endkey, startkey
+        return startkey, endkey
+
+    def _convert_view_row(self, row, id_only, convert_doc):
+        row_id, row_key, doc = row
+        if id_only:
+            return row_id, row_key, None
+        if convert_doc:
+            return row_id, row_key, self._persistence_dict_to_ion_object(doc)
+        return row_id, row_key, doc
+
     def _preload_create_doc(self, doc):
         """
         Stealth method used to force pre-defined objects into the data store
@@ -378,7 +560,11 @@ class DatastoreManager(object):
         if persistent:
             # Use inline import to prevent circular import dependency
             from pyon.datastore.couchdb.couchdb_datastore import CouchDB_DataStore
-            new_ds = CouchDB_DataStore(datastore_name=scoped_name, profile=profile)
+            # Read-through doc cache, enabled per datastore (by unscoped name)
+            cache_size = 0
+            if get_safe(CFG, "container.datastore.cache.enabled.%s" % ds_name):
+                cache_size = get_safe(CFG, "container.datastore.cache.size") or 1000
+            new_ds = CouchDB_DataStore(datastore_name=scoped_name, profile=profile, cache_size=cache_size)
         else:
             # Use inline import to prevent circular import dependency
             from pyon.datastore.mockdb.mockdb_datastore import MockDB_DataStore
@@ -405,3 +591,8 @@ class DatastoreManager(object):
                 log.exception("Error closing datastore")
 
         self._datastores = {}
+
+        if self.persistent:
+            # Use inline import to prevent circular import dependency
+            from pyon.datastore.couchdb.couchdb_datastore import CouchDB_DataStore
+            CouchDB_DataStore.close_session()
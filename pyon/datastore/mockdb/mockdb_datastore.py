@@ -3,6 +3,7 @@
 __author__ = 'Thomas R. Lennan'
 __license__ = 'Apache 2.0'
 
+from collections import defaultdict
 from uuid import uuid4
 
 from pyon.core.bootstrap import obj_registry
@@ -12,10 +13,91 @@ from pyon.datastore.datastore import DataStore
 from pyon.ion.resource import CommonResourceLifeCycleSM
 from pyon.util.log import log
 
+# The CouchDB views (see couchdb_config) that find_by_view supports in the mock: map functions
+# returning the key a doc emits, or None
+MOCK_VIEWS = {
+    'event': {
+        'by_time':          lambda doc: [doc.get('ts_created')] if doc.get('origin') else None,
+        'by_type':          lambda doc: [doc.get('type_'), doc.get('ts_created')] if doc.get('origin') else None,
+        'by_origin':        lambda doc: [doc.get('origin'), doc.get('ts_created')] if doc.get('origin') else None,
+        'by_origintype':    lambda doc: [doc.get('origin'), doc.get('type_'), doc.get('ts_created')] if doc.get('origin') else None,
+    },
+}
+
+class MockDatastore(object):
+    """
+    The in-memory contents of one mock data store: head docs by id, their revisions, and hash
+    indexes for the association and resource queries, kept up to date on every write.
+    """
+
+    def __init__(self):
+        self.docs = {}                                  # id -> head doc
+        self.revs = {}                                  # id -> {rev: doc}
+        self.index_keys = {}                            # id -> [(index, key)] the head doc was indexed under
+
+        self.assoc_by_subject = defaultdict(set)        # subject id -> association ids
+        self.assoc_by_object = defaultdict(set)         # object id -> association ids
+        self.assoc_by_predicate = defaultdict(set)      # predicate -> association ids
+        self.by_type = defaultdict(set)                 # type_ -> doc ids
+        self.by_lcstate = defaultdict(set)              # lcstate -> doc ids
+        self.by_name = defaultdict(set)                 # name -> doc ids
+
+    def _indexes(self, doc):
+        """
+        Yields (index, key) for every index entry of a doc.
+        """
+        if 'type_' in doc:
+            yield self.by_type, doc['type_']
+            if doc['type_'] == "Association":
+                yield self.assoc_by_subject, doc['s']
+                yield self.assoc_by_object, doc['o']
+                yield self.assoc_by_predicate, doc['p']
+        if isinstance(doc.get('lcstate'), basestring):
+            yield self.by_lcstate, doc['lcstate']
+        if isinstance(doc.get('name'), basestring):
+            yield self.by_name, doc['name']
+
+    def put(self, doc):
+        """
+        Stores doc as the head and a new revision of its id, replacing the previous head.
+        """
+        object_id = doc['_id']
+        self.remove_head(object_id)
+
+        self.docs[object_id] = doc
+        self.revs.setdefault(object_id, {})[doc['_rev']] = doc
+
+        # remember the keys, the doc dict may be changed in place by whoever read it
+        index_keys = list(self._indexes(doc))
+        for index, key in index_keys:
+            index[key].add(object_id)
+        self.index_keys[object_id] = index_keys
+
+    def remove_head(self, object_id):
+        if self.docs.pop(object_id, None) is None:
+            return
+        for index, key in self.index_keys.pop(object_id):
+            ids = index.get(key)
+            if ids is not None:
+                ids.discard(object_id)
+                if not ids:
+                    del index[key]
+
+    def remove(self, object_id):
+        self.remove_head(object_id)
+        self.revs.pop(object_id, None)
+
+    def lookup(self, index, key):
+        """
+        Returns the head docs with the given index key.
+        """
+        return [self.docs[object_id] for object_id in index.get(key, ())]
+
+
 class MockDB_DataStore(DataStore):
     """
-    Data store implementation utilizing in-memory dict of dicts
-    to persist documents.
+    Data store implementation utilizing in-memory dicts
+    to persist documents, with indexes for the association and resource queries.
     """
 
     def __init__(self, datastore_name='prototype'):
@@ -27,6 +109,13 @@ class MockDB_DataStore(DataStore):
         self._io_serializer     = IonObjectSerializer()
         self._io_deserializer   = IonObjectDeserializer(obj_registry=obj_registry)
 
+    def _get_datastore(self, datastore_name=None):
+        datastore_name = datastore_name or self.datastore_name
+        try:
+            return self.root[datastore_name], datastore_name
+        except KeyError:
+            raise BadRequest('Data store ' + datastore_name + ' does not exist.')
+
     def create_datastore(self, datastore_name="", create_indexes=True):
         if not datastore_name:
             datastore_name = self.datastore_name
@@ -34,7 +123,7 @@ class MockDB_DataStore(DataStore):
         if self.datastore_exists(datastore_name):
             raise BadRequest("Data store with name %s already exists" % datastore_name)
         if datastore_name not in self.root:
-            self.root[datastore_name] = {}
+            self.root[datastore_name] = MockDatastore()
 
     def delete_datastore(self, datastore_name=""):
         if not datastore_name:
@@ -69,10 +158,7 @@ class MockDB_DataStore(DataStore):
         if not datastore_name:
             datastore_name = self.datastore_name
         log.debug('Listing all objects in data store %s' % datastore_name)
-        objs = []
-        for key, value in self.root[datastore_name].items():
-            if key.find('_version_counter') == -1 and key.find('_version_') == -1:
-                objs.append(key)
+        objs = self.root[datastore_name].docs.keys()
         log.debug('Objects: %s' % str(objs))
         return objs
 
@@ -80,11 +166,7 @@ class MockDB_DataStore(DataStore):
         if not datastore_name:
             datastore_name = self.datastore_name
         log.debug('Listing all versions of object %s/%s' % (datastore_name, str(object_id)))
-        res = []
-        for key, value in self.root[datastore_name].items():
-            if (key.find('_version_counter') == -1
-                and (key.find(object_id + '_version_') == 0)):
-                res.append(key)
+        res = [object_id + '_version_' + rev for rev in self.root[datastore_name].revs.get(object_id, {})]
         log.debug('Versions: %s' % str(res))
         return res
 
@@ -95,19 +177,14 @@ class MockDB_DataStore(DataStore):
                                object_id=object_id, datastore_name=datastore_name)
 
     def create_doc(self, doc, object_id=None, datastore_name=""):
-        if not datastore_name:
-            datastore_name = self.datastore_name
         if '_id' in doc:
             raise BadRequest("Doc must not have '_id'")
         if '_rev' in doc:
             raise BadRequest("Doc must not have '_rev'")
-        try:
-            datastore_dict = self.root[datastore_name]
-        except KeyError:
-            raise BadRequest('Data store ' + datastore_name + ' does not exist.')
+        ds, datastore_name = self._get_datastore(datastore_name)
 
         if object_id:
-            if object_id in datastore_dict:
+            if object_id in ds.docs:
                 raise BadRequest("Object with id %s already exist" % object_id)
 
         # Assign an id to doc
@@ -116,18 +193,12 @@ class MockDB_DataStore(DataStore):
 
         log.debug('Creating new object %s/%s' % (datastore_name, object_id))
 
-        # Create key for version counter entry.  Will be used
-        # on update to increment version number easily.
-        version_counter_key = '__' + object_id + '_version_counter'
-        version_counter = 1
-
         # Assign initial version to doc
+        version_counter = 1
         doc["_rev"] = str(version_counter)
 
-        # Write HEAD, version and version counter dicts
-        datastore_dict[object_id] = doc
-        datastore_dict[version_counter_key] = version_counter
-        datastore_dict[object_id + '_version_' + str(version_counter)] = doc
+        # Write HEAD and version
+        ds.put(doc)
 
         # Return list that identifies the id of the new doc and its version
         res = [object_id, str(version_counter)]
@@ -168,21 +239,15 @@ class MockDB_DataStore(DataStore):
         return obj
 
     def read_doc(self, object_id, rev_id="", datastore_name=""):
-        if not datastore_name:
-            datastore_name = self.datastore_name
-        try:
-            datastore_dict = self.root[datastore_name]
-        except KeyError:
-            raise BadRequest('Data store ' + datastore_name + ' does not exist.')
+        ds, datastore_name = self._get_datastore(datastore_name)
 
         try:
-            key = object_id
             if rev_id != None and rev_id != "":
                 log.debug('Reading version %s of object %s/%s' % (str(rev_id), datastore_name, str(object_id)))
-                key += '_version_' + str(rev_id)
+                doc = ds.revs[object_id][str(rev_id)]
             else:
                 log.debug('Reading head version of object %s/%s' % (datastore_name, str(object_id)))
-            doc = datastore_dict[key]
+                doc = ds.docs[object_id]
         except KeyError:
             raise NotFound('Object with id %s does not exist.' % str(object_id))
         log.debug('Read result: %s' % str(doc))
@@ -197,18 +262,13 @@ class MockDB_DataStore(DataStore):
         return obj_list
 
     def read_doc_mult(self, object_ids, datastore_name=""):
-        if not datastore_name:
-            datastore_name = self.datastore_name
-        try:
-            datastore_dict = self.root[datastore_name]
-        except KeyError:
-            raise BadRequest('Data store ' + datastore_name + ' does not exist.')
+        ds, datastore_name = self._get_datastore(datastore_name)
 
         doc_list = []
         try:
             for object_id in object_ids:
                 log.debug('Reading head version of object %s/%s' % (datastore_name, str(object_id)))
-                doc = datastore_dict[object_id]
+                doc = ds.docs[object_id]
 
                 doc_list.append(doc.copy())
         except KeyError:
@@ -221,54 +281,63 @@ class MockDB_DataStore(DataStore):
         return self.update_doc(self._ion_object_to_persistence_dict(obj))
 
     def update_doc(self, doc, datastore_name=""):
-        if not datastore_name:
-            datastore_name = self.datastore_name
         if '_id' not in doc:
             raise BadRequest("Doc must have '_id'")
         if '_rev' not in doc:
             raise BadRequest("Doc must have '_rev'")
-        try:
-            datastore_dict = self.root[datastore_name]
-        except KeyError:
-            raise BadRequest('Data store ' + datastore_name + ' does not exist.')
+        ds, datastore_name = self._get_datastore(datastore_name)
 
-        try:
-            object_id = doc["_id"]
+        object_id = doc["_id"]
+        if object_id not in ds.docs:
+            # As in CouchDB, a doc with a _rev cannot create a new doc
+            raise Conflict('Object %s does not exist' % object_id)
 
-            # Find the next doc version
-            version_counter_key = '__' + object_id + '_version_counter'
-            baseVersion = doc["_rev"]
-            version_counter = datastore_dict[version_counter_key] + 1
-            if baseVersion != str(version_counter - 1):
-                raise Conflict('Object not based on most current version')
-        except KeyError:
-            raise BadRequest("Object missing required _id and/or _rev values")
+        # Find the next doc version
+        baseVersion = doc["_rev"]
+        version_counter = int(ds.docs[object_id]["_rev"]) + 1
+        if baseVersion != str(version_counter - 1):
+            raise Conflict('Object not based on most current version')
 
         log.debug('Saving new version of object %s/%s' % (datastore_name, doc["_id"]))
         doc["_rev"] = str(version_counter)
 
-        # Overwrite HEAD and version counter dicts, add new version dict
-        datastore_dict[object_id] = doc
-        datastore_dict[version_counter_key] = version_counter
-        datastore_dict[object_id + '_version_' + str(version_counter)] = doc
+        # Replace HEAD, add new version
+        ds.put(doc)
         res = [object_id, str(version_counter)]
         log.debug('Update result: %s' % str(res))
         return res
 
-    def delete(self, obj, datastore_name=""):
+    def update_mult(self, objects, datastore_name=""):
+        if any([not isinstance(obj, IonObjectBase) for obj in objects]):
+            raise BadRequest("Obj param is not instance of IonObjectBase")
+        return self.update_doc_mult([self._ion_object_to_persistence_dict(obj) for obj in objects],
+                                    datastore_name=datastore_name)
+
+    def update_doc_mult(self, docs, datastore_name=""):
+        if not all(["_id" in doc for doc in docs]):
+            raise BadRequest("Docs must have '_id'")
+        if not all(["_rev" in doc for doc in docs]):
+            raise BadRequest("Docs must have '_rev'")
+
+        res = []
+        for doc in docs:
+            try:
+                oid, rev = self.update_doc(doc, datastore_name)
+                res.append((True, oid, rev))
+            except Conflict as ex:
+                res.append((False, doc["_id"], ex))
+        return res
+
+    def delete(self, obj, datastore_name="", del_associations=False):
         if not isinstance(obj, IonObjectBase) and not isinstance(obj, str):
             raise BadRequest("Obj param is not instance of IonObjectBase or string id")
         if type(obj) is str:
-            return self.delete_doc(obj, datastore_name=datastore_name)
-        return self.delete_doc(self._ion_object_to_persistence_dict(obj), datastore_name=datastore_name)
+            return self.delete_doc(obj, datastore_name=datastore_name, del_associations=del_associations)
+        return self.delete_doc(self._ion_object_to_persistence_dict(obj), datastore_name=datastore_name,
+                               del_associations=del_associations)
 
-    def delete_doc(self, doc, datastore_name=""):
-        if not datastore_name:
-            datastore_name = self.datastore_name
-        try:
-            datastore_dict = self.root[datastore_name]
-        except KeyError:
-            raise BadRequest('Data store ' + datastore_name + ' does not exist.')
+    def delete_doc(self, doc, datastore_name="", del_associations=False):
+        ds, datastore_name = self._get_datastore(datastore_name)
 
         if type(doc) is str:
             object_id = doc
@@ -276,56 +345,77 @@ class MockDB_DataStore(DataStore):
             object_id = doc["_id"]
         
         log.info('Deleting object %s/%s' % (datastore_name, object_id))
-        if object_id in datastore_dict.keys():
+        if object_id in ds.docs:
+
+            if del_associations:
+                assoc_ids = ds.assoc_by_subject.get(object_id, set()) | ds.assoc_by_object.get(object_id, set())
+                self.delete_doc_mult(list(assoc_ids), datastore_name=datastore_name)
+                log.debug("Deleted %s associations for object %s" % (len(assoc_ids), object_id))
 
-            if self._is_in_association(object_id, datastore_name):
+            elif self._is_in_association(object_id, datastore_name):
                 obj = self.read(object_id, "", datastore_name)
                 log.warn("XXXXXXX Attempt to delete object %s that still has associations" % str(obj))
 #                raise BadRequest("Object cannot be deleted until associations are broken")
 
-            # Find all version dicts and delete them
-            for key in datastore_dict.keys():
-                if key.find(object_id + '_version_') == 0:
-                    del datastore_dict[key]
-            # Delete the HEAD dict
-            del datastore_dict[object_id]
-            # Delete the version counter dict
-            del datastore_dict['__' + object_id + '_version_counter']
+            # Delete the HEAD and all versions
+            ds.remove(object_id)
         else:
             raise NotFound('Object with id ' + object_id + ' does not exist.')
         log.info('Delete result: True')
 
+    def delete_mult(self, objects, datastore_name=""):
+        if any([not isinstance(ion_obj, IonObjectBase) and not isinstance(ion_obj, str) for ion_obj in objects]):
+            raise BadRequest("Obj param is not instance of IonObjectBase or string id")
+        return self.delete_doc_mult([ion_obj if type(ion_obj) is str else self._ion_object_to_persistence_dict(ion_obj) for ion_obj in objects],
+                                    datastore_name=datastore_name)
+
+    def delete_doc_mult(self, docs, datastore_name=""):
+        ds, datastore_name = self._get_datastore(datastore_name)
+        log.info('Deleting %s objects in %s' % (len(docs), datastore_name))
+
+        res = []
+        for doc in docs:
+            object_id = doc if type(doc) is str else doc["_id"]
+            head = ds.docs.get(object_id)
+            if head is None:
+                res.append((False, object_id, NotFound('Object with id %s does not exist.' % object_id)))
+            elif type(doc) is not str and "_rev" in doc and doc["_rev"] != head["_rev"]:
+                res.append((False, object_id, Conflict('Object %s not based on most current version' % object_id)))
+            else:
+                # Delete the HEAD and all versions
+                ds.remove(object_id)
+                res.append((True, object_id, str(int(head["_rev"]) + 1)))
+        log.debug('Delete result: %s' % str(res))
+        return res
+
     def _is_in_association(self, obj_id, datastore_name=""):
         log.debug("_is_in_association(%s)" % obj_id)
         if not obj_id:
             raise BadRequest("Must provide object id")
 
-        if not datastore_name:
-            datastore_name = self.datastore_name
-        try:
-            datastore_dict = self.root[datastore_name]
-        except KeyError:
-            raise BadRequest('Data store ' + datastore_name + ' does not exist.')
+        ds, datastore_name = self._get_datastore(datastore_name)
 
-        for objname,obj in datastore_dict.iteritems():
-            if (objname.find('_version_')>0) or (not type(obj) is dict): continue
-            if 'type_' in obj and obj['type_'] == "Association":
-                association = obj
-                if association["s"] == obj_id or association["o"] == obj_id:
-                    log.debug("association found(%s)" % association)
-                    return True
+        if obj_id in ds.assoc_by_subject or obj_id in ds.assoc_by_object:
+            log.debug("association found for %s" % obj_id)
+            return True
         return False
 
+    def _read_head(self, ds, object_id):
+        """
+        Returns the head version of an object as Ion object, like read but without another datastore lookup.
+        """
+        try:
+            return self._persistence_dict_to_ion_object(ds.docs[object_id])
+        except KeyError:
+            raise NotFound('Object with id %s does not exist.' % str(object_id))
+
     def find_objects(self, subject, predicate=None, object_type=None, id_only=False):
         log.debug("find_objects(subject=%s, predicate=%s, object_type=%s, id_only=%s" % (subject, predicate, object_type, id_only))
         if type(id_only) is not bool:
             raise BadRequest('id_only must be type bool, not %s' % type(id_only))
         if not subject:
             raise BadRequest("Must provide subject")
-        try:
-            datastore_dict = self.root[self.datastore_name]
-        except KeyError:
-            raise BadRequest('Data store ' + self.datastore_name + ' does not exist.')
+        ds, datastore_name = self._get_datastore()
 
         if type(subject) is str:
             subject_id = subject
@@ -337,21 +427,17 @@ class MockDB_DataStore(DataStore):
         assoc_list = []
         target_id_list = []
         target_list = []
-        for objname,obj in datastore_dict.iteritems():
-            if (objname.find('_version_')>0) or (not type(obj) is dict): continue
-            if 'type_' in obj and obj['type_'] == "Association":
-                if obj['s'] == subject_id:
-                    if predicate and obj['p'] == predicate:
-                        if (object_type and obj['ot'] == object_type) or not object_type:
-                            assoc_list.append(obj)
-                            target_id_list.append(obj['o'])
-                            target_list.append(self.read(obj['o']))
-                    elif not predicate:
-                        assoc_list.append(obj)
-                        target_id_list.append(obj['o'])
-                        target_list.append(self.read(obj['o']))
-
-        log.debug("find_objects() found %s objects" % (len(target_list)))
+        for obj in ds.lookup(ds.assoc_by_subject, subject_id):
+            if predicate and obj['p'] != predicate:
+                continue
+            if predicate and object_type and obj['ot'] != object_type:
+                continue
+            assoc_list.append(obj)
+            target_id_list.append(obj['o'])
+            if not id_only:
+                target_list.append(self._read_head(ds, obj['o']))
+
+        log.debug("find_objects() found %s objects" % (len(target_id_list)))
         if id_only:
             return (target_id_list, assoc_list)
         else:
@@ -363,10 +449,7 @@ class MockDB_DataStore(DataStore):
             raise BadRequest('id_only must be type bool, not %s' % type(id_only))
         if not obj:
             raise BadRequest("Must provide object")
-        try:
-            datastore_dict = self.root[self.datastore_name]
-        except KeyError:
-            raise BadRequest('Data store ' + self.datastore_name + ' does not exist.')
+        ds, datastore_name = self._get_datastore()
 
         if type(obj) is str:
             object_id = obj
@@ -378,21 +461,17 @@ class MockDB_DataStore(DataStore):
         assoc_list = []
         target_id_list = []
         target_list = []
-        for objname,obj in datastore_dict.iteritems():
-            if (objname.find('_version_')>0) or (not type(obj) is dict): continue
-            if 'type_' in obj and obj['type_'] == "Association":
-                if obj['o'] == object_id:
-                    if predicate and obj['p'] == predicate:
-                        if (subject_type and obj['st'] == subject_type) or not subject_type:
-                            assoc_list.append(obj)
-                            target_id_list.append(obj['s'])
-                            target_list.append(self.read(obj['s']))
-                    elif not predicate:
-                        assoc_list.append(obj)
-                        target_id_list.append(obj['s'])
-                        target_list.append(self.read(obj['s']))
-
-        log.debug("find_subjects() found %s subjects" % (len(target_list)))
+        for obj in ds.lookup(ds.assoc_by_object, object_id):
+            if predicate and obj['p'] != predicate:
+                continue
+            if predicate and subject_type and obj['st'] != subject_type:
+                continue
+            assoc_list.append(obj)
+            target_id_list.append(obj['s'])
+            if not id_only:
+                target_list.append(self._read_head(ds, obj['s']))
+
+        log.debug("find_subjects() found %s subjects" % (len(target_id_list)))
         if id_only:
             return (target_id_list, assoc_list)
         else:
@@ -406,10 +485,7 @@ class MockDB_DataStore(DataStore):
             pass
         else:
             raise BadRequest("Illegal parameters")
-        try:
-            datastore_dict = self.root[self.datastore_name]
-        except KeyError:
-            raise BadRequest('Data store ' + self.datastore_name + ' does not exist.')
+        ds, datastore_name = self._get_datastore()
 
         if subject and obj:
             if type(subject) is str:
@@ -426,23 +502,10 @@ class MockDB_DataStore(DataStore):
                     raise BadRequest("Object id not available in object")
                 else:
                     object_id = obj._id
-            target_list = []
-            for objname,obj in datastore_dict.iteritems():
-                if (objname.find('_version_')>0) or (not type(obj) is dict): continue
-                if 'type_' in obj and obj['type_'] == "Association":
-                    if obj['s'] == subject_id and obj['o'] == object_id:
-                        if assoc_type:
-                            if obj['at'] == assoc_type:
-                                target_list.append(obj)
-                        else:
-                            target_list.append(obj)
+            target_list = [assoc for assoc in ds.lookup(ds.assoc_by_subject, subject_id)
+                           if assoc['o'] == object_id and (not assoc_type or assoc['at'] == assoc_type)]
         else:
-            target_list = []
-            for objname,obj in datastore_dict.iteritems():
-                if (objname.find('_version_')>0) or (not type(obj) is dict): continue
-                if 'type_' in obj and obj['type_'] == "Association":
-                    if obj['p'] == predicate:
-                        target_list.append(obj)
+            target_list = ds.lookup(ds.assoc_by_predicate, predicate)
 
         if id_only:
             assocs = [row['_id'] for row in target_list]
@@ -451,61 +514,50 @@ class MockDB_DataStore(DataStore):
         log.debug("find_associations() found %s associations" % (len(assocs)))
         return assocs
         
+    def _find_related_hop(self, ids, predicate, direction, restype):
+        ds, datastore_name = self._get_datastore()
+        if direction == self.DIRECTION.OUT:
+            index, end, end_type = ds.assoc_by_subject, 'o', 'ot'
+        else:
+            index, end, end_type = ds.assoc_by_object, 's', 'st'
+
+        related_ids = []
+        for res_id in ids:
+            for assoc in ds.lookup(index, res_id):
+                if (not predicate or assoc['p'] == predicate) and (not restype or assoc[end_type] == restype):
+                    related_ids.append(assoc[end])
+        return related_ids
+
     def find_res_by_type(self, restype, lcstate=None, id_only=False):
         log.debug("find_res_by_type(restype=%s, lcstate=%s)" % (restype, lcstate))
         if type(id_only) is not bool:
             raise BadRequest('id_only must be type bool, not %s' % type(id_only))
-        try:
-            datastore_dict = self.root[self.datastore_name]
-        except KeyError:
-            raise BadRequest('Data store ' + self.datastore_name + ' does not exist.')
+        ds, datastore_name = self._get_datastore()
 
-        assoc_list = []
-        target_id_list = []
-        target_list = []
-        for objname,obj in datastore_dict.iteritems():
-            if (objname.find('_version_')>0) or (not type(obj) is dict): continue
-            if 'type_' in obj and (obj['type_'] == restype or (not restype and obj['type_'] != "Association")):
-                if (lcstate and 'lcstate' in obj and obj['lcstate'] == lcstate) or not lcstate or not restype:
-                    target_id_list.append(obj['_id'])
-                    target_list.append(self._persistence_dict_to_ion_object(obj))
-                    assoc_list.append([])
-
-        log.debug("find_res_by_type() found %s resources" % (len(target_list)))
-        if id_only:
-            return (target_id_list, assoc_list)
+        if restype:
+            candidates = ds.lookup(ds.by_type, restype)
+            if lcstate:
+                candidates = [obj for obj in candidates if obj.get('lcstate') == lcstate]
         else:
-            return (target_list, assoc_list)
+            candidates = [obj for type_ in ds.by_type.keys() if type_ != "Association"
+                          for obj in ds.lookup(ds.by_type, type_)]
+
+        return self._res_result(candidates, id_only, "find_res_by_type")
 
     def find_res_by_lcstate(self, lcstate, restype=None, id_only=False):
         log.debug("find_res_by_type(lcstate=%s, restype=%s)" % (lcstate, restype))
         if type(id_only) is not bool:
             raise BadRequest('id_only must be type bool, not %s' % type(id_only))
-        try:
-            datastore_dict = self.root[self.datastore_name]
-        except KeyError:
-            raise BadRequest('Data store ' + self.datastore_name + ' does not exist.')
+        ds, datastore_name = self._get_datastore()
 
         if lcstate in CommonResourceLifeCycleSM.STATE_ALIASES:
             lcstate_match = CommonResourceLifeCycleSM.STATE_ALIASES[lcstate]
         else:
             lcstate_match = [lcstate]
-        assoc_list = []
-        target_id_list = []
-        target_list = []
-        for objname,obj in datastore_dict.iteritems():
-            if (objname.find('_version_')>0) or (not type(obj) is dict): continue
-            if 'lcstate' in obj and obj['lcstate'] in lcstate_match:
-                if (restype and obj['type_'] == restype) or not restype:
-                    target_id_list.append(obj['_id'])
-                    target_list.append(self._persistence_dict_to_ion_object(obj))
-                    assoc_list.append([])
-
-        log.debug("find_res_by_lcstate() found %s resources" % (len(target_list)))
-        if id_only:
-            return (target_id_list, assoc_list)
-        else:
-            return (target_list, assoc_list)
+        candidates = [obj for state in set(lcstate_match) for obj in ds.lookup(ds.by_lcstate, state)
+                      if not restype or obj['type_'] == restype]
+
+        return self._res_result(candidates, id_only, "find_res_by_lcstate")
 
     def _pass(self):
         pass
@@ -514,31 +566,107 @@ class MockDB_DataStore(DataStore):
         log.debug("find_res_by_name(name=%s, restype=%s)" % (name, restype))
         if type(id_only) is not bool:
             raise BadRequest('id_only must be type bool, not %s' % type(id_only))
-        try:
-            datastore_dict = self.root[self.datastore_name]
-        except KeyError:
-            raise BadRequest('Data store ' + self.datastore_name + ' does not exist.')
+        ds, datastore_name = self._get_datastore()
 
-        assoc_list = []
-        target_id_list = []
-        target_list = []
-        for objname,obj in datastore_dict.iteritems():
-            if (objname.find('_version_')>0) or (not type(obj) is dict): continue
-            if 'name' in obj and obj['name'] == name:
-                if (restype and obj['type_'] == restype) or not restype:
-                    target_id_list.append(obj['_id'])
-                    target_list.append(self._persistence_dict_to_ion_object(obj))
-                    assoc_list.append([])
-
-        log.debug("find_res_by_name() found %s resources" % (len(target_list)))
+        candidates = [obj for obj in ds.lookup(ds.by_name, name)
+                      if not restype or obj['type_'] == restype]
+
+        return self._res_result(candidates, id_only, "find_res_by_name")
+
+    def _res_result(self, docs, id_only, query):
+        """
+        Returns the (ids or objects, associations) tuple of the find_res_by_* queries.
+        """
+        log.debug("%s() found %s resources" % (query, len(docs)))
+        assoc_list = [[] for doc in docs]
         if id_only:
-            return (target_id_list, assoc_list)
+            return ([doc['_id'] for doc in docs], assoc_list)
         else:
-            return (target_list, assoc_list)
+            return ([self._persistence_dict_to_ion_object(doc) for doc in docs], assoc_list)
 
     def find_dir_entries(self, qname):
         raise NotImplementedError()
 
+    def find_by_view(self, design_name, view_name, key=None, keys=None, start_key=None, end_key=None,
+                     id_only=True, convert_doc=True, **kwargs):
+        log.debug("find_by_view(%s/%s)" % (design_name, view_name))
+        if type(id_only) is not bool:
+            raise BadRequest('id_only must be type bool, not %s' % type(id_only))
+        if keys:
+            res_rows = []
+            for key in keys:
+                res_rows.extend(self.find_by_view_iter(design_name, view_name, key=key, id_only=id_only, convert_doc=convert_doc, **kwargs))
+        else:
+            res_rows = list(self.find_by_view_iter(design_name, view_name, key=key, start_key=start_key, end_key=end_key,
+                                                   id_only=id_only, convert_doc=convert_doc, **kwargs))
+
+        log.debug("find_by_view() found %s objects" % (len(res_rows)))
+        return res_rows
+
+    def find_by_view_iter(self, design_name, view_name, key=None, start_key=None, end_key=None,
+                          id_only=True, convert_doc=True, page_size=100, **kwargs):
+        """
+        Like the base find_by_view_iter, but the view rows are selected and sorted once for the whole
+        iteration instead of once per page.
+        """
+        limit = int(kwargs.pop('limit', 0) or 0)
+        rows = self._get_view_rows(design_name, view_name, key, start_key, end_key, **kwargs)
+        rows = rows[int(kwargs.get('skip', 0)):]
+        if limit:
+            rows = rows[:limit]
+        for doc_key, doc_id, doc in rows:
+            yield self._convert_view_row((doc_id, doc_key, None if id_only else doc), id_only, convert_doc)
+
+    def _find_view_page(self, design_name, view_name, key=None, start_key=None, end_key=None, id_only=True,
+                        page_size=100, cursor=None, **kwargs):
+        rows = self._get_view_rows(design_name, view_name, key, start_key, end_key, cursor=cursor, **kwargs)
+        if not cursor:
+            rows = rows[int(kwargs.get('skip', 0)):]
+
+        next_cursor = None
+        if len(rows) > page_size:
+            next_cursor = [rows[page_size][0], rows[page_size][1]]
+            rows = rows[:page_size]
+
+        return [(doc_id, doc_key, None if id_only else doc) for doc_key, doc_id, doc in rows], next_cursor
+
+    def _get_view_rows(self, design_name, view_name, key=None, start_key=None, end_key=None, cursor=None, **kwargs):
+        """
+        Returns the sorted list of (key, id, doc) view rows in the given range, starting at cursor if given.
+        """
+        ds, datastore_name = self._get_datastore()
+
+        if design_name == "_all_docs":
+            view_map = lambda doc: doc['_id']
+        else:
+            try:
+                view_map = MOCK_VIEWS[design_name][view_name]
+            except KeyError:
+                raise BadRequest("View %s/%s not supported by the mock datastore" % (design_name, view_name))
+
+        descending = bool(kwargs.get('descending', False))
+        startkey, endkey = self._get_view_range(key, start_key, end_key, descending)
+        startkey_docid = None
+        if cursor:
+            startkey, startkey_docid = cursor
+
+        def before(a, b):
+            return a > b if descending else a < b
+
+        rows = []
+        for obj in ds.docs.itervalues():
+            row_key = view_map(obj)
+            if row_key is None: continue
+            if startkey is not None:
+                if row_key == startkey:
+                    if startkey_docid is not None and before(obj['_id'], startkey_docid): continue
+                elif before(row_key, startkey): continue
+            if endkey is not None and before(endkey, row_key): continue
+            rows.append((row_key, obj['_id'], obj))
+
+        rows.sort(key=lambda row: (row[0], row[1]), reverse=descending)
+        return rows
+
     def _ion_object_to_persistence_dict(self, ion_object):
         if ion_object is None: return None
 
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+__license__ = 'Apache 2.0'
+
+from pyon.datastore.couchdb.couchdb_cache import CouchDBDocCache
+from pyon.util.unit_test import PyonTestCase
+from nose.plugins.attrib import attr
+
+
+@attr('UNIT', group='datastore')
+class TestCouchDBDocCache(PyonTestCase):
+
+    def setUp(self):
+        self.cache = CouchDBDocCache(size=2)
+
+    def test_get_put(self):
+        doc = {'_id': 'id1', '_rev': '1-a', 'foo': ['bar']}
+        self.cache.put('ds', doc)
+
+        cached = self.cache.get('ds', 'id1')
+        self.assertEquals(cached, doc)
+
+        # callers get their own copies
+        cached['foo'].append('baz')
+        doc['foo'].append('qux')
+        self.assertEquals(self.cache.get('ds', 'id1')['foo'], ['bar'])
+
+        self.assertIsNone(self.cache.get('other_ds', 'id1'))
+        self.assertEquals(self.cache.get('ds', 'id1', '1-a')['_rev'], '1-a')
+        self.assertIsNone(self.cache.get('ds', 'id1', '0-z'))
+
+        stats = self.cache.get_stats()
+        self.assertEquals(stats['hits'], 3)
+        self.assertEquals(stats['misses'], 2)
+        self.assertEquals(stats['hit_rate'], 0.6)
+
+    def test_lru_eviction(self):
+        self.cache.put('ds', {'_id': 'id1', '_rev': '1-a'})
+        self.cache.put('ds', {'_id': 'id2', '_rev': '1-a'})
+        self.cache.get('ds', 'id1')
+        self.cache.put('ds', {'_id': 'id3', '_rev': '1-a'})
+
+        self.assertIsNone(self.cache.get('ds', 'id2'))
+        self.assertIsNotNone(self.cache.get('ds', 'id1'))
+        self.assertIsNotNone(self.cache.get('ds', 'id3'))
+        self.assertEquals(self.cache.get_stats()['evictions'], 1)
+
+    def test_invalidate(self):
+        self.cache.put('ds', {'_id': 'id1', '_rev': '2-a'})
+
+        # the change of our own write keeps the doc
+        self.cache.invalidate('ds', 'id1', '2-a')
+        self.assertIsNotNone(self.cache.get('ds', 'id1'))
+
+        self.cache.invalidate('ds', 'id1', '3-b')
+        self.assertIsNone(self.cache.get('ds', 'id1'))
+        self.assertEquals(self.cache.get_stats()['invalidations'], 1)
+
+    def test_put_after_change(self):
+        generation = self.cache.generation('ds')
+        self.cache.invalidate('ds', 'id1', '3-b')
+
+        # read started before the change came in
+        self.cache.put('ds', {'_id': 'id1', '_rev': '2-a'}, generation)
+        self.assertIsNone(self.cache.get('ds', 'id1'))
+
+        self.cache.put('ds', {'_id': 'id1', '_rev': '3-b'}, self.cache.generation('ds'))
+        self.assertIsNotNone(self.cache.get('ds', 'id1'))
+
+    def test_clear(self):
+        self.cache.put('ds', {'_id': 'id1', '_rev': '1-a'})
+        self.cache.put('other_ds', {'_id': 'id1', '_rev': '1-a'})
+
+        self.cache.clear('ds')
+        self.assertIsNone(self.cache.get('ds', 'id1'))
+        self.assertIsNotNone(self.cache.get('other_ds', 'id1'))
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+__license__ = 'Apache 2.0'
+
+from pyon.datastore.couchdb.couchdb_session import PooledSession
+from pyon.util.unit_test import PyonTestCase
+from mock import Mock, patch, sentinel
+from nose.plugins.attrib import attr
+import gevent
+
+
+@attr('UNIT', group='datastore')
+class TestPooledSession(PyonTestCase):
+
+    @patch('pyon.datastore.couchdb.couchdb_session.Session.request')
+    def test_request_bounded(self, mockrequest):
+        def request(*args):
+            gevent.sleep(0.01)
+            return sentinel.response
+        mockrequest.side_effect = request
+
+        session = PooledSession(size=2)
+        gls = [gevent.spawn(session.request, 'GET', 'http://localhost:5984/db/doc%d' % x) for x in xrange(5)]
+        gevent.joinall(gls)
+
+        self.assertEquals([gl.value for gl in gls], [sentinel.response] * 5)
+        stats = session.get_stats()
+        self.assertEquals(stats['requests'], 5)
+        self.assertEquals(stats['max_in_use'], 2)
+        self.assertEquals(stats['waits'], 3)
+        self.assertEquals(stats['in_use'], 0)
+        self.assertEquals(sum(stats['latency'].values()), 5)
+        self.assertEquals(stats['latency']['<=1 ms'], 0)
+
+    @patch('pyon.datastore.couchdb.couchdb_session.Session.request')
+    def test_request_error(self, mockrequest):
+        mockrequest.side_effect = IOError("connection refused")
+
+        session = PooledSession(size=1)
+        self.assertRaises(IOError, session.request, 'GET', 'http://localhost:5984/db')
+        self.assertRaises(IOError, session.request, 'GET', 'http://localhost:5984/db')
+
+        stats = session.get_stats()
+        self.assertEquals(stats['errors'], 2)
+        self.assertEquals(stats['in_use'], 0)
+
+    def test_idle_connections_bounded(self):
+        session = PooledSession(size=1)
+        conn1, conn2 = Mock(), Mock()
+
+        session._return_connection('http://localhost:5984/db', conn1)
+        session._return_connection('http://localhost:5984/db', conn2)
+        self.assertFalse(conn1.close.called)
+        conn2.close.assert_called_once_with()
+        self.assertEquals(session.get_stats()['idle'], 1)
+
+        session.close()
+        conn1.close.assert_called_once_with()
+        self.assertEquals(session.get_stats()['idle'], 0)
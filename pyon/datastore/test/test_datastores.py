@@ -4,14 +4,17 @@ __author__ = 'Thomas R. Lennan, Michael Meisinger'
 __license__ = 'Apache 2.0'
 
 from pyon.core.bootstrap import IonObject
-from pyon.core.exception import BadRequest, NotFound
+from pyon.core.exception import BadRequest, Conflict, NotFound
 from pyon.datastore.datastore import DataStore
 from pyon.datastore.mockdb.mockdb_datastore import MockDB_DataStore
 from pyon.datastore.couchdb.couchdb_datastore import CouchDB_DataStore
+from couchdb.http import ResourceNotFound
 from pyon.util.int_test import IonIntegrationTestCase
 from pyon.ion.resource import RT, PRED, LCS
 from nose.plugins.attrib import attr
+from mock import Mock, MagicMock
 from unittest import SkipTest
+import gevent
 import socket
 
 import interface.objects
@@ -28,6 +31,45 @@ class Test_DataStores(IonIntegrationTestCase):
         
         self._do_test_views(MockDB_DataStore(datastore_name='ion_test_ds'))
 
+        self._do_test_view_paging(MockDB_DataStore(datastore_name='ion_test_ds'))
+
+    def test_non_persistent_indexes(self):
+        data_store = MockDB_DataStore(datastore_name='ion_test_ds')
+        data_store.create_datastore()
+        self.data_store = data_store
+        self.resources = {}
+
+        user_id = self._create_resource(RT.UserIdentity, 'user1')
+        inst_id = self._create_resource(RT.Instrument, 'inst1', lcstate=LCS.DRAFT_PRIVATE)
+        aid, _ = data_store.create_association(user_id, OWNER_OF, inst_id)
+
+        # a renamed resource is found by its new name only
+        inst_doc = data_store.read_doc(inst_id)
+        inst_doc['name'] = 'inst2'
+        data_store.update_doc(inst_doc)
+        self.assertEquals(data_store.find_res_by_name('inst1', id_only=True)[0], [])
+        self.assertEquals(data_store.find_res_by_name('inst2', id_only=True)[0], [inst_id])
+        self.assertEquals(data_store.find_res_by_lcstate(LCS.DRAFT_PRIVATE, RT.Instrument, id_only=True)[0], [inst_id])
+        self.assertEquals(len(data_store.list_object_revisions(inst_id)), 2)
+
+        self.assertEquals(data_store.find_objects(user_id, OWNER_OF, id_only=True)[0], [inst_id])
+        self.assertEquals(data_store.find_subjects(RT.UserIdentity, OWNER_OF, inst_id, id_only=True)[0], [user_id])
+
+        # a deleted association is gone from all indexes
+        data_store.delete_doc(aid)
+        self.assertEquals(data_store.find_objects(user_id, OWNER_OF, id_only=True)[0], [])
+        self.assertEquals(data_store.find_associations(None, OWNER_OF, None), [])
+        self.assertFalse(data_store._is_in_association(inst_id))
+
+        # deleting with its associations removes them in bulk
+        data_store.create_association(user_id, OWNER_OF, inst_id)
+        data_store.create_association(inst_id, HAS_A, inst_id)
+        data_store.delete_doc(inst_id, del_associations=True)
+        self.assertEquals(data_store.find_associations(None, OWNER_OF, None), [])
+        self.assertEquals(data_store.find_associations(None, HAS_A, None), [])
+        self.assertEquals(data_store.find_res_by_type(RT.Instrument, id_only=True)[0], [])
+        self.assertEquals(data_store.list_object_revisions(inst_id), [])
+
     def test_persistent(self):
         import socket
         try:
@@ -66,9 +108,70 @@ class Test_DataStores(IonIntegrationTestCase):
                 ds.delete_doc("badid", "BadDataStoreNamePerCouchDB")
 
             self._do_test_views(CouchDB_DataStore(datastore_name='ion_test_ds', profile=DataStore.DS_PROFILE.RESOURCES), is_persistent=True)
+
+            self._do_test_view_paging(CouchDB_DataStore(datastore_name='ion_test_ds', profile=DataStore.DS_PROFILE.EVENTS))
+        except socket.error:
+            raise SkipTest('Failed to connect to CouchDB')
+
+    def test_persistent_cache(self):
+        try:
+            ds = CouchDB_DataStore(datastore_name='ion_test_ds', profile=DataStore.DS_PROFILE.RESOURCES, cache_size=100)
+            self._do_test(ds)
+
+            # a doc changed through another connection is dropped from the cache
+            ds.create_datastore()
+            doc_id, _ = ds.create_doc({"foo": "bar"})
+            self.assertEquals(ds.read_doc(doc_id)["foo"], "bar")
+
+            other_ds = CouchDB_DataStore(datastore_name='ion_test_ds')
+            other_doc = other_ds.read_doc(doc_id)
+            other_doc["foo"] = "baz"
+            other_ds.update_doc(other_doc)
+
+            for x in xrange(50):
+                if ds.read_doc(doc_id)["foo"] == "baz":
+                    break
+                gevent.sleep(0.1)
+            self.assertEquals(ds.read_doc(doc_id)["foo"], "baz")
+            self.assertGreater(ds.get_cache_stats()['invalidations'], 0)
+
+            ds.delete_datastore()
+            ds.close()
+            other_ds.close()
         except socket.error:
             raise SkipTest('Failed to connect to CouchDB')
 
+    def test_persistent_delete_assocs_failed(self):
+        ds = CouchDB_DataStore(datastore_name='ion_test_ds')
+        db = MagicMock()
+        ds._get_datastore = Mock(return_value=(db, 'ion_test_ds'))
+        ds._is_in_association = Mock(return_value=True)
+        ds.find_associations = Mock(return_value=[Mock(_id='assoc1'), Mock(_id='assoc2')])
+        ds.delete_mult = Mock(return_value=[(True, 'assoc1', '2'), (False, 'assoc2', Conflict('not current'))])
+
+        # the object is kept when one of its associations could not be deleted
+        with self.assertRaises(Conflict):
+            ds.delete_doc('inst1', del_associations=True)
+        self.assertFalse(db.__delitem__.called)
+
+    def test_persistent_datastore_gone(self):
+        ds = CouchDB_DataStore(datastore_name='ion_test_ds')
+        db = MagicMock()
+        ds._dbs['ion_test_ds'] = db
+
+        # a datastore deleted behind the cached database is reported as on first access, and forgotten
+        db.update.side_effect = ResourceNotFound(('not_found', 'no_db_file'))
+        with self.assertRaises(BadRequest):
+            ds.create_doc_mult([{"foo": "bar"}])
+        self.assertNotIn('ion_test_ds', ds._dbs)
+
+        ds._dbs['ion_test_ds'] = db
+        ds._is_in_association = Mock(return_value=False)
+        db.__delitem__.side_effect = ResourceNotFound(('not_found', 'missing'))
+        with self.assertRaises(NotFound):
+            ds.delete_doc('doc1')
+        self.assertIn('ion_test_ds', ds._dbs)
+
     def _do_test(self, data_store):
         self.data_store = data_store
         self.resources = {}
@@ -281,6 +384,12 @@ class Test_DataStores(IonIntegrationTestCase):
         with self.assertRaises(NotFound):
             data_store.delete(head._id)
 
+        # Updating the deleted DataSet fails, it cannot be created again by update
+        with self.assertRaises(Conflict):
+            data_store.update(head)
+        with self.assertRaises(Conflict):
+            data_store.update_doc({"_id": "missing_id", "_rev": "1", "type_": "DataSet"})
+
         # List all objects in data store, should be back to six
         res = data_store.list_objects()
         self.assertTrue(len(res) == 6 + numcoredocs)
@@ -291,12 +400,36 @@ class Test_DataStores(IonIntegrationTestCase):
 
         o1 = IonObject("DataSet", name="One more")
         o2 = IonObject("DataSet", name="Another one")
-        res = data_store.create_mult((o1, o2))
-        self.assertTrue(all([success for success, oid, rev in res]))
+        res_mult = data_store.create_mult((o1, o2))
+        self.assertTrue(all([success for success, oid, rev in res_mult]))
 
         res = data_store.list_objects()
         self.assertTrue(len(res) == 8 + numcoredocs)
 
+        # Bulk update, an object that is not the most recent version fails on its own
+        objs = data_store.read_mult([oid for success, oid, rev in res_mult])
+        data_store.update(data_store.read(objs[1]._id))
+        objs[0].description = "Bulk updated"
+        objs[1].description = "Bulk updated"
+        res = data_store.update_mult(objs)
+        self.assertEquals([success for success, oid, rev in res], [True, False])
+        self.assertIsInstance(res[1][2], Conflict)
+        self.assertEquals(data_store.read(objs[0]._id).description, "Bulk updated")
+        self.assertNotEquals(data_store.read(objs[1]._id).description, "Bulk updated")
+
+        # Bulk delete by object and by id, a missing id fails on its own
+        res = data_store.delete_mult([data_store.read(objs[0]._id), objs[1]._id, "missing_id"])
+        self.assertEquals([success for success, oid, rev in res], [True, True, False])
+        self.assertIsInstance(res[2][2], NotFound)
+
+        res = data_store.list_objects()
+        self.assertTrue(len(res) == 6 + numcoredocs)
+
+        # Bulk update of a deleted object fails on its own
+        res = data_store.update_mult([objs[0]])
+        self.assertEquals([success for success, oid, rev in res], [False])
+        self.assertIsInstance(res[0][2], Conflict)
+
         # Delete data store to clean up
         data_store.delete_datastore()
 
@@ -416,6 +549,27 @@ class Test_DataStores(IonIntegrationTestCase):
         self.assertEquals(len(sub_ids3), 1)
         self.assertEquals(set(sub_ids3), set([admin_user_id]))
 
+        # Multiple hops: datasets of the instruments a user owns
+        OUT, IN = DataStore.DIRECTION.OUT, DataStore.DIRECTION.IN
+        rel_ids = data_store.find_related(admin_user_id, [(OWNER_OF, OUT, RT.InstrumentDevice), (HAS_A, OUT, None)], id_only=True)
+        self.assertEquals(rel_ids, [ds1_obj_id])
+
+        rel_objs = data_store.find_related([ds1_obj_id], [(HAS_A, IN, None), (None, IN, RT.PlatformDevice)])
+        self.assertEquals([o._id for o in rel_objs], [plat1_obj_id])
+
+        rel_ids = data_store.find_related([admin_user_id, other_user_id], [(OWNER_OF, OUT, RT.InstrumentDevice)], id_only=True)
+        self.assertEquals(set(rel_ids), set([inst1_obj_id, inst2_obj_id]))
+
+        # Repeated path, down to any depth, and around a cycle
+        rel_ids = data_store.find_related(plat1_obj_id, [(HAS_A, OUT, None)], max_depth=5, id_only=True)
+        self.assertEquals(rel_ids, [inst1_obj_id, ds1_obj_id])
+
+        rel_ids = data_store.find_related(ds1_obj_id, [(BASED_ON, OUT, None)], max_depth=5, id_only=True)
+        self.assertEquals(rel_ids, [])
+
+        with self.assertRaises(BadRequest):
+            data_store.find_related(ds1_obj_id, [(BASED_ON, "sideways", None)])
+
         if is_persistent:
             data_store._update_views()
 
@@ -526,6 +680,52 @@ class Test_DataStores(IonIntegrationTestCase):
         data_store.create_association(idev1_obj_id, PRED.hasAgentInstance, iag1_obj_id)
 
 
+    def _do_test_view_paging(self, data_store):
+        data_store.delete_datastore()
+        data_store.create_datastore()
+
+        # several events per timestamp, so pages continue within equal keys
+        for i in xrange(10):
+            data_store.create(IonObject("Event", origin="resource%d" % (i % 2), ts_created=str(1000 + i / 3)))
+
+        rows = data_store.find_by_view("event", "by_origin", start_key=["resource0"], end_key=["resource0"], id_only=True)
+        self.assertEquals(len(rows), 5)
+
+        rows_i = list(data_store.find_by_view_iter("event", "by_origin", start_key=["resource0"], end_key=["resource0"],
+                                                   id_only=True, page_size=2))
+        self.assertEquals(rows_i, rows)
+
+        rows_i = list(data_store.find_by_view_iter("event", "by_origin", start_key=["resource0"], end_key=["resource0"],
+                                                   id_only=False, page_size=2, limit=3, descending=True))
+        self.assertEquals(len(rows_i), 3)
+        self.assertEquals([row[0] for row in rows_i], [row[0] for row in reversed(rows)][:3])
+        self.assertEquals(type(rows_i[0][2]).__name__, "Event")
+
+        # page through all events by time, with the cursor
+        rows_p = []
+        cursor = None
+        while True:
+            page, cursor = data_store.find_by_view_page("event", "by_time", start_key=["1000"], end_key=["1003"],
+                                                        id_only=True, page_size=4, cursor=cursor)
+            self.assertTrue(len(page) <= 4)
+            rows_p.extend(page)
+            if not cursor:
+                break
+        self.assertEquals(len(rows_p), 10)
+        self.assertEquals(len(set(row[0] for row in rows_p)), 10)
+        self.assertEquals([row[1] for row in rows_p], sorted(row[1] for row in rows_p))
+
+        # string keys are ranges by prefix, not split into characters
+        for i in xrange(5):
+            data_store.create_doc({"type_": "Doc", "num": i}, object_id="doc_%d" % i)
+        rows = data_store.find_by_view("_all_docs", None, start_key="doc_1", end_key="doc_3", id_only=True)
+        self.assertEquals([row[0] for row in rows], ["doc_1", "doc_2", "doc_3"])
+        rows_i = list(data_store.find_by_view_iter("_all_docs", None, start_key="doc_", end_key="doc_",
+                                                   id_only=True, page_size=2, descending=True))
+        self.assertEquals([row[0] for row in rows_i], ["doc_4", "doc_3", "doc_2", "doc_1", "doc_0"])
+
+        data_store.delete_datastore()
+
     def _create_resource(self, restype, name, *args, **kwargs):
         res_obj = IonObject(restype, dict(name=name, **kwargs))
         res_obj_res = self.data_store.create(res_obj)
@@ -6,11 +6,18 @@ __author__ = 'Dave Foster <dfoster@asascience.com>, Michael Meisinger'
 __license__ = 'Apache 2.0'
 
 import time
+from uuid import uuid4
+
+import gevent
+from gevent import coros
+from gevent.event import AsyncResult
 
 from pyon.core import bootstrap
-from pyon.core.exception import BadRequest
+from pyon.core.bootstrap import CFG
+from pyon.core.exception import BadRequest, ServerError, Timeout
 from pyon.datastore.datastore import DataStore
 from pyon.net.endpoint import Publisher, Subscriber, PublisherEndpointUnit, SubscriberEndpointUnit, ListeningBaseEndpoint
+from pyon.util.async import spawn
 from pyon.util.log import log
 
 from interface.objects import Event
@@ -64,9 +71,10 @@ class EventPublisher(Publisher):
         @returns        A set of field names in msgargs that were NOT set on the object.
         """
         set_fields = set()
+        msg_fields = msg._get_fields()
 
         for k,v in msgargs.items():
-            if k in msg.__dict__:
+            if k in msg_fields:
                 setattr(msg, k, v)
                 set_fields.add(k)
 
@@ -93,13 +101,28 @@ class EventPublisher(Publisher):
         to_name = (self._send_name.exchange, self._topic(origin))
         log.debug("Publishing message to %s", to_name)
 
-        ep = self.publish(event_msg, to_name=to_name)
-        ep.close()
+        # same exchange, so this reuses our publishing channel
+        self.publish_many([event_msg], to_name=to_name)
 
         # store published event but only if we specified an event_repo
         if self.event_repo:
             self.event_repo.put_event(event_msg)
 
+    def publish_events(self, event_msgs, origin=None, **kwargs):
+        """
+        Publishes several events from the same origin as one batch, and stores them in the
+        event_repo (if any) with a single bulk write.
+        """
+        assert origin
+
+        to_name = (self._send_name.exchange, self._topic(origin))
+        log.debug("Publishing %d messages to %s", len(event_msgs), to_name)
+
+        self.publish_many(event_msgs, to_name=to_name)
+
+        if self.event_repo:
+            self.event_repo.put_events(event_msgs)
+
     def create_and_publish_event(self, origin=None, **kwargs):
         msg = self.create_event(origin=origin, **kwargs)
         self.publish_event(msg, origin=origin)
@@ -503,26 +526,151 @@ class DatasetIngestionConfigurationEventSubscriber(ResourceModifiedEventSubscrib
 class EventRepository(object):
     """
     Class that uses a data store to provide a persistent repository for ION events.
+
+    Writes may be buffered (write-behind): with a buffer_size set, put_event returns right away and a
+    writer greenlet stores the waiting events with one bulk write when buffer_size events are waiting
+    or buffer_latency seconds have passed since the first one. At most buffer_max events wait; beyond
+    that put_event writes the buffer itself before returning. With durable set, put_event blocks until
+    the write containing its event is done. close() writes what is still waiting.
     """
 
-    def __init__(self, datastore_manager=None):
+    def __init__(self, datastore_manager=None, buffer_size=None, buffer_latency=None, buffer_max=None, durable=None):
+        """
+        @param  buffer_size     Number of events to collect before they are written as a batch. If 0, every
+                                event is written immediately. Default CFG container.event_repository.buffer_size.
+        @param  buffer_latency  Max seconds a buffered event waits before it is written. Default 0.5.
+        @param  buffer_max      Max number of buffered events. Default 10 times buffer_size.
+        @param  durable         If True, put_event/put_events wait until their events are written.
+        """
 
         # Get an instance of datastore configured as directory.
         # May be persistent or mock, forced clean, with indexes
         datastore_manager = datastore_manager or bootstrap.container_instance.datastore_manager
         self.event_store = datastore_manager.get_datastore("events", DataStore.DS_PROFILE.EVENTS)
 
+        self._buffer_size       = buffer_size if buffer_size is not None else CFG.get_safe('container.event_repository.buffer_size', 0)
+        self._buffer_latency    = buffer_latency if buffer_latency is not None else CFG.get_safe('container.event_repository.buffer_latency', 0.5)
+        self._buffer_max        = buffer_max if buffer_max is not None else CFG.get_safe('container.event_repository.buffer_max', 10 * (self._buffer_size or 0))
+        self._durable           = durable if durable is not None else CFG.get_safe('container.event_repository.durable', False)
+        self._buffer_max        = max(self._buffer_max, self._buffer_size)
+
+        self._batch             = []                # (event, event_id) waiting to be written
+        self._batch_result      = AsyncResult()     # set to event_id -> rev when the batch is written
+        self._batch_ts          = 0
+        self._wake              = gevent.event.Event()
+        self._write_lock        = coros.RLock()
+        self._writer            = None
+        self._closing           = False
+
     def close(self):
         """
-        Pass-through method to close the underlying datastore.
+        Writes buffered events, then closes the underlying datastore.
         """
+        if self._writer is not None:
+            # let a write in progress finish
+            self._closing = True
+            self._wake.set()
+            self._writer.join()
+            self._writer = None
+        self.flush()
         self.event_store.close()
 
     def put_event(self, event):
         log.debug("Store event persistently %s" % event)
         if not isinstance(event, Event):
             raise BadRequest("event must be type Event, not %s" % type(event))
-        return self.event_store.create(event)
+        if not self._buffer_size:
+            return self.event_store.create(event)
+
+        event_id, result = self._buffer_events([event])[0]
+        return event_id, self._get_rev(event_id, result)
+
+    def put_events(self, events):
+        log.debug("Store %d events persistently", len(events))
+        for event in events:
+            if not isinstance(event, Event):
+                raise BadRequest("event must be type Event, not %s" % type(event))
+        if not self._buffer_size:
+            return self.event_store.create_mult(events)
+
+        return [(True, event_id, self._get_rev(event_id, result)) for event_id, result in self._buffer_events(events)]
+
+    def flush(self):
+        """
+        Writes all buffered events now, with one bulk write. Waits for a write in progress first.
+        """
+        with self._write_lock:
+            if not self._batch:
+                return
+
+            batch, result = self._batch, self._batch_result
+            self._batch, self._batch_result = [], AsyncResult()
+
+            try:
+                res = self.event_store.create_mult([ev for ev, event_id in batch], [event_id for ev, event_id in batch])
+            except Exception as ex:
+                log.exception("Error writing %d buffered events", len(batch))
+                result.set_exception(ex)
+                return
+
+            result.set(dict((event_id, rev) for success, event_id, rev in res if success))
+
+    def _buffer_events(self, events):
+        """
+        Adds events to the buffer, with their ids assigned here. Returns a list of (event_id, AsyncResult of the batch).
+        """
+        if len(self._batch) + len(events) > self._buffer_max:
+            self.flush()
+
+        if self._writer is None:
+            self._writer = spawn(self._run_writer)
+
+        if not self._batch:
+            self._batch_ts = time.time()
+            self._wake.set()
+
+        added = []
+        for ev in events:
+            event_id = uuid4().hex
+            self._batch.append((ev, event_id))
+            added.append((event_id, self._batch_result))
+
+        if len(self._batch) >= self._buffer_size:
+            self._wake.set()
+
+        return added
+
+    def _get_rev(self, event_id, result):
+        """
+        Returns the rev of a buffered event once written when durable, None otherwise.
+        """
+        if not self._durable:
+            return None
+
+        try:
+            revs = result.get(timeout=self._buffer_latency + 10)
+        except gevent.Timeout:
+            raise Timeout("Timed out waiting for event %s to be written" % event_id)
+        if event_id not in revs:
+            raise ServerError("Event %s could not be written" % event_id)
+        return revs[event_id]
+
+    def _run_writer(self):
+        """
+        Runs in the writer greenlet: writes the buffer when it is full or its first event is buffer_latency old.
+        """
+        while not self._closing:
+            self._wake.clear()
+            if not self._batch:
+                self._wake.wait()
+                continue
+
+            remaining = self._batch_ts + self._buffer_latency - time.time()
+            if len(self._batch) < self._buffer_size and remaining > 0:
+                self._wake.wait(timeout=remaining)
+                continue
+
+            self.flush()
 
     def get_event(self, event_id):
         log.debug("Retrieving persistent event for id=%s" % event_id)
@@ -534,6 +682,38 @@ class EventRepository(object):
                 event_type,origin,start_ts,end_ts,reverse_order,max_results))
         events = None
 
+        view_name, start_key, end_key = self._get_event_view(event_type, origin, start_ts, end_ts)
+
+        events = self.event_store.find_by_view("event", view_name, start_key=start_key, end_key=end_key,
+                                                descending=reverse_order, limit=max_results, id_only=False)
+
+        #log.info("Events: %s" % events)
+        return events
+
+    def find_events_iter(self, event_type=None, origin=None, start_ts=None, end_ts=None, reverse_order=False, max_results=0, page_size=100):
+        """
+        Like find_events, but a generator reading the events page_size at a time, so a long history is
+        never held in memory at once.
+        """
+        view_name, start_key, end_key = self._get_event_view(event_type, origin, start_ts, end_ts)
+
+        return self.event_store.find_by_view_iter("event", view_name, start_key=start_key, end_key=end_key,
+                                                  descending=reverse_order, limit=max_results, id_only=False, page_size=page_size)
+
+    def find_events_page(self, event_type=None, origin=None, start_ts=None, end_ts=None, reverse_order=False, page_size=100, cursor=None):
+        """
+        Returns one page of find_events results as a tuple (events, cursor). Pass the cursor back for the
+        next page; it is None after the last page.
+        """
+        view_name, start_key, end_key = self._get_event_view(event_type, origin, start_ts, end_ts)
+
+        return self.event_store.find_by_view_page("event", view_name, start_key=start_key, end_key=end_key,
+                                                  descending=reverse_order, id_only=False, page_size=page_size, cursor=cursor)
+
+    def _get_event_view(self, event_type=None, origin=None, start_ts=None, end_ts=None):
+        """
+        Returns the event view to query and its (start_key, end_key) for the given filters.
+        """
         view_name = None
         start_key = []
         end_key = []
@@ -561,8 +741,4 @@ class EventRepository(object):
         if end_ts:
             end_key.append(end_ts)
 
-        events = self.event_store.find_by_view("event", view_name, start_key=start_key, end_key=end_key,
-                                                descending=reverse_order, limit=max_results, id_only=False)
-
-        #log.info("Events: %s" % events)
-        return events
+        return view_name, start_key, end_key
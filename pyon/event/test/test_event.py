@@ -6,10 +6,9 @@ __license__ = 'Apache 2.0'
 
 import time
 
-from mock import Mock, sentinel, patch
+from mock import Mock, sentinel, patch, ANY
 from nose.plugins.attrib import attr
 from gevent import event, queue
-from unittest import SkipTest
 
 from pyon.core import bootstrap
 from pyon.event.event import EventPublisher, EventError, get_events_exchange_point, EventSubscriber, EventRepository
@@ -129,20 +128,41 @@ class TestEventPublisher(IonUnitTestCase):
         self.assertRaises(AssertionError, self._pub.publish_event, sentinel.event_msg)
 
     def test_publish_event(self):
-        self._pub.publish = Mock()
+        self._pub.publish_many = Mock()
 
         self._pub.publish_event(sentinel.event_msg, origin=sentinel.origin)
-        self._pub.publish.assert_called_once_with(sentinel.event_msg, to_name=(get_events_exchange_point(), self._pub._topic(sentinel.origin)))
-        self._pub.publish().close.assert_called_once_with()
+        self._pub.publish_many.assert_called_once_with([sentinel.event_msg], to_name=(get_events_exchange_point(), self._pub._topic(sentinel.origin)))
+
+    @patch.dict('pyon.net.endpoint.interceptors', {}, clear=True)
+    def test_publish_event_reuses_channel(self):
+        ch = Mock()
+        self._node.channel.return_value = ch
+
+        self._pub.publish_event(sentinel.event_msg, origin=sentinel.origin)
+        self._pub.publish_event(sentinel.event_msg2, origin=sentinel.origin2)
+
+        self.assertEquals(self._node.channel.call_count, 1)
+        self.assertEquals(ch.send_many.call_count, 2)
+        self.assertEquals(ch.send_many.call_args[1]['name'].binding, self._pub._topic(sentinel.origin2))
+        self.assertEquals(ch.close.call_count, 0)
 
     def test_publish_event_with_event_repo(self):
-        self._pub.publish = Mock()
+        self._pub.publish_many = Mock()
         self._pub.event_repo = Mock()
 
         self._pub.publish_event(sentinel.event_msg, origin=sentinel.origin)
 
         self._pub.event_repo.put_event.assert_called_once_with(sentinel.event_msg)
 
+    def test_publish_events_with_event_repo(self):
+        self._pub.publish_many = Mock()
+        self._pub.event_repo = Mock()
+
+        self._pub.publish_events([sentinel.event_msg, sentinel.event_msg2], origin=sentinel.origin)
+
+        self._pub.publish_many.assert_called_once_with([sentinel.event_msg, sentinel.event_msg2], to_name=(get_events_exchange_point(), self._pub._topic(sentinel.origin)))
+        self._pub.event_repo.put_events.assert_called_once_with([sentinel.event_msg, sentinel.event_msg2])
+
     def test_create_and_publish_event(self):
         self._pub.create_event = Mock()
         self._pub.create_event.return_value = sentinel.event_msg
@@ -338,9 +358,6 @@ class TestEvents(IonIntegrationTestCase):
 @attr('UNIT',group='datastore')
 class TestEventRepository(IonUnitTestCase):
     def test_event_repo(self):
-        if bootstrap.CFG.system.mockdb:
-            raise SkipTest("only works with CouchDB views")
-
         dsm = DatastoreManager()
 
         event_repo = EventRepository(dsm)
@@ -380,9 +397,90 @@ class TestEventRepository(IonUnitTestCase):
         events_r = event_repo.find_events(start_ts=str(ts+3), end_ts=str(ts+4))
         self.assertEquals(len(events_r), 2)
 
+        # the same, streamed and paged
+        events_i = list(event_repo.find_events_iter(origin='resource2', page_size=2))
+        self.assertEquals([evt[0] for evt in events_i], [evt[0] for evt in event_repo.find_events(origin='resource2')])
+
+        events_i = list(event_repo.find_events_iter(origin='resource2', reverse_order=True, max_results=3, page_size=2))
+        self.assertEquals([evt[2].ts_created for evt in events_i], [str(ts+4), str(ts+3), str(ts+2)])
+
+        events_p, cursor = event_repo.find_events_page(origin='resource2', page_size=3)
+        self.assertEquals(len(events_p), 3)
+        events_p2, cursor = event_repo.find_events_page(origin='resource2', page_size=3, cursor=cursor)
+        self.assertEquals(len(events_p2), 2)
+        self.assertIsNone(cursor)
+        self.assertEquals([evt[0] for evt in events_p + events_p2], [evt[0] for evt in event_repo.find_events(origin='resource2')])
+
 
         event3 = ResourceLifecycleEvent(origin="resource3")
         event_id, _ = event_repo.put_event(event3)
 
         events_r = event_repo.find_events(event_type="ResourceLifecycleEvent")
         self.assertEquals(len(events_r), 1)
+
+@attr('UNIT')
+class TestEventRepositoryBuffer(IonUnitTestCase):
+    def setUp(self):
+        self._dsm = Mock()
+        self._store = self._dsm.get_datastore.return_value
+        self._store.create_mult.side_effect = lambda events, ids: [(True, oid, "1-%s" % oid) for oid in ids]
+
+    def test_unbuffered(self):
+        event_repo = EventRepository(self._dsm, buffer_size=0)
+        event_repo.put_event(Event(origin="resource1"))
+
+        self.assertEquals(self._store.create.call_count, 1)
+        self.assertFalse(self._store.create_mult.called)
+
+    def test_buffer_size(self):
+        event_repo = EventRepository(self._dsm, buffer_size=3, buffer_latency=60)
+
+        ids = [event_repo.put_event(Event(origin="resource1"))[0] for i in xrange(3)]
+        self.assertFalse(self._store.create_mult.called)
+
+        # the writer greenlet writes the full buffer with one bulk write
+        time.sleep(0)
+        self._store.create_mult.assert_called_once_with([ANY] * 3, ids)
+        self.assertFalse(self._store.create.called)
+
+        event_repo.close()
+        self.assertEquals(self._store.create_mult.call_count, 1)
+        self._store.close.assert_called_once_with()
+
+    def test_buffer_latency(self):
+        event_repo = EventRepository(self._dsm, buffer_size=100, buffer_latency=0.05)
+
+        event_repo.put_event(Event(origin="resource1"))
+        time.sleep(0.02)
+        self.assertFalse(self._store.create_mult.called)
+
+        time.sleep(0.1)
+        self.assertEquals(self._store.create_mult.call_count, 1)
+        event_repo.close()
+
+    def test_buffer_max(self):
+        event_repo = EventRepository(self._dsm, buffer_size=2, buffer_max=4, buffer_latency=60)
+
+        # the writer greenlet does not get to run, put_event writes the full buffer itself
+        for i in xrange(5):
+            event_repo.put_event(Event(origin="resource1"))
+
+        self.assertEquals(len(self._store.create_mult.call_args[0][1]), 4)
+        self.assertEquals(len(event_repo._batch), 1)
+
+    def test_close_writes_buffer(self):
+        event_repo = EventRepository(self._dsm, buffer_size=100, buffer_latency=60)
+        event_repo.put_events([Event(origin="resource1"), Event(origin="resource2")])
+
+        event_repo.close()
+        self.assertEquals(len(self._store.create_mult.call_args[0][0]), 2)
+
+    def test_durable(self):
+        event_repo = EventRepository(self._dsm, buffer_size=100, buffer_latency=0.01, durable=True)
+
+        event_id, rev = event_repo.put_event(Event(origin="resource1"))
+        self.assertEquals(rev, "1-%s" % event_id)
+
+        self._store.create_mult.side_effect = Exception("write failed")
+        self.assertRaises(Exception, event_repo.put_event, Event(origin="resource1"))
+        event_repo.close()
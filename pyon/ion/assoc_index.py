@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+
+"""In-memory adjacency index of the associations of the resource registry"""
+
+__license__ = 'Apache 2.0'
+
+from collections import namedtuple
+
+from pyon.util.async import spawn
+from pyon.util.log import log
+
+# The fields of an association doc kept in the index
+DOC_FIELDS = ('_id', '_rev', 'at', 's', 'st', 'srv', 'p', 'o', 'ot', 'orv', 'ts')
+AssocEntry = namedtuple('AssocEntry', [field.lstrip('_') for field in DOC_FIELDS])
+# Fields whose values repeat across associations
+SHARED_FIELDS = set(['at', 's', 'st', 'p', 'o', 'ot'])
+
+
+class AssociationIndex(object):
+    """
+    Container-local index of all associations of a datastore, by subject and by object.
+
+    Bulk loaded from the association/by_pred view, then kept current by the writes of the resource
+    registry itself and by the change listener of the datastore, which also sees writes of other
+    containers (after a short delay). Queries must go to the datastore until the index is warm.
+    Answers have the order of the equivalent CouchDB view query.
+    """
+
+    def __init__(self, datastore):
+        self.datastore      = datastore
+        self.warm           = False
+        self._assocs        = {}        # association id -> AssocEntry
+        self._by_subject    = {}        # subject id -> set of association ids
+        self._by_object     = {}        # object id -> set of association ids
+        self._pending       = None      # changes that came in while loading, or None
+        self._reload        = False
+        self._loader        = None
+        self._stopped       = False     # the change listener stays registered, it then ignores changes
+        self._stats         = {'loads': 0, 'queries': 0, 'changes': 0}
+
+    def start(self):
+        """
+        Follows the changes of the datastore and loads the index in a greenlet.
+        Returns False if the datastore does not report changes, the index then stays cold.
+        """
+        self._stopped = False
+        if not self.datastore.add_change_listener(self._on_change):
+            return False
+        self._spawn_load()
+        return True
+
+    def stop(self):
+        self._stopped = True
+        if self._loader is not None:
+            self._loader.kill()
+        self.warm = False
+        self._pending = None
+
+    def _spawn_load(self):
+        # Changes from now on wait for the load
+        self.warm = False
+        self._pending = []
+        self._loader = spawn(self.load)
+
+    def load(self):
+        """
+        Loads all associations. Changes that come in meanwhile are applied after, in order.
+        """
+        self._reload = True
+        while self._reload:
+            self._reload = False
+            self.warm = False
+            if self._pending is None:
+                self._pending = []
+            self._assocs, self._by_subject, self._by_object = {}, {}, {}
+            try:
+                for assoc_id, key, doc in self.datastore.find_by_view_iter("association", "by_pred", id_only=False,
+                                                                           convert_doc=False, page_size=1000):
+                    self.add(doc)
+            except Exception:
+                log.exception("Error loading the association index, not using it")
+                self._pending = None
+                return
+
+            pending, self._pending = self._pending, None
+            for change in pending:
+                self._apply(change)
+        self.warm = True
+        self._stats['loads'] += 1
+        log.info("Association index loaded: %s associations" % len(self._assocs))
+
+    def _on_change(self, change):
+        if self._stopped:
+            return
+        if change is None:
+            # Changes may have been missed
+            if self._pending is not None:
+                self._reload = True
+            else:
+                self._spawn_load()
+        elif self._pending is not None:
+            self._pending.append(change)
+        else:
+            self._apply(change)
+
+    def _apply(self, change):
+        self._stats['changes'] += 1
+        if change.get('deleted'):
+            self.remove(change['id'])
+        else:
+            doc = change.get('doc')
+            if doc and doc.get('type_') == "Association":
+                self.add(doc)
+
+    def add(self, doc):
+        """
+        Adds (or replaces) an association, given as doc.
+        """
+        entry = AssocEntry(*[_compact(doc.get(field), field in SHARED_FIELDS) for field in DOC_FIELDS])
+        self.remove(entry.id)
+        self._assocs[entry.id] = entry
+        self._by_subject.setdefault(entry.s, set()).add(entry.id)
+        self._by_object.setdefault(entry.o, set()).add(entry.id)
+
+    def remove(self, assoc_id):
+        entry = self._assocs.pop(assoc_id, None)
+        if entry is None:
+            return
+        for index, res_id in ((self._by_subject, entry.s), (self._by_object, entry.o)):
+            assoc_ids = index[res_id]
+            assoc_ids.discard(assoc_id)
+            if not assoc_ids:
+                del index[res_id]
+
+    def remove_related(self, res_id):
+        """
+        Removes all associations of a resource, as subject or object.
+        """
+        for assoc_id in self._by_subject.get(res_id, set()) | self._by_object.get(res_id, set()):
+            self.remove(assoc_id)
+
+    def find_objects(self, subject_id, predicate=None, object_type=None):
+        """
+        Returns the entries of subject_id. As in the CouchDB view, object_type only applies with a predicate.
+        """
+        entries = self._lookup(self._by_subject, subject_id)
+        if predicate:
+            entries = [e for e in entries if e.p == predicate and (not object_type or e.ot == object_type)]
+        return sorted(entries, key=lambda e: (e.p, e.ot, e.o))
+
+    def find_subjects(self, object_id, predicate=None, subject_type=None):
+        entries = self._lookup(self._by_object, object_id)
+        if predicate:
+            entries = [e for e in entries if e.p == predicate and (not subject_type or e.st == subject_type)]
+        return sorted(entries, key=lambda e: (e.p, e.st, e.s))
+
+    def find_associations(self, subject_id, predicate=None, object_id=None, assoc_type=None):
+        """
+        Returns the entries between subject_id and object_id, or without object_id, of subject_id as subject
+        or object (as the CouchDB view).
+        """
+        if object_id:
+            entries = [e for e in self._lookup(self._by_subject, subject_id) if e.o == object_id]
+        else:
+            entries = self._lookup(self._by_subject, subject_id) + self._lookup(self._by_object, subject_id)
+            # an association of a resource with itself is found twice
+            entries = dict((e.id, e) for e in entries).values()
+        entries = [e for e in entries if (not predicate or e.p == predicate) and (not assoc_type or e.at == assoc_type)]
+        return sorted(entries, key=lambda e: (e.p, e.at, e.srv, e.orv))
+
+    def _lookup(self, index, res_id):
+        self._stats['queries'] += 1
+        return [self._assocs[assoc_id] for assoc_id in index.get(res_id, ())]
+
+    def to_doc(self, entry):
+        doc = dict((field, value) for field, value in zip(entry._fields, entry) if value is not None)
+        doc['_id'] = doc.pop('id')
+        doc['_rev'] = doc.pop('rev')
+        doc['type_'] = "Association"
+        return doc
+
+    def get_stats(self):
+        stats = dict(self._stats)
+        stats['warm'] = self.warm
+        stats['associations'] = len(self._assocs)
+        stats['subjects'] = len(self._by_subject)
+        stats['objects'] = len(self._by_object)
+        return stats
+
+
+def _compact(value, shared):
+    """
+    Values as byte strings (CouchDB returns unicode, 4 bytes per char), interned if they repeat across entries.
+    """
+    if isinstance(value, unicode):
+        try:
+            value = value.encode('ascii')
+        except UnicodeError:
+            return value
+    if shared and isinstance(value, str):
+        return intern(value)
+    return value
@@ -193,9 +193,10 @@ class StreamSubscriberRegistrar(object):
             raise PublisherError('Invalid CFG for core_xps.science_data: "%s"; must have "xs.xp" structure' % xs_dot_xp)
 
 
-    def create_subscriber(self, exchange_name=None, callback=None):
+    def create_subscriber(self, exchange_name=None, callback=None, **kwargs):
         """
         This method creates a new subscriber, a new exchange_name if it does not already exist.
+        Other keyword arguments (e.g. concurrency) are passed on to the StreamSubscriber.
         """
 
         if not exchange_name:
@@ -203,6 +204,6 @@ class StreamSubscriberRegistrar(object):
             exchange_name =  '%s_subscriber_%d' % (self.process.id, self._subscriber_cnt)
             self._subscriber_cnt += 1
 
-        return StreamSubscriber(name=(self.XP, exchange_name), process=self.process, callback=callback, node=self.node)
+        return StreamSubscriber(name=(self.XP, exchange_name), process=self.process, callback=callback, node=self.node, **kwargs)
 
 
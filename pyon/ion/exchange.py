@@ -268,6 +268,12 @@ class ExchangeManager(object):
     def stop(self, *args, **kwargs):
         log.debug("ExchangeManager stopping ...")
 
+    def get_declare_stats(self):
+        """
+        Returns the counters of the container-wide declaration cache, see AMQPTransport.get_declare_stats.
+        """
+        return AMQPTransport.get_instance().get_declare_stats()
+
     # transport implementations - XOTransport objects call here
     def declare_exchange(self, exchange, exchange_type='topic', durable=False, auto_delete=True):
         log.info("ExchangeManager.declare_exchange")
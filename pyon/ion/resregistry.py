@@ -12,6 +12,7 @@ from pyon.core import bootstrap
 from pyon.core.exception import BadRequest, NotFound, Inconsistent
 from pyon.core.object import IonObjectBase
 from pyon.datastore.datastore import DataStore
+from pyon.ion.assoc_index import AssociationIndex
 from pyon.ion.resource import LCS, PRED, AT, RT, get_restype_lcsm, is_resource
 from pyon.util.config import CFG
 from pyon.util.containers import get_ion_ts
@@ -32,12 +33,23 @@ class ResourceRegistry(object):
         datastore_manager = datastore_manager or bootstrap.container_instance.datastore_manager
         self.rr_store = datastore_manager.get_datastore("resources", DataStore.DS_PROFILE.RESOURCES)
 
+        # Optional in-memory index answering association queries
+        self._assoc_index = None
+        if CFG.get_safe("container.resource_registry.association_index", False):
+            assoc_index = AssociationIndex(self.rr_store)
+            if assoc_index.start():
+                self._assoc_index = assoc_index
+            else:
+                log.warn("Resource registry datastore does not report changes, not using an association index")
+
         self._init()
 
     def close(self):
         """
         Pass-through method to close the underlying datastore.
         """
+        if self._assoc_index:
+            self._assoc_index.stop()
         self.rr_store.close()
 
     def _init(self):
@@ -73,7 +85,7 @@ class ResourceRegistry(object):
 
         if actor_id and actor_id != 'anonymous':
             log.debug("Associate resource_id=%s with owner=%s" % (res_id, actor_id))
-            self.rr_store.create_association(res_id, PRED.hasOwner, actor_id)
+            self.create_association(res_id, PRED.hasOwner, actor_id)
 
         return res
 
@@ -115,10 +127,15 @@ class ResourceRegistry(object):
         if not res_obj:
             raise NotFound("Resource %s does not exist" % object_id)
 
-        # Delete all owner users.
-        owners,_ = self.rr_store.find_objects(object_id, PRED.hasOwner, RT.UserIdentity, id_only=True)
-        for oid in owners:
-            self.rr_store.delete_association(object_id, PRED.hasOwner, oid)
+        # Delete all owner users, in one request
+        _,owner_assocs = self.rr_store.find_objects(object_id, PRED.hasOwner, RT.UserIdentity, id_only=True)
+        if owner_assocs:
+            # IonObjects from CouchDB, plain docs from the mock datastore
+            owner_assoc_ids = [str(assoc._id if isinstance(assoc, IonObjectBase) else assoc['_id']) for assoc in owner_assocs]
+            self.rr_store.delete_mult(owner_assoc_ids)
+            if self._assoc_index:
+                for assoc_id in owner_assoc_ids:
+                    self._assoc_index.remove(assoc_id)
 
         res = self.rr_store.delete(res_obj)
         return res
@@ -182,7 +199,7 @@ class ResourceRegistry(object):
         att_id,_ = self.create(attachment)
 
         if resource_id:
-            self.rr_store.create_association(resource_id, PRED.hasAttachment, att_id)
+            self.create_association(resource_id, PRED.hasAttachment, att_id)
 
         return att_id
 
@@ -199,7 +216,10 @@ class ResourceRegistry(object):
         return attachment
 
     def delete_attachment(self, attachment_id=''):
-        return self.rr_store.delete(attachment_id, del_associations=True)
+        res = self.rr_store.delete(attachment_id, del_associations=True)
+        if self._assoc_index:
+            self._assoc_index.remove_related(attachment_id)
+        return res
 
     def find_attachments(self, resource_id='', limit=0, descending=False, include_content=False, id_only=True):
         key = [resource_id]
@@ -217,27 +237,84 @@ class ResourceRegistry(object):
             return atts
 
     def create_association(self, subject=None, predicate=None, object=None, assoc_type=None):
-        return self.rr_store.create_association(subject, predicate, object, assoc_type)
+        if not self._assoc_index:
+            return self.rr_store.create_association(subject, predicate, object, assoc_type)
+
+        assoc = self.rr_store.new_association(subject, predicate, object, assoc_type)
+        res = self.rr_store.create(assoc)
+
+        # Seen by our own queries right away, not only once it comes back from the changes feed
+        assoc_doc = dict((field, getattr(assoc, field)) for field in ('at', 's', 'st', 'srv', 'p', 'o', 'ot', 'orv', 'ts'))
+        assoc_doc['_id'], assoc_doc['_rev'] = res
+        self._assoc_index.add(assoc_doc)
+        return res
 
     def delete_association(self, association=''):
-        return self.rr_store.delete_association(association)
+        res = self.rr_store.delete_association(association)
+        if self._assoc_index:
+            self._assoc_index.remove(association if isinstance(association, basestring) else association._id)
+        return res
 
     def find(self, **kwargs):
         raise NotImplementedError("Do not use find. Use a specific find operation instead.")
 
     def find_objects(self, subject="", predicate="", object_type="", id_only=False):
-        return self.rr_store.find_objects(subject, predicate, object_type, id_only=id_only)
+        assoc_index = self._warm_assoc_index()
+        if not assoc_index or not subject or type(id_only) is not bool:
+            return self.rr_store.find_objects(subject, predicate, object_type, id_only=id_only)
+
+        entries = assoc_index.find_objects(self._get_id(subject), predicate, object_type)
+        obj_ids = [entry.o for entry in entries]
+        obj_assocs = self._get_assoc_objects(entries)
+        if id_only:
+            return (obj_ids, obj_assocs)
+        return (self.rr_store.read_mult(obj_ids), obj_assocs)
 
     def find_subjects(self, subject_type="", predicate="", object="", id_only=False):
-        return self.rr_store.find_subjects(subject_type, predicate, object, id_only=id_only)
+        assoc_index = self._warm_assoc_index()
+        if not assoc_index or not object or type(id_only) is not bool:
+            return self.rr_store.find_subjects(subject_type, predicate, object, id_only=id_only)
+
+        entries = assoc_index.find_subjects(self._get_id(object), predicate, subject_type)
+        sub_ids = [entry.s for entry in entries]
+        sub_assocs = self._get_assoc_objects(entries)
+        if id_only:
+            return (sub_ids, sub_assocs)
+        return (self.rr_store.read_mult(sub_ids), sub_assocs)
 
     def find_associations(self, subject="", predicate="", object="", assoc_type=None, id_only=False):
-        return self.rr_store.find_associations(subject, predicate, object, assoc_type, id_only=id_only)
+        assoc_index = self._warm_assoc_index()
+        # Queries by predicate only, and illegal ones, go to the datastore
+        if not assoc_index or not subject or (assoc_type and not predicate) or type(id_only) is not bool:
+            return self.rr_store.find_associations(subject, predicate, object, assoc_type, id_only=id_only)
+
+        entries = assoc_index.find_associations(self._get_id(subject), predicate,
+                                                self._get_id(object) if object else None, assoc_type)
+        if id_only:
+            return [entry.id for entry in entries]
+        return self._get_assoc_objects(entries)
+
+    def _warm_assoc_index(self):
+        if self._assoc_index and self._assoc_index.warm:
+            return self._assoc_index
+        return None
+
+    def _get_id(self, res):
+        return res if isinstance(res, basestring) else res._id
+
+    def _get_assoc_objects(self, entries):
+        return [self.rr_store._persistence_dict_to_ion_object(self._assoc_index.to_doc(entry)) for entry in entries]
+
+    def get_association_index_stats(self):
+        """
+        Returns the size and use of the association index, or None if there is none.
+        """
+        return self._assoc_index.get_stats() if self._assoc_index else None
 
     def get_association(self, subject="", predicate="", object="", assoc_type=None, id_only=False):
         if predicate:
             assoc_type = assoc_type or AT.H2H
-        assoc = self.rr_store.find_associations(subject, predicate, object, assoc_type, id_only=id_only)
+        assoc = self.find_associations(subject, predicate, object, assoc_type, id_only=id_only)
         if not assoc:
             raise NotFound("Association for subject/predicate/object/type %s/%s/%s/%s not found" % (
                 str(subject),str(predicate),str(object),str(assoc_type)))
@@ -248,3 +325,6 @@ class ResourceRegistry(object):
 
     def find_resources(self, restype="", lcstate="", name="", id_only=False):
         return self.rr_store.find_resources(restype, lcstate, name, id_only=id_only)
+
+    def find_related(self, start_ids=None, path=None, max_depth=None, id_only=False):
+        return self.rr_store.find_related(start_ids, path, max_depth, id_only=id_only)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+__license__ = 'Apache 2.0'
+
+from pyon.ion.assoc_index import AssociationIndex
+from pyon.util.unit_test import PyonTestCase
+from mock import Mock
+from nose.plugins.attrib import attr
+import gevent
+
+
+def assoc_doc(assoc_id, s, p, o, st="Resource", ot="Resource", at="H2H"):
+    return {'_id': assoc_id, '_rev': '1-a', 'type_': "Association", 'at': at,
+            's': s, 'st': st, 'srv': '1', 'p': p, 'o': o, 'ot': ot, 'orv': '1', 'ts': '1000'}
+
+
+@attr('UNIT')
+class TestAssociationIndex(PyonTestCase):
+
+    def setUp(self):
+        self.datastore = Mock()
+        self.datastore.add_change_listener.return_value = True
+        self.docs = [assoc_doc(u'a1', u'user', u'hasOwner', u'inst1', ot="Instrument"),
+                     assoc_doc(u'a2', u'plat', u'hasPart', u'inst1', st="Platform", ot="Instrument"),
+                     assoc_doc(u'a3', u'inst1', u'hasPart', u'ds1', st="Instrument", ot="DataSet")]
+        self.datastore.find_by_view_iter.side_effect = lambda *args, **kwargs: ((doc['_id'], None, doc) for doc in self.docs)
+        self.index = AssociationIndex(self.datastore)
+
+    def test_load_and_find(self):
+        self.assertTrue(self.index.start())
+        self.assertFalse(self.index.warm)
+        gevent.sleep(0)
+        self.assertTrue(self.index.warm)
+
+        self.assertEquals([e.o for e in self.index.find_objects('inst1')], ['ds1'])
+        self.assertEquals([e.s for e in self.index.find_subjects('inst1')], ['user', 'plat'])
+        self.assertEquals([e.s for e in self.index.find_subjects('inst1', 'hasPart', 'Platform')], ['plat'])
+        self.assertEquals(self.index.find_subjects('inst1', 'hasPart', 'User'), [])
+        assocs = self.index.find_associations('inst1')
+        self.assertEquals(assocs[0].id, 'a1')
+        self.assertEquals(set([e.id for e in assocs]), set(['a1', 'a2', 'a3']))
+        self.assertEquals([e.id for e in self.index.find_associations('user', None, 'inst1')], ['a1'])
+        self.assertEquals(self.index.find_associations('user', None, 'ds1'), [])
+
+        doc = self.index.to_doc(self.index.find_objects('user')[0])
+        self.assertEquals(doc, self.docs[0])
+        self.assertEquals(self.index.get_stats()['associations'], 3)
+
+    def test_changes(self):
+        self.index.start()
+        on_change = self.datastore.add_change_listener.call_args[0][0]
+
+        # changes during the load are applied after it
+        on_change({'id': 'a1', 'deleted': True})
+        gevent.sleep(0)
+        self.assertTrue(self.index.warm)
+        self.assertEquals(self.index.find_subjects('inst1', 'hasOwner'), [])
+
+        on_change({'id': 'a4', 'doc': assoc_doc('a4', 'user', 'hasOwner', 'ds1')})
+        on_change({'id': 'res1', 'doc': {'_id': 'res1', 'type_': "Instrument"}})
+        self.assertEquals([e.o for e in self.index.find_objects('user')], ['ds1'])
+        self.assertEquals(self.index.get_stats()['associations'], 3)
+
+        self.index.remove_related('inst1')
+        self.assertEquals(self.index.find_objects('plat'), [])
+        self.assertEquals([e.id for e in self.index.find_subjects('ds1')], ['a4'])
+
+        # missed changes: loaded again
+        on_change(None)
+        self.assertFalse(self.index.warm)
+        gevent.sleep(0)
+        self.assertTrue(self.index.warm)
+        self.assertEquals(self.index.get_stats()['associations'], 3)
+        self.assertEquals(self.index.get_stats()['loads'], 2)
+
+    def test_stop(self):
+        self.index.start()
+        on_change = self.datastore.add_change_listener.call_args[0][0]
+        gevent.sleep(0)
+        self.assertTrue(self.index.warm)
+
+        # a stopped index ignores the changes, missed changes do not load it again
+        self.index.stop()
+        self.assertFalse(self.index.warm)
+        on_change(None)
+        on_change({'id': 'a4', 'doc': assoc_doc('a4', 'user', 'hasOwner', 'ds1')})
+        gevent.sleep(0)
+        self.assertFalse(self.index.warm)
+        self.assertEquals(self.datastore.find_by_view_iter.call_count, 1)
+        self.assertEquals(self.index.get_stats()['changes'], 0)
+
+    def test_no_changes(self):
+        self.datastore.add_change_listener.return_value = False
+        self.assertFalse(self.index.start())
+        self.assertFalse(self.datastore.find_by_view_iter.called)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+__license__ = 'Apache 2.0'
+
+from pyon.core.bootstrap import IonObject
+from pyon.core.exception import NotFound
+from pyon.datastore.mockdb.mockdb_datastore import MockDB_DataStore
+from pyon.ion.resregistry import ResourceRegistry
+from pyon.ion.resource import RT, PRED
+from pyon.util.int_test import IonIntegrationTestCase
+from nose.plugins.attrib import attr
+from mock import Mock, patch
+
+
+@attr('UNIT', group='datastore')
+class TestResourceRegistry(IonIntegrationTestCase):
+
+    def setUp(self):
+        self.rr_store = MockDB_DataStore(datastore_name='ion_test_rr')
+        self.rr_store.create_datastore()
+        datastore_manager = Mock()
+        datastore_manager.get_datastore.return_value = self.rr_store
+        self.rr = ResourceRegistry(datastore_manager)
+
+    def test_delete_owned(self):
+        user_id, _ = self.rr.create(IonObject(RT.UserIdentity, name='user1'))
+        inst_id, _ = self.rr.create(IonObject(RT.InstrumentDevice, name='inst1'), actor_id=user_id)
+        self.assertEquals(self.rr.find_objects(inst_id, PRED.hasOwner, RT.UserIdentity, id_only=True)[0], [user_id])
+
+        self.rr.delete(inst_id)
+        self.assertRaises(NotFound, self.rr.read, inst_id)
+        self.assertEquals(self.rr.find_subjects(RT.InstrumentDevice, PRED.hasOwner, user_id, id_only=True)[0], [])
+        self.rr.read(user_id)
+
+    @patch('pyon.ion.resregistry.CFG')
+    def test_create_association_indexed(self, cfg_mock):
+        cfg_mock.get_safe.side_effect = lambda key, default=None: key == "container.resource_registry.association_index" or default
+        rr_store = Mock()
+        rr_store.add_change_listener.return_value = True
+        rr_store.find_resources.return_value = ([], [])
+        rr_store.new_association.return_value = Mock(at='H2H', s='inst1', st=RT.InstrumentDevice, srv='1', p=PRED.hasOwner,
+                                                     o='user1', ot=RT.UserIdentity, orv='1', ts='1000')
+        rr_store.create.return_value = ('assoc1', '1-a')
+        datastore_manager = Mock()
+        datastore_manager.get_datastore.return_value = rr_store
+        rr = ResourceRegistry(datastore_manager)
+
+        self.assertEquals(rr.create_association('inst1', PRED.hasOwner, 'user1'), ('assoc1', '1-a'))
+        rr_store.new_association.assert_called_once_with('inst1', PRED.hasOwner, 'user1', None)
+        # the index entry is built without reading the association back
+        self.assertFalse(rr_store.read_doc.called)
+        entries = rr._assoc_index.find_objects('inst1', PRED.hasOwner, RT.UserIdentity)
+        self.assertEquals([(e.id, e.rev, e.o) for e in entries], [('assoc1', '1-a', 'user1')])
+        rr.close()
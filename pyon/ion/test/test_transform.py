@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+__license__ = 'Apache 2.0'
+
+from pyon.ion.transform import TransformFunction, TransformDataProcess
+from pyon.core.process import ProcessWorkerPoolError
+from pyon.util.containers import DotDict
+from pyon.util.unit_test import PyonTestCase
+from mock import Mock, patch, sentinel
+from nose.plugins.attrib import attr
+import gevent
+
+
+@attr('UNIT')
+class TestTransformDataProcess(PyonTestCase):
+
+    def setUp(self):
+        self.tdp = TransformDataProcess()
+        self.tdp.streams = {'out1': 'stream1', 'out2': 'stream2'}
+        self.tdp.out1 = Mock()
+        self.tdp.out1._send_name = sentinel.name1
+        self.tdp.out2 = Mock()
+        self.tdp.out2._send_name = sentinel.name2
+
+    def test_publish_fanout(self):
+        self.tdp.publish(sentinel.msg)
+        self.tdp.publish_many([sentinel.msg, sentinel.msg2])
+
+        self.assertTrue(self.tdp._pub_init)
+        pub = self.tdp.publishers[0]
+        self.assertEquals(pub.publish_fanout.call_count, 2)
+        self.assertEquals(pub.publish_fanout.call_args_list[0][0][0], [sentinel.msg])
+        self.assertEquals(pub.publish_fanout.call_args_list[1][0][0], [sentinel.msg, sentinel.msg2])
+        self.assertEquals(set(pub.publish_fanout.call_args[0][1]), set([sentinel.name1, sentinel.name2]))
+
+        # no publisher publishes on its own
+        self.assertFalse(self.tdp.out1.publish.called)
+        self.assertFalse(self.tdp.out2.publish.called)
+
+    def test_publish_no_streams(self):
+        self.tdp.streams = {}
+        self.tdp.publish(sentinel.msg)
+
+        self.assertEquals(self.tdp.publishers, [])
+
+
+@attr('UNIT')
+class TestTransformFunction(PyonTestCase):
+
+    def _make_transform(self, workers):
+        tf = TransformFunction()
+        tf.CFG = DotDict({'process': {'transform_workers': workers}})
+        tf.streams = {'output': 'stream_id'}
+        tf.publish = Mock()
+        return tf
+
+    def test_process_inline(self):
+        tf = self._make_transform(0)
+        tf.execute = Mock(return_value='result')
+        tf._on_init()
+
+        tf.process('packet')
+
+        self.assertIsNone(tf._worker_pool)
+        tf.execute.assert_called_once_with('packet')
+        tf.publish.assert_called_once_with('result')
+
+    def test_process_multiple_outputs(self):
+        tf = self._make_transform(0)
+        tf.multiple_outputs = True
+        tf.publish_many = Mock()
+        tf.execute = Mock(return_value=['one', 'two'])
+        tf._on_init()
+
+        tf.process('packet')
+
+        tf.publish_many.assert_called_once_with(['one', 'two'])
+        self.assertFalse(tf.publish.called)
+
+    @patch('pyon.ion.transform.ProcessWorkerPool')
+    def test_process_pool_publish_order(self, mockpool):
+        # later packets finish first
+        def apply(packet):
+            gevent.sleep(0.01 * (3 - packet))
+            if packet == 1:
+                raise ProcessWorkerPoolError("failed")
+            return packet * 10
+        mockpool.return_value.apply.side_effect = apply
+
+        tf = self._make_transform(3)
+        tf._on_init()
+        mockpool.assert_called_once_with(tf.execute, size=3, shm_size=4*1024*1024)
+
+        gls = [gevent.spawn(tf.process, packet) for packet in xrange(4)]
+        gevent.joinall(gls)
+
+        # published in arrival order, the failed packet does not hold up the rest
+        self.assertEquals([c[0][0] for c in tf.publish.call_args_list], [0, 20, 30])
+        self.assertIsInstance(gls[1].exception, ProcessWorkerPoolError)
+        self.assertEquals(tf._publish_turn, 4)
+
+        tf._on_quit()
+        mockpool.return_value.shutdown.assert_called_once_with()
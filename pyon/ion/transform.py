@@ -7,6 +7,8 @@
 '''
 
 from pyon.ion.streamproc import StreamProcess
+from pyon.core.process import ProcessWorkerPool
+from gevent.event import Event
 
 class TransformBase(StreamProcess):
     """
@@ -52,6 +54,7 @@ class TransformDataProcess(TransformBase):
 
     def on_start(self):
         super(TransformDataProcess,self).on_start()
+        self._init_publishers()
 
     def process(self, packet):
         pass
@@ -60,22 +63,33 @@ class TransformDataProcess(TransformBase):
         pass
 
     def publish(self,msg):
-        self._publish_all(msg)
+        self._publish_all([msg])
 
+    def publish_many(self, msgs):
+        """
+        Publishes several messages on all output streams as one batch.
+        """
+        self._publish_all(msgs)
 
-    def _publish_all(self, msg):
-        '''Publishes a message on all output streams (publishers)
+    def _init_publishers(self):
+        '''Collects the publishers of the output streams, set as attributes by the container
+        '''
+        self.publishers = [getattr(self, stream) for stream in self.streams]
+        self._pub_init = True
+
+    def _publish_all(self, msgs):
+        '''Publishes messages on all output streams (publishers)
+
+        The messages are encoded once and the same bytes go to every stream, on the first publisher's channel.
         '''
         # Ensure the publisher list is only initialized once
         if not self._pub_init:
-            stream_names = list(k for k,v in self.streams.iteritems())
-            self.publishers = []
-            for stream in stream_names:
-                self.publishers.append(getattr(self,stream))
+            self._init_publishers()
 
+        if not self.publishers:
+            return
 
-        for publisher in self.publishers:
-            publisher.publish(msg)
+        self.publishers[0].publish_fanout(msgs, [publisher._send_name for publisher in self.publishers])
 
 
 
@@ -88,13 +102,84 @@ class TransformFunction(TransformDataProcess):
 
     A TransformFunction is interchangeable with a TransformProcess but it is also able to be called explicitly to run
 
+    With 'transform_workers': N in the process config, execute runs in a pool of N OS processes instead of
+    the container's greenlet (see ProcessWorkerPool), for CPU bound transforms. The stream process then
+    handles up to N packets at a time, results are still published in the order the packets arrived.
+    execute and its input and output must not rely on container state: they run in a forked copy.
+    'transform_shm_size' sets the shared memory per worker in bytes, it should hold a pickled packet.
+
+    Set multiple_outputs in a derived class whose execute returns a list of granules: they are published
+    as one batch.
     """
+    _worker_pool = None
+    multiple_outputs = False
+
+    def _on_init(self):
+        super(TransformFunction, self)._on_init()
+
+        workers = self.CFG.get('process',{}).get('transform_workers', 0)
+        if workers:
+            shm_size = self.CFG.get('process',{}).get('transform_shm_size', 4*1024*1024)
+            self._worker_pool = ProcessWorkerPool(self.execute, size=workers, shm_size=shm_size)
+
+            # packets are numbered as they come in, results wait for their turn to be published
+            self._next_ticket = 0
+            self._publish_turn = 0
+            self._turns_done = set()
+            self._turn_events = {}
+
+    def _on_quit(self):
+        if self._worker_pool is not None:
+            self._worker_pool.shutdown()
+            self._worker_pool = None
+
+        super(TransformFunction, self)._on_quit()
+
     def execute(self, input):
         pass
 
     def process(self, packet):
-        ret = self.execute(packet)
-        if len(self.streams)>0:
+        if self._worker_pool is None:
+            ret = self.execute(packet)
+            if len(self.streams)>0:
+                self._publish_result(ret)
+            return
+
+        ticket = self._next_ticket
+        self._next_ticket += 1
+
+        try:
+            ret = self._worker_pool.apply(packet)
+
+            self._wait_turn(ticket)
+            if len(self.streams)>0:
+                self._publish_result(ret)
+        finally:
+            self._end_turn(ticket)
+
+    def _publish_result(self, ret):
+        if self.multiple_outputs:
+            if ret:
+                self.publish_many(ret)
+        else:
             self.publish(ret)
 
+    def _wait_turn(self, ticket):
+        if ticket != self._publish_turn:
+            ev = self._turn_events[ticket] = Event()
+            ev.wait()
+
+    def _end_turn(self, ticket):
+        """
+        Marks the packet done (published or failed), and wakes the next one in line if its result is waiting.
+        """
+        self._turns_done.add(ticket)
+        while self._publish_turn in self._turns_done:
+            self._turns_done.remove(self._publish_turn)
+            self._publish_turn += 1
+
+        ev = self._turn_events.pop(self._publish_turn, None)
+        if ev is not None:
+            ev.set()
+
 
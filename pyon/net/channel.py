@@ -42,8 +42,10 @@ from pyon.util.log import log
 from pika import BasicProperties
 from gevent import queue as gqueue
 from contextlib import contextmanager
-from gevent.event import AsyncResult
+from gevent.event import AsyncResult, Event
 from pyon.net.transport import AMQPTransport, NameTrio
+from collections import deque
+import time
 
 class ChannelError(StandardError):
     """
@@ -66,6 +68,7 @@ class BaseChannel(object):
     _close_callback             = None      # close callback to use when closing, not always set (used for pooling)
     _closed_error_callback      = None      # callback which triggers when the underlying transport closes with error
     _exchange                   = None      # exchange (too AMQP specific)
+    _pipeline                   = None      # transport pipeline the declares go through during setup_listener
 
     # exchange related settings @TODO: these should likely come from config instead
     _exchange_type              = 'topic'
@@ -105,6 +108,12 @@ class BaseChannel(object):
         if not self._amq_chan:
             raise ChannelError("No amq_chan attached")
 
+    def _declarer(self):
+        """
+        Returns what to make declare/bind calls on: the transport, or its pipeline during setup_listener.
+        """
+        return self._pipeline or self._transport
+
     def _declare_exchange(self, exchange):
         """
         Performs an AMQP exchange declare.
@@ -122,11 +131,11 @@ class BaseChannel(object):
         log.debug("Exchange declare: %s, TYPE %s, DUR %s AD %s", self._exchange, self._exchange_type,
                                                                  self._exchange_durable, self._exchange_auto_delete)
 
-        self._transport.declare_exchange_impl(self._amq_chan,
-                                              self._exchange,
-                                              exchange_type=self._exchange_type,
-                                              durable=self._exchange_durable,
-                                              auto_delete=self._exchange_auto_delete)
+        self._declarer().declare_exchange_impl(self._amq_chan,
+                                               self._exchange,
+                                               exchange_type=self._exchange_type,
+                                               durable=self._exchange_durable,
+                                               auto_delete=self._exchange_auto_delete)
 
     def attach_underlying_channel(self, amq_chan):
         """
@@ -134,6 +143,30 @@ class BaseChannel(object):
         """
         self._amq_chan = amq_chan
 
+    def detach_underlying_channel(self):
+        """
+        Detaches the AMQP channel without closing it, so the Node can hand it to another Channel.
+
+        @returns The detached AMQP channel, or None.
+        """
+        amq_chan = self._amq_chan
+        self._amq_chan = None
+        return amq_chan
+
+    def can_reuse_underlying_channel(self):
+        """
+        Returns True if the AMQP channel carries no state of this Channel that would leak into
+        another Channel once detached (see detach_underlying_channel).
+        """
+        return self._amq_chan is not None
+
+    def get_underlying_qos(self):
+        """
+        Returns the (prefetch_size, prefetch_count) set on the AMQP channel, (0, 0) for none. It stays
+        with the AMQP channel when detached, so the Node only reuses it for Channels wanting the same.
+        """
+        return (0, 0)
+
     def get_channel_id(self):
         """
         Gets the underlying AMQP channel's channel identifier (number).
@@ -224,6 +257,10 @@ class BaseChannel(object):
             logmeth = log.error
         logmeth("BaseChannel.on_channel_close\n\tchannel number: %d\n\tcode: %d\n\ttext: %s", self._amq_chan.channel_number, code, text)
 
+        # the error may have been about something declared, don't trust cached declarations
+        if not (code == 0 or code == 200):
+            self._transport.clear_declare_cache()
+
         # make callback if it exists!
         if not (code == 0 or code == 200) and self._closed_error_callback:
             # run in try block because this can shutter the entire connection
@@ -306,6 +343,12 @@ class RecvChannel(BaseChannel):
     _consumer_tag   = None
     _recv_name      = None      # name this receiving channel is receiving on - tuple (exchange, queue)
     _recv_binding   = None      # binding this queue is listening on (set via _bind)
+    _qos_set        = False     # set_qos was called (or the pooled AMQP channel had it), the prefetch limit stays with the AMQP channel
+    _unacked        = 0         # delivered but not yet acked/rejected messages
+
+    # broker prefetch, applied by start_consume if set_qos was not called. 0 means no limit
+    _prefetch_count = 0
+    _prefetch_size  = 0
 
     # queue defaults
     _queue_auto_delete  = False
@@ -316,14 +359,28 @@ class RecvChannel(BaseChannel):
     _consumer_exclusive = False
     _consumer_no_ack    = False     # endpoint layers do the acking as they call recv()
 
-    def __init__(self, name=None, binding=None, **kwargs):
+    def __init__(self, name=None, binding=None, prefetch_count=None, prefetch_size=None, **kwargs):
         """
         Initializer for a recv channel.
 
         You may set the receiving name and binding here if you wish, otherwise they will
         be set when you call setup_listener.
+
+        @param  prefetch_count  Max unacked messages the broker delivers to this channel, see set_qos. If None,
+                                uses the channel type's default (no limit).
+        @param  prefetch_size   Max unacked bytes, likewise. RabbitMQ does not implement it, leave at 0.
         """
         self._recv_queue = gqueue.Queue()
+        self._enqueue_times = deque()       # delivery times of the messages in _recv_queue, oldest first
+        self._recv_stats = {'delivered'         : 0,
+                            'max_depth'         : 0,
+                            'time_in_queue'     : 0.0,      # total sec received messages spent in _recv_queue
+                            'max_time_in_queue' : 0.0}
+
+        if prefetch_count is not None:
+            self._prefetch_count = prefetch_count
+        if prefetch_size is not None:
+            self._prefetch_size = prefetch_size
 
         # set recv name and binding if given
         assert name is None or isinstance(name, tuple)
@@ -343,6 +400,9 @@ class RecvChannel(BaseChannel):
         - _declare_queue
         - _bind
 
+        When the transport supports it, these go through a transport pipeline: they are sent without waiting
+        for each reply, and the replies are waited for once at the end (see AMQPPipeline).
+
         Name must be a NameTrio. If queue is None, the broker will generate a name e.g. "amq-RANDOMSTUFF".
         Binding may be left none and will use the queue name by default.
 
@@ -369,11 +429,20 @@ class RecvChannel(BaseChannel):
             else:
                 self._recv_name = NameTrio(exchange, queue, binding)
 
-        self._declare_exchange(exchange)
-        queue   = self._declare_queue(queue)
-        binding = binding or self._recv_binding or self._recv_name.binding or queue      # last option should only happen in the case of anon-queue
+        self._pipeline = self._transport.pipeline(self._amq_chan) if self._amq_chan else None
+        try:
+            self._declare_exchange(exchange)
+            queue   = self._declare_queue(queue)
+            binding = binding or self._recv_binding or self._recv_name.binding or queue      # last option should only happen in the case of anon-queue
+
+            self._bind(binding)
 
-        self._bind(binding)
+            if self._pipeline:
+                self._pipeline.wait()
+        finally:
+            if self._pipeline:
+                self._pipeline.close()
+                self._pipeline = None
 
         self._setup_listener_called = True
 
@@ -415,6 +484,24 @@ class RecvChannel(BaseChannel):
         self._transport.delete_queue_impl(self._amq_chan,
                                           queue=self._recv_name.queue)
 
+    def set_qos(self, prefetch_size=0, prefetch_count=0):
+        """
+        Limits how many messages (or bytes) the broker delivers to this channel ahead of their acks.
+
+        0 means no limit. Should be called before start_consume.
+
+        This is what bounds _recv_queue: the endpoint layer acks a message once it has handled it, so with
+        a prefetch count of N at most N messages wait here, and a slow consumer leaves the backlog on the
+        broker. (Blocking on a full local queue instead would stall pika's ioloop and every channel on the
+        connection.)
+        """
+        log.debug("RecvChannel.set_qos: size %s, count %s", prefetch_size, prefetch_count)
+        self._ensure_amq_chan()
+        self._sync_call(self._amq_chan.basic_qos, 'callback', prefetch_size=prefetch_size, prefetch_count=prefetch_count)
+        self._prefetch_size = prefetch_size
+        self._prefetch_count = prefetch_count
+        self._qos_set = True
+
     def start_consume(self):
         """
         Starts consuming messages.
@@ -430,6 +517,9 @@ class RecvChannel(BaseChannel):
 
         self._ensure_amq_chan()
 
+        if (self._prefetch_count or self._prefetch_size) and not self._qos_set:
+            self.set_qos(prefetch_size=self._prefetch_size, prefetch_count=self._prefetch_count)
+
         self._consumer_tag = self._amq_chan.basic_consume(self._on_deliver,
                                                           queue=self._recv_name.queue,
                                                           no_ack=self._consumer_no_ack,
@@ -454,6 +544,9 @@ class RecvChannel(BaseChannel):
         self._sync_call(self._amq_chan.basic_cancel, 'callback', self._consumer_tag)
         self._consuming = False
 
+        if self._queue_auto_delete:
+            self._transport.invalidate_queue(self._recv_name.queue)
+
     def recv(self):
         """
         Pulls a message off the queue, will block if there are none.
@@ -465,8 +558,25 @@ class RecvChannel(BaseChannel):
         if isinstance(msg, ChannelShutdownMessage):
             raise ChannelClosedError('Attempt to recv on a channel that is being closed.')
 
+        if self._enqueue_times:
+            time_in_queue = time.time() - self._enqueue_times.popleft()
+            self._recv_stats['time_in_queue'] += time_in_queue
+            self._recv_stats['max_time_in_queue'] = max(self._recv_stats['max_time_in_queue'], time_in_queue)
+
         return msg
 
+    def get_recv_stats(self):
+        """
+        Returns a copy of the counters of messages delivered to this channel: total delivered, current and
+        max number waiting in the recv queue (depth), total and max time spent there before recv (in seconds),
+        and the prefetch limits.
+        """
+        stats = self._recv_stats.copy()
+        stats['depth'] = self._recv_queue.qsize()
+        stats['prefetch_count'] = self._prefetch_count
+        stats['prefetch_size'] = self._prefetch_size
+        return stats
+
     def close_impl(self):
         """
         Close implementation override.
@@ -484,6 +594,36 @@ class RecvChannel(BaseChannel):
 
         BaseChannel.close_impl(self)
 
+    def can_reuse_underlying_channel(self):
+        """
+        Override of BaseChannel. Unacked deliveries would only be requeued when the AMQP channel
+        closes, so such AMQP channels are not reused. (A prefetch limit stays too, see get_underlying_qos.)
+        """
+        if self._unacked and not self._consumer_no_ack:
+            return False
+
+        return BaseChannel.can_reuse_underlying_channel(self)
+
+    def get_underlying_qos(self):
+        """
+        Override of BaseChannel.
+        """
+        if self._qos_set:
+            return (self._prefetch_size, self._prefetch_count)
+
+        return (0, 0)
+
+    def detach_underlying_channel(self):
+        """
+        Override of BaseChannel. Stops consuming and notifies anything blocking on recv, as close_impl does.
+        """
+        if self._consuming:
+            self.stop_consume()
+
+        self._recv_queue.put(ChannelShutdownMessage())
+
+        return BaseChannel.detach_underlying_channel(self)
+
     def _declare_queue(self, queue):
 
         # prepend xp name in the queue for anti-clobbering
@@ -494,10 +634,10 @@ class RecvChannel(BaseChannel):
         self._ensure_amq_chan()
 
         log.debug("RecvChannel._declare_queue: %s", queue)
-        queue_name = self._transport.declare_queue_impl(self._amq_chan,
-                                                        queue=queue or '',
-                                                        auto_delete=self._queue_auto_delete,
-                                                        durable=self._queue_durable)
+        queue_name = self._declarer().declare_queue_impl(self._amq_chan,
+                                                         queue=queue or '',
+                                                         auto_delete=self._queue_auto_delete,
+                                                         durable=self._queue_durable)
 
         # save the new recv_name if our queue name differs (anon queue via '', or exchange prefixing)
         if queue_name != self._recv_name.queue:
@@ -511,10 +651,10 @@ class RecvChannel(BaseChannel):
 
         self._ensure_amq_chan()
 
-        self._transport.bind_impl(self._amq_chan,
-                                  exchange=self._recv_name.exchange,
-                                  queue=self._recv_name.queue,
-                                  binding=binding)
+        self._declarer().bind_impl(self._amq_chan,
+                                   exchange=self._recv_name.exchange,
+                                   queue=self._recv_name.queue,
+                                   binding=binding)
 
         self._recv_binding = binding
 
@@ -528,8 +668,13 @@ class RecvChannel(BaseChannel):
         routing_key = method_frame.routing_key
 
         # put body, headers, delivery tag (for acking) in the recv queue
+        self._unacked += 1
+        self._enqueue_times.append(time.time())
         self._recv_queue.put((body, header_frame.headers, delivery_tag))
 
+        self._recv_stats['delivered'] += 1
+        self._recv_stats['max_depth'] = max(self._recv_stats['max_depth'], self._recv_queue.qsize())
+
     def ack(self, delivery_tag):
         """
         Acks a message using the delivery tag.
@@ -538,6 +683,7 @@ class RecvChannel(BaseChannel):
         log.debug("RecvChannel.ack: %s", delivery_tag)
         self._ensure_amq_chan()
         self._amq_chan.basic_ack(delivery_tag)
+        self._settled()
 
     def reject(self, delivery_tag, requeue=False):
         """
@@ -547,19 +693,112 @@ class RecvChannel(BaseChannel):
         log.debug("RecvChannel.reject: %s", delivery_tag)
         self._ensure_amq_chan()
         self._sync_call(self._amq_chan.basic_reject, 'callback', delivery_tag, requeue=requeue)
+        self._settled()
+
+    def _settled(self):
+        """
+        Called after a delivery has been acked or rejected.
+        """
+        self._unacked -= 1
 
 class PublisherChannel(SendChannel):
     def __init__(self, close_callback=None):
         self._declared = False
+
+        # publisher confirms state, see enable_confirms
+        self._confirms          = False
+        self._publish_seq       = 0         # delivery tag the broker will give our last publish
+        self._unconfirmed       = set()
+        self._nacked            = 0
+        self._confirmed_event   = Event()
+
         SendChannel.__init__(self, close_callback=close_callback)
 
-    def send(self, data, headers=None):
+    def _ensure_declared(self):
         if not self._declared:
             assert self._send_name and self._send_name.exchange
             self._declare_exchange(self._send_name.exchange)
             self._declared = True
+
+    def send(self, data, headers=None):
+        self._ensure_declared()
         SendChannel.send(self, data, headers=headers)
 
+    def send_many(self, msgs, name=None):
+        """
+        Sends several messages back-to-back, declaring the exchange at most once.
+
+        @param  msgs    An iterable of (data, headers) tuples.
+        @param  name    Optional NameTrio to send to instead of the connected name. Must be on the same
+                        exchange as the connected name.
+        """
+        self._ensure_declared()
+        name = name or self._send_name
+        for data, headers in msgs:
+            self._send(name, data, headers=headers)
+
+    def can_reuse_underlying_channel(self):
+        """
+        Override of BaseChannel. Confirm mode can't be turned off on an AMQP channel.
+        """
+        return not self._confirms and SendChannel.can_reuse_underlying_channel(self)
+
+    def _send(self, name, data, headers=None):
+        SendChannel._send(self, name, data, headers=headers)
+
+        if self._confirms:
+            self._publish_seq += 1
+            self._unconfirmed.add(self._publish_seq)
+            self._confirmed_event.clear()
+
+    def enable_confirms(self):
+        """
+        Puts the underlying channel in publisher confirm mode.
+
+        The broker acknowledges each publish after this call. Use wait_for_confirms to block until
+        everything sent so far has been acknowledged, e.g. once per batch instead of once per message.
+        """
+        if self._confirms:
+            return
+
+        self._ensure_amq_chan()
+        self._amq_chan.confirm_delivery(callback=self._on_confirm)
+        self._confirms = True
+
+    def _on_confirm(self, frame):
+        """
+        Callback for Basic.Ack/Basic.Nack frames from the broker while in confirm mode.
+        """
+        method = frame.method
+        tag = method.delivery_tag
+
+        if method.NAME == 'Basic.Nack':
+            log.warn("PublisherChannel: broker nacked delivery tag %s (multiple: %s)", tag, method.multiple)
+            self._nacked += 1
+
+        if method.multiple:
+            self._unconfirmed = set(t for t in self._unconfirmed if t > tag)
+        else:
+            self._unconfirmed.discard(tag)
+
+        if not self._unconfirmed:
+            self._confirmed_event.set()
+
+    def wait_for_confirms(self, timeout=10):
+        """
+        Blocks until the broker has confirmed everything published on this channel so far.
+
+        @raises ChannelError    If not all publishes were confirmed in time, or the broker nacked any.
+        """
+        assert self._confirms, "enable_confirms must be called first"
+
+        if self._unconfirmed and not self._confirmed_event.wait(timeout=timeout):
+            raise ChannelError("Timed out waiting for confirmation of %d published messages" % len(self._unconfirmed))
+
+        if self._nacked:
+            nacked, self._nacked = self._nacked, 0
+            raise ChannelError("Broker nacked %d published messages" % nacked)
+
 class BidirClientChannel(SendChannel, RecvChannel):
     """
     This should be pooled for the receiving side?
@@ -584,6 +823,59 @@ class BidirClientChannel(SendChannel, RecvChannel):
 
         SendChannel._send(self, name, data, headers=headers)
 
+class SharedReplyChannel(RecvChannel):
+    """
+    Listening side of a container-wide reply queue, shared by many outstanding requests.
+
+    This channel is set up once with an anonymous queue and stays consuming for the life of the
+    container. Requests are sent on lightweight RequestChannels created via create_request_channel,
+    which share the underlying transport channel and set reply-to to this queue. Replies are
+    matched to requests above the channel layer (see pyon.net.endpoint.ReplyDispatcher).
+    """
+    _queue_auto_delete  = True
+    _consumer_exclusive = True
+
+    class RequestChannel(SendChannel):
+        """
+        The type of channel returned by create_request_channel.
+        """
+        def __init__(self, reply_name=None, **kwargs):
+            self._reply_name = reply_name
+            SendChannel.__init__(self, **kwargs)
+
+        def _send(self, name, data, headers=None):
+            """
+            Override of internal send method.
+            Sets reply-to ION level header to the shared reply queue.
+            """
+            if headers:
+                headers = headers.copy()
+            else:
+                headers = {}
+
+            if not 'reply-to' in headers:
+                headers['reply-to'] = "%s,%s" % (self._reply_name.exchange, self._reply_name.queue)
+
+            SendChannel._send(self, name, data, headers=headers)
+
+        def close_impl(self):
+            """
+            Do not close underlying amqp channel
+            """
+            pass
+
+    def create_request_channel(self):
+        """
+        @returns A new send channel that shares this channel's underlying transport channel and
+                 directs replies to this channel's queue. setup_listener must have been called first.
+        """
+        self._ensure_amq_chan()
+        assert self._recv_name and self._recv_name.queue
+
+        ch = self.RequestChannel(reply_name=self._recv_name)
+        ch.attach_underlying_channel(self._amq_chan)
+        return ch
+
 class ListenChannel(RecvChannel):
     """
     Used for listening patterns (RR server, Subscriber).
@@ -595,12 +887,18 @@ class ListenChannel(RecvChannel):
         """
         The type of channel returned by accept.
         """
+        _listen_chan = None     # the ListenChannel that accepted this, received the delivery
+
         def close_impl(self):
             """
             Do not close underlying amqp channel
             """
             pass
 
+        def _settled(self):
+            if self._listen_chan is not None:
+                self._listen_chan._settled()
+
     def _create_accepted_channel(self, amq_chan, msg):
         ch = self.AcceptedListenChannel()
         ch.attach_underlying_channel(amq_chan)
@@ -620,6 +918,7 @@ class ListenChannel(RecvChannel):
         self._ensure_amq_chan()
         m = self.recv()
         ch = self._create_accepted_channel(self._amq_chan, m)
+        ch._listen_chan = self
         ch._recv_queue.put(m)       # prime our recieved message here, should be acked by EP layer
 
         return ch
@@ -6,18 +6,23 @@ from pyon.core import bootstrap, exception
 from pyon.core.bootstrap import CFG, IonObject
 from pyon.core.exception import exception_map, IonException, BadRequest, ServerError
 from pyon.core.object import IonObjectBase
-from pyon.net.channel import ChannelError, ChannelClosedError, BaseChannel, PublisherChannel, ListenChannel, SubscriberChannel, ServerChannel, BidirClientChannel, ChannelShutdownMessage
-from pyon.core.interceptor.interceptor import Invocation, process_interceptors
+from pyon.net.channel import ChannelError, ChannelClosedError, BaseChannel, PublisherChannel, ListenChannel, SubscriberChannel, ServerChannel, BidirClientChannel, ChannelShutdownMessage, SharedReplyChannel
+from pyon.core.interceptor.interceptor import Invocation, build_pipeline, process_pipeline
+from pyon.core.interceptor.encode import ENCODING_MSGPACK
+from pyon.core.interceptor.codec import LazyPayload
 from pyon.util.async import spawn, switch
 from pyon.util.log import log
 from pyon.net.transport import NameTrio, BaseTransport
 
-from gevent import event, coros
+from gevent import event, coros, getcurrent, spawn_later
+from gevent.pool import Pool
 from gevent.timeout import Timeout
 from zope import interface
 import uuid
+import time
 
 import traceback
+import logging
 import sys
 
 
@@ -54,6 +59,34 @@ def instantiate_interceptors(interceptor_cfg):
 
             interceptors[type_and_direction].append(classinst)
 
+    # stacks changed, pipelines are rebuilt on next use
+    _pipelines.clear()
+
+_no_interceptors = ()
+_pipelines = {}     # (stack names, path, ids of stacks) -> (stacks, pipeline)
+
+def get_interceptor_pipeline(stack_names, path):
+    """
+    Returns the prebuilt pipeline (see build_pipeline) running the named interceptor stacks in order,
+    for one path (Invocation.PATH_IN/PATH_OUT).
+
+    Pipelines are built on first use and cached. The cache key includes the identity of the stack
+    lists, so replacing a stack in interceptors (e.g. in tests) yields a fresh pipeline.
+    """
+    stacks = tuple(interceptors.get(name, _no_interceptors) for name in stack_names)
+    key = (stack_names, path, tuple(id(stack) for stack in stacks))
+
+    cached = _pipelines.get(key, None)
+    if cached is None:
+        pipeline = ()
+        for stack in stacks:
+            pipeline += build_pipeline(stack, path)
+
+        # keep the stacks referenced so their ids cannot be reused
+        cached = _pipelines[key] = (stacks, pipeline)
+
+    return cached[1]
+
 class EndpointError(StandardError):
     pass
 
@@ -75,10 +108,15 @@ class EndpointUnit(object):
 
     channel = None
     _recv_greenlet = None
+    _lazy_payload = False       # see LazyPayload, set by endpoint units supporting it
+
+    # interceptor stacks (keys into interceptors) that messages pass through, in order
+    _interceptor_stacks_in  = ('message_incoming',)
+    _interceptor_stacks_out = ('message_outgoing',)
 
     def attach_channel(self, channel):
         log.debug("In EndpointUnit.attach_channel")
-        log.debug("channel %s" % str(channel))
+        log.debug("channel %s", channel)
         self.channel = channel
 
     # @TODO: is this used?
@@ -104,9 +142,14 @@ class EndpointUnit(object):
         friends work!
         """
         # interceptor point
+        kwargs = {}
+        if self._lazy_payload:
+            kwargs['lazy_payload'] = True
+
         inv = self._build_invocation(path=Invocation.PATH_IN,
                                      message=msg,
-                                     headers=headers)
+                                     headers=headers,
+                                     **kwargs)
         inv_prime = self._intercept_msg_in(inv)
         new_msg     = inv_prime.message
         new_headers = inv_prime.headers
@@ -121,7 +164,7 @@ class EndpointUnit(object):
         @param  inv     An Invocation instance.
         @returns        A processed Invocation instance.
         """
-        inv_prime = process_interceptors(interceptors["message_incoming"] if "message_incoming" in interceptors else [], inv)
+        inv_prime = process_pipeline(get_interceptor_pipeline(self._interceptor_stacks_in, Invocation.PATH_IN), inv)
         return inv_prime
 
     def message_received(self, msg, headers):
@@ -168,7 +211,7 @@ class EndpointUnit(object):
         @param  inv     An Invocation instance.
         @returns        A processed Invocation instance.
         """
-        inv_prime = process_interceptors(interceptors["message_outgoing"] if "message_outgoing" in interceptors else [], inv)
+        inv_prime = process_pipeline(get_interceptor_pipeline(self._interceptor_stacks_out, Invocation.PATH_OUT), inv)
         return inv_prime
 
     def spawn_listener(self):
@@ -361,6 +404,9 @@ def log_message(recv, msg, headers, delivery_tag=None):
     """
     Utility function to print an legible comprehensive summary of a received message.
     """
+    if not log.isEnabledFor(logging.INFO):
+        return
+
     if getattr(recv, '__iter__', False):
         recv = ".".join(str(item) for item in recv if item)
     log.info("MESSAGE RECV [S->%s]: len=%s, headers=%s", recv, len(str(msg)), headers)
@@ -371,7 +417,25 @@ class ListeningBaseEndpoint(BaseEndpoint):
     """
     channel_type = ListenChannel
 
-    def __init__(self, node=None, name=None, from_name=None, binding=None):
+    # max unacked messages the broker delivers to the listening channel, 0 means no limit. See _get_prefetch
+    default_prefetch_count = 0
+
+    def __init__(self, node=None, name=None, from_name=None, binding=None, concurrency=None, lazy_payload=None,
+                 prefetch_count=None, prefetch_size=None):
+        """
+        @param  concurrency     Max number of received messages handled at the same time. With a value
+                                greater than 1, messages are handled in a bounded greenlet pool and the
+                                broker prefetch is at least the same number. If None, uses
+                                CFG endpoint.listen.concurrency (default 1, handle one at a time).
+        @param  lazy_payload    If True, Subscriber callbacks and RPCServer routing get a LazyPayload which
+                                deserializes the message payload on demand. If None, uses
+                                CFG endpoint.listen.lazy_payload (default False).
+        @param  prefetch_count  Max number of received messages not yet handled and acked, which bounds what
+                                waits in memory (see RecvChannel.set_qos). 0 means no limit. If None, uses
+                                CFG endpoint.listen.prefetch_count, or the endpoint type's default_prefetch_count.
+        @param  prefetch_size   Max bytes likewise, if None uses CFG endpoint.listen.prefetch_size (default 0,
+                                RabbitMQ does not implement a size limit).
+        """
         BaseEndpoint.__init__(self, node=node)
 
         if name:
@@ -384,6 +448,17 @@ class ListeningBaseEndpoint(BaseEndpoint):
 
         self._ready_event = event.Event()
         self._binding = binding
+        self._concurrency = concurrency
+        self._lazy_payload = lazy_payload
+        self._prefetch_count = prefetch_count
+        self._prefetch_size = prefetch_size
+
+        # counters for sizing concurrency, see get_stats
+        self._stats = {'received'       : 0,
+                       'in_flight'      : 0,
+                       'max_in_flight'  : 0,
+                       'wait_time'      : 0.0,      # total sec messages waited for a free worker
+                       'max_wait_time'  : 0.0}
 
     def _create_channel(self, **kwargs):
         """
@@ -401,6 +476,53 @@ class ListeningBaseEndpoint(BaseEndpoint):
         """
         return self._ready_event
 
+    def get_stats(self):
+        """
+        Returns a copy of the counters of messages received on this endpoint's queue: total received,
+        currently and max in flight, total and max time waited for a free worker (in seconds), and
+        once listening, the recv queue stats of the listening channel.
+        """
+        stats = self._stats.copy()
+        stats['queue'] = self._recv_name.queue
+        stats['concurrency'] = self._get_concurrency()
+
+        # depth of and time spent in the listening channel's recv queue, see RecvChannel.get_recv_stats
+        if getattr(self, '_chan', None) is not None:
+            stats['recv_queue'] = self._chan.get_recv_stats()
+
+        return stats
+
+    def _get_concurrency(self):
+        if self._concurrency is not None:
+            return self._concurrency
+
+        return CFG.get_safe('endpoint.listen.concurrency', 1)
+
+    def _get_lazy_payload(self):
+        if self._lazy_payload is not None:
+            return self._lazy_payload
+
+        return CFG.get_safe('endpoint.listen.lazy_payload', False)
+
+    def _get_prefetch(self):
+        """
+        Returns the (prefetch_count, prefetch_size) to set on the listening channel. The count is raised to
+        the concurrency, so the worker pool never waits on the broker.
+        """
+        prefetch_count = self._prefetch_count
+        if prefetch_count is None:
+            prefetch_count = CFG.get_safe('endpoint.listen.prefetch_count', self.default_prefetch_count)
+
+        prefetch_size = self._prefetch_size
+        if prefetch_size is None:
+            prefetch_size = CFG.get_safe('endpoint.listen.prefetch_size', 0)
+
+        concurrency = self._get_concurrency()
+        if concurrency > 1 and prefetch_count < concurrency:
+            prefetch_count = concurrency
+
+        return prefetch_count, prefetch_size
+
     def _setup_listener(self, name, binding=None):
         self._chan.setup_listener(name, binding=binding)
 
@@ -413,6 +535,12 @@ class ListeningBaseEndpoint(BaseEndpoint):
         kwargs = {}
         if isinstance(self._recv_name, BaseTransport):
             kwargs.update({'transport':self._recv_name})
+
+        # bound the broker's unacked deliveries, and so what waits in our recv queue. Passed to the node
+        # as well, which reuses a pooled AMQP channel only if it has the same prefetch limit
+        prefetch_count, prefetch_size = self._get_prefetch()
+        if prefetch_count or prefetch_size:
+            kwargs.update({'prefetch_count':prefetch_count, 'prefetch_size':prefetch_size})
         self._chan = self.node.channel(self.channel_type, **kwargs)
 
         # @TODO this does not feel right
@@ -421,6 +549,15 @@ class ListeningBaseEndpoint(BaseEndpoint):
             self._chan._recv_name = self._recv_name
         else:
             self._setup_listener(self._recv_name, binding=binding)
+
+        if (prefetch_count or prefetch_size) and self._chan.get_underlying_qos() != (prefetch_size, prefetch_count):
+            self._chan.set_qos(prefetch_size=prefetch_size, prefetch_count=prefetch_count)
+
+        concurrency = self._get_concurrency()
+        pool = None
+        if concurrency > 1:
+            pool = Pool(size=concurrency)
+
         self._chan.start_consume()
 
         # notify any listeners of our readiness
@@ -439,15 +576,49 @@ class ListeningBaseEndpoint(BaseEndpoint):
                 log.debug('Channel was closed during LEF.listen')
                 break
 
-            try:
-                e = self.create_endpoint(existing_channel=newchan)
-                e._message_received(msg, headers)
-            except Exception:
-                log.exception("Unhandled error while handling received message")
-                raise
-            finally:
-                # ALWAYS ACK
-                newchan.ack(delivery_tag)
+            self._stats['received'] += 1
+
+            if pool is None:
+                self._handle_message(newchan, msg, headers, delivery_tag, time.time())
+            else:
+                # blocks while all workers are busy
+                pool.spawn(self._handle_message_safe, newchan, msg, headers, delivery_tag, time.time())
+
+        if pool is not None:
+            # let in-flight handlers finish and ack
+            pool.join()
+
+    def _handle_message(self, newchan, msg, headers, delivery_tag, recv_time):
+        """
+        Handles one received message: creates an endpoint unit for it and routes the message into it.
+        The message is acked when done, even on error.
+        """
+        wait_time = time.time() - recv_time
+        self._stats['wait_time'] += wait_time
+        self._stats['max_wait_time'] = max(self._stats['max_wait_time'], wait_time)
+        self._stats['in_flight'] += 1
+        self._stats['max_in_flight'] = max(self._stats['max_in_flight'], self._stats['in_flight'])
+
+        try:
+            e = self.create_endpoint(existing_channel=newchan)
+            e._message_received(msg, headers)
+        except Exception:
+            log.exception("Unhandled error while handling received message")
+            raise
+        finally:
+            self._stats['in_flight'] -= 1
+
+            # ALWAYS ACK
+            newchan.ack(delivery_tag)
+
+    def _handle_message_safe(self, *args):
+        """
+        Pooled version of _handle_message: errors are logged there and must not escape the worker greenlet.
+        """
+        try:
+            self._handle_message(*args)
+        except Exception:
+            pass
 
     def close(self):
         BaseEndpoint.close(self)
@@ -458,38 +629,188 @@ class ListeningBaseEndpoint(BaseEndpoint):
 #
 
 class PublisherEndpointUnit(EndpointUnit):
-    pass
+
+    def send_many(self, msgs, headers=None, name=None):
+        """
+        Sends several messages with a single channel operation.
+
+        Each message is built and put through the outgoing interceptor stack as in send, then the
+        whole batch is handed to the channel at once.
+
+        @param  msgs        An iterable of messages.
+        @param  headers     Optional headers to send with every message. Will override anything produced by _build_header.
+        @param  name        Optional NameTrio to send to instead of the connected name, on the same exchange.
+        """
+        self.channel.send_many(self.build_outgoing(msgs, headers=headers), name=name)
+
+    def build_outgoing(self, msgs, headers=None):
+        """
+        Builds messages and puts them through the outgoing interceptor stack, without sending them.
+
+        @returns A list of (encoded message, headers) tuples, as taken by PublisherChannel.send_many.
+        """
+        out = []
+        for msg in msgs:
+            _msg, _header = self._build_msg(msg)
+            if headers: _header.update(headers)
+
+            inv = self._build_invocation(path=Invocation.PATH_OUT,
+                                         message=_msg,
+                                         headers=_header)
+            inv_prime = self._intercept_msg_out(inv)
+            out.append((inv_prime.message, inv_prime.headers))
+
+        return out
 
 class Publisher(SendingBaseEndpoint):
     """
     Simple publisher sends out broadcast messages.
+
+    Messages may be buffered: with a buffer_size set, publish() collects messages and sends them as
+    one batch when buffer_size messages are waiting or buffer_latency seconds have passed since the
+    first one, whichever comes first. Call flush() to send what is waiting right away.
     """
 
     endpoint_unit_type = PublisherEndpointUnit
     channel_type = PublisherChannel
 
-    def __init__(self, **kwargs):
+    def __init__(self, buffer_size=None, buffer_latency=None, confirm=False, **kwargs):
+        """
+        @param  buffer_size     Number of messages to collect before publish() sends them as a batch. If None,
+                                every publish() is sent immediately.
+        @param  buffer_latency  Max seconds a buffered message waits before it is sent. Default 0.1.
+        @param  confirm         If True, use broker publisher confirms and block until each publish call,
+                                batch or flush has been confirmed.
+        """
         self._pub_ep = None
+
+        self._buffer_size       = buffer_size
+        self._buffer_latency    = buffer_latency or 0.1
+        self._buffer            = []
+        self._flush_greenlet    = None
+        self._confirm           = confirm
+
         SendingBaseEndpoint.__init__(self, **kwargs)
 
+    def _ensure_pub_ep(self):
+        # @TODO: needs thread safety
+        if not self._pub_ep:
+            self._pub_ep = self.create_endpoint(self._send_name)
+        return self._pub_ep
+
+    def create_endpoint(self, to_name=None, existing_channel=None, **kwargs):
+        e = SendingBaseEndpoint.create_endpoint(self, to_name=to_name, existing_channel=existing_channel, **kwargs)
+        if self._confirm:
+            e.channel.enable_confirms()
+        return e
+
+    def _wait_for_confirms(self, ep):
+        if self._confirm:
+            ep.channel.wait_for_confirms()
+
+    def _same_exchange(self, to_name):
+        if not isinstance(to_name, NameTrio):
+            to_name = NameTrio(bootstrap.get_sys_name(), to_name)
+        return to_name.exchange == self._send_name.exchange, to_name
+
     def publish(self, msg, to_name=None):
 
         ep = None
         if not to_name:
-            # @TODO: needs thread safety
-            if not self._pub_ep:
-                self._pub_ep = self.create_endpoint(self._send_name)
-            ep = self._pub_ep
+            ep = self._ensure_pub_ep()
+
+            if self._buffer_size:
+                self._buffer.append(msg)
+                if len(self._buffer) >= self._buffer_size:
+                    self.flush()
+                elif self._flush_greenlet is None:
+                    self._flush_greenlet = spawn_later(self._buffer_latency, self._flush_later)
+                return ep
         else:
             ep = self.create_endpoint(to_name)
 
         ep.send(msg)
+        self._wait_for_confirms(ep)
         return ep
 
+    def publish_many(self, msgs, to_name=None):
+        """
+        Publishes several messages as a batch, on one channel, bypassing the buffer.
+
+        If to_name is on this publisher's exchange (e.g. a different routing key), the publisher's own
+        channel is reused.
+        """
+        name = None
+        if to_name:
+            same_xp, name = self._same_exchange(to_name)
+            if not same_xp:
+                ep = self.create_endpoint(to_name)
+                try:
+                    ep.send_many(msgs)
+                    self._wait_for_confirms(ep)
+                finally:
+                    ep.close()
+                return
+
+        ep = self._ensure_pub_ep()
+        ep.send_many(msgs, name=name)
+        self._wait_for_confirms(ep)
+
+    def publish_fanout(self, msgs, to_names):
+        """
+        Publishes messages to several names, e.g. all output streams of a transform. Each message is built,
+        intercepted and encoded once, and the same encoded bytes are sent to every name. Bypasses the buffer.
+
+        Names on this publisher's exchange are sent to on its own channel, others on one channel per name.
+        The outgoing interceptors must not depend on the destination, as they see each message only once.
+        """
+        ep = self._ensure_pub_ep()
+        out = ep.build_outgoing(msgs)
+
+        for to_name in to_names:
+            same_xp, name = self._same_exchange(to_name)
+            if same_xp:
+                ep.channel.send_many(out, name=name)
+                continue
+
+            other_ep = self.create_endpoint(name)
+            try:
+                other_ep.channel.send_many(out)
+                self._wait_for_confirms(other_ep)
+            finally:
+                other_ep.close()
+
+        self._wait_for_confirms(ep)
+
+    def flush(self):
+        """
+        Sends all buffered messages now.
+        """
+        if self._flush_greenlet is not None and self._flush_greenlet is not getcurrent():
+            self._flush_greenlet.kill()
+        self._flush_greenlet = None
+
+        if not self._buffer:
+            return
+
+        msgs, self._buffer = self._buffer, []
+        self.publish_many(msgs)
+
+    def _flush_later(self):
+        """
+        Runs in the latency timer greenlet.
+        """
+        try:
+            self.flush()
+        except Exception:
+            log.exception("Error while flushing buffered messages")
+
     def close(self):
         """
-        Closes the opened publishing channel, if we've opened it previously.
+        Closes the opened publishing channel, if we've opened it previously, sending any buffered messages first.
         """
+        if self._buffer:
+            self.flush()
         if self._pub_ep:
             self._pub_ep.close()
 
@@ -499,9 +820,10 @@ class SubscriberEndpointUnit(EndpointUnit):
     """
     @TODO: Should have routing mechanics, possibly shared with other listener endpoint types
     """
-    def __init__(self, callback):
+    def __init__(self, callback, lazy_payload=False):
         EndpointUnit.__init__(self)
         self.set_callback(callback)
+        self._lazy_payload = lazy_payload
 
     def set_callback(self, callback):
         """
@@ -530,6 +852,9 @@ class Subscriber(ListeningBaseEndpoint):
     endpoint_unit_type = SubscriberEndpointUnit
     channel_type = SubscriberChannel
 
+    # enough to keep a stream process busy, few enough to keep a backlog of granules on the broker
+    default_prefetch_count = 50
+
     def __init__(self, callback=None, **kwargs):
         """
         @param  callback should be a callable with two args: msg, headers
@@ -540,7 +865,7 @@ class Subscriber(ListeningBaseEndpoint):
 
     def create_endpoint(self, **kwargs):
         log.debug("Subscriber.create_endpoint override")
-        return ListeningBaseEndpoint.create_endpoint(self, callback=self._callback, **kwargs)
+        return ListeningBaseEndpoint.create_endpoint(self, callback=self._callback, lazy_payload=self._get_lazy_payload(), **kwargs)
 
 
 #
@@ -556,7 +881,131 @@ class BidirectionalListeningEndpointUnit(EndpointUnit):
 #  REQ / RESP (and RPC)
 #
 
+class ReplyDispatcher(object):
+    """
+    A container-wide reply queue shared by all request clients on a node.
+
+    Instead of declaring, binding and consuming a reply queue for every request, requests are
+    sent with reply-to set to one long-lived anonymous queue. Replies are correlated back to their
+    waiting requests by the conv-id header and completed through AsyncResults, so a request costs
+    one publish plus one delivery.
+
+    Use get_instance to obtain the dispatcher for a node.
+    """
+    channel_type = SharedReplyChannel
+
+    _instances      = {}
+    _instances_lock = coros.RLock()
+
+    def __init__(self, node):
+        self.node           = node
+        self._chan          = None
+        self._recv_greenlet = None
+        self._pending       = {}        # conv-id -> AsyncResult
+
+    @classmethod
+    def get_instance(cls, node):
+        """
+        Returns the running ReplyDispatcher for this node, creating and starting one if needed.
+        """
+        with cls._instances_lock:
+            disp = cls._instances.get(node, None)
+            if disp is None or not disp.is_running():
+                disp = cls(node)
+                disp.start()
+                cls._instances[node] = disp
+
+        return disp
+
+    @classmethod
+    def close_instance(cls, node):
+        """
+        Closes the ReplyDispatcher for this node, if one exists.
+        """
+        with cls._instances_lock:
+            disp = cls._instances.pop(node, None)
+
+        if disp is not None:
+            disp.close()
+
+    def start(self):
+        """
+        Declares the shared reply queue, starts consuming and spawns the dispatching greenlet.
+        """
+        log.debug("ReplyDispatcher.start")
+        self._chan = self.node.channel(self.channel_type)
+        self._chan.setup_listener(NameTrio(bootstrap.get_sys_name()))    # anon queue
+        self._chan.start_consume()
+
+        # @TODO: spawn should be configurable to maybe the proc_sup in the container?
+        self._recv_greenlet = spawn(self._dispatch_loop)
+
+    def is_running(self):
+        return self._recv_greenlet is not None and not self._recv_greenlet.ready()
+
+    def create_channel(self):
+        """
+        Creates a send channel whose replies are routed to this dispatcher's queue.
+        """
+        return self._chan.create_request_channel()
+
+    def register(self, conv_id):
+        """
+        Registers interest in the reply to conversation conv_id.
+
+        @returns    An AsyncResult which will be set to a (msg, headers) tuple when the reply arrives.
+        """
+        if conv_id in self._pending:
+            raise EndpointError("A request with conv-id %s is already outstanding" % conv_id)
+
+        ar = event.AsyncResult()
+        self._pending[conv_id] = ar
+        return ar
+
+    def unregister(self, conv_id):
+        """
+        Removes a registration, typically after the reply arrived or the request timed out.
+        """
+        self._pending.pop(conv_id, None)
+
+    def _dispatch_loop(self):
+        while True:
+            try:
+                msg, headers, delivery_tag = self._chan.recv()
+            except ChannelClosedError:
+                log.debug('Channel was closed during ReplyDispatcher dispatch loop')
+                break
+
+            try:
+                conv_id = (headers or {}).get('conv-id', None)
+                ar = self._pending.pop(conv_id, None)
+                if ar is None:
+                    log.warn("ReplyDispatcher: dropping reply for unknown or expired conv-id %s", conv_id)
+                else:
+                    ar.set((msg, headers))
+            finally:
+                # always ack a reply
+                self._chan.ack(delivery_tag)
+
+        # nothing will complete the outstanding requests anymore
+        pending, self._pending = self._pending, {}
+        for ar in pending.itervalues():
+            ar.set_exception(ChannelClosedError("Shared reply channel closed while waiting for a reply"))
+
+    def close(self):
+        if self._chan is not None:
+            # puts a ChannelShutdownMessage into the recv queue, which ends the dispatch loop
+            self._chan.close()
+
+        if self._recv_greenlet is not None:
+            self._recv_greenlet.join(timeout=2)
+            self._recv_greenlet.kill()
+
 class RequestEndpointUnit(BidirectionalEndpointUnit):
+    def __init__(self, reply_dispatcher=None, **kwargs):
+        BidirectionalEndpointUnit.__init__(self)
+        self._reply_dispatcher = reply_dispatcher
+
     def _send(self, msg, headers=None, **kwargs):
 
         # could have a specified timeout in kwargs
@@ -567,6 +1016,9 @@ class RequestEndpointUnit(BidirectionalEndpointUnit):
 
         log.debug("RequestEndpointUnit.send (timeout: %s)", timeout)
 
+        if self._reply_dispatcher is not None:
+            return self._send_multiplexed(msg, headers, timeout)
+
         if not self._recv_greenlet:
             self.channel.setup_listener(NameTrio(self.channel._send_name.exchange)) # anon queue
             self.channel.start_consume()
@@ -585,6 +1037,34 @@ class RequestEndpointUnit(BidirectionalEndpointUnit):
         log.debug("Got response to our request: %s, headers: %s", result_data, result_headers)
         return result_data, result_headers
 
+    def _send_multiplexed(self, msg, headers, timeout):
+        """
+        Sends a request whose reply arrives on the shared reply queue of our ReplyDispatcher.
+
+        The reply is matched by the conv-id header, then run through the incoming interceptor
+        stack in this greenlet.
+        """
+        conv_id = headers.get('conv-id', None) if headers else None
+        if not conv_id:
+            raise EndpointError("A conv-id header is required to send over a shared reply queue")
+
+        ar = self._reply_dispatcher.register(conv_id)
+        try:
+            EndpointUnit._send(self, msg, headers=headers)
+
+            try:
+                raw_data, raw_headers = ar.get(timeout=timeout)
+            except Timeout:
+                raise exception.Timeout('Request timed out (%d sec) waiting for response from %s' % (timeout, str(self.channel._send_name)))
+        finally:
+            self._reply_dispatcher.unregister(conv_id)
+
+        self.message_received = lambda m, h: (m, h)
+        result_data, result_headers = self._message_received(raw_data, raw_headers)
+
+        log.debug("Got response to our request: %s, headers: %s", result_data, result_headers)
+        return result_data, result_headers
+
     def _build_header(self, raw_msg):
         """
         Sets headers common to Request-Response patterns, non-ion-specific.
@@ -625,7 +1105,7 @@ class ResponseEndpointUnit(BidirectionalListeningEndpointUnit):
         if self.channel and self.channel._send_name and isinstance(self.channel._send_name, NameTrio):
             headers['receiver'] = "%s,%s" % (self.channel._send_name.exchange, self.channel._send_name.queue)       # @TODO: correct?
         headers['language']     = 'ion-r2'
-        headers['encoding']     = 'msgpack'
+        headers['encoding']     = ENCODING_MSGPACK
         headers['format']       = raw_msg.__class__.__name__    # hmm
         headers['reply-by']     = 'todo'                        # clock sync is a problem
 
@@ -639,20 +1119,20 @@ class RequestResponseServer(ListeningBaseEndpoint):
 class RPCRequestEndpointUnit(RequestEndpointUnit):
 
     def _send(self, msg, headers=None, **kwargs):
-        log.info("MESSAGE SEND [S->D] RPC: %s" % str(msg))
+        log.info("MESSAGE SEND [S->D] RPC: %s", msg)
 
         res, res_headers = RequestEndpointUnit._send(self, msg, headers=headers, **kwargs)
 
         #log_message('?WHO AM I?', res, res_headers)
-        log.debug("RPCRequestEndpointUnit got this response: %s, headers: %s" % (str(res), str(res_headers)))
+        log.debug("RPCRequestEndpointUnit got this response: %s, headers: %s", res, res_headers)
 
         # Check response header
         if res_headers["status_code"] == 200:
             log.debug("OK status")
             return res, res_headers
         else:
-            log.debug("Bad status: %d" % res_headers["status_code"])
-            log.debug("Error message: %s" % res_headers["error_message"])
+            log.debug("Bad status: %d", res_headers["status_code"])
+            log.debug("Error message: %s", res_headers["error_message"])
             self._raise_exception(res_headers["status_code"], res_headers["error_message"])
 
         return res, res_headers
@@ -694,7 +1174,7 @@ class RPCRequestEndpointUnit(RequestEndpointUnit):
         headers['conv-seq'] = 1     # @TODO will not work well with agree/status etc
         headers['conv-id']  = self._build_conv_id()
         headers['language'] = 'ion-r2'
-        headers['encoding'] = 'msgpack'
+        headers['encoding'] = CFG.get_safe('endpoint.encoding', ENCODING_MSGPACK)       # responses use the same encoding
         headers['format']   = raw_msg.__class__.__name__    # hmm
         headers['reply-by'] = 'todo'                        # clock sync is a problem
 
@@ -719,14 +1199,42 @@ class RPCClient(RequestResponseClient):
     """
     endpoint_unit_type = RPCRequestEndpointUnit
 
-    def __init__(self, iface=None, **kwargs):
+    def __init__(self, iface=None, shared_reply_queue=None, **kwargs):
+        """
+        @param  shared_reply_queue  If True, requests receive their replies on the container-wide
+                                    reply queue (see ReplyDispatcher) instead of setting up a reply
+                                    queue per request. If None, uses CFG endpoint.rpc_client.shared_reply_queue.
+        """
         if isinstance(iface, interface.interface.InterfaceClass):
             self._define_interface(iface)
 #        elif isinstance(iface, IonServiceDefinition):
 #            self._define_svcdef(iface)
 
+        self._shared_reply_queue = shared_reply_queue
+
         RequestResponseClient.__init__(self, **kwargs)
 
+    def _use_shared_reply_queue(self):
+        if self._shared_reply_queue is not None:
+            return self._shared_reply_queue
+
+        return CFG.get_safe('endpoint.rpc_client.shared_reply_queue', False)
+
+    def create_endpoint(self, to_name=None, existing_channel=None, **kwargs):
+        """
+        Create endpoint override.
+
+        When using the shared reply queue, the endpoint unit gets a request channel from this node's
+        ReplyDispatcher, so no reply queue setup is needed per request.
+        """
+        if existing_channel is None and self._use_shared_reply_queue():
+            self._ensure_node()
+            dispatcher = ReplyDispatcher.get_instance(self.node)
+            existing_channel = dispatcher.create_channel()
+            kwargs['reply_dispatcher'] = dispatcher
+
+        return RequestResponseClient.create_endpoint(self, to_name=to_name, existing_channel=existing_channel, **kwargs)
+
 #    def _define_svcdef(self, svc_def):
 #        """
 #        Defines an RPCClient's attributes from an IonServiceDefinition.
@@ -788,9 +1296,10 @@ class RPCClient(RequestResponseClient):
 
 
 class RPCResponseEndpointUnit(ResponseEndpointUnit):
-    def __init__(self, routing_obj=None, **kwargs):
+    def __init__(self, routing_obj=None, lazy_payload=False, **kwargs):
         ResponseEndpointUnit.__init__(self)
         self._routing_obj = routing_obj
+        self._lazy_payload = lazy_payload
         
     def _message_received(self, msg, headers):
         """
@@ -803,15 +1312,15 @@ class RPCResponseEndpointUnit(ResponseEndpointUnit):
         try:
             result, response_headers = ResponseEndpointUnit._message_received(self, msg, headers)       # execute interceptor stack, calls into our message_received
         except IonException as ex:
-            (exc_type, exc_value, exc_traceback) = sys.exc_info()
-            tb_list = traceback.extract_tb(sys.exc_info()[2])
-            tb_list = traceback.format_list(tb_list)
-            tb_output = ""
-            for elt in tb_list:
-                tb_output += elt
-            log.debug("Got error response")
-            log.debug("Exception message: %s" % ex)
-            log.debug("Traceback:\n%s" % tb_output)
+            if log.isEnabledFor(logging.DEBUG):
+                tb_list = traceback.extract_tb(sys.exc_info()[2])
+                tb_list = traceback.format_list(tb_list)
+                tb_output = ""
+                for elt in tb_list:
+                    tb_output += elt
+                log.debug("Got error response")
+                log.debug("Exception message: %s", ex)
+                log.debug("Traceback:\n%s", tb_output)
             response_headers = self._create_error_response(ex)
 
         # REPLIES: propogate protocol, conv-id, conv-seq
@@ -819,6 +1328,10 @@ class RPCResponseEndpointUnit(ResponseEndpointUnit):
         response_headers['conv-id']     = headers.get('conv-id', '')
         response_headers['conv-seq']    = headers.get('conv-seq', 1) + 1
 
+        # reply in the encoding the requester used, so peers not knowing newer encodings keep working
+        if 'encoding' in headers:
+            response_headers['encoding'] = headers['encoding']
+
         log.info("MESSAGE SEND [S->D] RPC: %s, headers: %s", result, response_headers)
 
         return self.send(result, response_headers)
@@ -831,18 +1344,24 @@ class RPCResponseEndpointUnit(ResponseEndpointUnit):
         cmd_arg_obj = msg
         cmd_op      = headers.get('op', None)
 
+        # op name must exist!
+        if not hasattr(self._routing_obj, cmd_op):
+            raise BadRequest("Unknown op name: %s" % cmd_op)
+
+        # lazy payload mode: the args are needed now
+        if isinstance(cmd_arg_obj, LazyPayload):
+            cmd_arg_obj = cmd_arg_obj.resolve()
+
         # transform cmd_arg_obj into a dict
-        if hasattr(cmd_arg_obj, '__dict__'):
+        if isinstance(cmd_arg_obj, IonObjectBase):
+            cmd_arg_obj = cmd_arg_obj._get_fields()
+        elif hasattr(cmd_arg_obj, '__dict__'):
             cmd_arg_obj = cmd_arg_obj.__dict__
         elif isinstance(cmd_arg_obj, dict):
             pass
         else:
             raise BadRequest("Unknown message type, cannot convert into kwarg dict: %s" % str(type(cmd_arg_obj)))
 
-        # op name must exist!
-        if not hasattr(self._routing_obj, cmd_op):
-            raise BadRequest("Unknown op name: %s" % cmd_op)
-
         ro_meth     = getattr(self._routing_obj, cmd_op)
 
         result = None
@@ -866,6 +1385,9 @@ class RPCResponseEndpointUnit(ResponseEndpointUnit):
 class RPCServer(RequestResponseServer):
     endpoint_unit_type = RPCResponseEndpointUnit
 
+    # requests not yet being handled stay on the broker, for other workers on the same service queue
+    default_prefetch_count = 1
+
     def __init__(self, service=None, **kwargs):
         log.debug("In RPCServer.__init__")
         self._service = service
@@ -876,11 +1398,15 @@ class RPCServer(RequestResponseServer):
         @TODO: push this into RequestResponseServer
         """
         log.debug("RPCServer.create_endpoint override")
-        return RequestResponseServer.create_endpoint(self, routing_obj=self._service, **kwargs)
+        return RequestResponseServer.create_endpoint(self, routing_obj=self._service, lazy_payload=self._get_lazy_payload(), **kwargs)
 
 
 class ProcessRPCRequestEndpointUnit(RPCRequestEndpointUnit):
 
+    # This is a request, so the order should be Message, Process in and Process, Message out
+    _interceptor_stacks_in  = ('message_incoming', 'process_incoming')
+    _interceptor_stacks_out = ('process_outgoing', 'message_outgoing')
+
     def __init__(self, process=None, **kwargs):
         RPCRequestEndpointUnit.__init__(self, **kwargs)
         self._process = process
@@ -892,27 +1418,6 @@ class ProcessRPCRequestEndpointUnit(RPCRequestEndpointUnit):
         inv = RPCRequestEndpointUnit._build_invocation(self, **newkwargs)
         return inv
 
-    def _intercept_msg_in(self, inv):
-        """
-        Override for incoming message interception.
-
-        This is a request, so the order should be Message, Process
-        """
-        inv_one = RPCRequestEndpointUnit._intercept_msg_in(self, inv)
-        inv_two = process_interceptors(interceptors["process_incoming"] if "process_incoming" in interceptors else [], inv_one)
-        return inv_two
-
-    def _intercept_msg_out(self, inv):
-        """
-        Override for outgoing message interception.
-
-        This is request, so the order should be Process, Message
-        """
-        inv_one = process_interceptors(interceptors["process_outgoing"] if "process_outgoing" in interceptors else [], inv)
-        inv_two = RPCRequestEndpointUnit._intercept_msg_out(self, inv_one)
-
-        return inv_two
-
     def _build_header(self, raw_msg):
         """
         Builds the header for this Process-level RPC conversation.
@@ -975,6 +1480,10 @@ class ProcessRPCClient(RPCClient):
 
 class ProcessRPCResponseEndpointUnit(RPCResponseEndpointUnit):
 
+    # This is response, so the order should be Message, Process in and Process, Message out
+    _interceptor_stacks_in  = ('message_incoming', 'process_incoming')
+    _interceptor_stacks_out = ('process_outgoing', 'message_outgoing')
+
     def __init__(self, process=None, **kwargs):
         RPCResponseEndpointUnit.__init__(self, **kwargs)
         self._process = process
@@ -996,26 +1505,6 @@ class ProcessRPCResponseEndpointUnit(RPCResponseEndpointUnit):
         inv = RPCResponseEndpointUnit._build_invocation(self, **newkwargs)
         return inv
 
-    def _intercept_msg_in(self, inv):
-        """
-        Override for incoming message interception.
-
-        This is response incoming, so the order should be Message, Process
-        """
-        inv_one = RPCResponseEndpointUnit._intercept_msg_in(self, inv)
-        inv_two = process_interceptors(interceptors["process_incoming"] if "process_incoming" in interceptors else [], inv_one)
-        return inv_two
-
-    def _intercept_msg_out(self, inv):
-        """
-        Override for outgoing message interception.
-
-        This is response outgoing, so the order should be Process, Message
-        """
-        inv_one = process_interceptors(interceptors["process_outgoing"] if "process_outgoing" in interceptors else [], inv)
-        inv_two = RPCResponseEndpointUnit._intercept_msg_out(self, inv_one)
-        return inv_two
-
     def _build_header(self, raw_msg):
         """
         Builds the header for this Process-level RPC conversation.
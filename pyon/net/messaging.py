@@ -4,16 +4,20 @@
 
 import gevent
 from gevent import event, coros
+import heapq
+import time
 
 from pika.credentials import PlainCredentials
 from pika.connection import ConnectionParameters
 from pika.adapters import SelectConnection
 from pika import channel as pikachannel
 from pika.exceptions import NoFreeChannels
+from pika.reconnection_strategies import SimpleReconnectionStrategy
 
 from pyon.core.bootstrap import CFG
 from pyon.net import amqp
 from pyon.net import channel
+from pyon.net.transport import AMQPTransport
 from pyon.util.async import blocking_cb
 from pyon.util.log import log
 from pyon.util.pool import IDPool
@@ -26,16 +30,134 @@ class NodeB(amqp.Node):
     objects.
     """
 
-    def __init__(self):
+    # Channel types whose underlying AMQP channels are pooled: closing one of these parks its AMQP
+    # channel in the Node, and the next Channel of any of these types wanting the same prefetch limit is opened on it.
+    _pooled_channel_types = (channel.SendChannel, channel.PublisherChannel, channel.SubscriberChannel)
+
+    # how _next_client spreads new channels over the connections
+    POLICY_ROUND_ROBIN  = 'round_robin'
+    POLICY_LEAST_LOADED = 'least_loaded'
+
+    def __init__(self, chan_pool_max_idle=None, chan_pool_idle_timeout=None, connections=1, connection_policy=None):
+        """
+        @param  chan_pool_max_idle      Max number of idle AMQP channels kept for reuse. If None, uses
+                                        CFG container.messaging.channel_pool.max_idle (default 32).
+        @param  chan_pool_idle_timeout  Seconds an AMQP channel may stay idle in the pool before it is closed.
+                                        If None, uses CFG container.messaging.channel_pool.idle_timeout (default 60).
+        @param  connections             Number of AMQP connections this node uses, it starts once all are open.
+        @param  connection_policy       How new channels are spread over the connections, POLICY_ROUND_ROBIN or
+                                        POLICY_LEAST_LOADED (fewest open channels). If None, uses
+                                        CFG container.messaging.connection_policy (default round robin).
+        """
         log.debug("In NodeB.__init__")
         self.ready = event.Event()
         self._lock = coros.RLock()
         self._pool = IDPool()
         self._bidir_pool = {}   # maps inactive/active our numbers (from self._pool) to channels
-        self._pool_map = {}     # maps active pika channel numbers to our numbers (from self._pool)
+        self._pool_map = {}     # maps active pooled Channels to our numbers (from self._pool); pika channel numbers repeat across connections
+
+        self._chan_pool_max_idle        = chan_pool_max_idle if chan_pool_max_idle is not None else CFG.get_safe('container.messaging.channel_pool.max_idle', 32)
+        self._chan_pool_idle_timeout    = chan_pool_idle_timeout if chan_pool_idle_timeout is not None else CFG.get_safe('container.messaging.channel_pool.idle_timeout', 60)
+        self._idle_chans                = []    # idle pooled AMQP channels, (amq_chan, time released, qos), oldest first
+        self._chan_pool_stats           = {'hits': 0, 'misses': 0, 'released': 0, 'closed': 0, 'evicted': 0}
+
+        self._connections       = connections
+        self._connection_policy = connection_policy or CFG.get_safe('container.messaging.connection_policy', self.POLICY_ROUND_ROBIN)
+        self._clients           = []    # open(ed) connections, in order of opening. self.client is the first.
+        self._clients_down      = set() # connections closed, unless/until they reconnect
+        self._client_stats      = {}    # connection -> counters, see get_connection_stats
+        self._ioloops           = []    # ioloop greenlets, in order of the connections, set by make_node
+        self._next_client_idx   = 0
 
         amqp.Node.__init__(self)
 
+    def on_connection_open(self, client):
+        """
+        Override of Node. Called when each of our connections opens, and when it reopens after a
+        reconnect. Starts the node once all connections are open.
+        """
+        log.debug("NodeB.on_connection_open: %s", client)
+        with self._lock:
+            if client in self._client_stats:
+                log.info("NodeB: connection %d reconnected", self._clients.index(client))
+                self._clients_down.discard(client)
+                self._client_stats[client]['reconnects'] += 1
+                return
+
+            client.add_on_close_callback(lambda *a: self._on_client_close(client))
+            self._clients.append(client)
+            self._client_stats[client] = {'channels_opened': 0, 'reconnects': 0}
+
+            if self.client is None:
+                self.client = client
+
+            if len(self._clients) >= self._connections:
+                self.start_node()
+
+    def _on_client_close(self, client):
+        """
+        One of our connections closed. New channels go to the others until it reconnects (if configured to).
+        """
+        log.debug("NodeB: connection %d closed", self._clients.index(client))
+        with self._lock:
+            self._clients_down.add(client)
+
+            # idle pooled channels of this connection are gone with it
+            self._idle_chans = [entry for entry in self._idle_chans if entry[0].transport.connection is not client]
+
+        # as may be auto delete queues and exchanges declared through it
+        AMQPTransport.get_instance().clear_declare_cache()
+
+        self.on_connection_close()
+
+    def _next_client(self):
+        """
+        Returns the connection to open the next channel on, according to the connection policy.
+        Connections that are down are skipped, unless all are.
+        """
+        if not self._clients:
+            return self.client
+
+        clients = [c for c in self._clients if not c in self._clients_down] or self._clients
+        if len(clients) == 1:
+            return clients[0]
+
+        if self._connection_policy == self.POLICY_LEAST_LOADED:
+            return min(clients, key=lambda c: len(c._channels))
+
+        client = clients[self._next_client_idx % len(clients)]
+        self._next_client_idx = (self._next_client_idx + 1) % len(clients)
+        return client
+
+    def get_connection_stats(self):
+        """
+        Returns a list of counters per connection, in order of opening: whether it is up, open channels,
+        channels opened over its lifetime, reconnects, and Pika's byte and frame counters.
+        """
+        with self._lock:
+            stats = []
+            for client in self._clients:
+                cstats = self._client_stats[client].copy()
+                cstats['up']        = not client in self._clients_down
+                cstats['channels']  = len(client._channels)
+                for counter in ('bytes_sent', 'bytes_received', 'frames_sent', 'frames_received'):
+                    cstats[counter] = getattr(client, counter, 0)
+                stats.append(cstats)
+            return stats
+
+    def stop_node(self):
+        """
+        Closes all connections, running each one's ioloop until it has closed.
+        """
+        log.debug("In NodeB.stop_node")
+        for x, client in enumerate(self._clients):
+            client.close()
+            if x < len(self._ioloops):
+                self._ioloops[x].kill()
+            client.ioloop.start()     # loop until connection closes
+
+        self.running = 0
+
     def start_node(self):
         """
         This should only be called by on_connection_opened.
@@ -51,8 +173,13 @@ class NodeB(amqp.Node):
         Creates a pyon Channel based on the passed in type, and activates it for use.
         """
         chan = ch_type(**kwargs)
-        amq_chan = blocking_cb(self.client.channel, 'on_open_callback', channel_number=ch_number)
+        client = self._next_client()
+        amq_chan = blocking_cb(client.channel, 'on_open_callback', channel_number=ch_number)
         chan.on_channel_open(amq_chan)
+
+        if client in self._client_stats:
+            self._client_stats[client]['channels_opened'] += 1
+
         return chan
 
     def channel(self, ch_type, **kwargs):
@@ -70,19 +197,129 @@ class NodeB(amqp.Node):
                     log.debug("BidirClientChannel requested, pulling from pool (%d)", chid)
                     assert not chid in self._pool_map.values()
                     ch = self._bidir_pool[chid]
-                    self._pool_map[ch.get_channel_id()] = chid
+                    self._pool_map[ch] = chid
+                    self._chan_pool_stats['hits'] += 1
                 else:
                     log.debug("BidirClientChannel requested, no pool items available, creating new (%d)", chid)
                     ch = self._new_channel(ch_type, **kwargs)
                     ch.set_close_callback(self.on_channel_request_close)
                     self._bidir_pool[chid] = ch
-                    self._pool_map[ch.get_channel_id()] = chid
+                    self._pool_map[ch] = chid
+                    self._chan_pool_stats['misses'] += 1
+            elif ch_type in self._pooled_channel_types and not 'close_callback' in kwargs:
+                ch = self._pooled_channel(ch_type, **kwargs)
             else:
                 ch = self._new_channel(ch_type, **kwargs)
             assert ch
 
         return ch
 
+    def _pooled_channel(self, ch_type, **kwargs):
+        """
+        Creates a Channel of one of the pooled types, on an idle AMQP channel from the pool if there is one.
+        Must be called with the lock held.
+        """
+        self._evict_idle_channels()
+
+        # a prefetch limit can't be reset, only AMQP channels with the one wanted are reused
+        qos = tuple(kwargs[arg] if kwargs.get(arg) is not None else getattr(ch_type, '_' + arg, 0)
+                    for arg in ('prefetch_size', 'prefetch_count'))
+
+        # most recently released first, so the oldest ones idle out
+        idle_idx = None
+        for idx in xrange(len(self._idle_chans) - 1, -1, -1):
+            if self._idle_chans[idx][2] == qos:
+                idle_idx = idx
+                break
+
+        if idle_idx is not None:
+            amq_chan = self._idle_chans.pop(idle_idx)[0]
+            log.debug("%s requested, reusing pooled AMQP channel (%d)", ch_type.__name__, amq_chan.channel_number)
+            self._remove_close_callbacks(amq_chan)
+
+            ch = ch_type(**kwargs)
+            ch.on_channel_open(amq_chan)
+            if qos != (0, 0):
+                ch._qos_set = True      # already set on the AMQP channel
+            self._chan_pool_stats['hits'] += 1
+        else:
+            ch = self._new_channel(ch_type, **kwargs)
+            self._chan_pool_stats['misses'] += 1
+
+        ch.set_close_callback(self.on_pooled_channel_close)
+        return ch
+
+    def on_pooled_channel_close(self, ch):
+        """
+        Close callback for Channels of the pooled types.
+
+        Keeps the underlying AMQP channel for reuse when the Channel left no state on it and the pool
+        has room, otherwise closes it.
+        """
+        with self._lock:
+            self._evict_idle_channels()
+
+            if not ch.can_reuse_underlying_channel() or len(self._idle_chans) >= self._chan_pool_max_idle:
+                log.debug("NodeB: closing %s (%s), not pooling it", ch.__class__.__name__, ch.get_channel_id())
+                self._chan_pool_stats['closed'] += 1
+                ch.close_impl()
+                return
+
+            try:
+                amq_chan = ch.detach_underlying_channel()
+            except Exception:
+                log.exception("NodeB: could not detach AMQP channel from %s, closing it", ch.__class__.__name__)
+                self._chan_pool_stats['closed'] += 1
+                ch.close_impl()
+                return
+
+            # drop the close callbacks of the Channel, track closes while idle instead
+            self._remove_close_callbacks(amq_chan)
+            amq_chan.add_on_close_callback(lambda code, text: self._on_idle_channel_close(amq_chan))
+
+            self._idle_chans.append((amq_chan, time.time(), ch.get_underlying_qos()))
+            self._chan_pool_stats['released'] += 1
+
+    def _on_idle_channel_close(self, amq_chan):
+        """
+        An AMQP channel was closed (e.g. by the broker) while idle in the pool.
+        """
+        log.debug("NodeB: pooled AMQP channel %d closed while idle", amq_chan.channel_number)
+        with self._lock:
+            self._idle_chans = [entry for entry in self._idle_chans if entry[0] is not amq_chan]
+
+    def _evict_idle_channels(self):
+        """
+        Closes AMQP channels that have been idle in the pool for longer than the idle timeout.
+        Must be called with the lock held.
+        """
+        expired = time.time() - self._chan_pool_idle_timeout
+        while self._idle_chans and self._idle_chans[0][1] < expired:
+            amq_chan = self._idle_chans.pop(0)[0]
+            log.debug("NodeB: evicting idle pooled AMQP channel %d", amq_chan.channel_number)
+            self._remove_close_callbacks(amq_chan)
+
+            # close the way Channels do, see BaseChannel.close_impl
+            ch = channel.BaseChannel()
+            ch.attach_underlying_channel(amq_chan)
+            ch.close_impl()
+            self._chan_pool_stats['evicted'] += 1
+
+    def _remove_close_callbacks(self, amq_chan):
+        amq_chan.callbacks.remove(amq_chan.channel_number, '_on_channel_close')
+
+    def get_channel_pool_stats(self):
+        """
+        Returns a copy of the channel pool counters: Channels served from the pool (hits) or on newly
+        opened AMQP channels (misses), AMQP channels released to the pool, closed instead of pooled,
+        and evicted after idling, plus the current number of idle AMQP channels and pooled BidirClientChannels.
+        """
+        with self._lock:
+            stats = self._chan_pool_stats.copy()
+            stats['idle'] = len(self._idle_chans)
+            stats['bidir'] = len(self._bidir_pool)
+            return stats
+
     def on_channel_request_close(self, ch):
         """
         Close callback for pooled Channels.
@@ -92,10 +329,10 @@ class NodeB(amqp.Node):
         """
         log.debug("NodeB: on_channel_request_close\n\tChType %s, Ch#: %d", ch.__class__, ch.get_channel_id())
 
-        assert ch.get_channel_id() in self._pool_map
+        assert ch in self._pool_map
         with self._lock:
             ch.stop_consume()
-            chid = self._pool_map.pop(ch.get_channel_id())
+            chid = self._pool_map.pop(ch)
             log.debug("Releasing BiDir pool Pika #%d, our id #%d", ch.get_channel_id(), chid)
             self._pool.release_id(chid)
 
@@ -137,37 +374,73 @@ class PyonSelectConnection(SelectConnection):
     """
     def __init__(self, parameters=None, on_open_callback=None,
                  reconnection_strategy=None):
-        SelectConnection.__init__(self, parameters=parameters, on_open_callback=on_open_callback, reconnection_strategy=reconnection_strategy)
         self._bad_channel_numbers = set()
+        SelectConnection.__init__(self, parameters=parameters, on_open_callback=on_open_callback, reconnection_strategy=reconnection_strategy)
+
+    def _get_channels(self):
+        return self.__dict__['_channel_map']
+
+    def _set_channels(self, channels):
+        """
+        Pika (re)sets its channel number -> channel dict on connection setup. We wrap it so channel
+        numbers added and removed keep our free channel number heap up to date.
+        """
+        self.__dict__['_channel_map'] = ChannelMap(channels, self._channel_added, self._channel_freed)
+
+        # the high water mark, free numbers below it are kept in the heap
+        self._channel_hwm = max(channels) if channels else 0
+        self._free_channel_numbers = [x for x in xrange(1, self._channel_hwm) if not x in channels]
+        heapq.heapify(self._free_channel_numbers)
+        self._free_channel_set = set(self._free_channel_numbers)
+
+    _channels = property(_get_channels, _set_channels)
+
+    def _channel_added(self, ch_number):
+        # numbers skipped over by a new high water mark are free
+        for x in xrange(self._channel_hwm + 1, ch_number):
+            self._push_free_channel_number(x)
+        self._channel_hwm = max(self._channel_hwm, ch_number)
+
+    def _channel_freed(self, ch_number):
+        self._push_free_channel_number(ch_number)
+
+    def _push_free_channel_number(self, ch_number):
+        if not ch_number in self._free_channel_set and not ch_number in self._bad_channel_numbers:
+            heapq.heappush(self._free_channel_numbers, ch_number)
+            self._free_channel_set.add(ch_number)
 
     def _next_channel_number(self):
         """
         Get the next available channel number.
 
-        This improves on Pika's implementation by using a set, so lower channel numbers can be
-        re-used. It factors in channel numbers marked as bad and treats them as if they are in
-        use, so no bad channel number will ever be re-used.
+        This improves on Pika's implementation by keeping a heap of freed channel numbers, so lower
+        channel numbers can be re-used. It treats channel numbers marked as bad as if they are in use,
+        so no bad channel number will ever be re-used.
+
+        The number is not taken from the heap until Pika adds the channel, so asking twice gives the
+        same number, and a channel that failed to open does not lose its number.
         """
         # Our limit is the the Codec's Channel Max or MAX_CHANNELS if it's None
         limit = self.parameters.channel_max or pikachannel.MAX_CHANNELS
 
-        # generate a set of available channels
-        available = set(xrange(1, limit+1))
-
-        # subtract out existing channels
-        available.difference_update(self._channels.keys())
+        # lowest freed number, dropping any that have since been reused or marked bad
+        free = self._free_channel_numbers
+        while free and (free[0] in self._channels or free[0] in self._bad_channel_numbers):
+            self._free_channel_set.discard(heapq.heappop(free))
 
-        # also subtract out poison channels
-        available.difference_update(self._bad_channel_numbers)
+        if free:
+            ch_num = free[0]
+        else:
+            # above the high water mark
+            ch_num = self._channel_hwm + 1
+            while ch_num in self._bad_channel_numbers:
+                ch_num += 1
 
         # used all of our channels
-        if len(available) == 0:
+        if ch_num > limit:
             raise NoFreeChannels()
 
-        # get lowest available!
-        ch_num = min(available)
-
-        log.debug("_next_channel_number: %d (of %d possible, %d used, %d bad)", ch_num, len(available), len(self._channels), len(self._bad_channel_numbers))
+        log.debug("_next_channel_number: %d (%d used, %d bad)", ch_num, len(self._channels), len(self._bad_channel_numbers))
 
         return ch_num
 
@@ -175,20 +448,58 @@ class PyonSelectConnection(SelectConnection):
         log.debug("Marking %d as a bad channel", ch_number)
         self._bad_channel_numbers.add(ch_number)
 
-def make_node(connection_params=None):
+class ChannelMap(dict):
+    """
+    Pika's channel number -> channel dict, notifying the PyonSelectConnection of added and removed
+    channel numbers.
+    """
+    def __init__(self, channels, on_add, on_remove):
+        dict.__init__(self, channels)
+        self._on_add = on_add
+        self._on_remove = on_remove
+
+    def __setitem__(self, ch_number, chan):
+        dict.__setitem__(self, ch_number, chan)
+        self._on_add(ch_number)
+
+    def __delitem__(self, ch_number):
+        dict.__delitem__(self, ch_number)
+        self._on_remove(ch_number)
+
+    def pop(self, ch_number, *args):
+        had = ch_number in self
+        val = dict.pop(self, ch_number, *args)
+        if had:
+            self._on_remove(ch_number)
+        return val
+
+def make_node(connection_params=None, connections=None):
     """
     Blocking construction and connection of node.
 
     @param connection_params  AMQP connection parameters. By default, uses CFG.server.amqp (most common use).
+    @param connections        Number of AMQP connections, each with its own ioloop greenlet. Channels are
+                              spread across them (see NodeB). By default, uses CFG container.messaging.connections (1).
+    @returns                  The node and the ioloop greenlet of its first connection. Use node.stop_node()
+                              to close all connections.
     """
     log.debug("In make_node")
-    node = NodeB()
+    connections = connections or CFG.get_safe('container.messaging.connections', 1)
+    node = NodeB(connections=connections)
     connection_params = connection_params or CFG.server.amqp
     credentials = PlainCredentials(connection_params["username"], connection_params["password"])
     conn_parameters = ConnectionParameters(host=connection_params["host"], virtual_host=connection_params["vhost"], port=connection_params["port"], credentials=credentials)
-    connection = PyonSelectConnection(conn_parameters , node.on_connection_open)
-    ioloop_process = gevent.spawn(ioloop, connection)
-    #ioloop_process = gevent.spawn(connection.ioloop.start)
+
+    for x in xrange(connections):
+        # each connection reconnects on its own, if configured to
+        conn_kwargs = {}
+        if CFG.get_safe('container.messaging.reconnect', False):
+            conn_kwargs['reconnection_strategy'] = SimpleReconnectionStrategy()
+
+        connection = PyonSelectConnection(conn_parameters , node.on_connection_open, **conn_kwargs)
+        node._ioloops.append(gevent.spawn(ioloop, connection))
+        #ioloop_process = gevent.spawn(connection.ioloop.start)
+
     node.ready.wait()
-    return node, ioloop_process
+    return node, node._ioloops[0]
     #return node, ioloop, connection
@@ -11,7 +11,7 @@ from mock import Mock, sentinel, patch
 from pika import channel as pchannel
 from pika import BasicProperties
 from nose.plugins.attrib import attr
-from pyon.net.transport import NameTrio, BaseTransport
+from pyon.net.transport import NameTrio, BaseTransport, TransportError
 
 @attr('UNIT')
 class TestBaseChannel(PyonTestCase):
@@ -78,8 +78,11 @@ class TestBaseChannel(PyonTestCase):
         ch._amq_chan = Mock()
         ch._amq_chan.channel_number = 1
 
+        ch._transport = Mock(spec=BaseTransport)
         ch.on_channel_close(0, 'hi')
+        self.assertFalse(ch._transport.clear_declare_cache.called)
         ch.on_channel_close(1, 'onoes')
+        ch._transport.clear_declare_cache.assert_called_once_with()
 
     def test_get_channel_id(self):
         ch = BaseChannel()
@@ -215,6 +218,41 @@ class TestRecvChannel(PyonTestCase):
         mdq.assert_called_with(None)
         mb.assert_called_with(sentinel.binding2)
 
+    def test_setup_listener_pipelined(self):
+        transport = Mock(BaseTransport)
+        pipeline = transport.pipeline.return_value
+        pipeline.declare_queue_impl.return_value = 'xp.q'
+
+        ch = RecvChannel(transport=transport)
+        ch._amq_chan = sentinel.amq_chan
+
+        ch.setup_listener(NameTrio('xp', 'q'))
+
+        # all setup calls went through the pipeline, which was waited on once and closed
+        transport.pipeline.assert_called_once_with(sentinel.amq_chan)
+        self.assertTrue(pipeline.declare_exchange_impl.called)
+        self.assertTrue(pipeline.declare_queue_impl.called)
+        pipeline.bind_impl.assert_called_once_with(sentinel.amq_chan, exchange='xp', queue='xp.q', binding='xp.q')
+        pipeline.wait.assert_called_once_with()
+        pipeline.close.assert_called_once_with()
+
+        self.assertFalse(transport.declare_exchange_impl.called)
+        self.assertIsNone(ch._pipeline)
+
+    def test_setup_listener_pipeline_error(self):
+        transport = Mock(BaseTransport)
+        pipeline = transport.pipeline.return_value
+        pipeline.wait.side_effect = TransportError
+
+        ch = RecvChannel(transport=transport)
+        ch._amq_chan = sentinel.amq_chan
+
+        self.assertRaises(TransportError, ch.setup_listener, NameTrio('xp', 'q'))
+
+        pipeline.close.assert_called_once_with()
+        self.assertIsNone(ch._pipeline)
+        self.assertFalse(ch._setup_listener_called)
+
     def test__destroy_queue_no_recv_name(self):
         self.assertRaises(AssertionError, self.ch.destroy_listener)
 
@@ -274,6 +312,18 @@ class TestRecvChannel(PyonTestCase):
 
         ac.basic_consume.assert_called_once_with(self.ch._on_deliver, queue=sentinel.queue, no_ack=self.ch._consumer_no_ack, exclusive=self.ch._consumer_exclusive)
 
+    def test_start_consume_prefetch(self):
+        ch = RecvChannel(prefetch_count=10)
+        ch._amq_chan = Mock(pchannel.Channel)
+        ch._sync_call = Mock()
+        ch._recv_name = NameTrio(sentinel.xp, sentinel.queue)
+
+        ch.start_consume()
+
+        ch._sync_call.assert_called_once_with(ch._amq_chan.basic_qos, 'callback', prefetch_size=0, prefetch_count=10)
+        self.assertTrue(ch._qos_set)
+        self.assertEquals(ch.get_recv_stats()['prefetch_count'], 10)
+
     def test_start_consume_already_started(self):
         self.ch._consuming = True
         self.assertRaises(ChannelError, self.ch.start_consume)
@@ -316,6 +366,20 @@ class TestRecvChannel(PyonTestCase):
         self.assertTrue(ac.basic_cancel.called)
         self.assertIn(sentinel.consumer_tag, ac.basic_cancel.call_args[0])
 
+    def test_stop_consume_auto_delete_invalidates_queue(self):
+        ac = Mock(pchannel.Channel)
+        ac.basic_cancel.side_effect = lambda *args, **kwargs: kwargs.get('callback')()
+        self.ch._amq_chan = ac
+        self.ch._consuming = True
+        self.ch._queue_auto_delete = True
+        self.ch._recv_name = NameTrio(sentinel.xp, sentinel.queue)
+        self.ch._transport = Mock(spec=BaseTransport)
+
+        self.ch.stop_consume()
+
+        # the broker deletes the queue with its last consumer
+        self.ch._transport.invalidate_queue.assert_called_once_with(sentinel.queue)
+
     def test_stop_consume_havent_started(self):
         # we're not consuming, so this should raise
         self.assertRaises(ChannelError, self.ch.stop_consume)
@@ -333,6 +397,26 @@ class TestRecvChannel(PyonTestCase):
 
         self.assertTrue(rqmock.get.called)
 
+    @patch('pyon.net.channel.time')
+    def test_recv_stats(self, mocktime):
+        mocktime.time.side_effect = [10.0, 11.0, 13.5, 14.0]
+
+        self.ch._on_deliver(sentinel.chan, Mock(), Mock(), sentinel.body)
+        self.ch._on_deliver(sentinel.chan, Mock(), Mock(), sentinel.body)
+
+        stats = self.ch.get_recv_stats()
+        self.assertEquals(stats['delivered'], 2)
+        self.assertEquals(stats['depth'], 2)
+        self.assertEquals(stats['max_depth'], 2)
+
+        self.ch.recv()
+        self.ch.recv()
+
+        stats = self.ch.get_recv_stats()
+        self.assertEquals(stats['depth'], 0)
+        self.assertEquals(stats['time_in_queue'], 6.5)
+        self.assertEquals(stats['max_time_in_queue'], 3.5)
+
     def test_recv_shutdown(self):
         # replace recv_queue with a mock obj
         rqmock = Mock(spec=queue.Queue)
@@ -470,6 +554,52 @@ class TestRecvChannel(PyonTestCase):
         self.assertIn('requeue', ac.basic_reject.call_args[1])
         self.assertIn(True, ac.basic_reject.call_args[1].itervalues())
 
+    def test_set_qos(self):
+        ac = Mock(spec=pchannel.Channel)
+        self.ch._amq_chan = ac
+
+        def side(*args, **kwargs):
+            cb = kwargs.get('callback')
+            cb()
+
+        ac.basic_qos.side_effect = side
+
+        self.ch.set_qos(prefetch_count=5)
+
+        self.assertTrue(ac.basic_qos.called)
+        self.assertEquals(ac.basic_qos.call_args[1]['prefetch_count'], 5)
+        self.assertEquals(ac.basic_qos.call_args[1]['prefetch_size'], 0)
+
+        # the prefetch limit stays with the amq chan, the node pools it by the limit
+        self.assertTrue(self.ch.can_reuse_underlying_channel())
+        self.assertEquals(self.ch.get_underlying_qos(), (0, 5))
+
+    def test_can_reuse_underlying_channel(self):
+        self.assertFalse(self.ch.can_reuse_underlying_channel())
+
+        self.ch._amq_chan = Mock(spec=pchannel.Channel)
+        self.assertTrue(self.ch.can_reuse_underlying_channel())
+
+        # unacked deliveries
+        self.ch._on_deliver(sentinel.chan, Mock(), Mock(), sentinel.body)
+        self.assertFalse(self.ch.can_reuse_underlying_channel())
+
+        self.ch.ack(sentinel.delivery_tag)
+        self.assertTrue(self.ch.can_reuse_underlying_channel())
+
+    def test_detach_underlying_channel(self):
+        ac = Mock(spec=pchannel.Channel)
+        self.ch._amq_chan = ac
+        self.ch._consuming = True
+        self.ch.stop_consume = Mock()
+
+        self.assertEquals(self.ch.detach_underlying_channel(), ac)
+
+        self.ch.stop_consume.assert_called_once_with()
+        self.assertIsNone(self.ch._amq_chan)
+        self.assertFalse(ac.close.called)
+        self.assertRaises(ChannelClosedError, self.ch.recv)
+
 @attr('UNIT')
 @patch('pyon.net.channel.SendChannel')
 class TestPublisherChannel(PyonTestCase):
@@ -505,6 +635,64 @@ class TestPublisherChannel(PyonTestCase):
         self.assertEquals(mocksendchannel.send.call_count, 2)
         mocksendchannel.send.assert_called_with(pubchan, sentinel.data2, headers=None)
 
+    def test_send_many(self, mocksendchannel):
+        depmock = Mock()
+        pubchan = PublisherChannel()
+        pubchan._declare_exchange = depmock
+
+        pubchan._send_name = NameTrio(sentinel.xp, sentinel.routing_key)
+
+        pubchan.send_many([(sentinel.data, sentinel.headers), (sentinel.data2, None)])
+
+        depmock.assert_called_once_with(sentinel.xp)
+        self.assertEquals(mocksendchannel._send.call_count, 2)
+        mocksendchannel._send.assert_called_with(pubchan, pubchan._send_name, sentinel.data2, headers=None)
+
+        # explicit name
+        othername = NameTrio(sentinel.xp, sentinel.other_key)
+        pubchan.send_many([(sentinel.data3, None)], name=othername)
+
+        depmock.assert_called_once_with(sentinel.xp)
+        mocksendchannel._send.assert_called_with(pubchan, othername, sentinel.data3, headers=None)
+
+    def _confirm_frame(self, tag, multiple=False, name='Basic.Ack'):
+        frame = Mock()
+        frame.method.NAME = name
+        frame.method.delivery_tag = tag
+        frame.method.multiple = multiple
+        return frame
+
+    def test_confirms(self, mocksendchannel):
+        pubchan = PublisherChannel()
+        pubchan._amq_chan = Mock()
+        pubchan._send_name = NameTrio(sentinel.xp, sentinel.routing_key)
+        pubchan._declared = True
+
+        pubchan.enable_confirms()
+        pubchan._amq_chan.confirm_delivery.assert_called_once_with(callback=pubchan._on_confirm)
+
+        pubchan.send_many([(sentinel.data, None)] * 3)
+        self.assertEquals(pubchan._unconfirmed, set([1, 2, 3]))
+        self.assertRaises(ChannelError, pubchan.wait_for_confirms, timeout=0.01)
+
+        pubchan._on_confirm(self._confirm_frame(1))
+        pubchan._on_confirm(self._confirm_frame(3, multiple=True))
+        self.assertEquals(pubchan._unconfirmed, set())
+
+        pubchan.wait_for_confirms(timeout=0.01)
+
+    def test_confirms_nack(self, mocksendchannel):
+        pubchan = PublisherChannel()
+        pubchan._amq_chan = Mock()
+        pubchan._send_name = NameTrio(sentinel.xp, sentinel.routing_key)
+        pubchan._declared = True
+
+        pubchan.enable_confirms()
+        pubchan.send(sentinel.data)
+        pubchan._on_confirm(self._confirm_frame(1, name='Basic.Nack'))
+
+        self.assertRaises(ChannelError, pubchan.wait_for_confirms, timeout=0.01)
+
 @attr('UNIT')
 @patch('pyon.net.channel.SendChannel')
 class TestBidirClientChannel(PyonTestCase):
@@ -563,6 +751,17 @@ class TestListenChannel(PyonTestCase):
         cacmock.assert_called_once_with(sentinel.amq_chan, sentinel.msg)
         retch._recv_queue.put.assert_called_once_with(sentinel.msg)
 
+    def test_accept_ack_settles_delivery(self):
+        self.ch._amq_chan = Mock(spec=pchannel.Channel)
+        self.ch._on_deliver(sentinel.chan, Mock(), Mock(), sentinel.body)
+        self.assertEquals(self.ch._unacked, 1)
+
+        retch = self.ch.accept()
+        retch.ack(sentinel.delivery_tag)
+
+        # the delivery was on the listening channel
+        self.assertEquals(self.ch._unacked, 0)
+
 @attr('UNIT')
 class TestSusbcriberChannel(PyonTestCase):
     """
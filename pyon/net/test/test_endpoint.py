@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 from pyon.core.interceptor.interceptor import Invocation
+from pyon.core.interceptor.codec import LazyPayload
 from pyon.net.transport import NameTrio
 
 __author__ = 'Dave Foster <dfoster@asascience.com>'
@@ -10,8 +11,8 @@ from zope.interface.declarations import implements
 from zope.interface.interface import Interface
 from pyon.core import exception
 from pyon.net import endpoint
-from pyon.net.channel import BaseChannel, SendChannel, BidirClientChannel, SubscriberChannel, ChannelClosedError, ServerChannel
-from pyon.net.endpoint import EndpointUnit, BaseEndpoint, RPCServer, Subscriber, Publisher, RequestResponseClient, RequestEndpointUnit, RPCRequestEndpointUnit, RPCClient, RPCResponseEndpointUnit, EndpointError, SendingBaseEndpoint
+from pyon.net.channel import BaseChannel, SendChannel, PublisherChannel, BidirClientChannel, SubscriberChannel, ChannelClosedError, ServerChannel, SharedReplyChannel
+from pyon.net.endpoint import EndpointUnit, BaseEndpoint, RPCServer, Subscriber, Publisher, RequestResponseClient, RequestEndpointUnit, RPCRequestEndpointUnit, RPCClient, RPCResponseEndpointUnit, EndpointError, SendingBaseEndpoint, ReplyDispatcher, PublisherEndpointUnit
 from gevent import event, sleep
 from pyon.net.messaging import NodeB
 from pyon.service.service import BaseService
@@ -100,6 +101,62 @@ class TestEndpointUnit(PyonTestCase):
         self.assertTrue(self._endpoint_unit._intercept_msg_in.called)
         self.assertTrue(self._endpoint_unit.message_received.called)
 
+    def test__message_received_lazy_payload(self):
+        self._endpoint_unit._build_invocation = Mock()
+        self._endpoint_unit._intercept_msg_in = Mock()
+        self._endpoint_unit.message_received  = Mock()
+        self._endpoint_unit._lazy_payload = True
+
+        self._endpoint_unit._message_received(sentinel.msg, sentinel.headers)
+
+        self._endpoint_unit._build_invocation.assert_called_once_with(path=Invocation.PATH_IN,
+                                                                      message=sentinel.msg,
+                                                                      headers=sentinel.headers,
+                                                                      lazy_payload=True)
+
+    def test__intercept_msg_in_out(self):
+        icpt = Mock()
+        icpt.incoming.return_value = sentinel.inv_in
+        icpt.outgoing.return_value = sentinel.inv_out
+
+        with patch.dict(endpoint.interceptors, {'message_incoming': [icpt], 'message_outgoing': [icpt]}):
+            self.assertEquals(self._endpoint_unit._intercept_msg_in(sentinel.inv), sentinel.inv_in)
+            self.assertEquals(self._endpoint_unit._intercept_msg_out(sentinel.inv), sentinel.inv_out)
+
+        icpt.incoming.assert_called_once_with(sentinel.inv)
+        icpt.outgoing.assert_called_once_with(sentinel.inv)
+
+    def test__intercept_msg_skips_disabled(self):
+        icpt = Mock()
+        icpt.enabled = False
+
+        with patch.dict(endpoint.interceptors, {'message_incoming': [icpt]}):
+            self.assertEquals(self._endpoint_unit._intercept_msg_in(sentinel.inv), sentinel.inv)
+
+        self.assertFalse(icpt.incoming.called)
+
+    def test_get_interceptor_pipeline_cached(self):
+        icpt = Mock()
+
+        with patch.dict(endpoint.interceptors, {'message_incoming': [icpt]}):
+            pipeline = endpoint.get_interceptor_pipeline(('message_incoming',), Invocation.PATH_IN)
+            self.assertEquals(pipeline, (icpt.incoming,))
+            self.assertTrue(endpoint.get_interceptor_pipeline(('message_incoming',), Invocation.PATH_IN) is pipeline)
+
+            # replacing the stack rebuilds the pipeline
+            icpt2 = Mock()
+            endpoint.interceptors['message_incoming'] = [icpt2]
+            self.assertEquals(endpoint.get_interceptor_pipeline(('message_incoming',), Invocation.PATH_IN), (icpt2.incoming,))
+
+    def test_get_interceptor_pipeline_order(self):
+        msg_icpt = Mock()
+        proc_icpt = Mock()
+
+        with patch.dict(endpoint.interceptors, {'message_outgoing': [msg_icpt], 'process_outgoing': [proc_icpt]}):
+            pipeline = endpoint.get_interceptor_pipeline(('process_outgoing', 'message_outgoing'), Invocation.PATH_OUT)
+
+        self.assertEquals(pipeline, (proc_icpt.outgoing, msg_icpt.outgoing))
+
 @attr('UNIT')
 @patch.dict(endpoint.interceptors, no_interceptors, clear=True)
 class TestBaseEndpoint(PyonTestCase):
@@ -208,7 +265,7 @@ class TestPublisher(PyonTestCase):
     def setUp(self):
         self._node = Mock(spec=NodeB)
         self._pub = Publisher(node=self._node, to_name="testpub")
-        self._ch = Mock(spec=SendChannel)
+        self._ch = Mock(spec=PublisherChannel)
         self._node.channel.return_value = self._ch
 
     def test_publish(self):
@@ -223,6 +280,82 @@ class TestPublisher(PyonTestCase):
         self._node.channel.assert_called_once_with(self._pub.channel_type)
         self.assertEquals(self._ch.send.call_count, 2)
 
+    def test_publish_many(self):
+        self._pub.publish_many(["one", "two", "three"])
+
+        self._node.channel.assert_called_once_with(self._pub.channel_type)
+        self.assertEquals(self._ch.send.call_count, 0)
+        self._ch.send_many.assert_called_once_with([("one", {}), ("two", {}), ("three", {})], name=None)
+
+    def test_publish_many_same_exchange_reuses_channel(self):
+        self._pub.publish_many(["one"], to_name="other_key")
+
+        self._node.channel.assert_called_once_with(self._pub.channel_type)
+        self.assertEquals(self._ch.send_many.call_args[1]['name'].binding, "other_key")
+        self.assertEquals(self._ch.close.call_count, 0)
+
+    def test_publish_many_other_exchange(self):
+        self._pub.publish_many(["one"], to_name=("other_xp", "other_key"))
+
+        self.assertEquals(self._ch.connect.call_count, 1)
+        self.assertEquals(self._ch.connect.call_args[0][0].exchange, "other_xp")
+        self._ch.send_many.assert_called_once_with([("one", {})], name=None)
+        self._ch.close.assert_called_once_with()
+
+    def test_publish_fanout(self):
+        self._pub._ensure_pub_ep()
+        self._pub.create_endpoint = Mock(wraps=self._pub.create_endpoint)
+
+        with patch.object(PublisherEndpointUnit, '_intercept_msg_out', side_effect=lambda inv: inv) as mockicpt:
+            self._pub.publish_fanout(["one", "two"], ["key1", "key2", ("other_xp", "key3")])
+
+        # each message intercepted once, not once per name
+        self.assertEquals(mockicpt.call_count, 2)
+
+        self.assertEquals(self._ch.send_many.call_count, 3)
+        self.assertEquals(self._ch.send_many.call_args_list[0][0][0], [("one", {}), ("two", {})])
+        self.assertEquals(self._ch.send_many.call_args_list[0][1]['name'].binding, "key1")
+        self.assertEquals(self._ch.send_many.call_args_list[1][1]['name'].binding, "key2")
+
+        # the other exchange gets its own, closed channel
+        self.assertEquals(self._pub.create_endpoint.call_args[0][0].exchange, "other_xp")
+        self._ch.close.assert_called_once_with()
+
+    def test_publish_buffered(self):
+        pub = Publisher(node=self._node, to_name="testpub", buffer_size=3, buffer_latency=60)
+
+        pub.publish("one")
+        pub.publish("two")
+        self.assertEquals(self._ch.send_many.call_count, 0)
+        self.assertEquals(self._ch.send.call_count, 0)
+
+        pub.publish("three")
+        self._ch.send_many.assert_called_once_with([("one", {}), ("two", {}), ("three", {})], name=None)
+
+        # leftovers are sent on close
+        pub.publish("four")
+        pub.close()
+        self.assertEquals(self._ch.send_many.call_count, 2)
+        self._ch.send_many.assert_called_with([("four", {})], name=None)
+
+    def test_publish_buffered_latency(self):
+        pub = Publisher(node=self._node, to_name="testpub", buffer_size=100, buffer_latency=0.01)
+
+        pub.publish("one")
+        self.assertEquals(self._ch.send_many.call_count, 0)
+
+        sleep(0.1)
+        self._ch.send_many.assert_called_once_with([("one", {})], name=None)
+
+    def test_publish_confirm(self):
+        pub = Publisher(node=self._node, to_name="testpub", confirm=True)
+
+        pub.publish_many(["one", "two"])
+        pub.publish_many(["three"])
+
+        self._ch.enable_confirms.assert_called_once_with()
+        self.assertEquals(self._ch.wait_for_confirms.call_count, 2)
+
 class RecvMockMixin(object):
     """
     Helper mixin to get a properly mocked receiving channel into several tests.
@@ -270,6 +403,13 @@ class TestSubscriber(PyonTestCase, RecvMockMixin):
         e = sub.create_endpoint()
 
         self.assertEquals(e._callback, mycb)
+        self.assertFalse(e._lazy_payload)
+
+    def test_create_endpoint_lazy_payload(self):
+        sub = Subscriber(node=self._node, from_name="testsub", callback=Mock(), lazy_payload=True)
+        e = sub.create_endpoint()
+
+        self.assertTrue(e._lazy_payload)
 
     def test_subscribe(self):
         """
@@ -292,6 +432,94 @@ class TestSubscriber(PyonTestCase, RecvMockMixin):
         # make sure we got our message
         cbmock.assert_called_once_with('subbed', {'status_code':200, 'error_message':'', 'op': None})
 
+    def test_subscribe_concurrent(self):
+        """
+        With concurrency > 1, messages are handled in a pool and the prefetch is at least the pool size.
+        """
+        cbmock = Mock()
+        sub = Subscriber(node=self._node, from_name="testsub", callback=cbmock, concurrency=4)
+
+        listen_channel_mock = self._setup_mock_channel(ch_type=SubscriberChannel, value="subbed", error_message="")
+        sub.node.channel.return_value = listen_channel_mock
+        listen_channel_mock.accept.return_value = listen_channel_mock
+
+        sub.listen()
+
+        listen_channel_mock.set_qos.assert_called_once_with(prefetch_size=0, prefetch_count=50)
+        cbmock.assert_called_once_with('subbed', {'status_code':200, 'error_message':'', 'op': None})
+        listen_channel_mock.ack.assert_called_once_with(sentinel.delivery_tag)
+
+        stats = sub.get_stats()
+        self.assertEquals(stats['received'], 1)
+        self.assertEquals(stats['in_flight'], 0)
+        self.assertEquals(stats['max_in_flight'], 1)
+        self.assertEquals(stats['concurrency'], 4)
+
+    def test_subscribe_prefetch(self):
+        cbmock = Mock()
+        listen_channel_mock = self._setup_mock_channel(ch_type=SubscriberChannel, value="subbed", error_message="")
+        self._node.channel.return_value = listen_channel_mock
+        listen_channel_mock.accept.return_value = listen_channel_mock
+
+        # raised to the concurrency
+        sub = Subscriber(node=self._node, from_name="testsub", callback=cbmock, concurrency=4, prefetch_count=2)
+        self.assertEquals(sub._get_prefetch(), (4, 0))
+
+        # 0 is no limit, no qos at all
+        sub = Subscriber(node=self._node, from_name="testsub", callback=cbmock, prefetch_count=0)
+        sub.listen()
+
+        self.assertFalse(listen_channel_mock.set_qos.called)
+        self.assertIn('recv_queue', sub.get_stats())
+
+    @patch('pyon.net.messaging.blocking_cb')
+    def test_subscribe_default_reuses_pooled_channel(self, bcbmock):
+        """
+        A default configured Subscriber sets a prefetch limit on its channel. The node still reuses the
+        AMQP channel for the next Subscriber with the same limit, without setting it again.
+        """
+        node = NodeB()
+        node.client = Mock()
+        amq_chan = Mock()
+        bcbmock.return_value = amq_chan
+
+        def setup_listener(ch, name, binding=None):
+            ch._recv_name = name
+
+        with patch.object(SubscriberChannel, 'setup_listener', setup_listener):
+            with patch.object(SubscriberChannel, '_sync_call') as sync_call_mock:
+                with patch.object(SubscriberChannel, 'recv', side_effect=ChannelClosedError):
+                    for x in xrange(2):
+                        sub = Subscriber(node=node, from_name="testsub", callback=Mock())
+                        sub.listen()
+                        self.assertEquals(sub._chan.get_underlying_qos(), (0, Subscriber.default_prefetch_count))
+                        sub.close()
+
+        self.assertEquals(bcbmock.call_count, 1)
+        qos_calls = [call for call in sync_call_mock.call_args_list if call[0][0] == amq_chan.basic_qos]
+        self.assertEquals(len(qos_calls), 1)
+
+        stats = node.get_channel_pool_stats()
+        self.assertEquals(stats['misses'], 1)
+        self.assertEquals(stats['hits'], 1)
+        self.assertEquals(stats['idle'], 1)
+
+    def test_subscribe_concurrent_error_in_callback(self):
+        """
+        A failing handler in the pool is logged and acked but does not stop the listen loop.
+        """
+        cbmock = Mock(side_effect=StandardError)
+        sub = Subscriber(node=self._node, from_name="testsub", callback=cbmock, concurrency=2)
+
+        listen_channel_mock = self._setup_mock_channel(ch_type=SubscriberChannel, value="subbed", error_message="")
+        sub.node.channel.return_value = listen_channel_mock
+        listen_channel_mock.accept.return_value = listen_channel_mock
+
+        sub.listen()
+
+        self.assertEquals(cbmock.call_count, 1)
+        listen_channel_mock.ack.assert_called_once_with(sentinel.delivery_tag)
+
 @attr('UNIT')
 @patch.dict(endpoint.interceptors, no_interceptors, clear=True)
 class TestRequestResponse(PyonTestCase, RecvMockMixin):
@@ -396,6 +624,106 @@ class TestRPCClient(PyonTestCase, RecvMockMixin):
         rpcc = RPCClient(to_name="simply", iface=ISimpleInterface)
         self.assertRaises(AssertionError, rpcc.simple, "zap", "zip")
 
+@attr('UNIT')
+@patch.dict(endpoint.interceptors, no_interceptors, clear=True)
+class TestReplyDispatcher(PyonTestCase):
+
+    def _setup_dispatcher(self, replies):
+        """
+        Builds a started ReplyDispatcher over a mocked SharedReplyChannel that delivers the given
+        (msg, headers, delivery_tag) replies, then closes.
+        """
+        ch = Mock(spec=SharedReplyChannel)
+        vals = list(reversed(replies))
+        def _ret(*args, **kwargs):
+            if len(vals):
+                return vals.pop()
+            raise ChannelClosedError()
+        ch.recv.side_effect = _ret
+
+        node = Mock(spec=NodeB)
+        node.channel.return_value = ch
+
+        disp = ReplyDispatcher(node)
+        return disp, ch
+
+    def test_dispatch_by_conv_id(self):
+        disp, ch = self._setup_dispatcher([('reply-two', {'conv-id':'two'}, sentinel.dtag_two),
+                                           ('reply-one', {'conv-id':'one'}, sentinel.dtag_one)])
+        ar_one = disp.register('one')
+        ar_two = disp.register('two')
+
+        disp.start()
+
+        self.assertEquals(ar_one.get(timeout=1), ('reply-one', {'conv-id':'one'}))
+        self.assertEquals(ar_two.get(timeout=1), ('reply-two', {'conv-id':'two'}))
+        ch.ack.assert_any_call(sentinel.dtag_one)
+        ch.ack.assert_any_call(sentinel.dtag_two)
+
+    def test_unknown_conv_id_is_acked_and_dropped(self):
+        disp, ch = self._setup_dispatcher([('late', {'conv-id':'expired'}, sentinel.dtag)])
+        disp.start()
+        disp._recv_greenlet.join(timeout=1)
+
+        ch.ack.assert_called_once_with(sentinel.dtag)
+        self.assertFalse(disp.is_running())
+
+    def test_register_duplicate_conv_id(self):
+        disp, ch = self._setup_dispatcher([])
+        disp.register('one')
+        self.assertRaises(EndpointError, disp.register, 'one')
+
+    def test_pending_fails_on_close(self):
+        disp, ch = self._setup_dispatcher([])
+        ar = disp.register('one')
+        disp.start()
+
+        self.assertRaises(ChannelClosedError, ar.get, timeout=1)
+
+    def test_multiplexed_send(self):
+        disp = Mock(spec=ReplyDispatcher)
+        disp.register.return_value = event.AsyncResult()
+        disp.register.return_value.set(('bidirmsg', {'status_code':200, 'error_message':'', 'conv-id':sentinel.conv_id}))
+
+        e = RPCRequestEndpointUnit(reply_dispatcher=disp)
+        ch = Mock(spec=SharedReplyChannel.RequestChannel)
+        ch._send_name = NameTrio('', '')
+        e.attach_channel(ch)
+
+        ret, heads = e.send("rpc call")
+        self.assertEquals(ret, 'bidirmsg')
+
+        conv_id = ch.send.call_args[0][1]['conv-id']
+        disp.register.assert_called_once_with(conv_id)
+        disp.unregister.assert_called_once_with(conv_id)
+        self.assertEquals(ch.setup_listener.call_count, 0)
+
+    def test_multiplexed_send_timeout(self):
+        disp = Mock(spec=ReplyDispatcher)
+        disp.register.return_value = event.AsyncResult()
+
+        e = RPCRequestEndpointUnit(reply_dispatcher=disp)
+        ch = Mock(spec=SharedReplyChannel.RequestChannel)
+        ch._send_name = NameTrio('', '')
+        e.attach_channel(ch)
+
+        self.assertRaises(exception.Timeout, e.send, "rpc call", timeout=0.1)
+        self.assertEquals(disp.unregister.call_count, 1)
+
+    @patch('pyon.net.endpoint.ReplyDispatcher.get_instance')
+    def test_rpc_client_shared_reply_queue(self, gimock):
+        node = Mock(spec=NodeB)
+        disp = gimock.return_value
+        disp.create_channel.return_value = Mock(spec=SharedReplyChannel.RequestChannel)
+
+        rpcc = RPCClient(node=node, to_name="simply", iface=ISimpleInterface, shared_reply_queue=True)
+        e = rpcc.create_endpoint()
+
+        gimock.assert_called_once_with(node)
+        self.assertEquals(e.channel, disp.create_channel.return_value)
+        self.assertEquals(e._reply_dispatcher, disp)
+        self.assertEquals(node.channel.call_count, 0)
+
 @attr('UNIT')
 @patch.dict(endpoint.interceptors, no_interceptors, clear=True)
 class TestRPCResponseEndpoint(PyonTestCase, RecvMockMixin):
@@ -478,6 +806,18 @@ class TestRPCResponseEndpoint(PyonTestCase, RecvMockMixin):
                                                'receiver': ',',
                                                'reply-by': 'todo'})
 
+    def test_message_received_lazy_payload(self):
+        self._ar = event.AsyncResult()
+        deserializer = Mock()
+        deserializer.deserialize.side_effect = lambda raw: raw
+
+        e = RPCResponseEndpointUnit(routing_obj=self, lazy_payload=True)
+        e.message_received(LazyPayload({'named': ["ein", "zwei"]}, deserializer), {'op': 'simple'})
+
+        # ops are called with the resolved payload
+        self.assertEquals(self._ar.get(), ["ein", "zwei"])
+        deserializer.deserialize.assert_called_once_with(["ein", "zwei"])
+
     def test__message_received_interceptor_exception(self):
         e = RPCResponseEndpointUnit(routing_obj=self)
         e.send = Mock()
@@ -493,6 +833,17 @@ class TestRPCResponseEndpoint(PyonTestCase, RecvMockMixin):
                                                   'protocol':'',
                                                   'performative': 'failure'})
 
+    def test__message_received_keeps_encoding(self):
+        e = RPCResponseEndpointUnit(routing_obj=self)
+        e.send = Mock()
+        with patch('pyon.net.endpoint.ResponseEndpointUnit._message_received', new=Mock(return_value=(sentinel.result, {}))):
+            e._message_received(sentinel.msg, {'encoding':'ion-msgpack'})
+
+        e.send.assert_called_once_with(sentinel.result, {'conv-id': '',
+                                                         'conv-seq': 2,
+                                                         'protocol':'',
+                                                         'encoding':'ion-msgpack'})
+
     def error_op(self):
         """
         Routing method for next test, raises an IonException.
@@ -4,7 +4,7 @@ __author__ = 'Dave Foster <dfoster@asascience.com>'
 __license__ = 'Apache 2.0'
 
 from pyon.net.messaging import NodeB, ioloop, make_node, PyonSelectConnection
-from pyon.net.channel import BaseChannel, BidirClientChannel
+from pyon.net.channel import BaseChannel, BidirClientChannel, PublisherChannel, SubscriberChannel
 from pyon.util.unit_test import PyonTestCase
 from mock import Mock, sentinel, patch
 from nose.plugins.attrib import attr
@@ -42,7 +42,7 @@ class TestNodeB(PyonTestCase):
 
         # setup pool/map
         self._node._bidir_pool[ourchid] = chm
-        self._node._pool_map[5]         = ourchid
+        self._node._pool_map[chm]       = ourchid
 
         # make the call
         self._node.on_channel_request_close(chm)
@@ -63,7 +63,7 @@ class TestNodeB(PyonTestCase):
 
         # setup pool/map
         self._node._bidir_pool[ourchid] = chm
-        self._node._pool_map[5]         = ourchid
+        self._node._pool_map[chm]       = ourchid
 
         # make the call
         self._node.on_channel_request_close(chm)
@@ -105,7 +105,7 @@ class TestNodeB(PyonTestCase):
 
             # should expect to see this show up in the node's mappings
             self.assertIn(ch, self._node._bidir_pool.itervalues())
-            self.assertIn(sentinel.chid, self._node._pool_map)
+            self.assertIn(ch, self._node._pool_map)
             self.assertEquals(len(self._node._pool_map), 1)
             self.assertEquals(len(self._node._pool_map), len(self._node._bidir_pool))
 
@@ -123,7 +123,7 @@ class TestNodeB(PyonTestCase):
         self.assertEquals(ch2.get_channel_id(), sentinel.chid2)
         self.assertNotEqual(ch, ch2)
         self.assertIn(ch2, self._node._bidir_pool.itervalues())
-        self.assertIn(sentinel.chid2, self._node._pool_map)
+        self.assertIn(ch2, self._node._pool_map)
         self.assertEquals(len(self._node._pool_map), 2)
         self.assertEquals(len(self._node._pool_map), len(self._node._bidir_pool))
 
@@ -156,7 +156,7 @@ class TestNodeB(PyonTestCase):
         self.assertEquals(len(self._node._pool_map), 1)
 
         # ch2 still active so it should be in the pool map
-        self.assertIn(sentinel.chid2, self._node._pool_map)
+        self.assertIn(ch2, self._node._pool_map)
 
     @patch('pyon.net.messaging.blocking_cb', return_value=sentinel.amq_chan)
     def test_channel_pool_release_reacquire(self, bcbmock):
@@ -230,6 +230,244 @@ class TestMessaging(PyonTestCase):
         self.assertEquals(ilp, sentinel.ioloop_process)
         gevmock.assert_called_once_with(ioloop, sentinel.connection)
 
+    @patch('pyon.net.messaging.gevent.spawn')
+    def test_make_node_multiple_connections(self, gevmock):
+        connection_params = { 'username': sentinel.username,
+                              'password': sentinel.password,
+                              'host': str(sentinel.host),
+                              'vhost': sentinel.vhost,
+                              'port': 2111 }
+        gevmock.side_effect = lambda func, conn: conn.ioloop_process
+
+        def select_connection(params, cb):
+            cm = Mock()
+            cm._channels = {}
+            cb(cm)
+            return cm
+
+        with patch('pyon.net.messaging.PyonSelectConnection', new=select_connection):
+            node, ilp = make_node(connection_params, connections=3)
+
+        self.assertEquals(gevmock.call_count, 3)
+        self.assertEquals(len(node.get_connection_stats()), 3)
+        self.assertEquals(ilp, node.client.ioloop_process)
+
+    @patch('pyon.net.messaging.blocking_cb')
+    def test_channel_pooled_types(self, bcbmock):
+        amq_chan = Mock()
+        amq_chan.channel_number = 5
+        bcbmock.return_value = amq_chan
+        self._node.client = Mock()
+
+        ch = self._node.channel(PublisherChannel)
+        ch.close()
+
+        # the AMQP channel is kept and reused, by any of the pooled types
+        ch2 = self._node.channel(SubscriberChannel)
+        self.assertNotEquals(ch, ch2)
+        self.assertEquals(ch2._amq_chan, amq_chan)
+        self.assertEquals(bcbmock.call_count, 1)
+        self.assertFalse(amq_chan.close.called)
+
+        stats = self._node.get_channel_pool_stats()
+        self.assertEquals(stats['misses'], 1)
+        self.assertEquals(stats['hits'], 1)
+        self.assertEquals(stats['released'], 1)
+        self.assertEquals(stats['idle'], 0)
+
+    @patch('pyon.net.messaging.blocking_cb')
+    def test_channel_pooled_types_qos(self, bcbmock):
+        bcbmock.side_effect = lambda *args, **kwargs: Mock()
+        self._node.client = Mock()
+
+        ch = self._node.channel(SubscriberChannel, prefetch_count=50)
+        ch._sync_call = Mock()
+        ch.set_qos(prefetch_count=50)
+        amq_chan = ch._amq_chan
+        ch.close()
+
+        # a prefetch limit can't be reset, only reused for the same limit
+        pub = self._node.channel(PublisherChannel)
+        self.assertNotEquals(pub._amq_chan, amq_chan)
+
+        ch2 = self._node.channel(SubscriberChannel, prefetch_count=50)
+        self.assertEquals(ch2._amq_chan, amq_chan)
+        self.assertEquals(bcbmock.call_count, 2)
+        self.assertTrue(ch2._qos_set)
+        self.assertEquals(ch2.get_underlying_qos(), (0, 50))
+
+    @patch('pyon.net.messaging.blocking_cb')
+    def test_channel_pooled_types_not_reusable(self, bcbmock):
+        bcbmock.return_value = Mock()
+        self._node.client = Mock()
+
+        ch = self._node.channel(PublisherChannel)
+        ch._confirms = True
+        ch.close()
+
+        # confirm mode stays with the AMQP channel, it gets closed
+        self.assertTrue(bcbmock.return_value.close.called)
+        self.assertEquals(self._node.get_channel_pool_stats()['closed'], 1)
+        self.assertEquals(self._node.get_channel_pool_stats()['idle'], 0)
+
+    @patch('pyon.net.messaging.blocking_cb')
+    def test_channel_pooled_types_max_idle(self, bcbmock):
+        self._node = NodeB(chan_pool_max_idle=1)
+        self._node.client = Mock()
+
+        bcbmock.return_value = Mock()
+        ch = self._node.channel(PublisherChannel)
+        bcbmock.return_value = Mock()
+        ch2 = self._node.channel(PublisherChannel)
+
+        ch.close()
+        ch2.close()
+
+        # the pool is full when the second one is closed
+        self.assertTrue(bcbmock.return_value.close.called)
+
+        stats = self._node.get_channel_pool_stats()
+        self.assertEquals(stats['released'], 1)
+        self.assertEquals(stats['closed'], 1)
+        self.assertEquals(stats['idle'], 1)
+
+    @patch('pyon.net.messaging.blocking_cb')
+    def test_channel_pooled_types_evict_idle(self, bcbmock):
+        amq_chan = Mock()
+        bcbmock.return_value = amq_chan
+        self._node.client = Mock()
+
+        self._node.channel(PublisherChannel).close()
+
+        # pretend it has been idle for a long time
+        self._node._idle_chans[0] = (amq_chan, 0, (0, 0))
+
+        self._node.channel(PublisherChannel)
+
+        self.assertTrue(amq_chan.close.called)
+        stats = self._node.get_channel_pool_stats()
+        self.assertEquals(stats['evicted'], 1)
+        self.assertEquals(stats['misses'], 2)
+        self.assertEquals(stats['hits'], 0)
+
+    def test_channel_pool_stats_bidir(self):
+        ncm = Mock()
+        ncm.return_value = Mock(spec=BidirClientChannel)
+        ncm.return_value._queue_auto_delete = False
+        ncm.return_value.get_channel_id.return_value = sentinel.chid
+
+        with patch('pyon.net.messaging.NodeB._new_channel', ncm):
+            ch = self._node.channel(BidirClientChannel)
+            with patch('pyon.net.messaging.log'):
+                self._node.on_channel_request_close(ch)
+            self._node.channel(BidirClientChannel)
+
+        stats = self._node.get_channel_pool_stats()
+        self.assertEquals(stats['misses'], 1)
+        self.assertEquals(stats['hits'], 1)
+        self.assertEquals(stats['bidir'], 1)
+
+    def _open_clients(self, count):
+        self._node = NodeB(connections=count)
+        clients = []
+        for x in xrange(count):
+            client = Mock()
+            client._channels = {}
+            self._node.on_connection_open(client)
+            clients.append(client)
+        return clients
+
+    def test_on_connection_open_multiple(self):
+        self._node = NodeB(connections=2)
+        c1, c2 = Mock(), Mock()
+
+        self._node.on_connection_open(c1)
+        self.assertFalse(self._node.ready.is_set())
+
+        self._node.on_connection_open(c2)
+        self.assertTrue(self._node.ready.is_set())
+        self.assertEquals(self._node.client, c1)
+
+    def test__next_client_round_robin(self):
+        c1, c2, c3 = self._open_clients(3)
+
+        self.assertEquals([self._node._next_client() for x in xrange(6)], [c1, c2, c3, c1, c2, c3])
+
+        # down connections are skipped
+        self._node._on_client_close(c2)
+        self.assertNotIn(c2, [self._node._next_client() for x in xrange(6)])
+
+        # until they reconnect
+        self._node.on_connection_open(c2)
+        self.assertIn(c2, [self._node._next_client() for x in xrange(6)])
+
+    def test__next_client_least_loaded(self):
+        c1, c2 = self._open_clients(2)
+        self._node._connection_policy = NodeB.POLICY_LEAST_LOADED
+        c1._channels.update({1: sentinel.ch1, 2: sentinel.ch2})
+        c2._channels.update({1: sentinel.ch1})
+
+        self.assertEquals(self._node._next_client(), c2)
+
+    @patch('pyon.net.messaging.blocking_cb')
+    def test__new_channel_multiple_connections(self, bcbmock):
+        c1, c2 = self._open_clients(2)
+
+        self._node._new_channel(BaseChannel)
+        self._node._new_channel(BaseChannel)
+        self._node._new_channel(BaseChannel)
+
+        self.assertEquals([call[0][0] for call in bcbmock.call_args_list], [c1.channel, c2.channel, c1.channel])
+
+        c1.bytes_sent = 10
+        self._node._on_client_close(c1)
+        self._node.on_connection_open(c1)
+
+        stats = self._node.get_connection_stats()
+        self.assertEquals(len(stats), 2)
+        self.assertEquals(stats[0]['channels_opened'], 2)
+        self.assertEquals(stats[0]['reconnects'], 1)
+        self.assertEquals(stats[0]['bytes_sent'], 10)
+        self.assertTrue(stats[0]['up'])
+        self.assertEquals(stats[1]['channels_opened'], 1)
+
+    @patch('pyon.net.messaging.blocking_cb')
+    def test_channel_pool_multiple_connections(self, bcbmock):
+        c1, c2 = self._open_clients(2)
+        # each connection numbers its channels from 1
+        bcbmock.side_effect = lambda *args, **kwargs: Mock(channel_number=1)
+
+        ch1 = self._node.channel(BidirClientChannel)
+        ch2 = self._node.channel(BidirClientChannel)
+        self.assertEquals(ch1.get_channel_id(), ch2.get_channel_id())
+        self.assertEquals(len(self._node._pool_map), 2)
+        chid2 = self._node._pool_map[ch2]
+
+        with patch('pyon.net.messaging.log'):
+            ch1.stop_consume = Mock()
+            self._node.on_channel_request_close(ch1)
+            self.assertEquals(self._node._pool_map, {ch2: chid2})
+
+            ch2.stop_consume = Mock()
+            self._node.on_channel_request_close(ch2)
+        self.assertEquals(self._node._pool_map, {})
+
+        # both back in the pool
+        self.assertIn(self._node.channel(BidirClientChannel), (ch1, ch2))
+        self.assertIn(self._node.channel(BidirClientChannel), (ch1, ch2))
+        self.assertEquals(bcbmock.call_count, 2)
+
+    def test_stop_node(self):
+        c1, c2 = self._open_clients(2)
+        self._node._ioloops = [Mock(), Mock()]
+
+        self._node.stop_node()
+
+        for client, ioloop_gl in zip((c1, c2), self._node._ioloops):
+            client.close.assert_called_once_with()
+            ioloop_gl.kill.assert_called_once_with()
+            client.ioloop.start.assert_called_once_with()
+
 @attr('UNIT')
 class TestPyonSelectConnection(PyonTestCase):
 
@@ -311,3 +549,28 @@ class TestPyonSelectConnection(PyonTestCase):
                 self.conn.mark_bad_channel(x)
 
         self.assertRaises(NoFreeChannels, self.conn._next_channel_number)
+
+    def test__next_channel_number_channel_popped(self):
+        self.conn._channels[1] = sentinel.chan1
+        self.conn._channels[2] = sentinel.chan2
+
+        self.conn._channels.pop(1)
+
+        self.assertEquals(self.conn._next_channel_number(), 1)
+
+    def test__next_channel_number_channels_reset(self):
+        self.conn._channels[1] = sentinel.chan1
+
+        # as on reconnect, pika starts over with a new dict
+        self.conn._channels = {2: sentinel.chan2, 4: sentinel.chan4}
+
+        self.assertEquals(self.conn._next_channel_number(), 1)
+        self.conn._channels[1] = sentinel.any
+        self.assertEquals(self.conn._next_channel_number(), 3)
+        self.conn._channels[3] = sentinel.any
+        self.assertEquals(self.conn._next_channel_number(), 5)
+
+    def test__next_channel_number_asked_twice(self):
+        # not taken until pika adds the channel
+        self.assertEquals(self.conn._next_channel_number(), 1)
+        self.assertEquals(self.conn._next_channel_number(), 1)
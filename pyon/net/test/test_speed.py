@@ -22,8 +22,12 @@ class TestMessagingSpeed(IonIntegrationTestCase):
         self._stop_container()
 
     def test_rpc_speed(self):
-        hsc = HelloServiceClient()
+        self._test_rpc_speed(HelloServiceClient(), "Requests per second (RPC):")
 
+    def test_rpc_speed_shared_reply_queue(self):
+        self._test_rpc_speed(HelloServiceClient(shared_reply_queue=True), "Requests per second (RPC, shared reply queue):")
+
+    def _test_rpc_speed(self, hsc, label):
         print >>sys.stderr, ""
 
         self.counter = 0
@@ -46,7 +50,7 @@ class TestMessagingSpeed(IonIntegrationTestCase):
         diff = end_time - start_time
         mps = float(self.counter) / diff
 
-        print >>sys.stderr, "Requests per second (RPC):", mps, "(", self.counter, "messages in", diff, "seconds)"
+        print >>sys.stderr, label, mps, "(", self.counter, "messages in", diff, "seconds)"
 
     def test_pub_speed(self):
         pub = Publisher(node=self.container.node, name="i_no_exist")
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+
+from pyon.net.transport import AMQPTransport, TransportError
+from pyon.util.unit_test import PyonTestCase
+from mock import Mock, sentinel
+from nose.plugins.attrib import attr
+
+@attr('UNIT')
+class TestAMQPTransportDeclareCache(PyonTestCase):
+
+    def setUp(self):
+        self.transport = AMQPTransport(declare_ttl=30)
+        self.transport._sync_call = Mock()
+        self.client = Mock()
+
+    def test_declare_exchange_cached(self):
+        self.transport.declare_exchange_impl(self.client, 'ex')
+        self.transport.declare_exchange_impl(self.client, 'ex')
+
+        self.assertEquals(self.transport._sync_call.call_count, 1)
+
+        # different declare arguments are a different declaration
+        self.transport.declare_exchange_impl(self.client, 'ex', durable=True)
+        self.assertEquals(self.transport._sync_call.call_count, 2)
+
+        stats = self.transport.get_declare_stats()
+        self.assertEquals(stats['issued'], 2)
+        self.assertEquals(stats['skipped'], 1)
+        self.assertEquals(stats['cached'], 2)
+
+    def test_declare_queue_cached(self):
+        self.transport._sync_call.return_value.method.queue = 'ex.q'
+
+        self.assertEquals(self.transport.declare_queue_impl(self.client, 'ex.q'), 'ex.q')
+        self.assertEquals(self.transport.declare_queue_impl(self.client, 'ex.q'), 'ex.q')
+        self.assertEquals(self.transport._sync_call.call_count, 1)
+
+    def test_declare_anon_queue_not_cached(self):
+        self.transport.declare_queue_impl(self.client, None)
+        self.transport.declare_queue_impl(self.client, None)
+
+        self.assertEquals(self.transport._sync_call.call_count, 2)
+
+    def test_declare_ttl(self):
+        self.transport._declare_ttl = 0
+        self.transport.bind_impl(self.client, 'ex', 'ex.q', 'b')
+        self.transport.bind_impl(self.client, 'ex', 'ex.q', 'b')
+
+        self.assertEquals(self.transport._sync_call.call_count, 2)
+
+    def test_delete_queue_invalidates(self):
+        self.transport._sync_call.return_value.method.queue = 'ex.q'
+        self.transport.declare_exchange_impl(self.client, 'ex')
+        self.transport.declare_exchange_impl(self.client, 'other')
+        self.transport.declare_queue_impl(self.client, 'ex.q')
+        self.transport.bind_impl(self.client, 'ex', 'ex.q', 'b')
+
+        self.transport.delete_queue_impl(self.client, 'ex.q')
+
+        # queue, its binding and the (auto delete) exchange it was bound to are gone
+        self.assertEquals(self.transport.get_declare_stats()['cached'], 1)
+        self.assertEquals(self.transport._declared.keys()[0][1], 'other')
+
+    def test_unbind_and_delete_exchange_invalidate(self):
+        self.transport.declare_exchange_impl(self.client, 'ex')
+        self.transport.bind_impl(self.client, 'ex', 'ex.q', 'b')
+
+        self.transport.unbind_impl(self.client, 'ex', 'ex.q', 'b')
+        self.assertEquals(self.transport.get_declare_stats()['cached'], 0)
+
+        self.transport.declare_exchange_impl(self.client, 'ex')
+        self.transport.delete_exchange_impl(self.client, 'ex')
+        self.assertEquals(self.transport.get_declare_stats()['cached'], 0)
+
+    def test_invalidate_queue_keeps_shared_exchange(self):
+        self.transport.declare_exchange_impl(self.client, 'ex')
+        self.transport.declare_exchange_impl(self.client, 'durable_ex', auto_delete=False)
+        self.transport.bind_impl(self.client, 'ex', 'q1', 'b1')
+        self.transport.bind_impl(self.client, 'ex', 'q2', 'b2')
+        self.transport.bind_impl(self.client, 'durable_ex', 'q1', 'b1')
+
+        # q2 still binds ex, and durable_ex does not go away with its bindings
+        self.transport.invalidate_queue('q1')
+        self.assertEquals(sorted(k[1] for k in self.transport._declared), ['durable_ex', 'ex', 'ex'])
+
+        # q2 was the last binding of ex
+        self.transport.invalidate_queue('q2')
+        self.assertEquals(self.transport._declared.keys(), [('exchange', 'durable_ex', 'topic', False, False)])
+        self.assertEquals(self.transport._declared_refs.keys(), [('exchange', 'durable_ex')])
+
+    def test_anon_queue_binding_not_cached(self):
+        self.transport._sync_call.return_value.method.queue = 'amq.gen-1'
+        queue = self.transport.declare_queue_impl(self.client, None)
+        self.transport.bind_impl(self.client, 'ex', queue, 'b')
+
+        self.assertEquals(self.transport.get_declare_stats()['cached'], 0)
+
+        self.transport.invalidate_queue(queue)
+        self.assertEquals(self.transport._anon_queues, set())
+
+    def test_expired_purged(self):
+        self.transport.bind_impl(self.client, 'ex', 'q1', 'b')
+        self.transport._declared[('bind', 'ex', 'q1', 'b')] = (None, 0)
+        self.transport._next_purge = 0
+
+        self.transport.bind_impl(self.client, 'ex', 'q2', 'b')
+        self.assertEquals(self.transport._declared.keys(), [('bind', 'ex', 'q2', 'b')])
+        self.assertNotIn(('queue', 'q1'), self.transport._declared_refs)
+
+    def test_sync_call_error_clears_cache(self):
+        transport = AMQPTransport(declare_ttl=30)
+        transport._declared[('exchange', 'ex', 'topic', False, True)] = (None, 0)
+
+        # the close callback fires with an error during the call
+        def func(callback=None):
+            self.client.add_on_close_callback.call_args[0][0](sentinel.ch, 404, 'NOT_FOUND')
+        self.client.transport.connection = Mock()
+
+        self.assertRaises(TransportError, transport._sync_call, self.client, func, 'callback')
+        self.assertEquals(transport.get_declare_stats()['cached'], 0)
+        self.client.transport.connection.mark_bad_channel.assert_called_once_with(self.client.channel_number)
+
+@attr('UNIT')
+class TestAMQPPipeline(PyonTestCase):
+
+    def setUp(self):
+        self.transport = AMQPTransport(declare_ttl=30)
+        self.client = Mock()
+        self.pipeline = self.transport.pipeline(self.client)
+
+    def _reply(self, method):
+        method.call_args[1]['callback'](sentinel.frame)
+
+    def _close_with_error(self):
+        self.client.add_on_close_callback.call_args[0][0](sentinel.ch, 404, 'NOT_FOUND')
+
+    def _setup(self):
+        self.pipeline.declare_exchange_impl(self.client, 'ex')
+        self.assertEquals(self.pipeline.declare_queue_impl(self.client, 'ex.q'), 'ex.q')
+        self.pipeline.bind_impl(self.client, 'ex', 'ex.q', 'b')
+
+    def test_sends_without_waiting(self):
+        self._setup()
+
+        # all three went out before any reply
+        self.assertTrue(self.client.exchange_declare.called)
+        self.assertTrue(self.client.queue_declare.called)
+        self.assertTrue(self.client.queue_bind.called)
+
+        self._reply(self.client.exchange_declare)
+        self._reply(self.client.queue_declare)
+        self._reply(self.client.queue_bind)
+
+        self.pipeline.wait()
+        self.pipeline.close()
+
+        stats = self.transport.get_declare_stats()
+        self.assertEquals(stats['issued'], 3)
+        self.assertEquals(stats['cached'], 3)
+        self.assertEquals(self.transport._declared[('queue', 'ex.q', False, True)][0], 'ex.q')
+        self.assertTrue(self.client.callbacks.remove.called)
+
+    def test_cached_steps_not_sent(self):
+        self.transport._record_declare(('exchange', 'ex', 'topic', False, True), None)
+
+        self._setup()
+        self._reply(self.client.queue_declare)
+        self._reply(self.client.queue_bind)
+        self.pipeline.wait()
+
+        self.assertFalse(self.client.exchange_declare.called)
+        self.assertEquals(self.transport.get_declare_stats()['skipped'], 1)
+
+    def test_error_names_failed_step(self):
+        self.client.transport.connection = Mock()
+        self._setup()
+
+        # the exchange declare went through, the queue declare made the broker close the channel
+        self._reply(self.client.exchange_declare)
+        self._close_with_error()
+
+        with self.assertRaises(TransportError) as cm:
+            self.pipeline.wait()
+
+        self.assertIn('declare queue ex.q', str(cm.exception))
+        self.assertEquals(self.transport.get_declare_stats()['cached'], 0)
+        self.client.transport.connection.mark_bad_channel.assert_called_once_with(self.client.channel_number)
+
+    def test_anon_queue_waits(self):
+        self.transport._sync_call = Mock()
+        self.transport._sync_call.return_value.method.queue = 'amq.gen-1'
+
+        self.pipeline.declare_exchange_impl(self.client, 'ex')
+        self._reply(self.client.exchange_declare)
+
+        self.assertEquals(self.pipeline.declare_queue_impl(self.client, None), 'amq.gen-1')
+        self.assertEquals(self.pipeline._steps, [])
@@ -10,9 +10,11 @@ TODOS:
 __author__ = 'Dave Foster <dfoster@asascience.com>'
 __license__ = 'Apache 2.0'
 
+from pyon.core.bootstrap import CFG
 from pyon.util.log import log
 from gevent.event import AsyncResult
 from contextlib import contextmanager
+import time
 
 class TransportError(StandardError):
     pass
@@ -36,9 +38,37 @@ class BaseTransport(object):
     def setup_listener(self, binding, default_cb):
         raise NotImplementedError()
 
+    def pipeline(self, client):
+        """
+        Returns an object with the declare_exchange_impl/declare_queue_impl/bind_impl calls of this transport
+        that sends them without waiting for each reply, see AMQPPipeline. Transports that cannot pipeline
+        return None, and callers make the calls on the transport itself.
+        """
+        return None
+
+    def invalidate_queue(self, queue):
+        """
+        Called when a queue may have been deleted behind the transport's back, e.g. an auto delete
+        queue whose consumer was cancelled. Only transports caching declarations need to act on it.
+        """
+        pass
+
+    def clear_declare_cache(self):
+        """
+        Called on channel and connection errors. Only transports caching declarations need to act on it.
+        """
+        pass
+
 class AMQPTransport(BaseTransport):
     """
-    This is STATELESS. You can make instances of it, but no need to (true singleton).
+    The only state is a cache of declarations (exchanges, named queues, bindings) made through it, so
+    repeated declares of the same thing with the same arguments skip the broker round trip. You can make
+    instances of it, but no need to (true singleton, so the cache is container-wide).
+
+    Cached declarations expire after CFG container.messaging.declare_cache.ttl seconds (default 30,
+    a negative value disables the cache). They are dropped on delete_*/unbind_impl of anything they
+    depend on, on invalidate_queue, and all of them on any error (see clear_declare_cache). Auto delete
+    exchanges are dropped with their last cached binding. Bindings of anonymous queues are not cached.
     """
     __instance = None
 
@@ -48,6 +78,122 @@ class AMQPTransport(BaseTransport):
             cls.__instance = AMQPTransport()
         return cls.__instance
 
+    def __init__(self, declare_ttl=None):
+        self._declare_ttl   = declare_ttl if declare_ttl is not None else CFG.get_safe('container.messaging.declare_cache.ttl', 30)
+        self._declared      = {}    # declare key -> (result, time declared), see _cached_declare
+        self._declared_refs = {}    # ('exchange'|'queue', name) -> declare keys of it and its bindings
+        self._anon_queues   = set() # names the broker gave anonymous queues, bindings to them are not cached
+        self._next_purge    = 0
+        self._declare_stats = {'issued': 0, 'skipped': 0, 'invalidated': 0}
+
+    def _cached_declare(self, key, declare):
+        """
+        Returns the result of an earlier declare with the same key if it has not expired, otherwise calls declare
+        and caches its result.
+        """
+        entry = self._lookup_declare(key)
+        if entry is not None:
+            return entry[0]
+
+        result = declare()
+        self._record_declare(key, result)
+
+        return result
+
+    def _lookup_declare(self, key):
+        """
+        Returns the unexpired (result, time) cache entry for key, counting it as a skipped declare, or None.
+        """
+        entry = self._declared.get(key, None)
+        if entry is None:
+            return None
+
+        if time.time() - entry[1] < self._declare_ttl:
+            self._declare_stats['skipped'] += 1
+            return entry
+
+        self._drop_declare(key)
+        return None
+
+    def _record_declare(self, key, result):
+        self._declare_stats['issued'] += 1
+        if self._declare_ttl < 0:
+            return
+
+        # an anonymous queue is gone with its consumer, nobody declares the same binding again
+        if key[0] == 'bind' and key[2] in self._anon_queues:
+            return
+
+        now = time.time()
+        if now >= self._next_purge:
+            self._purge_expired(now)
+
+        self._declared[key] = (result, now)
+        for ref in self._get_refs(key):
+            self._declared_refs.setdefault(ref, set()).add(key)
+
+    def _purge_expired(self, now):
+        """
+        Drops expired entries, at most once per ttl: lookups only drop the ones they come across.
+        """
+        for key in [k for k, entry in self._declared.iteritems() if now - entry[1] >= self._declare_ttl]:
+            self._drop_declare(key)
+        self._next_purge = now + max(self._declare_ttl, 1)
+
+    def _get_refs(self, key):
+        if key[0] == 'bind':
+            return (('exchange', key[1]), ('queue', key[2]))
+        return ((key[0], key[1]),)
+
+    def _drop_declare(self, key):
+        if self._declared.pop(key, None) is None:
+            return
+        self._declare_stats['invalidated'] += 1
+        for ref in self._get_refs(key):
+            keys = self._declared_refs.get(ref)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._declared_refs[ref]
+
+    def _drop_unbound_exchange(self, exchange):
+        """
+        Drops the cached declarations of an auto delete exchange if no cached binding refers to it any more:
+        the broker deletes it with its last binding.
+        """
+        keys = self._declared_refs.get(('exchange', exchange), ())
+        if any(k[0] == 'bind' for k in keys):
+            return
+        for key in [k for k in keys if k[4]]:
+            self._drop_declare(key)
+
+    def invalidate_queue(self, queue):
+        """
+        Drops the cached declaration of a queue and its bindings, and of the auto delete exchanges
+        it was the last cached binding of.
+        """
+        self._anon_queues.discard(queue)
+        keys = list(self._declared_refs.get(('queue', queue), ()))
+        for key in keys:
+            self._drop_declare(key)
+        for exchange in set(k[1] for k in keys if k[0] == 'bind'):
+            self._drop_unbound_exchange(exchange)
+
+    def clear_declare_cache(self):
+        log.debug("AMQPTransport.clear_declare_cache (%d cached)", len(self._declared))
+        self._declare_stats['invalidated'] += len(self._declared)
+        self._declared = {}
+        self._declared_refs = {}
+
+    def get_declare_stats(self):
+        """
+        Returns a copy of the declare counters: declares sent to the broker (issued), answered from
+        the cache (skipped), cache entries dropped (invalidated), and the number currently cached.
+        """
+        stats = self._declare_stats.copy()
+        stats['cached'] = len(self._declared)
+        return stats
+
     @contextmanager
     def _push_close_cb(self, client, callback):
         client.add_on_close_callback(callback)
@@ -77,14 +223,7 @@ class AMQPTransport(BaseTransport):
             ret_vals = ar.get(timeout=10)
 
         if isinstance(ret_vals, TransportError):
-
-            # mark this channel as poison, do not use again!
-            # don't test for type here, we don't want to have to import PyonSelectConnection
-            if hasattr(client.transport, 'connection') and hasattr(client.transport.connection, 'mark_bad_channel'):
-                client.transport.connection.mark_bad_channel(client.channel_number)
-            else:
-                log.warn("Could not mark channel # (%s) as bad, Pika could be corrupt", client.channel_number)
-
+            self._on_call_error(client)
             raise ret_vals
 
         if len(ret_vals) == 0:
@@ -93,40 +232,74 @@ class AMQPTransport(BaseTransport):
             return ret_vals[0]
         return tuple(ret_vals)
 
+    def _on_call_error(self, client):
+        """
+        Called when a call on client failed, the broker has closed the channel.
+        """
+        # whatever failed, the broker state may not be what we think it is
+        self.clear_declare_cache()
+
+        # mark this channel as poison, do not use again!
+        # don't test for type here, we don't want to have to import PyonSelectConnection
+        if hasattr(client.transport, 'connection') and hasattr(client.transport.connection, 'mark_bad_channel'):
+            client.transport.connection.mark_bad_channel(client.channel_number)
+        else:
+            log.warn("Could not mark channel # (%s) as bad, Pika could be corrupt", client.channel_number)
+
+    def pipeline(self, client):
+        return AMQPPipeline(self, client)
 
     def declare_exchange_impl(self, client, exchange, exchange_type='topic', durable=False, auto_delete=True):
         log.debug("AMQPTransport.declare_exchange_impl: %s, T %s, D %s, AD %s", exchange, exchange_type, durable, auto_delete)
-        self._sync_call(client, client.exchange_declare, 'callback',
-                                             exchange=exchange,
-                                             type=exchange_type,
-                                             durable=durable,
-                                             auto_delete=auto_delete)
+        self._cached_declare(('exchange', exchange, exchange_type, durable, auto_delete),
+                             lambda: self._sync_call(client, client.exchange_declare, 'callback',
+                                                     exchange=exchange,
+                                                     type=exchange_type,
+                                                     durable=durable,
+                                                     auto_delete=auto_delete))
 
     def delete_exchange_impl(self, client, exchange, **kwargs):
         log.debug("AMQPTransport.delete_exchange_impl: %s", exchange)
+        for key in list(self._declared_refs.get(('exchange', exchange), ())):
+            self._drop_declare(key)
         self._sync_call(client, client.exchange_delete, 'callback', exchange=exchange)
 
     def declare_queue_impl(self, client, queue, durable=False, auto_delete=True):
         log.debug("AMQPTransport.declare_queue_impl: %s, D %s, AD %s", queue, durable, auto_delete)
-        frame = self._sync_call(client, client.queue_declare, 'callback',
-                                queue=queue or '',
-                                auto_delete=auto_delete,
-                                durable=durable)
-        return frame.method.queue
+
+        def declare():
+            frame = self._sync_call(client, client.queue_declare, 'callback',
+                                    queue=queue or '',
+                                    auto_delete=auto_delete,
+                                    durable=durable)
+            return frame.method.queue
+
+        # anonymous queues are new queues every time
+        if not queue:
+            queue = declare()
+            self._anon_queues.add(queue)
+            return queue
+
+        return self._cached_declare(('queue', queue, durable, auto_delete), declare)
 
     def delete_queue_impl(self, client, queue, **kwargs):
         log.debug("AMQPTransport.delete_queue_impl: %s", queue)
+        self.invalidate_queue(queue)
         self._sync_call(client, client.queue_delete, 'callback', queue=queue)
 
     def bind_impl(self, client, exchange, queue, binding):
         log.debug("AMQPTransport.bind_impl: EX %s, Q %s, B %s", exchange, queue, binding)
-        self._sync_call(client, client.queue_bind, 'callback',
-                                        queue=queue,
-                                        exchange=exchange,
-                                        routing_key=binding)
+        self._cached_declare(('bind', exchange, queue, binding),
+                             lambda: self._sync_call(client, client.queue_bind, 'callback',
+                                                     queue=queue,
+                                                     exchange=exchange,
+                                                     routing_key=binding))
 
     def unbind_impl(self, client, exchange, queue, binding):
         log.debug("AMQPTransport.unbind_impl: EX %s, Q %s, B %s", exchange, queue, binding)
+
+        self._drop_declare(('bind', exchange, queue, binding))
+        self._drop_unbound_exchange(exchange)
         self._sync_call(client, client.queue_unbind, 'callback', queue=queue,
                                                      exchange=exchange,
                                                      routing_key=binding)
@@ -138,6 +311,131 @@ class AMQPTransport(BaseTransport):
         return default_cb(self, binding)
 
 
+class AMQPPipeline(object):
+    """
+    Sends declares and binds on one AMQP channel without waiting for each reply in turn, then waits for
+    all the replies at once in wait(). Has the same *_impl calls as AMQPTransport, so it can be used in
+    its place while setting up a listener:
+
+        pipeline = transport.pipeline(client)
+        try:
+            pipeline.declare_exchange_impl(client, 'xp')
+            pipeline.declare_queue_impl(client, 'xp.q')
+            pipeline.bind_impl(client, 'xp', 'xp.q', 'b')
+            pipeline.wait()
+        finally:
+            pipeline.close()
+
+    Declarations the transport has cached are not sent. The broker answers a failed call by closing
+    the channel, so the first call without a reply at that point is the one that failed: wait() raises
+    a TransportError naming it.
+
+    Pika (v0.9.5) still only writes a synchronous method once the reply to the previous one has arrived,
+    but the calling greenlet no longer wakes up for every step, and steps served from the cache cost nothing.
+    """
+    def __init__(self, transport, client):
+        self._transport = transport
+        self._client    = client
+        self._steps     = []        # (description, declare key, AsyncResult, value to cache) in the order sent
+
+        self._close_cb  = transport._push_close_cb(client, self._on_close)
+        self._close_cb.__enter__()
+
+    def _on_close(self, ch, *args):
+        failed = False
+        for desc, key, ar, value in self._steps:
+            if ar.ready():
+                continue
+            if not failed:
+                ar.set(TransportError("%s could not complete due to an error (%s)" % (desc, args)))
+                failed = True
+            else:
+                ar.set(TransportError("%s not run, an earlier setup call failed" % desc))
+
+    def _send(self, desc, key, func, value=None, **kwargs):
+        """
+        Sends func(**kwargs), unless key is cached. On success, value (default: the reply frame) is cached.
+        """
+        ar = AsyncResult()
+
+        entry = self._transport._lookup_declare(key) if key is not None else None
+        if entry is not None:
+            ar.set(entry[0])
+            key = None
+        else:
+            def cb(*args):
+                ar.set(args[0] if len(args) else None)
+
+            kwargs['callback'] = cb
+            func(**kwargs)
+
+        self._steps.append((desc, key, ar, value))
+
+    def declare_exchange_impl(self, client, exchange, exchange_type='topic', durable=False, auto_delete=True):
+        log.debug("AMQPPipeline.declare_exchange_impl: %s, T %s, D %s, AD %s", exchange, exchange_type, durable, auto_delete)
+        self._send("declare exchange %s" % exchange,
+                   ('exchange', exchange, exchange_type, durable, auto_delete),
+                   client.exchange_declare,
+                   exchange=exchange,
+                   type=exchange_type,
+                   durable=durable,
+                   auto_delete=auto_delete)
+
+    def declare_queue_impl(self, client, queue, durable=False, auto_delete=True):
+        # the name of an anonymous queue is in the reply, which the caller needs right away
+        if not queue:
+            self.wait()
+            return self._transport.declare_queue_impl(client, queue, durable=durable, auto_delete=auto_delete)
+
+        log.debug("AMQPPipeline.declare_queue_impl: %s, D %s, AD %s", queue, durable, auto_delete)
+        self._send("declare queue %s" % queue,
+                   ('queue', queue, durable, auto_delete),
+                   client.queue_declare,
+                   value=queue,
+                   queue=queue,
+                   auto_delete=auto_delete,
+                   durable=durable)
+
+        # the broker declares a named queue under the name asked for
+        return queue
+
+    def bind_impl(self, client, exchange, queue, binding):
+        log.debug("AMQPPipeline.bind_impl: EX %s, Q %s, B %s", exchange, queue, binding)
+        self._send("bind %s to %s (%s)" % (queue, exchange, binding),
+                   ('bind', exchange, queue, binding),
+                   client.queue_bind,
+                   queue=queue,
+                   exchange=exchange,
+                   routing_key=binding)
+
+    def wait(self, timeout=10):
+        """
+        Waits for the replies to everything sent so far, timeout seconds in total. Successful declares are
+        cached with the transport. Raises a TransportError for the first failed step.
+
+        May be called more than once, each call waits for the steps sent since the last.
+        """
+        steps, self._steps = self._steps, []
+        deadline = time.time() + timeout
+
+        results = [ar.get(timeout=max(deadline - time.time(), 0)) for desc, key, ar, value in steps]
+
+        for result in results:
+            if isinstance(result, TransportError):
+                self._transport._on_call_error(self._client)
+                raise result
+
+        for (desc, key, ar, value), result in zip(steps, results):
+            if key is not None:
+                self._transport._record_declare(key, value if value is not None else result)
+
+    def close(self):
+        """
+        Stops watching the channel for errors. Call when done, whether wait() raised or not.
+        """
+        self._close_cb.__exit__(None, None, None)
+
+
 class NameTrio(object):
     """
     Internal representation of a name/queue/binding (optional).
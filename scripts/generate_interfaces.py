@@ -573,7 +573,13 @@ def find_subtypes(clz):
 # are two files:  interfaces/objects.py and interfaces/messages.py
 # TODO make this method legit by utilizing a parser to handle walking
 # the tokens.    
-def generate_model_objects():
+def generate_model_objects(slots=False):
+    """
+    Generates interface/objects.py from the data object definitions.
+
+    @param  slots   If True, generate classes based on IonSlotsObjectBase, which keep their fields in
+                    __slots__ and set inherited fields in their own constructor.
+    """
     data_yaml_files = list_files_recursive('obj/data', '*.yml', ['ion.yml', 'resource.yml'])
     data_yaml_text = '\n\n'.join((file.read() for file in (open(path, 'r') for path in data_yaml_files if os.path.exists(path))))
 
@@ -587,7 +593,7 @@ def generate_model_objects():
     # so we can easily reference their values later in the parsing
     # logic.
     dataobject_output_text = "#!/usr/bin/env python\n\n"
-    dataobject_output_text += "from pyon.core.object import IonObjectBase\n"
+    dataobject_output_text += "from pyon.core.object import IonObjectBase, IonSlotsObjectBase\n"
     dataobject_output_text += "# Enums\n"
 
     for line in combined_yaml_text.split('\n'):
@@ -728,6 +734,15 @@ def generate_model_objects():
             outline = str(value)
         return outline
             
+    # __slots__ of the class being generated: only its own fields,
+    # inherited fields are slots of the super classes.
+    def slots_text():
+        super_fields = class_args_dict[super_class]["fields"] if super_class in class_args_dict else []
+        own_fields = [field for field in fields if field not in super_fields]
+        return "    __slots__ = (" + "".join("'" + field + "', " for field in own_fields) + ")\n"
+
+    base_class = "IonSlotsObjectBase" if slots else "IonObjectBase"
+
     # Now walk the data model definition yaml files.  Generate
     # corresponding classes in the objects.py file.
     current_class_def_dict = None
@@ -788,7 +803,7 @@ def generate_model_objects():
             if first_time:
                 first_time = False
             else:
-                class_args_dict[current_class] = {'args': args, 'fields': fields}
+                class_args_dict[current_class] = {'args': args, 'fields': fields, 'assigns': [l for l in init_lines if l.startswith('        self.')]}
                 for arg in args:
                     dataobject_output_text += arg
                 dataobject_output_text += "):\n"
@@ -799,6 +814,8 @@ def generate_model_objects():
                     dataobject_output_text += current_class_schema + "\n              }.items())\n"
                 else:
                     dataobject_output_text += current_class_schema + "\n              }\n"
+                if slots:
+                    dataobject_output_text += slots_text()
             dataobject_output_text += '\n'
             args = []
             fields = []
@@ -812,18 +829,22 @@ def generate_model_objects():
             if ': !Extends_' in line:
                 super_class = line.split("!Extends_")[1]
                 args = args + class_args_dict[super_class]["args"]
-                init_lines.append('        ' + super_class + ".__init__(self")
                 fields = fields + class_args_dict[super_class]["fields"]
-                for super_field in fields:
-                    init_lines.append(", " + super_field)
-                init_lines.append(")\n")
+                if slots:
+                    # no super constructor call, set the inherited fields directly
+                    init_lines.extend(class_args_dict[super_class]["assigns"])
+                else:
+                    init_lines.append('        ' + super_class + ".__init__(self")
+                    for super_field in fields:
+                        init_lines.append(", " + super_field)
+                    init_lines.append(")\n")
                 schema_extended = True
                 current_class_schema = "\n    _schema = dict(" + super_class + "._schema.items() + {"
                 line = line.replace(': !Extends_','(')
             else:
                 schema_extended = False
                 current_class_schema = "\n    _schema = {"
-                line = line.replace(':','(IonObjectBase')
+                line = line.replace(':','(' + base_class)
             dataobject_output_text += 'class ' + line + '):\n    def __init__(self'
 
     # Find any data model definitions lurking in the service interface
@@ -882,7 +903,7 @@ def generate_model_objects():
                     if '!enum' in line:
                         index += 1
                         continue
-                    class_args_dict[current_class] = {'args': args, 'fields': fields}
+                    class_args_dict[current_class] = {'args': args, 'fields': fields, 'assigns': [l for l in init_lines if l.startswith('        self.')]}
                     for arg in args:
                         dataobject_output_text += arg
                     dataobject_output_text += "):\n"
@@ -893,6 +914,8 @@ def generate_model_objects():
                             dataobject_output_text += current_class_schema + "\n              }.items())\n"
                         else:
                             dataobject_output_text += current_class_schema + "\n              }\n"
+                        if slots:
+                            dataobject_output_text += slots_text()
                     dataobject_output_text += '\n'
                     dataobject_output_text += '\n'
                     args = []
@@ -907,18 +930,22 @@ def generate_model_objects():
                     if ': !Extends_' in line:
                         super_class = line.split("!Extends_")[1]
                         args = args + class_args_dict[super_class]["args"]
-                        init_lines.append('        ' + super_class + ".__init__(self")
                         fields = fields + class_args_dict[super_class]["fields"]
-                        for super_field in fields:
-                            init_lines.append(", " + super_field)
-                        init_lines.append(")\n")
+                        if slots:
+                            # no super constructor call, set the inherited fields directly
+                            init_lines.extend(class_args_dict[super_class]["assigns"])
+                        else:
+                            init_lines.append('        ' + super_class + ".__init__(self")
+                            for super_field in fields:
+                                init_lines.append(", " + super_field)
+                            init_lines.append(")\n")
                         schema_extended = True
                         current_class_schema = "\n    _schema = dict(" + super_class + "._schema.items() + {"
                         line = line.replace(': !Extends_','(')
                     else:
                         schema_extended = False
                         current_class_schema = "\n    _schema = {"
-                        line = line.replace(':','(IonObjectBase')
+                        line = line.replace(':','(' + base_class)
                     dataobject_output_text += 'class ' + line + '):\n    def __init__(self'
                     
                 index += 1
@@ -934,6 +961,8 @@ def generate_model_objects():
             dataobject_output_text += current_class_schema + "\n              }.items())\n"
         else:
             dataobject_output_text += current_class_schema + "\n              }\n"
+        if slots:
+            dataobject_output_text += slots_text()
  
 #    messageobject_output_text = "# Message Objects\n\nimport interface.objects\nfrom pyon.core.exception import BadRequest\nfrom pyon.core.object import IonObjectBase\n"
     messageobject_output_text = "# Message Objects\n\nimport interface.objects\nfrom pyon.core.object import IonObjectBase\n"
@@ -1218,6 +1247,7 @@ def main():
     parser.add_argument('-f', '--force', action='store_true', help='Do not do MD5 comparisons, always generate new files')
     parser.add_argument('-d', '--dryrun', action='store_true', help='Do not generate new files, just print status and exit with 1 if changes need to be made')
     parser.add_argument('-sd', '--servicedoc', action='store_true', help='Generate HTML service doc inclusion files')
+    parser.add_argument('-s', '--slots', action='store_true', help='Generate data object classes with __slots__ (less memory per object)')
     opts = parser.parse_args()
 
     print "Forcing --force, we keep changing generate_interfaces, sorry!"
@@ -1242,7 +1272,7 @@ def main():
     open(os.path.join(interface_dir, '__init__.py'), 'w').close()
 
     # Generate data object definitions into python classes
-    generate_model_objects()
+    generate_model_objects(slots=opts.slots)
 
     enum_tag = u'!enum'
     def enum_constructor(loader, node):